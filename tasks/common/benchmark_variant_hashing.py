@@ -0,0 +1,50 @@
+import argparse
+import random
+import timeit
+
+from ebi_eva_common_pyutils.logger import logging_config
+
+from tasks.common.variant_hashing import get_submitted_SHA1, get_submitted_SHA1_batch
+
+logger = logging_config.get_logger(__name__)
+logging_config.add_stdout_handler()
+
+
+def generate_submitted_variants(num_variants):
+    random.seed(42)
+    return [
+        {'seq': 'GCA_000001405.15', 'study': f'PRJEB{random.randint(1000, 9999)}',
+         'contig': f'CM0006{random.randint(63, 86)}.2', 'start': random.randint(1, 250000000),
+         'ref': random.choice('ACGT'), 'alt': random.choice('ACGT')}
+        for _ in range(num_variants)
+    ]
+
+
+def benchmark(num_variants, num_processes_list, repeat):
+    variants = generate_submitted_variants(num_variants)
+    columns = dict((key, [variant[key] for variant in variants])
+                   for key in ['seq', 'study', 'contig', 'start', 'ref', 'alt'])
+
+    expected_hashes = [get_submitted_SHA1(variant) for variant in variants]
+    per_record_time = min(timeit.repeat(lambda: [get_submitted_SHA1(variant) for variant in variants],
+                                        number=1, repeat=repeat))
+    logger.info(f'Per record: {num_variants} variants in {per_record_time:.2f}s')
+    for num_processes in num_processes_list:
+        hashes = get_submitted_SHA1_batch(**columns, num_processes=num_processes)
+        assert hashes == expected_hashes, f'Batch hashes with {num_processes} processes differ from per record hashes'
+        batch_time = min(timeit.repeat(lambda: get_submitted_SHA1_batch(**columns, num_processes=num_processes),
+                                       number=1, repeat=repeat))
+        logger.info(f'Batch with {num_processes} processes: {num_variants} variants in {batch_time:.2f}s '
+                    f'({per_record_time / batch_time:.1f}x)')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the per record and batch computation of submitted variant '
+                                                 'hashes')
+    parser.add_argument("--num-variants", help="Number of random variants to hash", type=int, default=1000000)
+    parser.add_argument("--num-processes", help="Number of processes to use with the batch function",
+                        type=int, nargs='+', default=[1, 4])
+    parser.add_argument("--repeat", help="Number of time each method is run (the best run is reported)",
+                        type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.num_variants, args.num_processes, args.repeat)
@@ -0,0 +1,190 @@
+import bz2
+import json
+import queue
+import shutil
+import subprocess
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from ebi_eva_common_pyutils.logger import logging_config
+
+logger = logging_config.get_logger(__name__)
+
+# Decompressors able to use several threads on a bz2 file, in order of preference. pbzip2 only decompresses in
+# parallel the files it compressed, lbzip2 does it for any bz2 file.
+PARALLEL_BZ2_DECOMPRESSORS = ['lbzip2', 'pbzip2']
+
+_worker_checkers = None
+
+
+def is_rs_id_mapped_to_assembly(rs_record, eva_production_human_dbsnp_assembly):
+    try:
+        for placement in rs_record["primary_snapshot_data"]["placements_with_allele"]:
+            # Primary top-level placement (ptlp) is used to identify records that are mapped to this assembly
+            # See https://github.com/EBIvariation/eva-accession/blob/d3c849f15b6b63ebd97d4ac6f2d857e3b65d908f/eva-accession-import-dbsnp2/src/main/java/uk/ac/ebi/eva/accession/dbsnp2/batch/processors/JsonNodeToClusteredVariantProcessor.java#L74-L74
+            if placement["is_ptlp"]:
+                for assembly_info in placement["placement_annot"]["seq_id_traits_by_assembly"]:
+                    if assembly_info["assembly_accession"] == eva_production_human_dbsnp_assembly:
+                        return True
+    except KeyError:
+        logger.error(traceback.format_exc())
+        return False
+    return False
+
+
+@contextmanager
+def open_bz2(bz2_file, decompress_threads=4):
+    """
+    Open a bz2 file for reading in binary mode, decompressing it with several threads when lbzip2 or pbzip2 is
+    installed and with the bz2 module otherwise.
+    """
+    decompressor = next(filter(shutil.which, PARALLEL_BZ2_DECOMPRESSORS), None)
+    if not decompressor or decompress_threads < 2:
+        with bz2.open(bz2_file) as open_file:
+            yield open_file
+        return
+    process = subprocess.Popen([decompressor, '-dc', f'-n{decompress_threads}' if decompressor == 'lbzip2'
+                                else f'-p{decompress_threads}', bz2_file], stdout=subprocess.PIPE)
+    stopped = False
+    try:
+        yield process.stdout
+    finally:
+        process.stdout.close()
+        # Stop the decompressor if the file was not read to the end
+        if process.poll() is None:
+            process.kill()
+            stopped = True
+        process.wait()
+    if process.returncode != 0 and not stopped:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+class DbsnpJsonChecker:
+    """
+    Base class of the checks run by DbsnpJsonReader.
+    check_record is called in the parsing processes with each record and the 0-based index of its line in the file. It
+    must return a picklable result, or None when there is nothing to report. process_results is then called in the reader process with the results of consecutive
+    records, in the order of the file, and finish once all the records have been read.
+    Checkers are copied to the parsing processes before the file is read, so the resources they use in process_results,
+    such as database connections, should be opened there rather than in the constructor.
+    """
+
+    def check_record(self, rs_record, line_index):
+        raise NotImplementedError
+
+    def process_results(self, results):
+        pass
+
+    def finish(self):
+        pass
+
+
+def _init_worker(checkers):
+    global _worker_checkers
+    _worker_checkers = checkers
+
+
+def _check_lines(first_line_index, json_lines):
+    results = [[] for _ in _worker_checkers]
+    for line_index, json_line in enumerate(json_lines, start=first_line_index):
+        if not json_line.strip():
+            continue
+        rs_record = json.loads(json_line)
+        for checker_results, checker in zip(results, _worker_checkers):
+            result = checker.check_record(rs_record, line_index)
+            if result is not None:
+                checker_results.append(result)
+    return results
+
+
+class DbsnpJsonReader:
+    """
+    Read a dbSNP JSON release file once and run several checkers on each of its records.
+    The file is decompressed by a parallel bz2 decompressor when one is available and the records are parsed and
+    checked by num_workers processes, chunk_size lines at a time. The results are passed to the checkers in a separate
+    thread through a queue of at most queue_size chunks so slow lookups done in process_results overlap with the
+    parsing while the memory used stays bounded.
+    """
+
+    def __init__(self, release_json_file, checkers, num_workers=4, chunk_size=1000, queue_size=8,
+                 decompress_threads=4):
+        self.release_json_file = release_json_file
+        self.checkers = checkers
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.decompress_threads = decompress_threads
+
+    def _read_chunks(self):
+        """Yields the index of the first line of each chunk, its lines and the number of records it contains."""
+        with open_bz2(self.release_json_file, self.decompress_threads) as open_file:
+            chunk = []
+            num_records = 0
+            line_index = 0
+            for json_line in open_file:
+                # Blank lines are kept in the chunks so the line indexes match the lines of the file
+                chunk.append(json_line)
+                if json_line.strip():
+                    num_records += 1
+                if num_records == self.chunk_size:
+                    yield line_index, chunk, num_records
+                    line_index += len(chunk)
+                    chunk = []
+                    num_records = 0
+            if chunk:
+                yield line_index, chunk, num_records
+
+    def _process_results(self, results_queue, errors):
+        while True:
+            results = results_queue.get()
+            if results is None:
+                return
+            if errors:
+                # Keep emptying the queue so the reader is not blocked
+                continue
+            try:
+                for checker, checker_results in zip(self.checkers, results):
+                    if checker_results:
+                        checker.process_results(checker_results)
+            except Exception as e:
+                errors.append(e)
+
+    def read(self):
+        """Run the checkers on all the records of the file and returns the number of records read."""
+        results_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        consumer = threading.Thread(target=self._process_results, args=(results_queue, errors))
+        consumer.start()
+        num_records = 0
+        try:
+            with ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_worker,
+                                     initargs=(self.checkers,)) as executor:
+                # Chunks are submitted as the previous ones complete so the file is not read faster than it is parsed
+                pending = deque()
+                for line_index, chunk, num_chunk_records in self._read_chunks():
+                    pending.append((executor.submit(_check_lines, line_index, chunk), num_chunk_records))
+                    if len(pending) >= self.num_workers * 2:
+                        num_records = self._queue_results(pending.popleft(), results_queue, errors, num_records)
+                while pending:
+                    num_records = self._queue_results(pending.popleft(), results_queue, errors, num_records)
+        finally:
+            results_queue.put(None)
+            consumer.join()
+        if errors:
+            raise errors[0]
+        for checker in self.checkers:
+            checker.finish()
+        logger.info(f"Processed {num_records} records from {self.release_json_file}")
+        return num_records
+
+    def _queue_results(self, pending_chunk, results_queue, errors, num_records):
+        future, chunk_length = pending_chunk
+        if errors:
+            raise errors[0]
+        results_queue.put(future.result())
+        if (num_records + chunk_length) // 100000 > num_records // 100000:
+            logger.info("Processed {0} records...".format(num_records + chunk_length))
+        return num_records + chunk_length
@@ -0,0 +1,154 @@
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+from bson import json_util
+from ebi_eva_common_pyutils.logger import logging_config
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError
+from pymongo.read_concern import ReadConcern
+
+logger = logging_config.get_logger(__name__)
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+def load_checkpoint(checkpoint_file):
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        with open(checkpoint_file) as open_file:
+            checkpoint = json_util.loads(open_file.read())
+        logger.info(f"Resuming from checkpoint {checkpoint_file}: {checkpoint}")
+        return checkpoint
+    return {'last_id': None, 'processed': 0, 'inserted': 0, 'dropped': 0, 'replaced': 0, 'skipped': 0}
+
+
+def save_checkpoint(checkpoint_file, checkpoint):
+    if checkpoint_file:
+        # Write to a temporary file first so a run killed while writing does not leave a truncated checkpoint
+        with open(checkpoint_file + '.tmp', 'w') as open_file:
+            open_file.write(json_util.dumps(checkpoint))
+        os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+
+def find_documents_after_id(collection, filter_criteria, last_id, batch_size, sort_by_id=True, limit=0):
+    """
+    Yields batches of the documents matching the filter, starting after last_id. The documents are only sorted by _id
+    when sort_by_id is set, which is needed for last_id to mark the progress of a run.
+    """
+    if last_id is not None:
+        filter_criteria = {'$and': [filter_criteria, {'_id': {'$gt': last_id}}]}
+    cursor = collection.with_options(read_concern=ReadConcern("majority")) \
+        .find(filter_criteria, no_cursor_timeout=True).limit(limit).batch_size(batch_size)
+    if sort_by_id:
+        cursor = cursor.sort('_id', pymongo.ASCENDING)
+    records = []
+    try:
+        for result in cursor:
+            records.append(result)
+            if len(records) == batch_size:
+                yield records
+                records = []
+        if records:
+            yield records
+    finally:
+        cursor.close()
+
+
+def write_batch(collection, insert_statements, drop_statements, replace_statements):
+    """
+    Insert the corrected documents then drop the original ones, and replace the documents corrected in place.
+    Returns the number inserted, dropped and replaced.
+    """
+    collection = collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000))
+    inserted = dropped = replaced = 0
+    if insert_statements:
+        try:
+            inserted = collection.bulk_write(requests=insert_statements, ordered=False).inserted_count
+        except BulkWriteError as bulk_error:
+            error_codes = set([error.get('code') for error in bulk_error.details.get('writeErrors')])
+            if error_codes == {DUPLICATE_KEY_ERROR_CODE}:
+                # This error occurs because we were able to create the entry in a previous run but not able to
+                # remove the original variant yet
+                inserted = bulk_error.details.get('nInserted')
+                logger.debug(f"Duplicate key error found while inserting but still inserted {inserted} new documents")
+            else:
+                raise bulk_error
+        dropped = collection.bulk_write(requests=drop_statements, ordered=False).deleted_count
+    if replace_statements:
+        replaced = collection.bulk_write(requests=replace_statements, ordered=False).modified_count
+    return inserted, dropped, replaced
+
+
+def rewrite_collection_ids(collection, filter_criteria, correction_func, id_creation_func, batch_size=1000,
+                           checkpoint_file=None, limit=0):
+    """
+    Apply correction_func to every document matching filter_criteria and replace each document with a copy whose _id
+    is recalculated with id_creation_func (InsertOne of the copy then DeleteOne of the original). Documents whose _id
+    does not change are replaced in place when the correction changed them and left untouched otherwise, so the
+    rewrite is idempotent. At most limit documents are corrected when limit is set.
+    Documents are read one batch at a time while the previous batch is being written. With a checkpoint_file, the
+    documents are read in _id order and the last _id and the counts are saved after each batch is written so a run
+    that was killed resumes after the last batch written.
+    Returns the counts of documents processed, inserted, dropped, replaced and skipped.
+    """
+    checkpoint = load_checkpoint(checkpoint_file)
+    # Checkpoints written before documents were replaced in place do not have the count
+    checkpoint.setdefault('replaced', 0)
+    if limit:
+        limit = max(limit - checkpoint['processed'], 0)
+        if not limit:
+            return checkpoint
+
+    def write_and_checkpoint(insert_statements, drop_statements, replace_statements, last_id, num_processed):
+        inserted, dropped, replaced = write_batch(collection, insert_statements, drop_statements, replace_statements)
+        logger.debug(f'{inserted} new documents inserted, {dropped} old documents dropped and {replaced} documents '
+                     f'replaced in {collection.name}')
+        checkpoint['inserted'] += inserted
+        checkpoint['dropped'] += dropped
+        checkpoint['replaced'] += replaced
+        checkpoint['processed'] += num_processed
+        checkpoint['skipped'] += num_processed - len(insert_statements) - len(replace_statements)
+        checkpoint['last_id'] = last_id
+        save_checkpoint(checkpoint_file, checkpoint)
+
+    # A single writer thread so batches are written (and checkpointed) in order while the next one is read
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        pending_write = None
+        for batch_of_documents in find_documents_after_id(collection, filter_criteria, checkpoint['last_id'],
+                                                          batch_size, sort_by_id=checkpoint_file is not None,
+                                                          limit=limit):
+            insert_statements = []
+            drop_statements = []
+            replace_statements = []
+            last_id = batch_of_documents[-1]['_id']
+            for document in batch_of_documents:
+                original_id = id_creation_func(document)
+                assert document['_id'] == original_id, \
+                    "Original id is different from the one calculated %s != %s" % (document['_id'], original_id)
+                original_document = copy.deepcopy(document)
+                correction_func(document)
+                document['_id'] = id_creation_func(document)
+                if document['_id'] != original_id:
+                    insert_statements.append(pymongo.InsertOne(document))
+                    drop_statements.append(pymongo.DeleteOne({'_id': original_id}))
+                elif document != original_document:
+                    replace_statements.append(pymongo.ReplaceOne({'_id': original_id}, document))
+            if pending_write:
+                pending_write.result()
+            pending_write = writer.submit(write_and_checkpoint, insert_statements, drop_statements,
+                                          replace_statements, last_id, len(batch_of_documents))
+        if pending_write:
+            pending_write.result()
+
+    logger.info(f"{checkpoint['processed']} documents processed in {collection.name}: "
+                f"{checkpoint['inserted']} new documents inserted, {checkpoint['dropped']} old documents dropped, "
+                f"{checkpoint['replaced']} documents replaced, {checkpoint['skipped']} documents already correct")
+    return checkpoint
+
+
+def rewrite_document_ids(mongo_source, collection_name, filter_criteria, correction_func, id_creation_func,
+                         batch_size=1000, checkpoint_file=None, limit=0):
+    """Apply rewrite_collection_ids to the collection_name collection of the mongo_source database."""
+    return rewrite_collection_ids(mongo_source.mongo_handle[mongo_source.db_name][collection_name], filter_criteria,
+                                  correction_func, id_creation_func, batch_size, checkpoint_file, limit)
@@ -0,0 +1,204 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+from collections import defaultdict
+from itertools import groupby
+
+import pysam
+from ebi_eva_common_pyutils.logger import AppLogger
+from pysam.libcbgzf import BGZFile
+
+# Positions closer than this are fetched with a single region query
+DEFAULT_MAX_GAP = 1000
+
+
+def path_in_index_dir(data_file, index_dir=None, suffix=''):
+    """
+    Returns the path of a file derived from data_file in index_dir (the system temporary directory by default). The
+    path of the data file is reproduced under index_dir so files with the same name do not share their derived files.
+    """
+    derived_file = os.path.join(index_dir or tempfile.gettempdir(), os.path.abspath(data_file).lstrip(os.sep) + suffix)
+    os.makedirs(os.path.dirname(derived_file), exist_ok=True)
+    return derived_file
+
+
+def is_gzip(data_file):
+    with open(data_file, 'rb') as open_file:
+        return open_file.read(2) == b'\x1f\x8b'
+
+
+def is_bgzf(data_file):
+    # BGZF blocks are gzip members whose extra field starts with the BC subfield holding the size of the block
+    with open(data_file, 'rb') as open_file:
+        header = open_file.read(14)
+    return header[:4] == b'\x1f\x8b\x08\x04' and header[12:14] == b'BC'
+
+
+def bgzip_vcf(vcf_file, bgzipped_vcf_file):
+    """Write vcf_file, plain text or gzipped, in BGZF blocks to bgzipped_vcf_file."""
+    tmp_vcf_file = f'{bgzipped_vcf_file}.{os.getpid()}.tmp'
+    if is_gzip(vcf_file):
+        with gzip.open(vcf_file, 'rb') as open_input, BGZFile(tmp_vcf_file, 'wb') as open_output:
+            shutil.copyfileobj(open_input, open_output)
+    else:
+        pysam.tabix_compress(vcf_file, tmp_vcf_file, force=True)
+    os.replace(tmp_vcf_file, bgzipped_vcf_file)
+
+
+def index_vcf(vcf_file, index_dir=None, csi=False):
+    """
+    Returns the path of the bgzipped VCF with a tabix (or CSI) index. An indexed VCF, or an indexed bgzipped copy next
+    to it, is used as is. Otherwise the bgzipped VCF and its index are created in index_dir and the directory of the VCF
+    is left untouched: a plain text or gzip (but not BGZF) VCF is compressed in BGZF blocks, a BGZF VCF is linked.
+    """
+    work_vcf_file = path_in_index_dir(vcf_file, index_dir, '' if vcf_file.endswith('.gz') else '.gz')
+    for indexed_vcf_file in [vcf_file, vcf_file + '.gz', work_vcf_file]:
+        if os.path.exists(indexed_vcf_file + '.tbi') or os.path.exists(indexed_vcf_file + '.csi'):
+            return indexed_vcf_file
+    if not os.path.exists(work_vcf_file):
+        if is_bgzf(vcf_file):
+            os.symlink(os.path.abspath(vcf_file), work_vcf_file)
+        else:
+            bgzip_vcf(vcf_file, work_vcf_file)
+    return pysam.tabix_index(work_vcf_file, preset='vcf', keep_original=True, csi=csi)
+
+
+def merge_positions(positions, window, max_gap=DEFAULT_MAX_GAP):
+    """
+    Returns the regions (contig, start, end), 1-based and inclusive, covering window bases around each
+    (contig, position). Positions closer than max_gap are merged in the same region.
+    """
+    regions = []
+    for contig, contig_positions in groupby(sorted(positions), key=lambda position: position[0]):
+        start = end = None
+        for _, position in contig_positions:
+            if end is not None and position - window <= end + max_gap:
+                end = position + window
+            else:
+                if end is not None:
+                    regions.append((contig, start, end))
+                start, end = max(1, position - window), position + window
+        regions.append((contig, start, end))
+    return regions
+
+
+def fetch_vcf_records_around(vcf_file, positions, window=0, max_gap=DEFAULT_MAX_GAP, index_dir=None):
+    """
+    Yields the records of the indexed VCF starting within window bases of one of the (contig, position), reading
+    only the regions around the positions. Each record is only returned once. See index_vcf for index_dir.
+    """
+    with pysam.VariantFile(index_vcf(vcf_file, index_dir), 'r') as vcf_in:
+        contigs = set(vcf_in.header.contigs)
+        for contig, start, end in merge_positions(positions, window, max_gap):
+            if contig not in contigs:
+                continue
+            for vcf_record in vcf_in.fetch(contig, start - 1, end):
+                # Records overlapping the start of the region belong to the previous one
+                if start <= vcf_record.pos <= end:
+                    yield vcf_record
+
+
+def variant_id_from_read_name(read_name):
+    # The fields describing the variant are separated by | in the read name, the fifth one is the variant id
+    return read_name.split('|', 5)[4]
+
+
+def open_alignment_file(bam_file):
+    return pysam.AlignmentFile(bam_file, 'rb')
+
+
+def open_variant_file(vcf_file):
+    return pysam.VariantFile(vcf_file, 'r')
+
+
+def vcf_record_id(vcf_record):
+    return vcf_record.id
+
+
+class RecordOffsetIndex(AppLogger):
+    """
+    Persisted index of the virtual offsets of the records of a BAM or bgzipped VCF, keyed by a value derived from each
+    record (the variant id in the read name, the VCF id...). The index is built with a single pass over the file the
+    first time it is needed and stored in a SQLite database in index_dir (see path_in_index_dir). It is rebuilt when the
+    size or modification time of the file changes. The records of a few keys can then be read without scanning the
+    file. Records cannot be sought in gzip files that are not BGZF, which are scanned instead.
+    """
+
+    def __init__(self, data_file, key_function, open_function=open_alignment_file, index_file=None, index_dir=None):
+        self.data_file = data_file
+        self.key_function = key_function
+        self.open_function = open_function
+        self.index_file = index_file or path_in_index_dir(data_file, index_dir, '.offsets.sqlite')
+
+    def _is_current(self, connection):
+        stat = os.stat(self.data_file)
+        try:
+            row = connection.execute('SELECT size, mtime FROM indexed_file').fetchone()
+        except sqlite3.OperationalError:
+            return False
+        return row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime
+
+    def _build(self, connection):
+        self.info(f'Index the records of {self.data_file} in {self.index_file}')
+        stat = os.stat(self.data_file)
+        with connection:
+            connection.execute('DROP TABLE IF EXISTS record_offset')
+            connection.execute('DROP TABLE IF EXISTS indexed_file')
+            connection.execute('CREATE TABLE record_offset (key TEXT, offset INTEGER)')
+            connection.execute('CREATE TABLE indexed_file (size INTEGER, mtime REAL)')
+            with self.open_function(self.data_file) as open_file:
+                batch = []
+                while True:
+                    offset = open_file.tell()
+                    record = next(open_file, None)
+                    if record is None:
+                        break
+                    batch.append((self.key_function(record), offset))
+                    if len(batch) == 100000:
+                        connection.executemany('INSERT INTO record_offset VALUES (?, ?)', batch)
+                        batch = []
+                connection.executemany('INSERT INTO record_offset VALUES (?, ?)', batch)
+            connection.execute('CREATE INDEX record_offset_key ON record_offset (key)')
+            connection.execute('INSERT INTO indexed_file VALUES (?, ?)', (stat.st_size, stat.st_mtime))
+
+    def get_offsets(self, keys):
+        connection = sqlite3.connect(self.index_file)
+        try:
+            if not self._is_current(connection):
+                self._build(connection)
+            keys = [str(key) for key in keys]
+            offsets = []
+            # Stay below the maximum number of parameters of a SQLite query
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                offsets.extend(connection.execute(
+                    f'SELECT key, offset FROM record_offset WHERE key IN ({",".join("?" * len(batch))})', batch
+                ))
+            return offsets
+        finally:
+            connection.close()
+
+    def _scan(self, keys):
+        self.warning(f'{self.data_file} is not compressed in BGZF blocks, scan the whole file')
+        keys = set(str(key) for key in keys)
+        records_per_key = defaultdict(list)
+        # htslib cannot open these files, they are decompressed by Python instead
+        with gzip.open(self.data_file, 'rb') as open_gzip, self.open_function(open_gzip) as open_file:
+            for record in open_file:
+                key = str(self.key_function(record))
+                if key in keys:
+                    records_per_key[key].append(record)
+        return records_per_key
+
+    def fetch(self, keys):
+        """Returns the records of each key found in the file, in the order of the file."""
+        if is_gzip(self.data_file) and not is_bgzf(self.data_file):
+            return self._scan(keys)
+        records_per_key = defaultdict(list)
+        with self.open_function(self.data_file) as open_file:
+            for key, offset in sorted(self.get_offsets(keys), key=lambda key_offset: key_offset[1]):
+                open_file.seek(offset)
+                records_per_key[key].append(next(open_file))
+        return records_per_key
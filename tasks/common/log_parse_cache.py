@@ -0,0 +1,71 @@
+import copy
+import os
+import pickle
+import sqlite3
+
+from ebi_eva_common_pyutils.logger import AppLogger
+
+
+class LogParseCache(AppLogger):
+    """
+    Keep the state of the parsing of log files in a SQLite database so each log is only read once.
+    For each log file, the size and modification time, the offset up to which the file was parsed and the state of the
+    parser are stored. When a log grows, only the bytes appended since the last parse are read. When it shrinks, it is
+    parsed again from the start.
+    The parser is a function taking an iterable of lines and the state of the previous parse and updating that state,
+    which must be picklable. Only complete lines are parsed, a line still being written is read on the next call.
+    Without cache file, the states are only kept in memory.
+    """
+
+    def __init__(self, cache_file=None, parser_name='default'):
+        self.parser_name = parser_name
+        self.connection = sqlite3.connect(cache_file or ':memory:')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS log_state (parser TEXT, path TEXT, size INTEGER, mtime REAL, '
+            'offset INTEGER, state BLOB, PRIMARY KEY (parser, path))'
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_state(self, log_file, parse_lines, initial_state):
+        """Returns a copy of the state of parse_lines once it has been applied to all the lines of the log file."""
+        path = os.path.abspath(log_file)
+        stat = os.stat(path)
+        row = self.connection.execute('SELECT size, mtime, offset, state FROM log_state WHERE parser = ? AND path = ?',
+                                      (self.parser_name, path)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return pickle.loads(row[3])
+        if row and stat.st_size >= row[2]:
+            offset, state = row[2], pickle.loads(row[3])
+            self.debug(f'Parse {stat.st_size - offset} bytes appended to {path}')
+        else:
+            offset, state = 0, copy.deepcopy(initial_state)
+            self.debug(f'Parse {path}')
+
+        end_of_last_line = offset
+
+        def complete_lines(open_file):
+            nonlocal end_of_last_line
+            for line in open_file:
+                # Keep the last line for the next parse if it is not complete yet
+                if not line.endswith(b'\n'):
+                    break
+                end_of_last_line += len(line)
+                yield line.decode(errors='replace')
+
+        # The lines are read one at a time so the logs are never loaded in memory
+        with open(path, 'rb') as open_file:
+            open_file.seek(offset)
+            parse_lines(complete_lines(open_file), state)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO log_state VALUES (?, ?, ?, ?, ?, ?)',
+                                    (self.parser_name, path, stat.st_size, stat.st_mtime, end_of_last_line,
+                                     pickle.dumps(state)))
+        return state
@@ -0,0 +1,237 @@
+import json
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from ebi_eva_common_pyutils.logger import AppLogger
+from retry import retry
+
+eutils_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+ensembl_url = 'https://rest.ensembl.org/'
+ena_url = 'https://www.ebi.ac.uk/ena/browser/api/'
+
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+class MetadataCache:
+    """
+    Cache of the values retrieved from remote services stored in a SQLite database, which several processes can read
+    and write at the same time. Values are stored as JSON by namespace and key with an expiry time after which they
+    are ignored and eventually evicted. Without cache file, the values are only kept in memory.
+    """
+
+    def __init__(self, cache_file=None, ttl=DEFAULT_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.local = threading.local()
+        self.memory_cache = {}
+        self.lock = threading.Lock()
+        if self.cache_file:
+            with self._connection() as connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS metadata_cache (namespace TEXT, key TEXT, value TEXT, '
+                                   'expires REAL, PRIMARY KEY (namespace, key))')
+            self.evict_expired()
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = sqlite3.connect(self.cache_file, timeout=60)
+            # Readers are not blocked by a process writing to the cache
+            self.local.connection.execute('PRAGMA journal_mode=WAL')
+        return self.local.connection
+
+    def get_many(self, namespace, keys):
+        """Returns a dict with the values of the keys present in the cache and not expired."""
+        keys = [str(key) for key in keys]
+        now = time.time()
+        if not self.cache_file:
+            with self.lock:
+                return dict(
+                    (key, self.memory_cache[(namespace, key)][0]) for key in keys
+                    if (namespace, key) in self.memory_cache and self.memory_cache[(namespace, key)][1] > now
+                )
+        values = {}
+        connection = self._connection()
+        # Stay under the maximum number of parameters of a SQLite query
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = connection.execute(
+                f'SELECT key, value FROM metadata_cache WHERE namespace = ? AND expires > ? '
+                f'AND key IN ({",".join("?" * len(chunk))})', [namespace, now] + chunk
+            ).fetchall()
+            values.update((key, json.loads(value)) for key, value in rows)
+        return values
+
+    def set_many(self, namespace, values):
+        expires = time.time() + self.ttl
+        if not self.cache_file:
+            with self.lock:
+                # Go through JSON so the values are the same as the ones read from a cache file
+                self.memory_cache.update(((namespace, str(key)), (json.loads(json.dumps(value)), expires))
+                                         for key, value in values.items())
+            return
+        connection = self._connection()
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO metadata_cache VALUES (?, ?, ?, ?)',
+                                   [(namespace, str(key), json.dumps(value), expires) for key, value in values.items()])
+
+    def evict_expired(self):
+        if self.cache_file:
+            connection = self._connection()
+            with connection:
+                connection.execute('DELETE FROM metadata_cache WHERE expires <= ?', (time.time(),))
+
+
+class RateLimiter:
+    """Space the calls to wait so there are no more than requests_per_second across all the threads."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class MetadataClient(AppLogger):
+    """
+    Retrieve metadata from NCBI, ENA and Ensembl.
+    Identifiers are looked up in batches: NCBI esummary calls take up to batch_size ids and the other services are
+    called for each identifier. Calls are made concurrently by max_workers threads without exceeding
+    ncbi_requests_per_second to NCBI and requests_per_second to each of the other services. The results, including
+    the identifiers that were not found, are stored in a MetadataCache shared by all the scripts using the same cache
+    file.
+    In offline mode, only the cache is used and identifiers that are not in it are missing from the results.
+    """
+
+    def __init__(self, cache_file=None, ttl=DEFAULT_TTL, offline=False, max_workers=4, ncbi_requests_per_second=3,
+                 requests_per_second=10, batch_size=200, api_key=None, eutils_url=eutils_url, ensembl_url=ensembl_url,
+                 ena_url=ena_url):
+        self.cache = MetadataCache(cache_file, ttl)
+        self.offline = offline
+        self.max_workers = max_workers
+        # NCBI allows 3 requests per second without an api key and 10 with one
+        self.rate_limiters = {
+            eutils_url: RateLimiter(ncbi_requests_per_second),
+            ensembl_url: RateLimiter(requests_per_second),
+            ena_url: RateLimiter(requests_per_second)
+        }
+        self.batch_size = batch_size
+        self.api_key = api_key
+        self.eutils_url = eutils_url
+        self.ensembl_url = ensembl_url
+        self.ena_url = ena_url
+
+    @retry(exceptions=(requests.ConnectionError, requests.Timeout, requests.HTTPError), tries=3, delay=2, backoff=1.2,
+           jitter=(1, 3))
+    def _get(self, base_url, path, params=None):
+        self.rate_limiters[base_url].wait()
+        response = requests.get(base_url + path, params=params, timeout=60)
+        # Not found identifiers are reported with a 400 by Ensembl and a 404 by ENA
+        if response.status_code not in (400, 404):
+            response.raise_for_status()
+        return response
+
+    def _lookup(self, namespace, keys, fetch_batch, batch_size):
+        """
+        Returns the values of the keys found in the cache or retrieved with fetch_batch, which takes a list of keys and
+        returns a dict of the values found for them. Keys without value are cached as None.
+        """
+        keys = list(dict.fromkeys(str(key) for key in keys))
+        values = self.cache.get_many(namespace, keys)
+        missing_keys = [key for key in keys if key not in values]
+        if not missing_keys:
+            return values
+        if self.offline:
+            self.warning(f'{len(missing_keys)} {namespace} not in the cache in offline mode')
+            return values
+
+        def fetch_and_cache(batch):
+            batch_values = fetch_batch(batch)
+            batch_values = dict((key, batch_values.get(key)) for key in batch)
+            self.cache.set_many(namespace, batch_values)
+            return batch_values
+
+        self.info(f'Retrieve {len(missing_keys)} {namespace}')
+        batches = [missing_keys[start:start + batch_size] for start in range(0, len(missing_keys), batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch_values in executor.map(fetch_and_cache, batches):
+                values.update(batch_values)
+        return values
+
+    def _esummary(self, database, ids):
+        params = {'db': database, 'id': ','.join(ids), 'retmode': 'JSON'}
+        if self.api_key:
+            params['api_key'] = self.api_key
+        result = self._get(self.eutils_url, 'esummary.fcgi', params).json().get('result', {})
+        return dict((uid, result.get(uid)) for uid in result.get('uids', []))
+
+    def _esearch(self, database, term):
+        params = {'db': database, 'term': term, 'retmode': 'JSON', 'retmax': 1000}
+        if self.api_key:
+            params['api_key'] = self.api_key
+        return self._get(self.eutils_url, 'esearch.fcgi', params).json().get('esearchresult', {}).get('idlist', [])
+
+    def get_ncbi_taxonomy_summaries(self, taxonomy_ids):
+        """Returns the NCBI esummary of each taxonomy id, keyed by taxonomy id as string."""
+        return self._lookup('ncbi_taxonomy', taxonomy_ids, lambda batch: self._esummary('Taxonomy', batch),
+                            self.batch_size)
+
+    def get_ncbi_assembly_summaries(self, assembly_accessions):
+        """Returns the list of NCBI esummary found when searching each assembly accession, keyed by accession."""
+        def fetch_batch(accessions):
+            ids_per_accession = dict((accession, self._esearch('Assembly', f'"{accession}"'))
+                                     for accession in accessions)
+            all_ids = sorted(set(i for ids in ids_per_accession.values() for i in ids))
+            summaries = {}
+            for start in range(0, len(all_ids), self.batch_size):
+                summaries.update(self._esummary('Assembly', all_ids[start:start + self.batch_size]))
+            return dict((accession, [summaries[i] for i in ids if i in summaries])
+                        for accession, ids in ids_per_accession.items())
+
+        # Each accession needs its own search so smaller batches spread the searches across threads
+        return self._lookup('ncbi_assembly', assembly_accessions, fetch_batch, max(1, self.batch_size // 20))
+
+    def get_ncbi_scientific_names(self, taxonomy_ids):
+        return dict((taxonomy_id, summary.get('scientificname') if summary else None)
+                    for taxonomy_id, summary in self.get_ncbi_taxonomy_summaries(taxonomy_ids).items())
+
+    def get_ensembl_scientific_names(self, taxonomy_ids):
+        def fetch_batch(batch):
+            names = {}
+            for taxonomy_id in batch:
+                response = self._get(self.ensembl_url, f'taxonomy/id/{taxonomy_id}',
+                                     {'content-type': 'application/json'})
+                names[taxonomy_id] = response.json().get('scientific_name') if response.ok else None
+            return names
+        return self._lookup('ensembl_scientific_name', taxonomy_ids, fetch_batch, 1)
+
+    def get_ena_scientific_names(self, taxonomy_ids):
+        def fetch_batch(batch):
+            names = {}
+            for taxonomy_id in batch:
+                response = self._get(self.ena_url, f'xml/{taxonomy_id}')
+                taxon = ElementTree.fromstring(response.content).find('taxon') if response.ok else None
+                names[taxonomy_id] = taxon.get('scientificName') if taxon is not None else None
+            return names
+        return self._lookup('ena_scientific_name', taxonomy_ids, fetch_batch, 1)
+
+    def get_ensembl_current_assemblies(self, scientific_names):
+        """Returns the accession of the assembly currently supported by Ensembl for each species."""
+        def fetch_batch(batch):
+            assemblies = {}
+            for scientific_name in batch:
+                response = self._get(self.ensembl_url, 'info/assembly/' + scientific_name.lower().replace(' ', '_'),
+                                     {'content-type': 'application/json'})
+                assemblies[scientific_name] = response.json().get('assembly_accession') if response.ok else None
+            return assemblies
+        return self._lookup('ensembl_assembly', scientific_names, fetch_batch, 1)
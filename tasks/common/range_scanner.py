@@ -0,0 +1,228 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+from bson import json_util, MinKey, MaxKey
+from ebi_eva_common_pyutils.logger import AppLogger
+from pymongo.errors import OperationFailure
+from pymongo.read_concern import ReadConcern
+
+RANGE_DONE = 'done'
+
+
+def _bound(chunk_bound):
+    # The first and last chunks are bounded by MinKey and MaxKey which mean the range is open on that side
+    return None if isinstance(chunk_bound, (MinKey, MaxKey)) else chunk_bound
+
+
+def get_chunk_ranges(collection):
+    """
+    Returns the _id ranges of the chunks of a collection sharded on _id, ordered by _id, as read from config.chunks.
+    Returns None when the collection is not sharded on _id or the config database cannot be read.
+    """
+    config_db = collection.database.client['config']
+    namespace = collection.full_name
+    try:
+        collection_info = config_db['collections'].find_one({'_id': namespace})
+        if not collection_info or collection_info.get('dropped') or collection_info.get('key') != {'_id': 1}:
+            return None
+        # Chunks are referenced by namespace up to MongoDB 4.4 and by collection uuid after that
+        chunk_filter = {'$or': [{'ns': namespace}, {'uuid': collection_info.get('uuid')}]} \
+            if 'uuid' in collection_info else {'ns': namespace}
+        chunks = config_db['chunks'].find(chunk_filter, {'min': 1, 'max': 1}).sort('min', pymongo.ASCENDING)
+        return [(_bound(chunk['min']['_id']), _bound(chunk['max']['_id'])) for chunk in chunks] or None
+    except OperationFailure:
+        return None
+
+
+def get_sampled_ranges(collection, num_ranges, samples_per_range=20):
+    """
+    Split the _id space of a collection in num_ranges ranges of roughly equal size using a random sample of _id.
+    All the _id of the collection are expected to have the same type. None means the range is open on that side.
+    """
+    sample_size = num_ranges * samples_per_range
+    sampled_ids = sorted(set(
+        document['_id']
+        for document in collection.aggregate([{'$sample': {'size': sample_size}}, {'$project': {'_id': 1}}])
+    ))
+    split_points = []
+    for i in range(1, num_ranges):
+        split_point = sampled_ids[i * len(sampled_ids) // num_ranges] if sampled_ids else None
+        if split_point is not None and (not split_points or split_point > split_points[-1]):
+            split_points.append(split_point)
+    bounds = [None] + split_points + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def get_ranges(collection, num_ranges=None, default_num_ranges=16):
+    """
+    Returns the chunk ranges of the collection if it is sharded on _id and num_ranges is not set, otherwise num_ranges
+    (or default_num_ranges) ranges estimated from a sample of _id.
+    """
+    ranges = None
+    if num_ranges is None:
+        ranges = get_chunk_ranges(collection)
+    if not ranges:
+        ranges = get_sampled_ranges(collection, num_ranges or default_num_ranges)
+    return ranges
+
+
+def get_id_range_filter(lower, upper):
+    """Returns the filter selecting the _id in [lower, upper[, None meaning the range is open on that side."""
+    id_filter = {}
+    if lower is not None:
+        id_filter['$gte'] = lower
+    if upper is not None:
+        id_filter['$lt'] = upper
+    return {'_id': id_filter} if id_filter else {}
+
+
+class RangeScanner(AppLogger):
+    """
+    Scan the documents of a collection matching a filter with one cursor per _id range, several ranges being read
+    concurrently so the work is spread across the shards of the cluster.
+    The ranges are the chunks of the collection when it is sharded on _id, otherwise they are estimated from a random
+    sample of _id. Documents are returned in batches of batch_size from the calling thread.
+    When a progress file is provided, the ranges and the last _id returned for each of them are saved in it so an
+    interrupted scan resumes where it stopped.
+    """
+
+    def __init__(self, collection, filter_criteria, projection=None, max_workers=4, num_ranges=None, batch_size=1000,
+                 progress_file=None, save_interval=30):
+        self.collection = collection
+        self.filter_criteria = filter_criteria
+        self.projection = projection
+        self.max_workers = max_workers
+        self.num_ranges = num_ranges
+        self.batch_size = batch_size
+        self.progress_file = progress_file
+        self.save_interval = save_interval
+        self.ranges = None
+
+    def _load_or_create_ranges(self):
+        if self.progress_file and os.path.exists(self.progress_file):
+            with open(self.progress_file) as open_file:
+                self.ranges = json_util.loads(open_file.read())['ranges']
+            self.info(f'Resuming scan of {self.collection.full_name} from {self.progress_file}: '
+                      f'{sum(1 for r in self.ranges if r["last_id"] == RANGE_DONE)}/{len(self.ranges)} ranges done')
+            return
+        ranges = get_ranges(self.collection, self.num_ranges, default_num_ranges=self.max_workers * 4)
+        self.ranges = [{'min': lower, 'max': upper, 'last_id': None} for lower, upper in ranges]
+        self.info(f'Scanning {self.collection.full_name} in {len(self.ranges)} ranges')
+        self._save_progress()
+
+    def _save_progress(self):
+        if self.progress_file:
+            # Write to a temporary file first so a run killed while writing does not leave a truncated progress file
+            with open(self.progress_file + '.tmp', 'w') as open_file:
+                open_file.write(json_util.dumps({'ranges': self.ranges}))
+            os.replace(self.progress_file + '.tmp', self.progress_file)
+
+    def _range_filter(self, scan_range):
+        id_filter = {}
+        if scan_range['last_id'] is not None:
+            id_filter['$gt'] = scan_range['last_id']
+        elif scan_range['min'] is not None:
+            id_filter['$gte'] = scan_range['min']
+        if scan_range['max'] is not None:
+            id_filter['$lt'] = scan_range['max']
+        if not id_filter:
+            return self.filter_criteria
+        return {'$and': [self.filter_criteria, {'_id': id_filter}]}
+
+    def _read_range(self, range_index, output_queue, stop_event):
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    output_queue.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            cursor = self.collection.with_options(read_concern=ReadConcern("majority")) \
+                .find(self._range_filter(self.ranges[range_index]), self.projection, no_cursor_timeout=True) \
+                .batch_size(self.batch_size)
+            # The last _id read in a range only marks its progress when the range is read in _id order
+            if self.progress_file:
+                cursor = cursor.sort('_id', pymongo.ASCENDING)
+            try:
+                documents = []
+                for document in cursor:
+                    documents.append(document)
+                    if len(documents) == self.batch_size:
+                        if not put((range_index, documents)):
+                            return
+                        documents = []
+                if documents and not put((range_index, documents)):
+                    return
+            finally:
+                cursor.close()
+            put((range_index, RANGE_DONE))
+        except Exception as e:
+            put((range_index, e))
+
+    def scan_batches(self):
+        """
+        Yields lists of documents. Progress is recorded for a batch once the next one is requested so a batch being
+        processed when the scan is interrupted is returned again when the scan is resumed.
+        """
+        self._load_or_create_ranges()
+        ranges_to_scan = [i for i, scan_range in enumerate(self.ranges) if scan_range['last_id'] != RANGE_DONE]
+        output_queue = queue.Queue(maxsize=self.max_workers * 2)
+        stop_event = threading.Event()
+        last_save = time.time()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for range_index in ranges_to_scan:
+                executor.submit(self._read_range, range_index, output_queue, stop_event)
+            remaining_ranges = len(ranges_to_scan)
+            batch = []
+            batch_last_ids = {}
+            while remaining_ranges:
+                range_index, item = output_queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                if item == RANGE_DONE:
+                    remaining_ranges -= 1
+                    batch_last_ids[range_index] = RANGE_DONE
+                    continue
+                for document in item:
+                    batch.append(document)
+                    batch_last_ids[range_index] = document['_id']
+                    if len(batch) == self.batch_size:
+                        yield batch
+                        batch = []
+                        self._record_progress(batch_last_ids)
+                        batch_last_ids = {}
+                if time.time() - last_save > self.save_interval:
+                    self._save_progress()
+                    last_save = time.time()
+            if batch:
+                yield batch
+            self._record_progress(batch_last_ids)
+        finally:
+            stop_event.set()
+            executor.shutdown(wait=True)
+            self._save_progress()
+
+    def _record_progress(self, batch_last_ids):
+        for range_index, last_id in batch_last_ids.items():
+            if self.ranges[range_index]['last_id'] != RANGE_DONE:
+                self.ranges[range_index]['last_id'] = last_id
+
+    def scan_documents(self):
+        for batch in self.scan_batches():
+            yield from batch
+
+    def scan(self, callback):
+        """Call callback with each batch of documents from the calling thread and return the number of documents."""
+        count = 0
+        for batch in self.scan_batches():
+            callback(batch)
+            count += len(batch)
+        return count
@@ -0,0 +1,107 @@
+import os
+import tempfile
+from collections import OrderedDict
+
+import pysam
+
+
+def index_fasta(fasta_file, index_dir):
+    """
+    Write the faidx index of fasta_file under index_dir, where the path of the FASTA file is reproduced so that
+    genomes with the same file name do not share an index. samtools rejects FASTA files whose lines are not all the
+    same length. The index is written to a temporary file then renamed so concurrent processes never read a partial
+    index.
+    """
+    fai_file = os.path.join(index_dir, os.path.abspath(fasta_file).lstrip(os.sep) + '.fai')
+    if not os.path.exists(fai_file):
+        os.makedirs(os.path.dirname(fai_file), exist_ok=True)
+        tmp_fai_file = f'{fai_file}.{os.getpid()}.tmp'
+        pysam.faidx(fasta_file, '--fai-idx', tmp_fai_file)
+        os.replace(tmp_fai_file, fai_file)
+    return fai_file
+
+
+class IndexedFasta:
+    """
+    Random access to the sequences of a FASTA file through its faidx index. The index next to the FASTA file is used
+    when it exists, otherwise it is created in index_dir so the genome directory is never written to.
+    """
+
+    def __init__(self, fasta_file, index_dir):
+        self.fasta_file = fasta_file
+        fai_file = fasta_file + '.fai'
+        if not os.path.exists(fai_file):
+            fai_file = index_fasta(fasta_file, index_dir)
+        self.fasta = pysam.FastaFile(fasta_file, filepath_index=fai_file)
+        self.lengths = dict(zip(self.fasta.references, self.fasta.lengths))
+        self.contig_order = dict((contig, i) for i, contig in enumerate(self.fasta.references))
+
+    def close(self):
+        self.fasta.close()
+
+    def fetch(self, contig, start, end):
+        """
+        Returns the sequence of contig between start and end, 1-based and inclusive like samtools faidx. The region is
+        truncated to the contig and an empty string is returned for a contig absent from the index.
+        """
+        if contig not in self.lengths:
+            return ''
+        start = max(start, 1)
+        end = min(end, self.lengths[contig])
+        if end < start:
+            return ''
+        return self.fasta.fetch(contig, start - 1, end)
+
+    def fetch_regions(self, regions):
+        """Returns the sequences of a list of (contig, start, end), reading the regions in the order of the file."""
+        sequences = [None] * len(regions)
+        order = sorted(range(len(regions)), key=lambda i: (self.contig_order.get(regions[i][0], -1), regions[i][1]))
+        for i in order:
+            sequences[i] = self.fetch(*regions[i])
+        return sequences
+
+
+class ReferenceSequenceCache:
+    """
+    Keep at most max_open_genomes IndexedFasta open, closing the least recently used one first. Missing indexes are
+    created in index_dir, or in a temporary directory removed on close when index_dir is not provided.
+    """
+
+    def __init__(self, max_open_genomes=4, index_dir=None):
+        self.max_open_genomes = max_open_genomes
+        self.genomes = OrderedDict()
+        self.tmp_index_dir = None
+        if not index_dir:
+            self.tmp_index_dir = tempfile.TemporaryDirectory()
+            index_dir = self.tmp_index_dir.name
+        self.index_dir = index_dir
+
+    def get(self, fasta_file):
+        if fasta_file in self.genomes:
+            self.genomes.move_to_end(fasta_file)
+            return self.genomes[fasta_file]
+        if len(self.genomes) >= self.max_open_genomes:
+            _, least_recent_genome = self.genomes.popitem(last=False)
+            least_recent_genome.close()
+        self.genomes[fasta_file] = IndexedFasta(fasta_file, self.index_dir)
+        return self.genomes[fasta_file]
+
+    def fetch(self, fasta_file, contig, start, end):
+        return self.get(fasta_file).fetch(contig, start, end)
+
+    def fetch_regions(self, fasta_file, regions):
+        return self.get(fasta_file).fetch_regions(regions)
+
+    def close(self):
+        for genome in self.genomes.values():
+            genome.close()
+        self.genomes.clear()
+        if self.tmp_index_dir:
+            self.tmp_index_dir.cleanup()
+            self.tmp_index_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
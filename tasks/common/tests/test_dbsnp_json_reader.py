@@ -0,0 +1,104 @@
+import bz2
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from tasks.common.dbsnp_json_reader import DbsnpJsonChecker, DbsnpJsonReader, is_rs_id_mapped_to_assembly
+
+
+class RecordCollector(DbsnpJsonChecker):
+
+    def __init__(self):
+        self.results = []
+        self.finished = False
+
+    def check_record(self, rs_record, line_index):
+        return line_index, int(rs_record['refsnp_id'])
+
+    def process_results(self, results):
+        self.results.extend(results)
+
+    def finish(self):
+        self.finished = True
+
+
+class EvenRSCounter(DbsnpJsonChecker):
+
+    def __init__(self):
+        self.count = 0
+
+    def check_record(self, rs_record, line_index):
+        return 1 if int(rs_record['refsnp_id']) % 2 == 0 else None
+
+    def process_results(self, results):
+        self.count += len(results)
+
+
+class FailingChecker(DbsnpJsonChecker):
+
+    def check_record(self, rs_record, line_index):
+        return rs_record['refsnp_id']
+
+    def process_results(self, results):
+        raise ValueError('Lookup failed')
+
+
+def rs_record(rs_id, assembly):
+    return {
+        'refsnp_id': str(rs_id),
+        'primary_snapshot_data': {'placements_with_allele': [
+            {'is_ptlp': True, 'placement_annot': {'seq_id_traits_by_assembly': [{'assembly_accession': assembly}]}}
+        ]}
+    }
+
+
+class TestDbsnpJsonReader(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.release_json_file = os.path.join(self.tmp_dir.name, 'refsnp-chr1.json.bz2')
+        with bz2.open(self.release_json_file, 'wt') as open_file:
+            for rs_id in range(1, 2502):
+                open_file.write(json.dumps(rs_record(rs_id, 'GCF_000001405.38')) + '\n')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_read_with_several_checkers(self):
+        collector = RecordCollector()
+        counter = EvenRSCounter()
+        num_records = DbsnpJsonReader(self.release_json_file, [collector, counter], num_workers=3,
+                                      chunk_size=100, queue_size=2).read()
+        self.assertEqual(num_records, 2501)
+        # Results are processed in the order of the file
+        self.assertEqual(collector.results, [(i, i + 1) for i in range(2501)])
+        self.assertTrue(collector.finished)
+        self.assertEqual(counter.count, 1250)
+
+    def test_read_without_parallel_decompression(self):
+        collector = RecordCollector()
+        DbsnpJsonReader(self.release_json_file, [collector], num_workers=1, decompress_threads=1).read()
+        self.assertEqual(len(collector.results), 2501)
+
+    def test_line_index_counts_blank_lines(self):
+        with bz2.open(self.release_json_file, 'wt') as open_file:
+            for rs_id in range(1, 6):
+                open_file.write(json.dumps(rs_record(rs_id, 'GCF_000001405.38')) + '\n')
+                if rs_id % 2 == 0:
+                    open_file.write('\n')
+        collector = RecordCollector()
+        num_records = DbsnpJsonReader(self.release_json_file, [collector], num_workers=2, chunk_size=2).read()
+        self.assertEqual(num_records, 5)
+        # The blank lines after rs2 and rs4 are counted in the line indexes
+        self.assertEqual(collector.results, [(0, 1), (1, 2), (3, 3), (4, 4), (6, 5)])
+
+    def test_error_in_checker_is_raised(self):
+        with self.assertRaises(ValueError):
+            DbsnpJsonReader(self.release_json_file, [FailingChecker()], num_workers=2, chunk_size=100).read()
+
+    def test_is_rs_id_mapped_to_assembly(self):
+        self.assertTrue(is_rs_id_mapped_to_assembly(rs_record(1, 'GCF_000001405.38'), 'GCF_000001405.38'))
+        self.assertFalse(is_rs_id_mapped_to_assembly(rs_record(1, 'GCF_000001405.25'), 'GCF_000001405.38'))
+        self.assertFalse(is_rs_id_mapped_to_assembly({'refsnp_id': '1', 'primary_snapshot_data': {}},
+                                                     'GCF_000001405.38'))
@@ -0,0 +1,102 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from ebi_eva_common_pyutils.mongodb import MongoDatabase
+
+from tasks.common.id_rewrite import rewrite_document_ids, save_checkpoint, load_checkpoint
+from tasks.common.variant_hashing import get_submitted_SHA1
+
+
+class TestIdRewrite(TestCase):
+    def setUp(self) -> None:
+        self.db = "eva_accession_sharded"
+        self.collection = "submittedVariantEntity"
+        self.mongo_source = MongoDatabase(uri="mongodb://localhost:27017/", db_name=self.db)
+        self.variants = []
+        for i in range(10):
+            variant = {"seq": "GCA_000001.1", "study": "PRJEB1", "contig": "CM0001.1", "start": 100 + i,
+                       "ref": "A", "alt": "T", "accession": 5000 + i}
+            variant['_id'] = get_submitted_SHA1(variant)
+            self.variants.append(variant)
+        self.mongo_source.mongo_handle[self.db][self.collection].drop()
+        self.mongo_source.mongo_handle[self.db][self.collection].insert_many(self.variants)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_file = os.path.join(self.tmp_dir.name, 'rewrite.checkpoint')
+
+    def tearDown(self) -> None:
+        self.mongo_source.mongo_handle[self.db][self.collection].drop()
+        self.mongo_source.mongo_handle.close()
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def correct_assembly(variant):
+        variant['seq'] = 'GCA_000001.2'
+
+    def test_rewrite_document_ids(self):
+        counts = rewrite_document_ids(self.mongo_source, self.collection, {'seq': 'GCA_000001.1'},
+                                      self.correct_assembly, get_submitted_SHA1, batch_size=3,
+                                      checkpoint_file=self.checkpoint_file)
+        self.assertEqual((counts['processed'], counts['inserted'], counts['dropped']), (10, 10, 10))
+        collection = self.mongo_source.mongo_handle[self.db][self.collection]
+        self.assertEqual(collection.count_documents({'seq': 'GCA_000001.1'}), 0)
+        for variant in collection.find():
+            self.assertEqual(variant['_id'], get_submitted_SHA1(variant))
+        self.assertEqual(load_checkpoint(self.checkpoint_file)['processed'], 10)
+
+    def test_rewrite_without_checkpoint(self):
+        counts = rewrite_document_ids(self.mongo_source, self.collection, {'seq': 'GCA_000001.1'},
+                                      self.correct_assembly, get_submitted_SHA1, batch_size=3)
+        self.assertEqual((counts['processed'], counts['inserted'], counts['dropped']), (10, 10, 10))
+        collection = self.mongo_source.mongo_handle[self.db][self.collection]
+        self.assertEqual(collection.count_documents({'seq': 'GCA_000001.2'}), 10)
+
+    def test_correction_outside_of_the_id(self):
+        def correct_accession_and_first_assembly(variant):
+            variant['accession'] += 1000
+            if variant['start'] == 100:
+                self.correct_assembly(variant)
+
+        counts = rewrite_document_ids(self.mongo_source, self.collection, {'seq': 'GCA_000001.1'},
+                                      correct_accession_and_first_assembly, get_submitted_SHA1, batch_size=3)
+        self.assertEqual((counts['inserted'], counts['dropped'], counts['replaced'], counts['skipped']),
+                         (1, 1, 9, 0))
+        collection = self.mongo_source.mongo_handle[self.db][self.collection]
+        self.assertEqual(sorted(variant['accession'] for variant in collection.find()), list(range(6000, 6010)))
+
+        # Running the same rewrite again does not change anything
+        counts = rewrite_document_ids(self.mongo_source, self.collection, {'seq': 'GCA_000001.2'},
+                                      self.correct_assembly, get_submitted_SHA1)
+        self.assertEqual((counts['processed'], counts['replaced'], counts['skipped']), (1, 0, 1))
+
+    def test_limit(self):
+        counts = rewrite_document_ids(self.mongo_source, self.collection, {'seq': 'GCA_000001.1'},
+                                      self.correct_assembly, get_submitted_SHA1, batch_size=3, limit=4)
+        self.assertEqual((counts['processed'], counts['inserted']), (4, 4))
+        collection = self.mongo_source.mongo_handle[self.db][self.collection]
+        self.assertEqual(collection.count_documents({'seq': 'GCA_000001.2'}), 4)
+
+    def test_resume_from_checkpoint(self):
+        # A previous run processed the first half of the variants (in _id order) but was killed after inserting the
+        # corrected version of the next one and before dropping the original
+        sorted_variants = sorted(self.variants, key=lambda v: v['_id'])
+        collection = self.mongo_source.mongo_handle[self.db][self.collection]
+        for variant in sorted_variants[:5]:
+            collection.delete_one({'_id': variant['_id']})
+            corrected = dict(variant)
+            self.correct_assembly(corrected)
+            corrected['_id'] = get_submitted_SHA1(corrected)
+            collection.insert_one(corrected)
+        interrupted = dict(sorted_variants[5])
+        self.correct_assembly(interrupted)
+        interrupted['_id'] = get_submitted_SHA1(interrupted)
+        collection.insert_one(interrupted)
+        save_checkpoint(self.checkpoint_file, {'last_id': sorted_variants[4]['_id'], 'processed': 5, 'inserted': 5,
+                                               'dropped': 5, 'skipped': 0})
+
+        counts = rewrite_document_ids(self.mongo_source, self.collection, {'seq': 'GCA_000001.1'},
+                                      self.correct_assembly, get_submitted_SHA1, batch_size=2,
+                                      checkpoint_file=self.checkpoint_file)
+        self.assertEqual((counts['processed'], counts['inserted'], counts['dropped']), (10, 9, 10))
+        self.assertEqual(collection.count_documents({'seq': 'GCA_000001.1'}), 0)
+        self.assertEqual(collection.count_documents({'seq': 'GCA_000001.2'}), 10)
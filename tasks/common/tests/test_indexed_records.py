@@ -0,0 +1,79 @@
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from tasks.common.indexed_records import merge_positions, fetch_vcf_records_around, index_vcf, RecordOffsetIndex, \
+    open_variant_file, vcf_record_id, variant_id_from_read_name, is_bgzf, path_in_index_dir
+
+
+class TestIndexedRecords(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.vcf_dir = os.path.join(self.tmp_dir.name, 'vcfs')
+        self.index_dir = os.path.join(self.tmp_dir.name, 'indexes')
+        os.makedirs(self.vcf_dir)
+        self.vcf_file = os.path.join(self.vcf_dir, 'variants.vcf')
+        with open(self.vcf_file, 'w') as open_file:
+            open_file.write('##fileformat=VCFv4.2\n##contig=<ID=1,length=100000>\n##contig=<ID=2,length=100000>\n')
+            open_file.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+            for contig, position, variant_id in [('1', 100, 'rs1'), ('1', 5000, 'rs2'), ('1', 5002, 'rs3'),
+                                                 ('2', 10, 'rs4'), ('2', 90000, 'rs5')]:
+                open_file.write(f'{contig}\t{position}\t{variant_id}\tA\tT\t.\t.\t.\n')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_merge_positions(self):
+        self.assertEqual(merge_positions([('2', 5), ('1', 3000), ('1', 1), ('1', 900)], 2),
+                         [('1', 1, 902), ('1', 2998, 3002), ('2', 3, 7)])
+
+    def test_variant_id_from_read_name(self):
+        self.assertEqual(variant_id_from_read_name('1|100|A|T|rs1|read|1'), 'rs1')
+
+    def test_fetch_vcf_records_around(self):
+        records = fetch_vcf_records_around(self.vcf_file, [('1', 5001), ('2', 89999), ('3', 1)], window=1,
+                                           index_dir=self.index_dir)
+        self.assertEqual([vcf_record.id for vcf_record in records], ['rs2', 'rs3', 'rs5'])
+        self.assertTrue(os.path.exists(path_in_index_dir(self.vcf_file, self.index_dir, '.gz.tbi')))
+        # Nothing is written next to the VCF
+        self.assertEqual(os.listdir(self.vcf_dir), ['variants.vcf'])
+
+    def test_index_vcf(self):
+        gzipped_vcf_file = self.vcf_file + '.gz'
+        with open(self.vcf_file, 'rb') as open_input, gzip.open(gzipped_vcf_file, 'wb') as open_output:
+            shutil.copyfileobj(open_input, open_output)
+        self.assertFalse(is_bgzf(gzipped_vcf_file))
+        # The plain gzip VCF is compressed in BGZF blocks in the index directory
+        bgzipped_vcf_file = index_vcf(gzipped_vcf_file, self.index_dir)
+        self.assertEqual(bgzipped_vcf_file, path_in_index_dir(gzipped_vcf_file, self.index_dir))
+        self.assertTrue(is_bgzf(bgzipped_vcf_file))
+        self.assertTrue(os.path.exists(bgzipped_vcf_file + '.tbi'))
+        # A BGZF VCF is linked in the index directory
+        os.remove(gzipped_vcf_file)
+        shutil.copy(bgzipped_vcf_file, gzipped_vcf_file)
+        shutil.rmtree(self.index_dir)
+        self.assertTrue(os.path.islink(index_vcf(gzipped_vcf_file, self.index_dir)))
+        self.assertEqual(sorted(os.listdir(self.vcf_dir)), ['variants.vcf', 'variants.vcf.gz'])
+
+    def test_record_offset_index(self):
+        bgzipped_vcf_file = index_vcf(self.vcf_file, self.index_dir)
+        index = RecordOffsetIndex(bgzipped_vcf_file, vcf_record_id, open_variant_file, index_dir=self.index_dir)
+        records_per_id = index.fetch(['rs4', 'rs2', 'rs6'])
+        self.assertEqual(sorted(records_per_id), ['rs2', 'rs4'])
+        self.assertEqual(records_per_id['rs4'][0].pos, 10)
+        self.assertTrue(os.path.exists(path_in_index_dir(bgzipped_vcf_file, self.index_dir, '.offsets.sqlite')))
+        # The persisted index is reused
+        self.assertEqual(RecordOffsetIndex(bgzipped_vcf_file, vcf_record_id, open_variant_file, index_dir=self.index_dir)
+                         .fetch(['rs5'])['rs5'][0].pos, 90000)
+
+    def test_record_offset_index_of_plain_gzip_file(self):
+        gzipped_vcf_file = self.vcf_file + '.gz'
+        with open(self.vcf_file, 'rb') as open_input, gzip.open(gzipped_vcf_file, 'wb') as open_output:
+            shutil.copyfileobj(open_input, open_output)
+        index = RecordOffsetIndex(gzipped_vcf_file, vcf_record_id, open_variant_file, index_dir=self.index_dir)
+        records_per_id = index.fetch(['rs4', 'rs2', 'rs6'])
+        self.assertEqual(sorted(records_per_id), ['rs2', 'rs4'])
+        self.assertEqual(records_per_id['rs2'][0].pos, 5000)
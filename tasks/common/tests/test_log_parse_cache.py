@@ -0,0 +1,73 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from tasks.common.log_parse_cache import LogParseCache
+
+
+def count_words(lines, state):
+    state['calls'] += 1
+    for line in lines:
+        state['words'] += len(line.split())
+        state['parsed_lines'].append(line.strip())
+
+
+class TestLogParseCache(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmp_dir.name, 'cache.db')
+        self.log_file = os.path.join(self.tmp_dir.name, 'cluster_20220112170519.log')
+        self.initial_state = {'calls': 0, 'words': 0, 'parsed_lines': []}
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def write_log(self, content, mode='a'):
+        with open(self.log_file, mode) as open_file:
+            open_file.write(content)
+
+    def test_parse_appended_lines_only(self):
+        self.write_log('first line\nsecond line\nthird', mode='w')
+        with LogParseCache(self.cache_file) as cache:
+            state = cache.get_state(self.log_file, count_words, self.initial_state)
+        # The incomplete last line is left for the next parse
+        assert state['parsed_lines'] == ['first line', 'second line']
+        assert self.initial_state['parsed_lines'] == []
+
+        self.write_log(' line\nfourth line\n')
+        with LogParseCache(self.cache_file) as cache:
+            state = cache.get_state(self.log_file, count_words, self.initial_state)
+            assert state['parsed_lines'] == ['first line', 'second line', 'third line', 'fourth line']
+            assert state['words'] == 8
+            # Two calls to the parser, the file was not parsed again from the start
+            assert state['calls'] == 2
+            # Unchanged file is not parsed
+            assert cache.get_state(self.log_file, count_words, self.initial_state)['calls'] == 2
+
+    def test_parse_again_when_file_shrinks(self):
+        self.write_log('first line\nsecond line\n', mode='w')
+        with LogParseCache(self.cache_file) as cache:
+            cache.get_state(self.log_file, count_words, self.initial_state)
+            self.write_log('new\n', mode='w')
+            state = cache.get_state(self.log_file, count_words, self.initial_state)
+        assert state['parsed_lines'] == ['new']
+        assert state['calls'] == 1
+
+    def test_lines_read_one_at_a_time(self):
+        self.write_log('first line\nsecond line\nthird', mode='w')
+        lines_read = []
+
+        def record_lines(lines, state):
+            # The lines are provided lazily, not as a list of the whole content
+            assert not isinstance(lines, list)
+            for line in lines:
+                lines_read.append(line)
+
+        with LogParseCache(self.cache_file) as cache:
+            cache.get_state(self.log_file, record_lines, {})
+            assert lines_read == ['first line\n', 'second line\n']
+            self.write_log(' line\n')
+            cache.get_state(self.log_file, record_lines, {})
+        # The next parse starts after the last complete line
+        assert lines_read == ['first line\n', 'second line\n', 'third line\n']
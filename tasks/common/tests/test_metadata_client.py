@@ -0,0 +1,125 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from urllib.parse import urlparse, parse_qs
+
+from tasks.common.metadata_client import MetadataClient, MetadataCache
+
+taxonomies = {'9606': 'Homo sapiens', '9913': 'Bos taurus', '10090': 'Mus musculus'}
+assemblies = {
+    'GCA_000001405.15': {'uid': '2334371', 'assemblyaccession': 'GCA_000001405.15', 'speciesname': 'Homo sapiens',
+                         'speciestaxid': '9606', 'taxid': '9606'},
+    'GCA_002263795.2': {'uid': '1796121', 'assemblyaccession': 'GCA_002263795.2', 'speciesname': 'Bos taurus',
+                        'speciestaxid': '9913', 'taxid': '9913'}
+}
+
+
+class MetadataRequestHandler(BaseHTTPRequestHandler):
+    """Stand-in for the NCBI eutils, Ensembl and ENA endpoints used by MetadataClient."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        self.server.requests.append((url.path, params))
+        if url.path == '/eutils/esummary.fcgi':
+            ids = params['id'].split(',')
+            if params['db'] == 'Taxonomy':
+                result = dict((i, {'uid': i, 'scientificname': taxonomies[i], 'rank': 'species'})
+                              for i in ids if i in taxonomies)
+            else:
+                result = dict((assembly['uid'], assembly) for assembly in assemblies.values() if assembly['uid'] in ids)
+            self.send_json({'result': dict(result, uids=list(result))})
+        elif url.path == '/eutils/esearch.fcgi':
+            accession = params['term'].strip('"')
+            self.send_json({'esearchresult': {
+                'idlist': [assemblies[accession]['uid']] if accession in assemblies else []
+            }})
+        elif url.path.startswith('/ensembl/taxonomy/id/'):
+            taxonomy_id = url.path.split('/')[-1]
+            if taxonomy_id in taxonomies:
+                self.send_json({'scientific_name': taxonomies[taxonomy_id]})
+            else:
+                self.send_json({'error': f'No taxon found for {taxonomy_id}'}, status=400)
+        elif url.path.startswith('/ena/xml/'):
+            taxonomy_id = url.path.split('/')[-1]
+            taxon = f'<taxon scientificName="{taxonomies[taxonomy_id]}"/>' if taxonomy_id in taxonomies else ''
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(f'<TAXON_SET>{taxon}</TAXON_SET>'.encode())
+        else:
+            self.send_json({}, status=404)
+
+    def send_json(self, content, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(content).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMetadataClient(TestCase):
+
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(('localhost', 0), MetadataRequestHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://localhost:{self.server.server_address[1]}/'
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmp_dir.name, 'metadata_cache.sqlite')
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def client(self, **kwargs):
+        return MetadataClient(
+            cache_file=self.cache_file, eutils_url=self.base_url + 'eutils/', ensembl_url=self.base_url + 'ensembl/',
+            ena_url=self.base_url + 'ena/', ncbi_requests_per_second=100, requests_per_second=100, **kwargs
+        )
+
+    def test_ncbi_taxonomy_ids_are_batched(self):
+        names = self.client(batch_size=2).get_ncbi_scientific_names([9606, 9913, 10090, 1])
+        self.assertEqual(names, {'9606': 'Homo sapiens', '9913': 'Bos taurus', '10090': 'Mus musculus', '1': None})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_results_are_cached_across_clients(self):
+        self.client().get_ensembl_scientific_names([9606, 1])
+        self.assertEqual(len(self.server.requests), 2)
+        names = self.client().get_ensembl_scientific_names([9606, 1])
+        self.assertEqual(names, {'9606': 'Homo sapiens', '1': None})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_expired_results_are_retrieved_again(self):
+        self.client(ttl=0.5).get_ena_scientific_names([9913])
+        time.sleep(0.6)
+        names = self.client(ttl=0.5).get_ena_scientific_names([9913])
+        self.assertEqual(names, {'9913': 'Bos taurus'})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_offline_mode_only_uses_the_cache(self):
+        self.client().get_ncbi_assembly_summaries(['GCA_000001405.15'])
+        num_requests = len(self.server.requests)
+        summaries = self.client(offline=True).get_ncbi_assembly_summaries(['GCA_000001405.15', 'GCA_002263795.2'])
+        self.assertEqual(list(summaries), ['GCA_000001405.15'])
+        self.assertEqual(summaries['GCA_000001405.15'][0]['speciesname'], 'Homo sapiens')
+        self.assertEqual(len(self.server.requests), num_requests)
+
+    def test_assembly_summaries_and_ensembl_assemblies(self):
+        client = self.client()
+        summaries = client.get_ncbi_assembly_summaries(['GCA_000001405.15', 'GCA_002263795.2', 'GCA_000000000.1'])
+        self.assertEqual(summaries['GCA_002263795.2'][0]['speciestaxid'], '9913')
+        self.assertEqual(summaries['GCA_000000000.1'], [])
+        self.assertEqual(client.get_ensembl_current_assemblies(['Homo sapiens']), {'Homo sapiens': None})
+
+    def test_memory_cache(self):
+        cache = MetadataCache()
+        cache.set_many('ncbi_taxonomy', {9606: {'scientificname': 'Homo sapiens'}, 1: None})
+        self.assertEqual(cache.get_many('ncbi_taxonomy', [9606, 1, 2]),
+                         {'9606': {'scientificname': 'Homo sapiens'}, '1': None})
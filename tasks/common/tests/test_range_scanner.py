@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from ebi_eva_common_pyutils.mongodb import MongoDatabase
+
+from tasks.common.range_scanner import RangeScanner, get_sampled_ranges, RANGE_DONE
+from tasks.common.variant_hashing import get_submitted_SHA1
+
+
+class TestRangeScanner(TestCase):
+    def setUp(self) -> None:
+        self.db = "eva_accession_sharded"
+        self.mongo_source = MongoDatabase(uri="mongodb://localhost:27017/", db_name=self.db)
+        self.collection = self.mongo_source.mongo_handle[self.db]["submittedVariantEntity"]
+        self.variants = []
+        for i in range(100):
+            variant = {"seq": "GCA_000001.1", "study": "PRJEB1", "contig": "CM0001.1", "start": 100 + i,
+                       "ref": "A", "alt": "T", "accession": 5000 + i, "allelesMatch": i % 3 != 0}
+            variant['_id'] = get_submitted_SHA1(variant)
+            self.variants.append(variant)
+        self.collection.drop()
+        self.collection.insert_many(self.variants)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.progress_file = os.path.join(self.tmp_dir.name, 'scan.progress')
+
+    def tearDown(self) -> None:
+        self.collection.drop()
+        self.mongo_source.mongo_handle.close()
+        self.tmp_dir.cleanup()
+
+    def test_get_sampled_ranges(self):
+        ranges = get_sampled_ranges(self.collection, 4)
+        assert len(ranges) == 4
+        for (_, upper), (lower, _) in zip(ranges[:-1], ranges[1:]):
+            assert upper == lower
+
+    def test_scan_batches(self):
+        scanner = RangeScanner(self.collection, {'allelesMatch': False}, projection={'accession': 1},
+                               max_workers=2, num_ranges=4, batch_size=10)
+        batches = list(scanner.scan_batches())
+        assert [len(batch) for batch in batches] == [10, 10, 10, 4]
+        assert sorted(variant['accession'] for batch in batches for variant in batch) == \
+            [variant['accession'] for variant in self.variants if not variant['allelesMatch']]
+
+    def test_resume_scan(self):
+        scanner = RangeScanner(self.collection, {}, max_workers=2, num_ranges=4, batch_size=10,
+                               progress_file=self.progress_file)
+        first_ids = []
+        for batch in scanner.scan_batches():
+            first_ids.extend(variant['_id'] for variant in batch)
+            if len(first_ids) == 30:
+                break
+        assert os.path.exists(self.progress_file)
+
+        scanner = RangeScanner(self.collection, {}, max_workers=2, num_ranges=4, batch_size=10,
+                               progress_file=self.progress_file)
+        remaining_ids = [variant['_id'] for variant in scanner.scan_documents()]
+        # The batch being processed when the scan stopped is returned again
+        assert len(remaining_ids) == 80
+        assert set(first_ids[:20]).isdisjoint(remaining_ids)
+        assert set(first_ids + remaining_ids) == set(variant['_id'] for variant in self.variants)
+        assert all(scan_range['last_id'] == RANGE_DONE for scan_range in scanner.ranges)
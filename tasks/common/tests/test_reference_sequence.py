@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pysam.utils import SamtoolsError
+
+from tasks.common.reference_sequence import IndexedFasta, ReferenceSequenceCache, index_fasta
+
+
+class TestReferenceSequence(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.genome_dir = os.path.join(self.tmp_dir.name, 'genomes')
+        self.index_dir = os.path.join(self.tmp_dir.name, 'indexes')
+        os.makedirs(self.genome_dir)
+        self.contigs = {
+            'chr1': 'ACGTACGTAC' * 13 + 'GGA',
+            'chr2': 'TTGCA' * 7,
+        }
+        self.fasta_files = []
+        for i in range(3):
+            fasta_file = os.path.join(self.genome_dir, f'genome{i}.fa')
+            with open(fasta_file, 'w') as open_file:
+                for name, sequence in self.contigs.items():
+                    open_file.write(f'>{name} description\n')
+                    for start in range(0, len(sequence), 60):
+                        open_file.write(sequence[start:start + 60] + '\n')
+            self.fasta_files.append(fasta_file)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_index_fasta(self):
+        fai_file = index_fasta(self.fasta_files[0], self.index_dir)
+        self.assertTrue(fai_file.startswith(self.index_dir))
+        self.assertFalse(os.path.exists(self.fasta_files[0] + '.fai'))
+        with open(fai_file) as open_file:
+            self.assertEqual([line.split('\t') for line in open_file.read().splitlines()],
+                             [['chr1', '133', '18', '60', '61'], ['chr2', '35', '172', '35', '36']])
+
+    def test_index_fasta_with_different_line_lengths(self):
+        with open(self.fasta_files[0], 'w') as open_file:
+            open_file.write('>chr1\nACGT\nACGTACGT\nAC\n')
+        with self.assertRaises(SamtoolsError):
+            index_fasta(self.fasta_files[0], self.index_dir)
+
+    def test_fetch(self):
+        genome = IndexedFasta(self.fasta_files[0], self.index_dir)
+        self.assertFalse(os.path.exists(self.fasta_files[0] + '.fai'))
+        for start, end in [(1, 10), (55, 70), (58, 125), (100, 133)]:
+            self.assertEqual(genome.fetch('chr1', start, end), self.contigs['chr1'][start - 1:end])
+        # Regions are truncated to the contig
+        self.assertEqual(genome.fetch('chr2', -10, 3), 'TTG')
+        self.assertEqual(genome.fetch('chr2', 30, 50), self.contigs['chr2'][29:])
+        self.assertEqual(genome.fetch('chr3', 1, 10), '')
+        self.assertEqual(genome.fetch_regions([('chr2', 1, 5), ('chr1', 61, 62), ('chr3', 1, 2)]),
+                         ['TTGCA', self.contigs['chr1'][60:62], ''])
+        genome.close()
+
+    def test_existing_index_is_used(self):
+        shutil.copy(index_fasta(self.fasta_files[0], self.index_dir), self.fasta_files[1] + '.fai')
+        shutil.rmtree(self.index_dir)
+        genome = IndexedFasta(self.fasta_files[1], self.index_dir)
+        self.assertEqual(genome.fetch('chr2', 1, 5), 'TTGCA')
+        self.assertFalse(os.path.exists(self.index_dir))
+        genome.close()
+
+    def test_least_recently_used_genome_is_closed(self):
+        with ReferenceSequenceCache(max_open_genomes=2) as reference_cache:
+            reference_cache.fetch(self.fasta_files[0], 'chr1', 1, 4)
+            reference_cache.fetch(self.fasta_files[1], 'chr1', 1, 4)
+            reference_cache.fetch(self.fasta_files[0], 'chr1', 1, 4)
+            self.assertEqual(reference_cache.fetch(self.fasta_files[2], 'chr2', 1, 4), 'TTGC')
+            self.assertEqual(list(reference_cache.genomes), [self.fasta_files[0], self.fasta_files[2]])
+            tmp_index_dir = reference_cache.index_dir
+        # The indexes were created in a temporary directory, none were written next to the genomes
+        self.assertFalse(os.path.exists(tmp_index_dir))
+        self.assertEqual(sorted(os.listdir(self.genome_dir)), ['genome0.fa', 'genome1.fa', 'genome2.fa'])
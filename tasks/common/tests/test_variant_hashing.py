@@ -0,0 +1,59 @@
+import hashlib
+from unittest import TestCase
+
+import numpy
+
+from tasks.common.variant_hashing import get_submitted_SHA1, get_clustered_SHA1, get_submitted_SHA1_batch, \
+    get_clustered_SHA1_batch, get_SHA1_batch, get_submitted_SHA1_for_records, get_clustered_SHA1_for_records
+
+
+class TestVariantHashing(TestCase):
+
+    def setUp(self) -> None:
+        self.submitted_variants = [
+            {'seq': 'GCA_015227675.1', 'study': 'PRJEB30318', 'contig': 'CM026996.1', 'start': 76166296 + i,
+             'ref': 'C', 'alt': 'T' if i % 2 else ''}
+            for i in range(25)
+        ]
+        self.clustered_variants = [
+            {'asm': 'GCA_015227675.1', 'contig': 'CM026996.1', 'start': 76166296 + i, 'type': 'SNV'}
+            for i in range(25)
+        ]
+
+    def test_get_submitted_SHA1(self):
+        variant = self.submitted_variants[0]
+        expected = hashlib.sha1('GCA_015227675.1_PRJEB30318_CM026996.1_76166296_C_'.encode()).hexdigest().upper()
+        assert get_submitted_SHA1(variant) == expected
+
+    def test_get_submitted_SHA1_batch(self):
+        expected = [get_submitted_SHA1(variant) for variant in self.submitted_variants]
+        columns = dict((key, [variant[key] for variant in self.submitted_variants])
+                       for key in ['seq', 'study', 'contig', 'start', 'ref', 'alt'])
+        assert get_submitted_SHA1_batch(**columns) == expected
+        assert get_submitted_SHA1_for_records(self.submitted_variants) == expected
+        # Single values are used for all the rows
+        columns['seq'] = 'GCA_015227675.1'
+        assert get_submitted_SHA1_batch(**columns) == expected
+
+    def test_get_clustered_SHA1_batch(self):
+        expected = [get_clustered_SHA1(variant) for variant in self.clustered_variants]
+        starts = [variant['start'] for variant in self.clustered_variants]
+        assert get_clustered_SHA1_batch('GCA_015227675.1', 'CM026996.1', starts, 'SNV') == expected
+        assert get_clustered_SHA1_for_records(self.clustered_variants) == expected
+
+    def test_numpy_inputs(self):
+        expected = [get_clustered_SHA1(variant) for variant in self.clustered_variants]
+        starts = numpy.array([variant['start'] for variant in self.clustered_variants])
+        assert get_clustered_SHA1_batch('GCA_015227675.1', 'CM026996.1', starts, 'SNV') == expected
+        # numpy scalars are single values like int and str
+        assert get_clustered_SHA1_batch(numpy.str_('GCA_015227675.1'), 'CM026996.1', numpy.int64(76166296),
+                                        'SNV') == expected[:1]
+
+    def test_multi_process(self):
+        expected = [get_submitted_SHA1(variant) for variant in self.submitted_variants]
+        assert get_submitted_SHA1_for_records(self.submitted_variants, num_processes=3, chunk_size=4) == expected
+
+    def test_empty_and_invalid(self):
+        assert get_SHA1_batch([[], []]) == []
+        with self.assertRaises(ValueError):
+            get_SHA1_batch([[1, 2], [1]])
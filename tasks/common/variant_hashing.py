@@ -0,0 +1,81 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+SUBMITTED_VARIANT_KEYS = ['seq', 'study', 'contig', 'start', 'ref', 'alt']
+CLUSTERED_VARIANT_KEYS = ['asm', 'contig', 'start', 'type']
+
+
+def get_SHA1(text):
+    h = hashlib.sha1()
+    h.update(text.encode())
+    return h.hexdigest().upper()
+
+
+def get_submitted_SHA1(variant_rec):
+    """Calculate the SHA1 digest from the seq, study, contig, start, ref, and alt attributes of the variant"""
+    return get_SHA1('_'.join([str(variant_rec[key]) for key in SUBMITTED_VARIANT_KEYS]))
+
+
+def get_clustered_SHA1(variant_rec):
+    """Calculate the SHA1 digest from the asm, contig, start and type attributes of the variant"""
+    return get_SHA1('_'.join([str(variant_rec[key]) for key in CLUSTERED_VARIANT_KEYS]))
+
+
+def _hash_rows(columns):
+    sha1 = hashlib.sha1
+    # Upper-casing all the digests at once is cheaper than once per digest
+    digests = '\n'.join([sha1('_'.join(row).encode()).hexdigest() for row in zip(*[map(str, c) for c in columns])])
+    return digests.upper().split('\n') if digests else []
+
+
+def _is_single_value(column):
+    # Strings and scalars (including numpy scalars) are single values, anything else with a length is a column
+    return isinstance(column, str) or not hasattr(column, '__len__')
+
+
+def _to_columns(columns):
+    """Check that all columns have the same length and repeat the single values (str, int...) to that length"""
+    lengths = set(len(column) for column in columns if not _is_single_value(column))
+    if len(lengths) > 1:
+        raise ValueError(f'All columns must have the same length but got lengths {sorted(lengths)}')
+    length = lengths.pop() if lengths else 1
+    return [[str(column)] * length if _is_single_value(column) else column for column in columns], length
+
+
+def get_SHA1_batch(columns, num_processes=1, chunk_size=100000):
+    """
+    Calculate the SHA1 digest of each row made of the provided columns joined with '_'.
+    Columns can be lists, tuples or arrays of the same length, or single values that are the same for all rows.
+    With num_processes > 1 the rows are hashed in chunks of chunk_size in a pool of processes.
+    """
+    columns, length = _to_columns(columns)
+    if num_processes <= 1 or length <= chunk_size:
+        return _hash_rows(columns)
+    chunks = [[column[i:i + chunk_size] for column in columns] for i in range(0, length, chunk_size)]
+    hashes = []
+    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+        for chunk_hashes in executor.map(_hash_rows, chunks):
+            hashes.extend(chunk_hashes)
+    return hashes
+
+
+def get_submitted_SHA1_batch(seq, study, contig, start, ref, alt, num_processes=1, chunk_size=100000):
+    """Batch version of get_submitted_SHA1 taking one list per attribute"""
+    return get_SHA1_batch([seq, study, contig, start, ref, alt], num_processes, chunk_size)
+
+
+def get_clustered_SHA1_batch(asm, contig, start, type, num_processes=1, chunk_size=100000):
+    """Batch version of get_clustered_SHA1 taking one list per attribute"""
+    return get_SHA1_batch([asm, contig, start, type], num_processes, chunk_size)
+
+
+def get_submitted_SHA1_for_records(variant_recs, num_processes=1, chunk_size=100000):
+    """Batch version of get_submitted_SHA1 taking a list of records"""
+    return get_SHA1_batch([[rec[key] for rec in variant_recs] for key in SUBMITTED_VARIANT_KEYS],
+                          num_processes, chunk_size)
+
+
+def get_clustered_SHA1_for_records(variant_recs, num_processes=1, chunk_size=100000):
+    """Batch version of get_clustered_SHA1 taking a list of records"""
+    return get_SHA1_batch([[rec[key] for rec in variant_recs] for key in CLUSTERED_VARIANT_KEYS],
+                          num_processes, chunk_size)
@@ -1,19 +1,12 @@
 #!/usr/bin/env python
-import hashlib
 import traceback
 from argparse import ArgumentParser
 import pymongo
 from urllib.parse import quote_plus
 from tasks.eva_2124.load_synonyms import load_synonyms_for_assembly
 import logging
-
-
-def get_SHA1(variant_rec):
-    """Calculate the SHA1 digest from the identifying fields of the clustered variant"""
-    h = hashlib.sha1()
-    keys = ['asm', 'contig', 'start', 'type']
-    h.update('_'.join([str(variant_rec[key]) for key in keys]).encode())
-    return h.hexdigest().upper()
+from tasks.common.id_rewrite import rewrite_collection_ids
+from tasks.common.variant_hashing import get_clustered_SHA1
 
 
 def get_genbank(synonym_dictionaries, contig):
@@ -48,7 +41,7 @@ def get_mongo_connection_handle_url(host, port=27017, username=None, password=No
 
 
 def correct(mongo_user, mongo_password, mongo_host, assembly_accession, mongo_database, assembly_report=None,
-            chunk_size=1000, only_check=False):
+            chunk_size=1000, only_check=False, checkpoint_file=None):
     """
     Connect to mongodb and retrieve all variants the should be updated, check their key and update them in bulk.
     """
@@ -62,7 +55,8 @@ def correct(mongo_user, mongo_password, mongo_host, assembly_accession, mongo_da
         synonym_dictionaries = load_synonyms_for_assembly(assembly_accession, assembly_report)
         number_of_variants_to_replace = assert_all_contigs_can_be_replaced(cve_collection, synonym_dictionaries, assembly_accession)
         if not only_check:
-            do_updates(cve_collection, synonym_dictionaries, assembly_accession, chunk_size, number_of_variants_to_replace)
+            do_updates(cve_collection, synonym_dictionaries, assembly_accession, chunk_size,
+                       number_of_variants_to_replace, checkpoint_file)
 
 
 def assert_all_contigs_can_be_replaced(cve_collection, synonym_dictionaries, assembly_accession):
@@ -104,60 +98,27 @@ def assert_all_contigs_can_be_replaced(cve_collection, synonym_dictionaries, ass
     return replaceable_variants
 
 
-def do_updates(cve_collection, synonym_dictionaries, assembly_accession, chunk_size, number_of_variants_to_replace):
-    cursor = cve_collection.find({'asm': assembly_accession}, no_cursor_timeout=True)
-    insert_statements = []
-    drop_statements = []
-    record_checked = 0
-    already_genbanks = 0
-    total_inserted = 0
-    total_dropped = 0
+def do_updates(cve_collection, synonym_dictionaries, assembly_accession, chunk_size, number_of_variants_to_replace,
+               checkpoint_file=None):
+    filter_criteria = {'asm': assembly_accession}
+
+    def correct_contig(variant):
+        variant['contig'], _ = get_genbank(synonym_dictionaries, variant['contig'])
+
     logging.info("Performing updates...")
     try:
-        for variant in cursor:
-            # Ensure that the variant we are changing has the expected SHA1
-            original_id = get_SHA1(variant)
-            assert variant['_id'] == original_id, "Original id is different from the one calculated %s != %s" % (
-                variant['_id'], original_id)
-            genbank, was_already_genbank = get_genbank(synonym_dictionaries, variant['contig'])
-            if was_already_genbank:
-                already_genbanks += 1
-            else:
-                variant['contig'] = genbank
-                variant['_id'] = get_SHA1(variant)
-                insert_statements.append(pymongo.InsertOne(variant))
-                drop_statements.append(pymongo.DeleteOne({'_id': original_id}))
-            record_checked += 1
-            if len(insert_statements) >= chunk_size:
-                total_inserted, total_dropped = execute_bulk(drop_statements, insert_statements, cve_collection,
-                                                             total_dropped, total_inserted)
-                logging.info('%s / %s new documents inserted' % (total_inserted, number_of_variants_to_replace))
-                logging.info('%s / %s old documents dropped' % (total_dropped, number_of_variants_to_replace))
+        counts = rewrite_collection_ids(cve_collection, filter_criteria, correct_contig, get_clustered_SHA1, chunk_size,
+                                        checkpoint_file)
     except Exception as e:
         print(traceback.format_exc())
         raise e
-    finally:
-        cursor.close()
 
-    if len(insert_statements) > 0:
-        total_inserted, total_dropped = execute_bulk(drop_statements, insert_statements, cve_collection,
-                                                     total_dropped, total_inserted)
-    logging.info('Retrieved %s documents and checked matching Sha1 hash' % record_checked)
+    logging.info('Retrieved %s documents and checked matching Sha1 hash' % counts['processed'])
     logging.info('{} of those documents had already a genbank contig. If the projects were all affected, '
-          'that number should be 0, but even if it is not, there is nothing else to fix'.format(already_genbanks))
-    logging.info('There was %s new documents inserted' % total_inserted)
-    logging.info('There was %s old documents dropped' % total_dropped)
-    return total_inserted
-
-
-def execute_bulk(drop_statements, insert_statements, cve_collection, total_dropped, total_inserted):
-    result_insert = cve_collection.bulk_write(requests=insert_statements, ordered=False)
-    total_inserted += result_insert.inserted_count
-    result_drop = cve_collection.bulk_write(requests=drop_statements, ordered=False)
-    total_dropped += result_drop.deleted_count
-    insert_statements.clear()
-    drop_statements.clear()
-    return total_inserted, total_dropped
+          'that number should be 0, but even if it is not, there is nothing else to fix'.format(counts['skipped']))
+    logging.info('There was %s / %s new documents inserted' % (counts['inserted'], number_of_variants_to_replace))
+    logging.info('There was %s / %s old documents dropped' % (counts['dropped'], number_of_variants_to_replace))
+    return counts['inserted']
 
 
 def main():
@@ -173,10 +134,12 @@ def main():
                           required=False)
     argparse.add_argument('--only_check', help='Check that the variant contig names can be replaced using the assembly report',
                           default=False, action='store_true')
+    argparse.add_argument('--checkpoint_file', help='File where the progress of the updates is saved so an interrupted '
+                                                    'run can be resumed', required=False)
 
     args = argparse.parse_args()
     correct(args.mongo_user, args.mongo_password, args.mongo_host, args.assembly, args.mongo_database,
-            args.assembly_report, only_check=args.only_check)
+            args.assembly_report, only_check=args.only_check, checkpoint_file=args.checkpoint_file)
     logging.info("Finished successfully.")
 
 
@@ -4,6 +4,8 @@ from urllib.parse import quote_plus
 
 import pymongo
 
+from tasks.common.range_scanner import RangeScanner
+
 
 def get_mongo_connection_handle(host, port=27017, username=None, password=None, authentication_database="admin", **kwargs) -> pymongo.MongoClient:
     mongo_connection_uri = "mongodb://"
@@ -13,7 +15,7 @@ def get_mongo_connection_handle(host, port=27017, username=None, password=None,
     return pymongo.MongoClient(mongo_connection_uri, **kwargs)
 
 
-def check_mapping_weight(mongo_host, database_name, username, password, assembly_accession):
+def check_mapping_weight(mongo_host, database_name, username, password, assembly_accession, max_workers=4):
     """
     Connect to mongodb and retrieve all clustered variants of specific assembly that have high mapping weight (>1) to check
     if they can be found multiple times. When they can't, check that they fall in one of the following categories:
@@ -23,12 +25,13 @@ def check_mapping_weight(mongo_host, database_name, username, password, assembly
     """
     with get_mongo_connection_handle(mongo_host, username=username, password=password) as accessioning_mongo_handle:
         dbsnp_cve_collection = accessioning_mongo_handle[database_name]["dbsnpClusteredVariantEntity"]
-        cursor = dbsnp_cve_collection.find({'asm': assembly_accession, 'mapWeight': {'$gt': 1}}, no_cursor_timeout=True)
+        scanner = RangeScanner(dbsnp_cve_collection, {'asm': assembly_accession, 'mapWeight': {'$gt': 1}},
+                               projection={'accession': 1, 'mapWeight': 1}, max_workers=max_workers)
         count_clustered_variants = 0
         list_variants_inconsistent = []
         inconsistent_recovered_merged = 0
         inconsistent_recovered_declusted = 0
-        for variant in cursor:
+        for variant in scanner.scan_documents():
             count = dbsnp_cve_collection.count({'asm': assembly_accession, 'accession': variant['accession']})
             count_clustered_variants += 1
             if count < 2:
@@ -54,8 +57,6 @@ def check_mapping_weight(mongo_host, database_name, username, password, assembly
                     print("Found %s operation for submitted variants" % len(updated_sve_operation))
         except:
             pass
-        finally:
-            cursor.close()
 
         print("Checked %s clustered variants" % count_clustered_variants)
         print("Found %s inconsistent variants" % len(list_variants_inconsistent))
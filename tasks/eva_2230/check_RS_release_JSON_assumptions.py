@@ -1,19 +1,16 @@
-import bz2
 import click
-import json
-import traceback
 
 from ebi_eva_common_pyutils.config_utils import get_mongo_uri_for_eva_profile
 from ebi_eva_common_pyutils.logger import logging_config
 from pymongo import MongoClient
 
+from tasks.common.dbsnp_json_reader import DbsnpJsonChecker, DbsnpJsonReader, is_rs_id_mapped_to_assembly
+
 
 logging_config.add_stdout_handler()
 logger = logging_config.get_logger(__name__)
 
 
-updated_rs_that_should_not_exist_in_EVA = []
-non_updated_rs_that_should_exist_in_EVA = []
 min_rs_records_to_check = 1000
 
 
@@ -21,106 +18,109 @@ def get_mongo_query_result(rs_to_find, mongo_connection_handle):
     results = []
     dbsnpCVEHandle = mongo_connection_handle["eva_accession_human_sharded"]["dbsnpClusteredVariantEntity"]
     dbsnpCVOEHandle = mongo_connection_handle["eva_accession_human_sharded"]["dbsnpClusteredVariantOperationEntity"]
-    for result in dbsnpCVEHandle.find({"accession": {"$in": rs_to_find}}):
+    for result in dbsnpCVEHandle.find({"accession": {"$in": rs_to_find}}, {"accession": 1}):
         results.append(result)
-    for result in dbsnpCVOEHandle.find({"accession": {"$in": rs_to_find}}):
+    for result in dbsnpCVOEHandle.find({"accession": {"$in": rs_to_find}}, {"accession": 1}):
         results.append(result)
     return [result["accession"] for result in results]
 
 
-def ensure_existing_rs_in_eva_human_accession_db(mongo_connection_handle: MongoClient, eva_production_human_dbsnp_build,
-                                                 rs_id=None):
-    global non_updated_rs_that_should_exist_in_EVA, min_rs_records_to_check
-
-    num_rs_records_to_check = min_rs_records_to_check
-    if rs_id:
-        non_updated_rs_that_should_exist_in_EVA.append(rs_id)
-    else:
-        num_rs_records_to_check = len(non_updated_rs_that_should_exist_in_EVA)
-    if len(non_updated_rs_that_should_exist_in_EVA) == num_rs_records_to_check or \
-            (rs_id is None and num_rs_records_to_check > 0):
-        results = get_mongo_query_result(non_updated_rs_that_should_exist_in_EVA, mongo_connection_handle)
-        if len(results) < num_rs_records_to_check:
+def get_rs_last_updated_build(rs_record):
+    """Returns the build in which the RS was last updated, or None if the RS does not have any support record."""
+    support_record_last_updated_builds = set()
+    for support_record in rs_record["present_obs_movements"]:
+        if "last_added_to_this_rs" in support_record:
+            support_record_last_updated_builds.add(int(support_record["last_added_to_this_rs"]))
+    if not support_record_last_updated_builds:
+        return None
+    return min(support_record_last_updated_builds)
+
+
+class RSReleaseBuildChecker(DbsnpJsonChecker):
+    """
+    Ensure that the RS released on or before the dbSNP build currently in EVA production are present in EVA and that
+    the ones released after it are not.
+    """
+
+    def __init__(self, mongo_uri, eva_production_human_dbsnp_build, eva_production_human_dbsnp_assembly):
+        self.mongo_uri = mongo_uri
+        self.eva_production_human_dbsnp_build = eva_production_human_dbsnp_build
+        self.eva_production_human_dbsnp_assembly = eva_production_human_dbsnp_assembly
+        self.mongo_connection_handle = None
+        self.updated_rs_that_should_not_exist_in_EVA = []
+        self.non_updated_rs_that_should_exist_in_EVA = []
+
+    def check_record(self, rs_record, line_index):
+        if not is_rs_id_mapped_to_assembly(rs_record, self.eva_production_human_dbsnp_assembly):
+            return 'not_mapped', rs_record["refsnp_id"]
+        rs_id = int(rs_record["refsnp_id"])
+        if "support" in rs_record["primary_snapshot_data"]:
+            rs_last_updated_build = get_rs_last_updated_build(rs_record)
+            if rs_last_updated_build is None:
+                return 'no_support', rs_id, line_index
+            # Ensure newly added RS are not in production
+            if rs_last_updated_build > self.eva_production_human_dbsnp_build:
+                return 'new', rs_id
+            # Ensure RS in previous builds are present in production
+            return 'existing', rs_id
+        return None
+
+    def process_results(self, results):
+        for result in results:
+            if result[0] == 'not_mapped':
+                logger.error("RS ID {0} is not mapped to assembly {1}".format(result[1],
+                                                                              self.eva_production_human_dbsnp_assembly))
+            elif result[0] == 'no_support':
+                logger.error("Support record not found for RS {0} at line {1}!!".format(result[1], result[2] + 1))
+            elif result[0] == 'new':
+                self.updated_rs_that_should_not_exist_in_EVA.append(result[1])
+                if len(self.updated_rs_that_should_not_exist_in_EVA) == min_rs_records_to_check:
+                    self.ensure_new_rs_not_in_eva_human_accession_db()
+            else:
+                self.non_updated_rs_that_should_exist_in_EVA.append(result[1])
+                if len(self.non_updated_rs_that_should_exist_in_EVA) == min_rs_records_to_check:
+                    self.ensure_existing_rs_in_eva_human_accession_db()
+
+    def finish(self):
+        self.ensure_new_rs_not_in_eva_human_accession_db()
+        self.ensure_existing_rs_in_eva_human_accession_db()
+        if self.mongo_connection_handle:
+            self.mongo_connection_handle.close()
+            self.mongo_connection_handle = None
+
+    def get_mongo_query_result(self, rs_to_find):
+        # The connection is opened in the reader process, after the checker has been copied to the parsing processes
+        if not self.mongo_connection_handle:
+            self.mongo_connection_handle = MongoClient(self.mongo_uri)
+        return get_mongo_query_result(rs_to_find, self.mongo_connection_handle)
+
+    def ensure_existing_rs_in_eva_human_accession_db(self):
+        if not self.non_updated_rs_that_should_exist_in_EVA:
+            return
+        results = self.get_mongo_query_result(self.non_updated_rs_that_should_exist_in_EVA)
+        if len(results) < len(self.non_updated_rs_that_should_exist_in_EVA):
             logger.error("Could not find RS IDs {0} in EVA production even though they were marked in JSON "
                          "as released on or before dbSNP build {1} currently in EVA production!!"
-                         .format(set(non_updated_rs_that_should_exist_in_EVA) - set(results),
-                                 eva_production_human_dbsnp_build))
-        non_updated_rs_that_should_exist_in_EVA = []
-    
-
-def ensure_new_rs_not_in_eva_human_accession_db(mongo_connection_handle: MongoClient, eva_production_human_dbsnp_build,
-                                                    rs_id=None):
-    global updated_rs_that_should_not_exist_in_EVA, min_rs_records_to_check
-
-    num_rs_records_to_check = min_rs_records_to_check
-    if rs_id:
-        updated_rs_that_should_not_exist_in_EVA.append(rs_id)
-    else:
-        num_rs_records_to_check = len(updated_rs_that_should_not_exist_in_EVA)
-    if len(updated_rs_that_should_not_exist_in_EVA) == num_rs_records_to_check or \
-            (rs_id is None and num_rs_records_to_check > 0):
-        results = get_mongo_query_result(updated_rs_that_should_not_exist_in_EVA, mongo_connection_handle)
+                         .format(set(self.non_updated_rs_that_should_exist_in_EVA) - set(results),
+                                 self.eva_production_human_dbsnp_build))
+        self.non_updated_rs_that_should_exist_in_EVA = []
+
+    def ensure_new_rs_not_in_eva_human_accession_db(self):
+        if not self.updated_rs_that_should_not_exist_in_EVA:
+            return
+        results = self.get_mongo_query_result(self.updated_rs_that_should_not_exist_in_EVA)
         if len(results) > 0:
             logger.error("Found RS IDs {0} in EVA production even though they were marked in JSON "
                          "as released after dbSNP build {1} currently in EVA production!!"
-                         .format(results, eva_production_human_dbsnp_build))
-        updated_rs_that_should_not_exist_in_EVA = []
-
-
-def is_rs_id_mapped_to_assembly(rs_record, eva_production_human_dbsnp_assembly):
-    try:
-        for placement in rs_record["primary_snapshot_data"]["placements_with_allele"]:
-            # Primary top-level placement (ptlp) is used to identify records that are mapped to this assembly
-            # See https://github.com/EBIvariation/eva-accession/blob/d3c849f15b6b63ebd97d4ac6f2d857e3b65d908f/eva-accession-import-dbsnp2/src/main/java/uk/ac/ebi/eva/accession/dbsnp2/batch/processors/JsonNodeToClusteredVariantProcessor.java#L74-L74
-            if placement["is_ptlp"]:
-                for assembly_info in placement["placement_annot"]["seq_id_traits_by_assembly"]:
-                    if assembly_info["assembly_accession"] == eva_production_human_dbsnp_assembly:
-                        return True
-    except KeyError as ex:
-        logger.error(traceback.format_exc())
-        return False
-    return False
+                         .format(results, self.eva_production_human_dbsnp_build))
+        self.updated_rs_that_should_not_exist_in_EVA = []
 
 
 def check_RS_release_JSON_assumptions(private_config_xml_file, release_json_file, eva_production_human_dbsnp_build,
-                                      eva_production_human_dbsnp_assembly):
-    with bz2.open(release_json_file) as release_json_file_handle, \
-            MongoClient(get_mongo_uri_for_eva_profile("production", private_config_xml_file)) \
-                    as mongo_connection_handle:
-        line_index = 0
-        for json_line in release_json_file_handle:
-            if line_index % 100000 == 0:
-                logger.info("Processed {0} records...".format(line_index))
-            line_index += 1
-            rs_record = json.loads(json_line.decode("utf-8").strip())
-            if not (is_rs_id_mapped_to_assembly(rs_record, eva_production_human_dbsnp_assembly)):
-                logger.error("RS ID {0} is not mapped to assembly {1}".format(rs_record["refsnp_id"],
-                                                                              eva_production_human_dbsnp_assembly))
-                continue
-            rs_id = int(rs_record["refsnp_id"])
-
-            if "support" in rs_record["primary_snapshot_data"]:
-                support_record_count = 0
-                support_record_last_updated_builds = set()
-                for support_record in rs_record["present_obs_movements"]:
-                    if "last_added_to_this_rs" in support_record:
-                        support_record_count += 1
-                        support_record_last_updated_builds.add(int(support_record["last_added_to_this_rs"]))
-                if support_record_count == 0:
-                    logger.error("Support record not found for RS {0} at line {1}!!".format(rs_id, line_index))
-                    continue
-                rs_last_updated_build = min(support_record_last_updated_builds)
-                # Ensure newly added RS are not in production
-                if rs_last_updated_build > eva_production_human_dbsnp_build:
-                    ensure_new_rs_not_in_eva_human_accession_db(mongo_connection_handle,
-                                                                    eva_production_human_dbsnp_build, rs_id)
-                # Ensure RS in previous builds are present in production
-                if rs_last_updated_build <= eva_production_human_dbsnp_build:
-                    ensure_existing_rs_in_eva_human_accession_db(mongo_connection_handle, eva_production_human_dbsnp_build,
-                                                                 rs_id)
-        
-        ensure_new_rs_not_in_eva_human_accession_db(mongo_connection_handle, eva_production_human_dbsnp_build)
-        ensure_existing_rs_in_eva_human_accession_db(mongo_connection_handle, eva_production_human_dbsnp_build)
+                                      eva_production_human_dbsnp_assembly, num_workers=4):
+    checker = RSReleaseBuildChecker(get_mongo_uri_for_eva_profile("production", private_config_xml_file),
+                                    eva_production_human_dbsnp_build, eva_production_human_dbsnp_assembly)
+    DbsnpJsonReader(release_json_file, [checker], num_workers=num_workers).read()
 
 
 @click.option("--private-config-xml-file", help="ex: /path/to/eva-maven-settings.xml", required=True)
@@ -129,11 +129,13 @@ def check_RS_release_JSON_assumptions(private_config_xml_file, release_json_file
               help="Most recent dbSNP human release build in EVA production (ex: 152)", type=int, required=True)
 @click.option("--eva-production-human-dbsnp-assembly",
               help="Most recent dbSNP human assembly in EVA production (ex: GCF_000001405.38)", required=True)
+@click.option("--num-workers", help="Number of processes parsing the JSON records", type=int, default=4,
+              required=False)
 @click.command()
 def main(private_config_xml_file, release_json_file, eva_production_human_dbsnp_build,
-         eva_production_human_dbsnp_assembly):
+         eva_production_human_dbsnp_assembly, num_workers):
     check_RS_release_JSON_assumptions(private_config_xml_file, release_json_file, eva_production_human_dbsnp_build,
-                                      eva_production_human_dbsnp_assembly)
+                                      eva_production_human_dbsnp_assembly, num_workers)
 
 
 if __name__ == "__main__":
@@ -3,6 +3,8 @@ from argparse import ArgumentParser
 
 import pysam
 
+from tasks.common.indexed_records import fetch_vcf_records_around, variant_id_from_read_name
+
 
 def assessment_result_per_variants_from_vcf(vcf_file):
     # Two samples in this VCF first the truth set then the query set
@@ -17,25 +19,25 @@ def assessment_result_per_variants_from_vcf(vcf_file):
     return assessment_result_per_variants
 
 
-def get_variant_id(assessment_result_per_variants, vcf_file):
+def get_variant_id(assessment_result_per_variants, vcf_file, index_dir=None):
+    # Only the regions of the assessed variants are read from the indexed VCF
     variant_id_to_assessment_result = {}
-    with pysam.VariantFile(vcf_file, 'r') as vcf_in:
-        for vcf_record in vcf_in:
-            if (vcf_record.chrom, vcf_record.pos) in assessment_result_per_variants:
-                variant_id_to_assessment_result[vcf_record.id] = assessment_result_per_variants[(vcf_record.chrom, vcf_record.pos)]
+    for vcf_record in fetch_vcf_records_around(vcf_file, assessment_result_per_variants, index_dir=index_dir):
+        if (vcf_record.chrom, vcf_record.pos) in assessment_result_per_variants:
+            variant_id_to_assessment_result[vcf_record.id] = assessment_result_per_variants[(vcf_record.chrom, vcf_record.pos)]
     return variant_id_to_assessment_result
 
 
-def output_alignment_records(variant_id_to_assessment_result, bam_file):
+def output_alignment_records(variant_id_to_assessment_result, bam_file, threads=1):
     base, ext = os.path.splitext(bam_file)
     output_bam = base + '_annotated' + ext
     output_csv = base + '_annotated.csv'
-    with pysam.AlignmentFile(bam_file, "rb") as bam_in, \
-            pysam.AlignmentFile(output_bam, "wb", template=bam_in) as bam_out, \
+    # Additional threads decompress and compress the BAM blocks
+    with pysam.AlignmentFile(bam_file, "rb", threads=threads) as bam_in, \
+            pysam.AlignmentFile(output_bam, "wb", template=bam_in, threads=threads) as bam_out, \
             open(output_csv, 'w') as open_csv:
         for sam_record in bam_in:
-            sp_name = sam_record.query_name.split('|')
-            rs_id = sp_name[4]
+            rs_id = variant_id_from_read_name(sam_record.query_name)
             if rs_id in variant_id_to_assessment_result:
                 bd_tag, bvt_tag = variant_id_to_assessment_result[rs_id]
                 sam_record.set_tag('BD', bd_tag)
@@ -54,10 +56,10 @@ def output_alignment_records(variant_id_to_assessment_result, bam_file):
                 file=open_csv)
 
 
-def process_files(bam_file, realigned_vcf_file, assessment_vcf_file):
+def process_files(bam_file, realigned_vcf_file, assessment_vcf_file, threads=1, index_dir=None):
     assessment_result_per_variants = assessment_result_per_variants_from_vcf(assessment_vcf_file)
-    variant_id_to_assessment_result = get_variant_id(assessment_result_per_variants, realigned_vcf_file)
-    output_alignment_records(variant_id_to_assessment_result, bam_file)
+    variant_id_to_assessment_result = get_variant_id(assessment_result_per_variants, realigned_vcf_file, index_dir)
+    output_alignment_records(variant_id_to_assessment_result, bam_file, threads)
 
 
 if __name__ == "__main__":
@@ -65,8 +67,11 @@ if __name__ == "__main__":
     parser.add_argument('--alignment_bam')
     parser.add_argument('--realigned_vcf')
     parser.add_argument('--assessment_vcf')
+    parser.add_argument('--threads', type=int, default=1, help='Number of threads used to read and write the BAM')
+    parser.add_argument('--index_dir', help='Directory where the bgzipped realigned VCF and its index are written, '
+                                            'the system temporary directory by default')
     args = parser.parse_args()
 
-    process_files(args.alignment_bam, args.realigned_vcf, args.assessment_vcf)
+    process_files(args.alignment_bam, args.realigned_vcf, args.assessment_vcf, args.threads, args.index_dir)
 
 
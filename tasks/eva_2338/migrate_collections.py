@@ -0,0 +1,205 @@
+# Copyright 2021 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from ebi_eva_common_pyutils.mongodb import MongoDatabase
+from ebi_eva_common_pyutils.logger import logging_config, AppLogger
+
+from tasks.eva_2338.prepare_dest_db import collections_shard_key_map
+
+logger = logging_config.get_logger(__name__)
+logging_config.add_stdout_handler()
+
+DUMPED = 'dumped'
+RESTORED = 'restored'
+INDEXED = 'indexed'
+PREPARED = 'prepared'
+
+
+class CollectionMigration(AppLogger):
+    """
+    Move databases from one MongoDB instance to another one collection at a time. Each collection is dumped, restored
+    and indexed in turn, and the collections are processed concurrently so the restore of a collection overlaps with
+    the dump of the next ones and indexes are built as soon as a collection is restored.
+    At most max_dumps, max_restores and max_index_builds collections are in each step at once.
+    A marker file is written in the dump directory after each step so a migration can be resumed where it stopped.
+    """
+
+    def __init__(self, mongo_source_uri, mongo_source_secrets_file, mongo_dest_uri, mongo_dest_secrets_file,
+                 dump_dir, max_dumps=2, max_restores=2, max_index_builds=2, insertion_workers_per_collection=4,
+                 keep_dumps=False):
+        self.mongo_source_uri = mongo_source_uri
+        self.mongo_source_secrets_file = mongo_source_secrets_file
+        self.mongo_dest_uri = mongo_dest_uri
+        self.mongo_dest_secrets_file = mongo_dest_secrets_file
+        self.dump_dir = dump_dir
+        self.dump_slots = threading.Semaphore(max_dumps)
+        self.restore_slots = threading.Semaphore(max_restores)
+        self.index_slots = threading.Semaphore(max_index_builds)
+        self.max_collections_in_progress = max_dumps + max_restores + max_index_builds
+        self.insertion_workers_per_collection = insertion_workers_per_collection
+        self.keep_dumps = keep_dumps
+        self.database_locks = defaultdict(threading.Lock)
+
+    def source_db(self, db_name):
+        return MongoDatabase(uri=self.mongo_source_uri, secrets_file=self.mongo_source_secrets_file, db_name=db_name)
+
+    def dest_db(self, db_name):
+        return MongoDatabase(uri=self.mongo_dest_uri, secrets_file=self.mongo_dest_secrets_file, db_name=db_name)
+
+    def _marker(self, db_name, name, step):
+        return os.path.join(self.dump_dir, db_name, f'{name}.{step}')
+
+    def is_done(self, db_name, name, step):
+        return os.path.exists(self._marker(db_name, name, step))
+
+    def mark_done(self, db_name, name, step):
+        with open(self._marker(db_name, name, step), 'w'):
+            pass
+
+    def clear_markers(self, db_name):
+        db_dump_dir = os.path.join(self.dump_dir, db_name)
+        if os.path.isdir(db_dump_dir):
+            for file_name in os.listdir(db_dump_dir):
+                if file_name.endswith((f'.{DUMPED}', f'.{RESTORED}', f'.{INDEXED}', f'.{PREPARED}')):
+                    os.remove(os.path.join(db_dump_dir, file_name))
+
+    def prepare_database(self, db_name, collection_names):
+        """Drop and shard the destination database once, before the first collection is restored."""
+        with self.database_locks[db_name]:
+            if self.is_done(db_name, db_name, PREPARED):
+                return
+            self.info(f'Prepare destination database {db_name}')
+            mongo_dest = self.dest_db(db_name)
+            mongo_dest.drop()
+            mongo_dest.enable_sharding()
+            mongo_dest.shard_collections(collections_shard_key_map, collections_to_shard=collection_names)
+            self.mark_done(db_name, db_name, PREPARED)
+
+    def dump_collection(self, db_name, collection_name):
+        self.info(f'Dump {db_name}.{collection_name}')
+        # Force table scan is performant for many workloads avoids cursor timeout issues
+        # See https://jira.mongodb.org/browse/TOOLS-845
+        self.source_db(db_name).dump_data(dump_dir=self.dump_dir,
+                                          mongodump_args={'collection': collection_name, 'forceTableScan': ''})
+
+    def restore_collection(self, db_name, collection_name):
+        self.info(f'Restore {db_name}.{collection_name}')
+        mongo_dest = self.dest_db(db_name)
+        # Remove the documents of a restore that was interrupted, the collection itself is kept to keep its sharding
+        dest_collection = mongo_dest.mongo_handle[db_name][collection_name]
+        if dest_collection.estimated_document_count():
+            dest_collection.delete_many({})
+        # noIndexRestore - Do not restore indexes because MongoDB 3.2 does not have index compatibility with MongoDB 4.0
+        mongo_dest.restore_data(dump_dir=os.path.join(self.dump_dir, db_name, f'{collection_name}.bson'),
+                                mongorestore_args={'collection': collection_name, 'noIndexRestore': '',
+                                                   'numInsertionWorkersPerCollection':
+                                                       self.insertion_workers_per_collection})
+
+    def create_collection_indexes(self, db_name, collection_name):
+        self.info(f'Create indexes of {db_name}.{collection_name}')
+        source_indexes = self.source_db(db_name).mongo_handle[db_name][collection_name].index_information()
+        self.dest_db(db_name).create_index_on_collections({collection_name: source_indexes})
+
+    def remove_dump(self, db_name, collection_name):
+        for extension in ['.bson', '.metadata.json']:
+            dump_file = os.path.join(self.dump_dir, db_name, collection_name + extension)
+            if os.path.exists(dump_file):
+                os.remove(dump_file)
+
+    def migrate_collection(self, db_name, collection_name, collection_names):
+        if not self.is_done(db_name, collection_name, DUMPED) and not self.is_done(db_name, collection_name, RESTORED):
+            with self.dump_slots:
+                self.dump_collection(db_name, collection_name)
+            self.mark_done(db_name, collection_name, DUMPED)
+        if not self.is_done(db_name, collection_name, RESTORED):
+            self.prepare_database(db_name, collection_names)
+            with self.restore_slots:
+                self.restore_collection(db_name, collection_name)
+            self.mark_done(db_name, collection_name, RESTORED)
+            if not self.keep_dumps:
+                self.remove_dump(db_name, collection_name)
+        if not self.is_done(db_name, collection_name, INDEXED):
+            with self.index_slots:
+                self.create_collection_indexes(db_name, collection_name)
+            self.mark_done(db_name, collection_name, INDEXED)
+
+    def migrate(self, db_names, resume=True):
+        """Migrate all the collections of the databases and returns the collections that failed."""
+        collections_to_migrate = []
+        for db_name in db_names:
+            if not resume:
+                self.clear_markers(db_name)
+            os.makedirs(os.path.join(self.dump_dir, db_name), exist_ok=True)
+            collection_names = self.source_db(db_name).get_collection_names()
+            collections_to_migrate.extend((db_name, collection_name, collection_names)
+                                          for collection_name in collection_names)
+
+        failed_collections = []
+        with ThreadPoolExecutor(max_workers=self.max_collections_in_progress) as executor:
+            futures = dict((executor.submit(self.migrate_collection, *collection), collection[:2])
+                           for collection in collections_to_migrate)
+            for future, (db_name, collection_name) in futures.items():
+                try:
+                    future.result()
+                except Exception as ex:
+                    self.error(f'Error while migrating {db_name}.{collection_name}!\n{ex.__str__()}')
+                    failed_collections.append((db_name, collection_name))
+        return failed_collections
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move databases from one MongoDB instance to another, '
+                                                 'one collection at a time',
+                                     formatter_class=argparse.RawTextHelpFormatter, add_help=False)
+    parser.add_argument("--mongo-source-uri",
+                        help="Mongo Source URI (ex: mongodb://user:@mongos-source-host:27017/admin)", required=True)
+    parser.add_argument("--mongo-source-secrets-file",
+                        help="Full path to the Mongo Source secrets file (ex: /path/to/mongo/source/secret)",
+                        required=True)
+    parser.add_argument("--mongo-dest-uri",
+                        help="Mongo Destination URI (ex: mongodb://user:@mongos-dest-host:27017/admin)",
+                        required=True)
+    parser.add_argument("--mongo-dest-secrets-file",
+                        help="Full path to the Mongo Source secrets file (ex: /path/to/mongo/source/secret)",
+                        required=True)
+    parser.add_argument("--db-name", help="Database to migrate (ex: eva_hsapiens_grch37)", nargs='+', required=True)
+    parser.add_argument("--dump-dir", help="Top-level directory where all dumps reside (ex: /path/to/dumps)",
+                        required=True)
+    parser.add_argument("--max-dumps", help="Number of collections dumped at once", type=int, default=2)
+    parser.add_argument("--max-restores", help="Number of collections restored at once", type=int, default=2)
+    parser.add_argument("--max-index-builds", help="Number of collections indexed at once", type=int, default=2)
+    parser.add_argument("--keep-dumps", help="Keep the dump of each collection after it is restored",
+                        action='store_true')
+    parser.add_argument("--restart", help="Ignore the steps completed by a previous migration", action='store_true')
+    parser.add_argument('--help', action='help', help='Show this help message and exit')
+
+    args = parser.parse_args()
+    failed_collections = CollectionMigration(
+        args.mongo_source_uri, args.mongo_source_secrets_file, args.mongo_dest_uri, args.mongo_dest_secrets_file,
+        args.dump_dir, args.max_dumps, args.max_restores, args.max_index_builds, keep_dumps=args.keep_dumps
+    ).migrate(args.db_name, resume=not args.restart)
+    if failed_collections:
+        logger.error(f"Error while migrating {len(failed_collections)} collections!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
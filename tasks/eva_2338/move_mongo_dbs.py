@@ -20,6 +20,8 @@ import yaml
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.nextflow import LinearNextFlowPipeline
 
+from tasks.eva_2338.migrate_collections import CollectionMigration
+
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
@@ -72,6 +74,23 @@ class MoveMongoDBs:
         # See https://github.com/nextflow-io/nextflow/issues/937#issuecomment-630806451
         self.db_move_pipeline.run_pipeline(resume=self.resume_flag, other_args={"bg": ""})
 
+    def move_per_collection(self):
+        """
+        Move the databases one collection at a time, dumping, restoring and indexing several collections at once.
+        The number of collections in each step can be set with max-dumps, max-restores and max-index-builds in the
+        migration configuration.
+        """
+        failed_collections = CollectionMigration(
+            self.migration_config["mongo-source-uri"], self.migration_config["mongo-source-secrets-file"],
+            self.migration_config["mongo-dest-uri"], self.migration_config["mongo-dest-secrets-file"],
+            dump_dir=self.workflow_run_dir,
+            max_dumps=self.migration_config.get("max-dumps", 2),
+            max_restores=self.migration_config.get("max-restores", 2),
+            max_index_builds=self.migration_config.get("max-index-builds", 2)
+        ).migrate(self.dbs_to_migrate, resume=self.resume_flag)
+        if failed_collections:
+            raise Exception(f"Migration failed for collections {failed_collections}")
+
 
 def main():
     parser = argparse.ArgumentParser(description='Move a database from one MongoDB instance to another',
@@ -85,10 +104,17 @@ def main():
     parser.add_argument("--batch", help="Migration batch (ex: 1)", required=True)
     parser.add_argument("--resume", help="Flag to indicate if migration job is to be resumed", action='store_true',
                         required=False)
+    parser.add_argument("--per-collection", help="Move the databases one collection at a time instead of running the "
+                                                 "Nextflow pipeline on each database", action='store_true',
+                        required=False)
     parser.add_argument('--help', action='help', help='Show this help message and exit')
 
     args = parser.parse_args()
-    MoveMongoDBs(args.migration_config_file, args.dbs_to_migrate_list, args.batch, args.resume).move()
+    mover = MoveMongoDBs(args.migration_config_file, args.dbs_to_migrate_list, args.batch, args.resume)
+    if args.per_collection:
+        mover.move_per_collection()
+    else:
+        mover.move()
 
 
 if __name__ == "__main__":
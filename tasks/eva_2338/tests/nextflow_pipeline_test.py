@@ -6,7 +6,7 @@ from unittest import TestCase
 
 class TestMoveMongoDBs(TestCase):
     # Tests require Nextflow binary and two locally running mongos instances in different ports
-    def test_move(self):
+    def get_mover(self):
         dir_path = os.path.dirname(os.path.realpath(__file__))
         config_file_content = f"""migration-folder: {dir_path}/../resources
 python3-path: python3
@@ -28,8 +28,9 @@ mongo-dest-secrets-file: {dir_path}/empty_secret_file
             source_db = MongoDatabase(mover.migration_config["mongo-source-uri"], db_name=db_name)
             source_db.drop()
             source_db.restore_data(dump_dir=f"{dir_path}/../resources/{db_name}")
+        return mover
 
-        mover.move()
+    def assert_dest_matches_source(self, mover):
         # Check if source data made it to the destination
         for db_name in mover.dbs_to_migrate:
             source_db = MongoDatabase(mover.migration_config["mongo-source-uri"], db_name=db_name)
@@ -37,3 +38,19 @@ mongo-dest-secrets-file: {dir_path}/empty_secret_file
             for collection_name in source_db.get_collection_names():
                 self.assertEqual(source_db.mongo_handle[db_name][collection_name].count_documents(filter={}),
                                  dest_db.mongo_handle[db_name][collection_name].count_documents(filter={}))
+                self.assertEqual(set(source_db.mongo_handle[db_name][collection_name].index_information()),
+                                 set(dest_db.mongo_handle[db_name][collection_name].index_information()))
+
+    def test_move(self):
+        mover = self.get_mover()
+        mover.move()
+        self.assert_dest_matches_source(mover)
+
+    def test_move_per_collection(self):
+        mover = self.get_mover()
+        mover.move_per_collection()
+        self.assert_dest_matches_source(mover)
+        # Completed collections are not migrated again
+        mover.resume_flag = True
+        mover.move_per_collection()
+        self.assert_dest_matches_source(mover)
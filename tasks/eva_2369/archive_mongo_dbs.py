@@ -13,7 +13,9 @@
 # limitations under the License.
 
 import argparse
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
@@ -22,17 +24,25 @@ logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
 
-def archive_data_from_source(mongo_source: MongoDatabase, top_level_archive_dir):
+def archive_data_from_source(mongo_source: MongoDatabase, top_level_archive_dir, num_parallel_collections=1):
+    # The marker is only written once the archive is complete so a failed or interrupted archive is created again
+    done_marker = os.path.join(top_level_archive_dir, mongo_source.db_name + '.done')
+    if os.path.exists(done_marker):
+        logger.info(f"Archive of {mongo_source.db_name} already completed")
+        return
     try:
-        logger.info("Running mongodump from source...")
+        logger.info(f"Running mongodump of {mongo_source.db_name} from source...")
 
         # Force table scan is performant for many workloads avoids cursor timeout issues
         # See https://jira.mongodb.org/browse/TOOLS-845?focusedCommentId=988298&page=com.atlassian.jira.plugin.system.issuetabpanels:comment-tabpanel#comment-988298
         mongo_source.archive_data(archive_dir=top_level_archive_dir, archive_name=mongo_source.db_name,
-                                  mongodump_args={"gzip": "", "forceTableScan": "", "numParallelCollections": "1"})
+                                  mongodump_args={"gzip": "", "forceTableScan": "",
+                                                  "numParallelCollections": str(num_parallel_collections)})
     except Exception as ex:
         logger.error(f"Error while dumping data from source!\n{ex.__str__()}")
-        sys.exit(1)
+        raise
+    with open(done_marker, 'w'):
+        pass
 
 
 def get_databases_list_for_export(file_path):
@@ -62,15 +72,33 @@ def main():
                         required=True)
     parser.add_argument("--archive-dir", help="Top-level directory where all archives reside (ex: /path/to/archives)",
                         required=True)
+    parser.add_argument("--num-parallel-dbs", help="Number of databases archived at once", type=int, default=1)
+    parser.add_argument("--num-parallel-collections", help="Number of collections of each database dumped at once",
+                        type=int, default=1)
     parser.add_argument('--help', action='help', help='Show this help message and exit')
 
     args = parser.parse_args()
 
     databases_list = get_databases_list_for_export(args.db_names_list_file)
 
-    for db in databases_list:
+    def archive_database(db):
         archive_data_from_source(MongoDatabase(uri=args.mongo_source_uri, secrets_file=args.mongo_source_secrets_file,
-                                               db_name=db), top_level_archive_dir=args.archive_dir)
+                                               db_name=db), top_level_archive_dir=args.archive_dir,
+                                 num_parallel_collections=args.num_parallel_collections)
+
+    # Each archive is written by its own mongodump process. A failed archive does not stop the others, the failures
+    # are reported once all the databases have been processed
+    failed_databases = []
+    with ThreadPoolExecutor(max_workers=args.num_parallel_dbs) as executor:
+        futures = [(db, executor.submit(archive_database, db)) for db in databases_list]
+        for db, future in futures:
+            try:
+                future.result()
+            except Exception:
+                failed_databases.append(db)
+    if failed_databases:
+        logger.error(f"Archive failed for {len(failed_databases)} database(s): {', '.join(failed_databases)}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -2,11 +2,13 @@ import os
 import sys
 import tempfile
 from unittest import TestCase
+from unittest.mock import patch
 
 import pymongo
 from ebi_eva_common_pyutils.command_utils import run_command_with_output
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
 
+from tasks.eva_2369 import archive_mongo_dbs
 from tasks.eva_2369.archive_mongo_dbs import main
 
 
@@ -36,3 +38,34 @@ class TestArchiveMongoDatabase(TestCase):
                             f"""--mongo-source-secrets-file={self.dir_path}/../resources/{self.mongo_secret_file}"""]
             main()
             self.assertTrue(os.path.isfile(os.path.join(tempdir, self.db_name)))
+
+
+class TestArchiveFailures(TestCase):
+
+    def test_failed_archive_does_not_stop_the_others(self):
+        class FakeMongoDatabase:
+            def __init__(self, uri, secrets_file, db_name):
+                self.db_name = db_name
+
+            def archive_data(self, archive_dir, archive_name, mongodump_args):
+                if self.db_name == 'db2':
+                    raise Exception('mongodump failed')
+                open(os.path.join(archive_dir, archive_name), 'w').close()
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            db_names_list_file = os.path.join(tempdir, 'db-names-list.txt')
+            with open(db_names_list_file, 'w') as open_file:
+                open_file.write('db1\ndb2\ndb3\n')
+            archive_dir = os.path.join(tempdir, 'archives')
+            os.makedirs(archive_dir)
+            sys.argv[1:] = [f"--db-names-list-file={db_names_list_file}", f"--archive-dir={archive_dir}",
+                            "--mongo-source-uri=mongodb://localhost:27017/admin",
+                            "--mongo-source-secrets-file=secret", "--num-parallel-dbs=2"]
+            with patch.object(archive_mongo_dbs, 'MongoDatabase', FakeMongoDatabase), \
+                    self.assertLogs(archive_mongo_dbs.logger, level='ERROR') as logs, \
+                    self.assertRaises(SystemExit) as exit_context:
+                main()
+            assert exit_context.exception.code == 1
+            # The other archives are completed and the failure is reported after all of them
+            assert sorted(os.listdir(archive_dir)) == ['db1', 'db1.done', 'db3', 'db3.done']
+            assert 'Archive failed for 1 database(s): db2' in logs.output[-1]
@@ -1,30 +1,131 @@
+import os
+import shutil
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
 import pysam
+from ebi_eva_common_pyutils.logger import logging_config
 
+logger = logging_config.get_logger(__name__)
 
-def process_files(vcf_files_list, output_tsv):
-    """Extract Basic info from all the VCF files provided to populate a tsv file"""
+COLUMNS = ['variant_id', 'AF', 'variantType', 'Sample']
 
-    with open(vcf_files_list) as open_list, open(output_tsv, 'w') as open_output:
-        for file_name in open_list:
-            sample_name = file_name.split('.')[0]
-            with pysam.VariantFile(file_name.strip(), 'r') as vcf_in:
-                for vcf_record in vcf_in:
-                    variant_type='SNP' if len(vcf_record.ref) == 1 and len(vcf_record.alts[0]) == 1 else 'INDEL'
-                    print(
-                        ':'.join((vcf_record.chrom, str(vcf_record.pos), vcf_record.ref, vcf_record.alts[0]))
-                        + f"\t{vcf_record.info['AF']}\t{variant_type}\t{sample_name}", file=open_output
-                    )
+
+def get_sample_name(vcf_file):
+    return os.path.basename(vcf_file).split('.')[0]
+
+
+def extract_AF(vcf_file):
+    """Yields the variant id, AF, variant type and sample of each record of the VCF file."""
+    sample_name = get_sample_name(vcf_file)
+    # The sample columns are not needed so they are not parsed
+    with pysam.VariantFile(vcf_file, 'r', drop_samples=True) as vcf_in:
+        for vcf_record in vcf_in:
+            alt = vcf_record.alts[0]
+            variant_type = 'SNP' if len(vcf_record.ref) == 1 and len(alt) == 1 else 'INDEL'
+            yield (f'{vcf_record.chrom}:{vcf_record.pos}:{vcf_record.ref}:{alt}', vcf_record.info['AF'],
+                   variant_type, sample_name)
+
+
+def write_tsv(rows, output_file):
+    """Write the rows to output_file as they are read and return the number of rows."""
+    nb_rows = 0
+    with open(output_file, 'w') as open_output:
+        for variant_id, af, variant_type, sample_name in rows:
+            open_output.write(f'{variant_id}\t{af}\t{variant_type}\t{sample_name}\n')
+            nb_rows += 1
+    return nb_rows
+
+
+def write_parquet(rows, output_file, row_group_size=100000):
+    """Write the rows to output_file in row groups of row_group_size and return the number of rows."""
+    # pyarrow is only required for the parquet output
+    import pyarrow
+    import pyarrow.parquet
+    schema = pyarrow.schema(list(zip(COLUMNS, [pyarrow.string(), pyarrow.float64(), pyarrow.string(),
+                                               pyarrow.string()])))
+    nb_rows = 0
+    with pyarrow.parquet.ParquetWriter(output_file, schema) as writer:
+        while True:
+            row_group = list(islice(rows, row_group_size))
+            if not row_group:
+                break
+            columns = dict(zip(COLUMNS, zip(*row_group)))
+            # AF declared with Number=A is a tuple with one value per alternate allele, only the first one is extracted
+            columns['AF'] = [af[0] if isinstance(af, tuple) else af for af in columns['AF']]
+            writer.write_table(pyarrow.table(columns, schema=schema))
+            nb_rows += len(row_group)
+    return nb_rows
+
+
+def extract_AF_from_files(vcf_files, output_file, output_format):
+    """Write the AF of all the records of vcf_files to output_file and return the number of records."""
+    rows = (row for vcf_file in vcf_files for row in extract_AF(vcf_file))
+    if output_format == 'parquet':
+        return write_parquet(rows, output_file)
+    return write_tsv(rows, output_file)
+
+
+def merge_parquet_files(part_files, output_file):
+    import pyarrow.parquet
+    writer = None
+    for part_file in part_files:
+        # The part files are copied one row group at a time
+        part = pyarrow.parquet.ParquetFile(part_file)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(output_file, part.schema_arrow)
+        for i in range(part.num_row_groups):
+            writer.write_table(part.read_row_group(i))
+        part.close()
+        os.remove(part_file)
+    if writer:
+        writer.close()
+
+
+def read_vcf_files_list(vcf_files_list):
+    with open(vcf_files_list) as open_list:
+        return [line.strip() for line in open_list if line.strip()]
+
+
+def process_files(vcf_files_list, output_tsv, num_processes=1, files_per_task=100, output_format='tsv'):
+    """
+    Extract Basic info from all the VCF files provided to populate a tsv (or parquet) file.
+    The files are split in groups of files_per_task processed in parallel, each writing its own part file. The part
+    files are merged in the order of the list as they complete.
+    """
+    vcf_files = read_vcf_files_list(vcf_files_list)
+    file_groups = [vcf_files[i:i + files_per_task] for i in range(0, len(vcf_files), files_per_task)]
+    part_files = [f'{output_tsv}.part{i}' for i in range(len(file_groups))]
+    nb_records = 0
+    if output_format == 'parquet':
+        with ProcessPoolExecutor(max_workers=num_processes) as executor:
+            for nb_group_records in executor.map(extract_AF_from_files, file_groups, part_files,
+                                                 [output_format] * len(file_groups)):
+                nb_records += nb_group_records
+        merge_parquet_files(part_files, output_tsv)
+    else:
+        with ProcessPoolExecutor(max_workers=num_processes) as executor, open(output_tsv, 'wb') as open_output:
+            for part_file, nb_group_records in zip(part_files, executor.map(
+                    extract_AF_from_files, file_groups, part_files, [output_format] * len(file_groups))):
+                with open(part_file, 'rb') as open_part:
+                    shutil.copyfileobj(open_part, open_output)
+                os.remove(part_file)
+                nb_records += nb_group_records
+    logger.info(f'Extracted {nb_records} records from {len(vcf_files)} VCF files to {output_tsv}')
+    return nb_records
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument('--vcf_files_list')
     parser.add_argument('--output_tsv')
+    parser.add_argument('--num_processes', type=int, default=1, help='Number of processes reading the VCF files')
+    parser.add_argument('--files_per_task', type=int, default=100,
+                        help='Number of VCF files each process reads before writing them to its part file')
+    parser.add_argument('--output_format', choices=('tsv', 'parquet'), default='tsv',
+                        help='Write a TSV file or a parquet file (requires pyarrow) with the same columns')
     args = parser.parse_args()
+    logging_config.add_stdout_handler()
 
-    process_files(args.vcf_files_list, args.output_tsv)
-
-
-
+    process_files(args.vcf_files_list, args.output_tsv, args.num_processes, args.files_per_task, args.output_format)
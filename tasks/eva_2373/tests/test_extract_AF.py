@@ -0,0 +1,49 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from tasks.eva_2373.extract_AF import extract_AF_from_files, process_files
+
+
+class TestExtractAF(TestCase):
+
+    header = ('##fileformat=VCFv4.2\n'
+              '##INFO=<ID=AF,Number=A,Type=Float,Description="Allele Frequency">\n'
+              '##contig=<ID=chr1>\n'
+              '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.vcf_files = []
+        for i in range(5):
+            vcf_file = os.path.join(self.tmp_dir.name, f'sample{i}.vcf')
+            with open(vcf_file, 'w') as open_file:
+                open_file.write(self.header)
+                open_file.write(f'chr1\t{i + 1}\t.\tA\tT\t.\t.\tAF=0.25\n')
+                open_file.write(f'chr1\t{i + 10}\t.\tA\tTC\t.\t.\tAF=0.5\n')
+            self.vcf_files.append(vcf_file)
+        self.vcf_files_list = os.path.join(self.tmp_dir.name, 'vcf_files.txt')
+        with open(self.vcf_files_list, 'w') as open_file:
+            open_file.write('\n'.join(self.vcf_files) + '\n')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def expected_lines(self, sample_indexes):
+        return [line for i in sample_indexes for line in (f'chr1:{i + 1}:A:T\t(0.25,)\tSNP\tsample{i}\n',
+                                                          f'chr1:{i + 10}:A:TC\t(0.5,)\tINDEL\tsample{i}\n')]
+
+    def test_extract_AF_from_files(self):
+        part_file = os.path.join(self.tmp_dir.name, 'output.tsv.part1')
+        assert extract_AF_from_files(self.vcf_files[2:4], part_file, 'tsv') == 4
+        with open(part_file) as open_file:
+            assert open_file.readlines() == self.expected_lines([2, 3])
+
+    def test_process_files(self):
+        output_tsv = os.path.join(self.tmp_dir.name, 'output.tsv')
+        assert process_files(self.vcf_files_list, output_tsv, num_processes=2, files_per_task=2) == 10
+        # The part files of the three tasks are merged in the order of the list then removed
+        with open(output_tsv) as open_file:
+            assert open_file.readlines() == self.expected_lines(range(5))
+        assert sorted(os.listdir(self.tmp_dir.name)) == \
+            ['output.tsv', 'sample0.vcf', 'sample1.vcf', 'sample2.vcf', 'sample3.vcf', 'sample4.vcf', 'vcf_files.txt']
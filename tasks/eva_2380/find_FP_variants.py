@@ -1,10 +1,16 @@
-import os
 import sys
 from argparse import ArgumentParser
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import pysam
 
+from tasks.common.indexed_records import fetch_vcf_records_around, RecordOffsetIndex, variant_id_from_read_name, \
+    open_variant_file, vcf_record_id, index_vcf
+
+# Normalisation might not give exact coordinates so realigned variants are searched around the assessed positions,
+# closest first
+POSITION_OFFSETS = [0, 1, -1, 2, -2]
+
 
 def fetch_bases(fasta, contig, start, length):
     """
@@ -31,60 +37,61 @@ def extract_FP_from_assessment_vcf(vcf_file):
     return assessment_result_per_variants
 
 
-def get_variant_id(assessment_result_per_variants, vcf_file):
+def get_assessed_position_per_probe(assessment_result_per_variants):
+    """
+    Returns the assessed position to use for a realigned variant at each (contig, position), so each realigned
+    record is matched with a single lookup.
+    """
+    assessed_position_per_probe = {}
+    for offset in POSITION_OFFSETS:
+        for contig, position in assessment_result_per_variants:
+            assessed_position_per_probe.setdefault((contig, position - offset), (contig, position))
+    return assessed_position_per_probe
+
+
+def get_variant_id(assessment_result_per_variants, vcf_file, index_dir=None):
     print('Read realigned VCF: ' + vcf_file, file=sys.stderr)
     variant_id_to_assessment_result = {}
     variant_id_to_alignment_result = {}
-    with pysam.VariantFile(vcf_file, 'r') as vcf_in:
-        for vcf_record in vcf_in:
-            # Check around the location because normalisation might not give exact coordinates
-            keys = [
-                (vcf_record.chrom, vcf_record.pos),
-                (vcf_record.chrom, vcf_record.pos + 1),
-                (vcf_record.chrom, vcf_record.pos - 1),
-                (vcf_record.chrom, vcf_record.pos + 2),
-                (vcf_record.chrom, vcf_record.pos - 2)
-            ]
-            for key in keys:
-                if key in assessment_result_per_variants:
-                    variant_id_to_assessment_result[vcf_record.id] = assessment_result_per_variants[key]
-                    variant_id_to_alignment_result[vcf_record.id] = vcf_record
-                    # once found don't continue
-                    break
-
+    assessed_position_per_probe = get_assessed_position_per_probe(assessment_result_per_variants)
+    for vcf_record in fetch_vcf_records_around(vcf_file, assessment_result_per_variants,
+                                               window=max(POSITION_OFFSETS), index_dir=index_dir):
+        key = assessed_position_per_probe.get((vcf_record.chrom, vcf_record.pos))
+        if key:
+            variant_id_to_assessment_result[vcf_record.id] = assessment_result_per_variants[key]
+            variant_id_to_alignment_result[vcf_record.id] = vcf_record
     return variant_id_to_assessment_result, variant_id_to_alignment_result
 
 
-def get_variant_from_vcf(variant_ids, vcf_file):
+def get_variant_from_vcf(variant_ids, vcf_file, index_dir=None):
     print('Read standard VCF: ' + vcf_file, file=sys.stderr)
-    variant_id_to_record = {}
-    with pysam.VariantFile(vcf_file, 'r') as vcf_in:
-        for vcf_record in vcf_in:
-            if vcf_record.id in variant_ids:
-                variant_id_to_record[vcf_record.id] = vcf_record
-    return variant_id_to_record
+    # Records can only be sought in BGZF files so gzip VCFs are compressed again in index_dir
+    records_per_variant_id = RecordOffsetIndex(index_vcf(vcf_file, index_dir), vcf_record_id, open_variant_file,
+                                               index_dir=index_dir).fetch(variant_ids)
+    return dict((variant_id, records[0]) for variant_id, records in records_per_variant_id.items())
 
 
-def get_alignment_records(variant_ids, bam_file):
+def get_alignment_records(variant_ids, bam_file, index_dir=None):
+    """Returns the alignments of the reads of each variant in SAM format, using the read name index of the BAM."""
     print('Read alignment BAM: ' + bam_file, file=sys.stderr)
-    variant_id_to_bam_records = defaultdict(list)
-    with pysam.AlignmentFile(bam_file, "rb") as bam_in:
-        for sam_record in bam_in:
-            sp_name = sam_record.query_name.split('|')
-            rs_id = sp_name[4]
-            if rs_id in variant_ids:
-                variant_id_to_bam_records[rs_id].append(sam_record)
-    return variant_id_to_bam_records
+    records_per_variant_id = RecordOffsetIndex(bam_file, variant_id_from_read_name, index_dir=index_dir) \
+        .fetch(variant_ids)
+    return dict((variant_id, [sam_record.to_string() for sam_record in sam_records])
+                for variant_id, sam_records in records_per_variant_id.items())
 
 
-def process_files(realigned_vcf_file, assessment_vcf_file, source_vcf, truth_vcf, bam_files, old_ref, new_ref):
+def process_files(realigned_vcf_file, assessment_vcf_file, source_vcf, truth_vcf, bam_files, old_ref, new_ref,
+                  num_processes=4, index_dir=None):
     assessment_result_per_variants = extract_FP_from_assessment_vcf(assessment_vcf_file)
-    variant_id_to_assessment_result, variant_id_to_alignment_result = get_variant_id(assessment_result_per_variants, realigned_vcf_file)
-    variant_id_to_source_record = get_variant_from_vcf(variant_id_to_assessment_result, source_vcf)
-    variant_id_to_truth_record = get_variant_from_vcf(variant_id_to_assessment_result, truth_vcf)
-    alignment_record_lists = []
-    for bam_file in bam_files:
-        alignment_record_lists.append(get_alignment_records(variant_id_to_assessment_result, bam_file))
+    variant_id_to_assessment_result, variant_id_to_alignment_result = get_variant_id(assessment_result_per_variants, realigned_vcf_file, index_dir)
+    variant_ids = list(variant_id_to_assessment_result)
+    # The BAMs are searched in parallel, each in its own process
+    with ProcessPoolExecutor(max_workers=max(1, min(num_processes, len(bam_files)))) as executor:
+        alignment_record_futures = [executor.submit(get_alignment_records, variant_ids, bam_file, index_dir)
+                                    for bam_file in bam_files]
+        variant_id_to_source_record = get_variant_from_vcf(variant_ids, source_vcf, index_dir)
+        variant_id_to_truth_record = get_variant_from_vcf(variant_ids, truth_vcf, index_dir)
+        alignment_record_lists = [future.result() for future in alignment_record_futures]
 
     flank_len = 100
     old_fasta = pysam.FastaFile(old_ref)
@@ -100,8 +107,8 @@ def process_files(realigned_vcf_file, assessment_vcf_file, source_vcf, truth_vcf
         print('In truth:' + str(truth_var))
         print('In realignment:' + str(variant_id_to_alignment_result[variant_id]))
         for alignment_records in alignment_record_lists:
-            for alignment_record in alignment_records[variant_id]:
-                print('Alignments:' + alignment_record.to_string())
+            for alignment_record in alignment_records.get(variant_id, []):
+                print('Alignments:' + alignment_record)
             print('----')
 
         old_ref_left = fetch_bases(old_fasta, source_var.chrom, source_var.pos - flank_len, flank_len)
@@ -127,9 +134,12 @@ if __name__ == "__main__":
     parser.add_argument('--truth_vcf')
     parser.add_argument('--old_ref')
     parser.add_argument('--new_ref')
+    parser.add_argument('--num_processes', type=int, default=4, help='Number of BAM files searched in parallel')
+    parser.add_argument('--index_dir', help='Directory where the bgzipped VCFs and the indexes of the input files are '
+                                            'written, the system temporary directory by default')
     args = parser.parse_args()
 
     process_files(args.realigned_vcf, args.assessment_vcf, args.source_vcf, args.truth_vcf, args.alignment_bams,
-                  args.old_ref, args.new_ref)
+                  args.old_ref, args.new_ref, args.num_processes, args.index_dir)
 
 
@@ -1,4 +1,5 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import psycopg2
@@ -14,55 +15,117 @@ logging_config.add_stdout_handler()
 mongo_migration_count_validation_table_name = "eva_tasks.mongo4_migration_count_validation"
 
 
-def create_collection_count_validation_report(mongo_source: MongoDatabase, database_list, private_config_xml_file):
+def create_collection_count_validation_report(mongo_source: MongoDatabase, database_list, private_config_xml_file,
+                                              mode='exact', max_workers=4):
+    """
+    Count the documents of every collection of each database and store the counts in Postgres, in a single insert per
+    database. In fast mode the counts come from the collection metadata (estimated_document_count) instead of a full
+    scan. In exact mode the collections of a database are counted concurrently by max_workers threads.
+    """
     report_timestamp = datetime.now()
     mongo_host = mongo_source.mongo_handle.address[0]
 
-    for db in database_list:
-        mongo_source.db_name = db
-        source_collections = mongo_source.get_collection_names()
+    with get_metadata_connection(private_config_xml_file) as metadata_connection_handle:
+        for db in database_list:
+            mongo_source.db_name = db
+            source_collections = mongo_source.get_collection_names()
 
-        if not source_collections:
-            logger.warning(f"database {db} does not exist in mongo instances {mongo_host}")
-            continue
+            if not source_collections:
+                logger.warning(f"database {db} does not exist in mongo instances {mongo_host}")
+                continue
 
-        for coll in sorted(source_collections):
-            logger.info(f"fetching count for database ({db}) - collection ({coll})")
+            logger.info(f"fetching {mode} count for {len(source_collections)} collections of database ({db})")
+            counts = get_documents_count_for_collections(mongo_source, db, sorted(source_collections), mode,
+                                                         max_workers)
+            for coll, no_of_documents in counts.items():
+                logger.info(f"Found {no_of_documents} documents in database ({db}) - collection ({coll})")
 
-            no_of_documents = get_documents_count_for_collection(mongo_source, db, coll)
-            logger.info(f"Found {no_of_documents} documents in database ({db}) - collection ({coll})")
-
-            insert_count_validation_result_to_db(private_config_xml_file,
-                                                 (mongo_host, db, coll, no_of_documents, report_timestamp))
+            insert_count_validation_result_to_db(
+                metadata_connection_handle,
+                [(mongo_host, db, coll, no_of_documents, report_timestamp) for coll, no_of_documents in counts.items()]
+            )
 
 
 @retry(logger=logger, tries=3, delay=3, backoff=2)
-def get_documents_count_for_collection(mongo_server: MongoDatabase, db, coll):
+def get_documents_count_for_collection(mongo_server: MongoDatabase, db, coll, mode='exact'):
+    if mode == 'fast':
+        return mongo_server.mongo_handle[db][coll].estimated_document_count()
     return mongo_server.mongo_handle[db][coll].count_documents({})
 
 
+def get_documents_count_for_collections(mongo_server: MongoDatabase, db, collections, mode='exact', max_workers=4):
+    # The metadata based counts are immediate so they are not worth running in parallel
+    if mode == 'fast' or max_workers == 1:
+        counts = [get_documents_count_for_collection(mongo_server, db, coll, mode) for coll in collections]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            counts = list(executor.map(lambda coll: get_documents_count_for_collection(mongo_server, db, coll, mode),
+                                       collections))
+    return dict(zip(collections, counts))
+
+
+def get_metadata_connection(private_config_xml_file):
+    return psycopg2.connect(get_pg_metadata_uri_for_eva_profile("development", private_config_xml_file),
+                            user="evadev")
+
+
 def create_table_for_count_validation(private_config_xml_file):
-    with psycopg2.connect(get_pg_metadata_uri_for_eva_profile("development", private_config_xml_file),
-                          user="evadev") as metadata_connection_handle:
+    with get_metadata_connection(private_config_xml_file) as metadata_connection_handle:
         query_create_table_for_count_validation = "create table if not exists {0} " \
                                                   "(mongo_host text, database text, collection text, " \
                                                   "document_count bigint not null, report_time timestamp, " \
                                                   "primary key(mongo_host, database, collection, report_time))" \
             .format(mongo_migration_count_validation_table_name)
 
-    execute_query(metadata_connection_handle, query_create_table_for_count_validation)
+        execute_query(metadata_connection_handle, query_create_table_for_count_validation)
 
 
-def insert_count_validation_result_to_db(private_config_xml_file, count_validation_res_list):
+def insert_count_validation_result_to_db(metadata_connection_handle, count_validation_res_list):
     if len(count_validation_res_list) > 0:
-        with psycopg2.connect(get_pg_metadata_uri_for_eva_profile("development", private_config_xml_file),
-                              user="evadev") as metadata_connection_handle:
-            with metadata_connection_handle.cursor() as cursor:
-                psycopg2.extras.execute_values(cursor,
-                                               "INSERT INTO {0} "
-                                               "(mongo_host, database, collection, document_count,report_time) "
-                                               "VALUES %s".format(mongo_migration_count_validation_table_name),
-                                               [count_validation_res_list])
+        with metadata_connection_handle.cursor() as cursor:
+            psycopg2.extras.execute_values(cursor,
+                                           "INSERT INTO {0} "
+                                           "(mongo_host, database, collection, document_count,report_time) "
+                                           "VALUES %s".format(mongo_migration_count_validation_table_name),
+                                           count_validation_res_list)
+        metadata_connection_handle.commit()
+
+
+def get_latest_counts(metadata_connection_handle, mongo_host, database_list):
+    """Returns the document count of each (database, collection) in the latest report of mongo_host."""
+    if not database_list:
+        return {}
+    with metadata_connection_handle.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT ON (database, collection) database, collection, document_count "
+                       "FROM {0} WHERE mongo_host = %s AND database IN %s "
+                       "ORDER BY database, collection, report_time DESC"
+                       .format(mongo_migration_count_validation_table_name),
+                       (mongo_host, tuple(database_list)))
+        return dict(((database, collection), document_count) for database, collection, document_count in cursor)
+
+
+def create_count_diff_report(private_config_xml_file, mongo_host, other_mongo_host, database_list, output_file):
+    """
+    Compare the latest counts of mongo_host with the latest counts of other_mongo_host for the same databases and
+    write the collections whose counts differ, or that only exist on one host, to a tab separated file.
+    Returns the number of collections that differ.
+    """
+    with get_metadata_connection(private_config_xml_file) as metadata_connection_handle:
+        counts = get_latest_counts(metadata_connection_handle, mongo_host, database_list)
+        other_counts = get_latest_counts(metadata_connection_handle, other_mongo_host, database_list)
+    nb_differences = 0
+    with open(output_file, 'w') as open_output:
+        print('database', 'collection', mongo_host, other_mongo_host, 'difference', sep='\t', file=open_output)
+        for database, collection in sorted(set(counts) | set(other_counts)):
+            count = counts.get((database, collection))
+            other_count = other_counts.get((database, collection))
+            if count != other_count:
+                nb_differences += 1
+                difference = count - other_count if count is not None and other_count is not None else 'NA'
+                print(database, collection, 'NA' if count is None else count,
+                      'NA' if other_count is None else other_count, difference, sep='\t', file=open_output)
+    logger.info(f"{nb_differences} collections have different counts in {mongo_host} and {other_mongo_host}")
+    return nb_differences
 
 
 def get_databases_list_for_validation(file_path):
@@ -94,15 +157,28 @@ def main():
     parser.add_argument("--private-config-xml-file",
                         help="ex: /path/to/eva-maven-settings.xml",
                         required=True)
+    parser.add_argument("--mode", choices=('exact', 'fast'), default='exact',
+                        help="Count the documents (exact) or use the counts of the collection metadata (fast)")
+    parser.add_argument("--max-workers", help="Number of collections counted at once in exact mode", type=int,
+                        default=4)
+    parser.add_argument("--compare-with-host",
+                        help="Mongo host of an earlier report to compare the new counts with (ex: mongos-source-host)")
+    parser.add_argument("--diff-report", help="Full path to the report of the differences with --compare-with-host")
     parser.add_argument('--help', action='help', help='Show this help message and exit')
 
     args = parser.parse_args()
+    if args.compare_with_host and not args.diff_report:
+        parser.error('--diff-report is required with --compare-with-host')
 
     mongo_source = MongoDatabase(uri=args.mongo_source_uri, secrets_file=args.mongo_source_secrets_file)
     database_list = get_databases_list_for_validation(args.db_list)
 
     create_table_for_count_validation(args.private_config_xml_file)
-    create_collection_count_validation_report(mongo_source, database_list, args.private_config_xml_file)
+    create_collection_count_validation_report(mongo_source, database_list, args.private_config_xml_file,
+                                              args.mode, args.max_workers)
+    if args.compare_with_host:
+        create_count_diff_report(args.private_config_xml_file, mongo_source.mongo_handle.address[0],
+                                 args.compare_with_host, database_list, args.diff_report)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,7 @@
 #!/usr/bin/env python
 import csv
-import json
 import operator
-import os
-import re
 from argparse import ArgumentParser
-from collections import defaultdict
-
-import atexit
 
 import pandas as pd
 import psycopg2
@@ -17,6 +11,8 @@ from ebi_eva_common_pyutils.config_utils import get_pg_metadata_uri_for_eva_prof
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.pg_utils import execute_query, get_all_results_for_query
 
+from tasks.common.metadata_client import MetadataClient
+
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
@@ -24,30 +20,10 @@ logging_config.add_stdout_handler()
 eutils_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
 esearch_url = eutils_url + 'esearch.fcgi'
 esummary_url = eutils_url + 'esummary.fcgi'
-efetch_url = eutils_url + 'efetch.fcgi'
-ensembl_url = 'http://rest.ensembl.org/info/assembly'
-
-
-cache_file = 'cache.json'
-
-
-def load_cache():
-    global cache
-    if os.path.exists(cache_file):
-        with open(cache_file) as open_file:
-            cache.update(json.load(open_file))
-
-
-def save_cache():
-    with open(cache_file, 'w') as open_file:
-        json.dump(cache, open_file)
 
 
-atexit.register(save_cache)
-
-
-cache = defaultdict(dict)
-load_cache()
+# Replaced in main with a client using the cache file and options provided
+metadata_client = MetadataClient()
 
 
 def retrieve_assembly_summary_from_species_name(species):
@@ -83,44 +59,41 @@ def best_assembly(assembly_list):
 
 def retrieve_species_names_from_tax_id(taxid):
     """Search for a species scientific name based on the taxonomy id"""
-    if str(taxid) not in cache['taxid_to_name']:
-        logger.info(f'Query NCBI for taxonomy {taxid}', )
-        payload = {'db': 'Taxonomy', 'id': taxid}
-        r = requests.get(efetch_url, params=payload)
-        match = re.search('<Rank>(.+?)</Rank>', r.text, re.MULTILINE)
-        rank = None
-        if match:
-            rank = match.group(1)
-        if rank not in ['species', 'subspecies']:
-            logger.warning('Taxonomy id %s does not point to a species', taxid)
-        match = re.search('<ScientificName>(.+?)</ScientificName>', r.text, re.MULTILINE)
-        if match:
-            cache['taxid_to_name'][str(taxid)] = match.group(1)
-        else:
-            logger.warning('No species found for %s' % taxid)
-            cache['taxid_to_name'][str(taxid)] = None
-    return taxid, cache['taxid_to_name'].get(str(taxid))
+    summary = metadata_client.get_ncbi_taxonomy_summaries([taxid]).get(str(taxid))
+    if not summary or summary.get('rank') not in ['species', 'subspecies']:
+        logger.warning('Taxonomy id %s does not point to a species', taxid)
+    if not summary or not summary.get('scientificname'):
+        logger.warning('No species found for %s' % taxid)
+        return taxid, None
+    return taxid, summary.get('scientificname')
 
 
 def retrieve_species_name_from_assembly_accession(assembly_accession):
     """Search for a species scientific name based on an assembly accession"""
-    if assembly_accession not in cache['assembly_to_species']:
-        logger.info(f'Query NCBI for assembly {assembly_accession}', )
-        payload = {'db': 'Assembly', 'term': '"{}"'.format(assembly_accession), 'retmode': 'JSON'}
-        data = requests.get(esearch_url, params=payload).json()
-        if data:
-            assembly_id_list = data.get('esearchresult').get('idlist')
-            payload = {'db': 'Assembly', 'id': ','.join(assembly_id_list), 'retmode': 'JSON'}
-            summary_list = requests.get(esummary_url, params=payload).json()
-            all_species_names = set()
-            for assembly_id in summary_list.get('result', {}).get('uids', []):
-                assembly_info = summary_list.get('result').get(assembly_id)
-                all_species_names.add((assembly_info.get('speciestaxid'), assembly_info.get('speciesname')))
-            if len(all_species_names) == 1:
-                cache['assembly_to_species'][assembly_accession] = all_species_names.pop()
-            else:
-                logger.warning('%s taxons found for assembly %s ' % (len(all_species_names), assembly_accession))
-    return cache['assembly_to_species'].get(assembly_accession) or (None, None)
+    assembly_summaries = metadata_client.get_ncbi_assembly_summaries([assembly_accession]).get(assembly_accession)
+    all_species_names = set()
+    for assembly_info in assembly_summaries or []:
+        all_species_names.add((assembly_info.get('speciestaxid'), assembly_info.get('speciesname')))
+    if len(all_species_names) == 1:
+        return all_species_names.pop()
+    logger.warning('%s taxons found for assembly %s ' % (len(all_species_names), assembly_accession))
+    return None, None
+
+
+def prefetch_species_information(taxids_or_assemblies):
+    """
+    Retrieve the species and Ensembl assemblies of all the taxonomies and assemblies at once so the remote services
+    are queried concurrently and in batches rather than one identifier at a time.
+    """
+    taxids_or_assemblies = set(str(t) for t in taxids_or_assemblies if t)
+    taxids = [t for t in taxids_or_assemblies if t.isdigit()]
+    assemblies = [t for t in taxids_or_assemblies if not t.isdigit()]
+    scientific_names = set(metadata_client.get_ncbi_scientific_names(taxids).values())
+    for assembly_summaries in metadata_client.get_ncbi_assembly_summaries(assemblies).values():
+        species_names = set(assembly_info.get('speciesname') for assembly_info in assembly_summaries or [])
+        if len(species_names) == 1:
+            scientific_names.update(species_names)
+    metadata_client.get_ensembl_current_assemblies([name for name in scientific_names if name])
 
 
 def retrieve_current_ensembl_assemblies(taxid_or_assembly):
@@ -139,14 +112,8 @@ def retrieve_current_ensembl_assemblies(taxid_or_assembly):
         taxid, scientific_name = retrieve_species_name_from_assembly_accession(taxid_or_assembly)
     if scientific_name:
         logger.debug('Found %s', scientific_name)
-        if scientific_name not in cache['scientific_name_to_ensembl']:
-            logger.info(f'Query Ensembl for species {scientific_name}', )
-            url = ensembl_url + '/' + scientific_name.lower().replace(' ', '_')
-            response = requests.get(url, params={'content-type': 'application/json'})
-            data = response.json()
-            assembly_accession = str(data.get('assembly_accession'))
-            cache['scientific_name_to_ensembl'][scientific_name] = assembly_accession
-        return [str(taxid), str(scientific_name), cache['scientific_name_to_ensembl'].get(scientific_name)]
+        assembly_accession = metadata_client.get_ensembl_current_assemblies([scientific_name]).get(scientific_name)
+        return [str(taxid), str(scientific_name), str(assembly_accession)]
 
     return ['NA', 'NA', 'NA']
 
@@ -164,7 +131,9 @@ def find_all_eva_studies(accession_counts, private_config_xml_file):
             'ORDER BY pt.taxonomy_id, a.vcf_reference_accession'
         )
         data = []
-        for assembly, tax_id, study in filter_studies(get_all_results_for_query(pg_conn, query)):
+        studies = list(filter_studies(get_all_results_for_query(pg_conn, query)))
+        prefetch_species_information([tax_id for _, tax_id, _ in studies] + [assembly for assembly, _, _ in studies])
+        for assembly, tax_id, study in studies:
             taxid_from_ensembl, scientific_name, ensembl_assembly_from_taxid = retrieve_current_ensembl_assemblies(tax_id)
             _, _, ensembl_assembly_from_assembly = retrieve_current_ensembl_assemblies(assembly)
 
@@ -268,6 +237,7 @@ def parse_dbsnp_csv(input_file, accession_counts):
     ensembl_assemblies_from_assembly = []
     target_assemblies = []
 
+    prefetch_species_information(list(df['Taxid']) + list(df['Assembly']))
     for index, record in df.iterrows():
         taxid, scientific_name, ensembl_assembly_from_taxid = retrieve_current_ensembl_assemblies(record['Taxid'])
         _, _, ensembl_assembly_from_assembly = retrieve_current_ensembl_assemblies(record['Assembly'])
@@ -333,7 +303,13 @@ def main():
     argparse.add_argument('--private_config_xml_file', required=True,
                           help='Path to the file containing the username/passwords tp access '
                                'production and development databases')
+    argparse.add_argument('--cache_file', default='cache.sqlite',
+                          help='Path to the file where the information retrieved from NCBI and Ensembl is cached')
+    argparse.add_argument('--offline', action='store_true', default=False,
+                          help='Only use the information already in the cache file')
     args = argparse.parse_args()
+    global metadata_client
+    metadata_client = MetadataClient(cache_file=args.cache_file, offline=args.offline)
     output_header = ['Source', 'Taxid', 'Scientific Name', 'Assembly', 'number Of Studies',
                      'Number Of Variants (submitted variants)', 'Ensembl assembly from taxid',
                      'Ensembl assembly from assembly', 'Target Assembly']
@@ -1,58 +1,33 @@
 import argparse
-import hashlib
 import traceback
 
-import pymongo
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
-from pymongo import WriteConcern
-from pymongo.read_concern import ReadConcern
+
+from tasks.common.id_rewrite import rewrite_document_ids
+from tasks.common.variant_hashing import get_submitted_SHA1
 
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
 
-def get_SHA1(variant_rec):
-    """Calculate the SHA1 digest from the seq, study, contig, start, ref, and alt attributes of the variant"""
-    h = hashlib.sha1()
-    keys = ['seq', 'study', 'contig', 'start', 'ref', 'alt']
-    h.update('_'.join([str(variant_rec[key]) for key in keys]).encode())
-    return h.hexdigest().upper()
-
-
 def replace_with_correct_assembly(mongo_source):
     correct_assembly = 'GCA_000002315.5'
-    sve_collection = mongo_source.mongo_handle[mongo_source.db_name]["submittedVariantEntity"]
     filter_criteria = {'seq': 'PRJEB36115', 'study': 'PRJEB36115'}
-    cursor = sve_collection.with_options(read_concern=ReadConcern("majority")) \
-        .find(filter_criteria, no_cursor_timeout=True)
-    insert_statements = []
-    drop_statements = []
     number_of_variants_to_replace = 1
-    total_inserted, total_dropped = 0, 0
+
+    def correct_seq(variant):
+        variant['seq'] = correct_assembly
+
     try:
-        for variant in cursor:
-            original_id = get_SHA1(variant)
-            assert variant['_id'] == original_id, "Original id is different from the one calculated %s != %s" % (
-                variant['_id'], original_id)
-            variant['seq'] = correct_assembly
-            variant['_id'] = get_SHA1(variant)
-            insert_statements.append(pymongo.InsertOne(variant))
-            drop_statements.append(pymongo.DeleteOne({'_id': original_id}))
-        result_insert = sve_collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000)) \
-            .bulk_write(requests=insert_statements, ordered=False)
-        total_inserted += result_insert.inserted_count
-        result_drop = sve_collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000)) \
-            .bulk_write(requests=drop_statements, ordered=False)
-        total_dropped += result_drop.deleted_count
-        logger.info('%s / %s new documents inserted' % (total_inserted, number_of_variants_to_replace))
-        logger.info('%s / %s old documents dropped' % (total_dropped, number_of_variants_to_replace))
+        counts = rewrite_document_ids(mongo_source, "submittedVariantEntity", filter_criteria, correct_seq,
+                                      get_submitted_SHA1)
+        logger.info('%s / %s new documents inserted' % (counts['inserted'], number_of_variants_to_replace))
+        logger.info('%s / %s old documents dropped' % (counts['dropped'], number_of_variants_to_replace))
     except Exception as e:
         print(traceback.format_exc())
         raise e
-    finally:
-        cursor.close()
-    return total_inserted
+    return counts['inserted']
 
 
 def main():
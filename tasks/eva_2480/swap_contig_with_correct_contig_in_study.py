@@ -1,5 +1,4 @@
 import argparse
-import hashlib
 import traceback
 
 import pymongo
@@ -8,18 +7,12 @@ from ebi_eva_common_pyutils.mongodb import MongoDatabase
 from pymongo import WriteConcern
 from pymongo.read_concern import ReadConcern
 
+from tasks.common.variant_hashing import get_submitted_SHA1
+
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
 
-def get_SHA1(variant_rec):
-    """Calculate the SHA1 digest from the seq, study, contig, start, ref, and alt attributes of the variant"""
-    h = hashlib.sha1()
-    keys = ['seq', 'study', 'contig', 'start', 'ref', 'alt']
-    h.update('_'.join([str(variant_rec[key]) for key in keys]).encode())
-    return h.hexdigest().upper()
-
-
 def swap_with_correct_contig(mongo_source, contig_swap_list):
     sve_collection = mongo_source.mongo_handle[mongo_source.db_name]["submittedVariantEntity"]
     insert_statements = []
@@ -58,11 +51,11 @@ def get_insert_statements(sve_collection, curr_contig, swap_contig):
     drop_statements = []
     try:
         for variant in cursor:
-            original_id = get_SHA1(variant)
+            original_id = get_submitted_SHA1(variant)
             assert variant['_id'] == original_id, "Original id is different from the one calculated %s != %s" % (
                 variant['_id'], original_id)
             variant['contig'] = swap_contig
-            variant['_id'] = get_SHA1(variant)
+            variant['_id'] = get_submitted_SHA1(variant)
             insert_statements.append(pymongo.InsertOne(variant))
             drop_statements.append(pymongo.DeleteOne({'_id': original_id}))
     except Exception as e:
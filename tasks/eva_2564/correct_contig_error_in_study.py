@@ -1,25 +1,16 @@
 import argparse
-import hashlib
 import traceback
 
-import pymongo
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
-from pymongo import WriteConcern
-from pymongo.read_concern import ReadConcern
+
+from tasks.common.id_rewrite import rewrite_document_ids
+from tasks.common.variant_hashing import get_submitted_SHA1
 
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
 
-def get_SHA1(variant_rec):
-    """Calculate the SHA1 digest from the seq, study, contig, start, ref, and alt attributes of the variant"""
-    h = hashlib.sha1()
-    keys = ['seq', 'study', 'contig', 'start', 'ref', 'alt']
-    h.update('_'.join([str(variant_rec[key]) for key in keys]).encode())
-    return h.hexdigest().upper()
-
-
 def get_contig_equivalents():
     return {
         '1_random.1': 'AABR07046142.1',
@@ -399,49 +390,20 @@ def get_contig_equivalents():
 
 def correct(mongo_source):
     contig_equivalents = get_contig_equivalents()
-    sve_collection = mongo_source.mongo_handle[mongo_source.db_name]["submittedVariantEntity"]
-    insert_statements, drop_statements = get_insert_statements(sve_collection, contig_equivalents)
+    filter_criteria = {'seq': 'GCA_000001895.4', 'study': 'PRJEB42012', 'contig': {'$in': list(contig_equivalents)}}
 
-    total_inserted = 0
-    total_dropped = 0
-    try:
-        result_insert = sve_collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000)) \
-            .bulk_write(requests=insert_statements, ordered=False)
-        total_inserted += result_insert.inserted_count
-        logger.info(f"{total_inserted} new documents inserted")
-        result_drop = sve_collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000)) \
-            .bulk_write(requests=drop_statements, ordered=False)
-        total_dropped += result_drop.deleted_count
-        logger.info(f"{total_dropped} wrong documents dropped")
-        return total_inserted, total_dropped
-    except Exception as e:
-        print(traceback.format_exc())
-        raise e
+    def correct_contig(variant):
+        variant['contig'] = contig_equivalents[variant['contig']]
 
-
-def get_insert_statements(sve_collection, contig_equivalents):
-    wrong_contigs = list(contig_equivalents.keys())
-    filter_criteria = {'seq': 'GCA_000001895.4', 'study': 'PRJEB42012', 'contig': {'$in': wrong_contigs}}
-    cursor = sve_collection.with_options(read_concern=ReadConcern("majority")).find(filter_criteria,
-                                                                                    no_cursor_timeout=True)
-    insert_statements = []
-    drop_statements = []
     try:
-        for variant in cursor:
-            original_id = get_SHA1(variant)
-            assert variant['_id'] == original_id, f"Original id is different from the one calculated " \
-                                                  f"{variant['_id']} != {original_id}"
-            variant['contig'] = contig_equivalents[variant['contig']]
-            variant['_id'] = get_SHA1(variant)
-            insert_statements.append(pymongo.InsertOne(variant))
-            drop_statements.append(pymongo.DeleteOne({'_id': original_id}))
+        counts = rewrite_document_ids(mongo_source, "submittedVariantEntity", filter_criteria, correct_contig,
+                                      get_submitted_SHA1)
+        logger.info(f"{counts['inserted']} new documents inserted")
+        logger.info(f"{counts['dropped']} wrong documents dropped")
+        return counts['inserted'], counts['dropped']
     except Exception as e:
         print(traceback.format_exc())
         raise e
-    finally:
-        cursor.close()
-
-    return insert_statements, drop_statements
 
 
 def main():
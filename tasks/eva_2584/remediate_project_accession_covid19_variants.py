@@ -19,60 +19,35 @@
 # Adapted from https://github.com/EBIvariation/eva-tasks/blob/master/tasks/eva_2464/correct_contig_error_in_study.py
 
 import argparse
-import hashlib
-import pymongo
 import traceback
 
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
-from pymongo import WriteConcern
-from pymongo.read_concern import ReadConcern
+
+from tasks.common.id_rewrite import rewrite_document_ids
+from tasks.common.variant_hashing import get_submitted_SHA1
 
 
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
 
-def get_SHA1(variant_rec):
-    """Calculate the SHA1 digest from the seq, study, contig, start, ref, and alt attributes of the variant"""
-    h = hashlib.sha1()
-    keys = ['seq', 'study', 'contig', 'start', 'ref', 'alt']
-    h.update('_'.join([str(variant_rec[key]) for key in keys]).encode())
-    return h.hexdigest().upper()
-
-
 def replace_with_correct_project_accession(mongo_source, assembly_accession, incorrect_prj_accession,
                                           correct_prj_accession, num_variants_to_replace):
-    sve_collection = mongo_source.mongo_handle[mongo_source.db_name]["submittedVariantEntity"]
     filter_criteria = {'seq': assembly_accession, 'study': incorrect_prj_accession}
-    cursor = sve_collection.with_options(read_concern=ReadConcern("majority")) \
-        .find(filter_criteria, no_cursor_timeout=True).limit(num_variants_to_replace)
-    insert_statements = []
-    drop_statements = []
-    total_inserted, total_dropped = 0, 0
+
+    def correct_study(variant):
+        variant['study'] = correct_prj_accession
+
     try:
-        for variant in cursor:
-            original_id = get_SHA1(variant)
-            assert variant['_id'] == original_id, "Original id is different from the one calculated %s != %s" % (
-                variant['_id'], original_id)
-            variant['study'] = correct_prj_accession
-            variant['_id'] = get_SHA1(variant)
-            insert_statements.append(pymongo.InsertOne(variant))
-            drop_statements.append(pymongo.DeleteOne({'_id': original_id}))
-        result_insert = sve_collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000)) \
-            .bulk_write(requests=insert_statements, ordered=False)
-        total_inserted += result_insert.inserted_count
-        result_drop = sve_collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000)) \
-            .bulk_write(requests=drop_statements, ordered=False)
-        total_dropped += result_drop.deleted_count
-        logger.info('%s / %s new documents inserted' % (total_inserted, num_variants_to_replace))
-        logger.info('%s / %s old documents dropped' % (total_dropped, num_variants_to_replace))
+        counts = rewrite_document_ids(mongo_source, "submittedVariantEntity", filter_criteria, correct_study,
+                                      get_submitted_SHA1, limit=num_variants_to_replace)
+        logger.info('%s / %s new documents inserted' % (counts['inserted'], num_variants_to_replace))
+        logger.info('%s / %s old documents dropped' % (counts['dropped'], num_variants_to_replace))
     except Exception as e:
         print(traceback.format_exc())
         raise e
-    finally:
-        cursor.close()
-    return total_inserted
+    return counts['inserted']
 
 
 def main():
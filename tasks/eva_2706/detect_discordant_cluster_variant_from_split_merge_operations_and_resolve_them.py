@@ -1,5 +1,4 @@
 import argparse
-import hashlib
 from collections import defaultdict
 from itertools import zip_longest
 
@@ -7,6 +6,8 @@ from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
 from pymongo.read_concern import ReadConcern
 
+from tasks.common.variant_hashing import get_SHA1
+
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
@@ -74,14 +75,12 @@ def classify_variant(reference, alternate):
 
 def submitted_variant_to_clustered_variant_hash(submitted_variant):
     """Calculate the SHA1 digest from the clustered variant based on the submitted variant information"""
-    h = hashlib.sha1()
-    h.update('_'.join([
+    return get_SHA1('_'.join([
         submitted_variant.get('seq'),
         submitted_variant.get('contig'),
         str(submitted_variant.get('start')),
         classify_variant(submitted_variant.get('ref'), submitted_variant.get('alt')),
-    ]).encode())
-    return h.hexdigest().upper()
+    ]))
 
 
 def fix_error(dbsnp_sve_collection, sve_collection, dbsnp_cve_collection, cve_collection,
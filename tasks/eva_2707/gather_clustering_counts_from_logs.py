@@ -8,22 +8,26 @@ from datetime import datetime
 
 from ebi_eva_common_pyutils.logger import logging_config
 
+from tasks.common.log_parse_cache import LogParseCache
+
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
 
-def gather_count_from_logs(clustering_dir, output_file):
-    pass
+def gather_count_from_logs(clustering_dir, output_file, cache_file=None):
     # Assume the directory structure:
     # clustering_dir --> <scientific_name_taxonomy_id> --> <assembly_accession> --> cluster_<date>.log
 
     all_log_pattern = os.path.join(clustering_dir, '*', 'GCA*', 'cluster_*.log')
     all_log_files = glob.glob(all_log_pattern)
     metrics_per_species = defaultdict(dict)
-    for log_file in all_log_files:
-        logger.info('Parse log file: ' + log_file)
+    parsed_logs = []
+    with LogParseCache(cache_file, parser_name='clustering_counts') as log_parse_cache:
+        for log_file in all_log_files:
+            logger.info('Parse log file: ' + log_file)
+            parsed_logs.append((log_file, parse_one_log_with_cache(log_parse_cache, log_file)))
+    for log_file, result_dict in parsed_logs:
         scientific_name, taxid, assembly_accession, log_date = parse_log_file_path(log_file)
-        result_dict = parse_one_log(log_file)
         truncated = detect_missing_data(result_dict)
         if truncated:
             metrics_per_species[taxid]['truncated'] = 'Yes'
@@ -73,27 +77,37 @@ def parse_log_file_path(log_file_path):
 
 
 def parse_one_log(log_file):
+    state = {'current_step': None, 'results': {}}
+    with open(log_file) as open_file:
+        parse_log_lines(open_file, state)
+    return state['results']
+
+
+def parse_one_log_with_cache(log_parse_cache, log_file):
+    """Same as parse_one_log but only parse the part of the log that was not parsed in a previous run"""
+    return log_parse_cache.get_state(log_file, parse_log_lines, {'current_step': None, 'results': {}})['results']
+
+
+def parse_log_lines(lines, state):
     # identify the clustering step
     # identify the start end of run
     # find the count lines and extract metrics
-    results = {}
-    with open(log_file) as open_file:
-        current_step = None
-        for line in open_file:
-            sp_line = line.strip().split()
-            if len(sp_line) < 8:
-                continue
-            if sp_line[7] == 'u.a.e.e.a.c.b.l.GenericProgressListener':
-                current_step = sp_line[9].rstrip(':')
-                if current_step not in results:
-                    results[current_step] = {}
-                if len(sp_line) > 17:
-                    results[current_step]['item_written'] = sp_line[17]
-            elif sp_line[7] == 'u.a.e.eva.metrics.metric.MetricCompute' and sp_line[9] == 'Count{id=null,':
-                metric = sp_line[12].split("'")[1]
-                count = sp_line[13].split('=')[1].rstrip('}')
-                results[current_step][metric] = count
-    return results
+    # The current step is kept in the state so the parsing can carry on with the lines appended to the log
+    results = state['results']
+    for line in lines:
+        sp_line = line.strip().split()
+        if len(sp_line) < 8:
+            continue
+        if sp_line[7] == 'u.a.e.e.a.c.b.l.GenericProgressListener':
+            state['current_step'] = sp_line[9].rstrip(':')
+            if state['current_step'] not in results:
+                results[state['current_step']] = {}
+            if len(sp_line) > 17:
+                results[state['current_step']]['item_written'] = sp_line[17]
+        elif sp_line[7] == 'u.a.e.eva.metrics.metric.MetricCompute' and sp_line[9] == 'Count{id=null,':
+            metric = sp_line[12].split("'")[1]
+            count = sp_line[13].split('=')[1].rstrip('}')
+            results[state['current_step']][metric] = count
 
 steps = [
         'CLUSTERING_CLUSTERED_VARIANTS_FROM_MONGO_STEP', 'PROCESS_RS_MERGE_CANDIDATES_STEP',
@@ -154,9 +168,12 @@ def main():
                         help="base directory where all the clustering was run.", required=True)
     parser.add_argument("--output_csv", type=str,
                         help="path to the output .", required=True)
+    parser.add_argument("--cache_file", type=str, required=False,
+                        help="SQLite file where the parsing of each log is saved so the next runs only parse the "
+                             "logs that are new or have changed.")
 
     args = parser.parse_args()
-    gather_count_from_logs(args.clustering_root_path, args.output_csv)
+    gather_count_from_logs(args.clustering_root_path, args.output_csv, args.cache_file)
 
 
 if __name__ == '__main__':
@@ -6,7 +6,8 @@ from itertools import islice
 from bson import ObjectId
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
-from pymongo.read_concern import ReadConcern
+
+from tasks.common.range_scanner import RangeScanner
 
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
@@ -33,18 +34,17 @@ def find_ids_of_submitted_variant_operations(mongo_source, output_dir):
     return extract_ids_to_file(mongo_source, collections, filter_criteria, output_dir)
 
 
-def extract_ids_to_file(mongo_source, collections, filter_criteria, output_dir):
+def extract_ids_to_file(mongo_source, collections, filter_criteria, output_dir, max_workers=4):
     file_names = []
     for collection_name in collections:
         file_name = f"{output_dir}/{collection_name}_{assembly}.txt"
         file_names.append(file_name)
         logger.info(f'Searching in collections {collection_name}')
         collection = mongo_source.mongo_handle[mongo_source.db_name][collection_name]
-        cursor = collection \
-            .with_options(read_concern=ReadConcern("majority")) \
-            .find(filter_criteria, no_cursor_timeout=True)
+        scanner = RangeScanner(collection, filter_criteria, projection={'_id': 1}, max_workers=max_workers,
+                               batch_size=batch_size)
         with open(file_name, "w") as file:
-            for variant in cursor:
+            for variant in scanner.scan_documents():
                 file.write(str(variant['_id']) + '\n')
     return file_names
 
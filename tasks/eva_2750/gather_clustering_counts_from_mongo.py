@@ -10,23 +10,26 @@ from ebi_eva_common_pyutils.mongodb import MongoDatabase
 from ebi_eva_common_pyutils.config_utils import get_pg_metadata_uri_for_eva_profile
 from ebi_eva_common_pyutils.pg_utils import execute_query, get_all_results_for_query
 
+from tasks.common.log_parse_cache import LogParseCache
+
 
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
 
-def gather_count_from_mongo(clustering_dir, mongo_source, private_config_xml_file):
+def gather_count_from_mongo(clustering_dir, mongo_source, private_config_xml_file, cache_file=None):
     # Assume the directory structure:
     # clustering_dir --> <scientific_name_taxonomy_id> --> <assembly_accession> --> cluster_<date>.log_dict
 
     all_log_pattern = os.path.join(clustering_dir, '*', 'GCA_*', 'cluster_*.log')
     all_log_files = glob.glob(all_log_pattern)
-    ranges_per_assembly = get_assembly_info_and_date_ranges(all_log_files)
+    with LogParseCache(cache_file, parser_name='clustering_date_ranges') as log_parse_cache:
+        ranges_per_assembly = get_assembly_info_and_date_ranges(all_log_files, log_parse_cache)
     metrics_per_assembly = get_metrics_per_assembly(mongo_source, ranges_per_assembly)
     insert_counts_in_db(private_config_xml_file, metrics_per_assembly, ranges_per_assembly)
 
 
-def get_assembly_info_and_date_ranges(all_log_files):
+def get_assembly_info_and_date_ranges(all_log_files, log_parse_cache=None):
     """
     Parse all the log files and retrieve assembly basic information (taxonomy, scientific name) and the date ranges
     where all jobs and steps were run during the clustering process
@@ -35,7 +38,10 @@ def get_assembly_info_and_date_ranges(all_log_files):
     for log_file in all_log_files:
         logger.info('Parse log_dict file: ' + log_file)
         scientific_name, taxid, assembly_accession, log_date = parse_log_file_path(log_file)
-        log_metric_date_range = parse_one_log(log_file)
+        if log_parse_cache:
+            log_metric_date_range = parse_one_log_with_cache(log_parse_cache, log_file)
+        else:
+            log_metric_date_range = parse_one_log(log_file)
 
         if assembly_accession not in ranges_per_assembly:
             ranges_per_assembly[assembly_accession] = defaultdict(dict)
@@ -97,8 +103,8 @@ def get_metrics_per_assembly(mongo_source, ranges_per_assembly):
         new_remapped_current_rs, new_clustered_current_rs, merged_rs, split_rs, new_ss_clustered = 0, 0, 0, 0, 0
         for metric, log_dict in asm_dict['metrics'].items():
             expressions = []
-            for log_name, query_range in log_dict.items():
-                expressions.append({"createdDate": {"$gt": query_range["from"], "$lt": query_range["to"]}})
+            for date_from, date_to in merge_date_ranges(log_dict.values()):
+                expressions.append({"createdDate": {"$gt": date_from, "$lt": date_to}})
 
             date_range_filter = expressions
             if metric == 'new_remapped_current_rs':
@@ -134,6 +140,20 @@ def get_metrics_per_assembly(mongo_source, ranges_per_assembly):
     return metrics_per_assembly
 
 
+def merge_date_ranges(query_ranges):
+    """
+    Merge the overlapping date ranges so the count queries carry one expression per period of clustering rather than
+    one per log file. Ranges are exclusive of both ends so ranges that only touch are not merged.
+    """
+    merged_ranges = []
+    for query_range in sorted(query_ranges, key=lambda r: r['from']):
+        if merged_ranges and query_range['from'] < merged_ranges[-1][1]:
+            merged_ranges[-1][1] = max(merged_ranges[-1][1], query_range['to'])
+        else:
+            merged_ranges.append([query_range['from'], query_range['to']])
+    return [tuple(merged_range) for merged_range in merged_ranges]
+
+
 def query_mongo(mongo_source, filter_criteria, metric):
     total_count = 0
     for collection_name in collections[metric]:
@@ -317,41 +337,59 @@ def parse_log_file_path(log_file_path):
 
 
 def parse_one_log(log_file):
+    state = {'results': {}, 'timestamp': None}
+    with open(log_file) as open_file:
+        parse_log_lines(open_file, state)
+    return get_log_date_ranges(state)
+
+
+def parse_one_log_with_cache(log_parse_cache, log_file):
+    """Same as parse_one_log but only parse the part of the log that was not parsed in a previous run"""
+    return get_log_date_ranges(
+        log_parse_cache.get_state(log_file, parse_log_lines, {'results': {}, 'timestamp': None})
+    )
+
+
+def get_log_date_ranges(state):
+    results = state['results']
+    results["last_timestamp"] = state['timestamp']
+    return results
+
+
+def parse_log_lines(lines, state):
     # identify the clustering job/step
     # identify the start end of run
     # find the count lines and extract metrics
-    results = {}
-    with open(log_file) as open_file:
-        for line in open_file:
-            sp_line = line.strip().split()
-            if len(sp_line) < 8:
-                continue
-
-            # get last timestamp
-            try:
-                timestamp = datetime.strptime(f"{sp_line[0]}T{sp_line[1]}Z", '%Y-%m-%dT%H:%M:%S.%fZ')
-            except ValueError:
-                pass
-
-            # Jobs
-            if sp_line[7] == 'o.s.b.c.l.support.SimpleJobLauncher':
-                if sp_line[12] == "launched" or sp_line[12] == "completed":
-                    current_job = sp_line[11].rstrip(']').lstrip('[name=')
-                    job_status = sp_line[12]
-                    if current_job not in results:
-                        results[current_job] = {}
-                    if job_status not in results[current_job]:
-                        results[current_job][job_status] = {}
-                    results[current_job][job_status] = timestamp
-            # Steps
-            if sp_line[7] == 'o.s.batch.core.job.SimpleStepHandler':
-                current_step = sp_line[11].rstrip(']').lstrip('[')
-                if current_step not in results:
-                    results[current_step] = {}
-                results[current_step] = timestamp
-
-    results["last_timestamp"] = timestamp
-    return results
+    # The last timestamp is kept in the state so the parsing can carry on with the lines appended to the log
+    results = state['results']
+    for line in lines:
+        sp_line = line.strip().split()
+        if len(sp_line) < 8:
+            continue
+
+        # get last timestamp
+        try:
+            state['timestamp'] = datetime.strptime(f"{sp_line[0]}T{sp_line[1]}Z", '%Y-%m-%dT%H:%M:%S.%fZ')
+        except ValueError:
+            pass
+        timestamp = state['timestamp']
+
+        # Jobs
+        if sp_line[7] == 'o.s.b.c.l.support.SimpleJobLauncher':
+            if sp_line[12] == "launched" or sp_line[12] == "completed":
+                current_job = sp_line[11].rstrip(']').lstrip('[name=')
+                job_status = sp_line[12]
+                if current_job not in results:
+                    results[current_job] = {}
+                if job_status not in results[current_job]:
+                    results[current_job][job_status] = {}
+                results[current_job][job_status] = timestamp
+        # Steps
+        if sp_line[7] == 'o.s.batch.core.job.SimpleStepHandler':
+            current_step = sp_line[11].rstrip(']').lstrip('[')
+            if current_step not in results:
+                results[current_step] = {}
+            results[current_step] = timestamp
 
 
 def main():
@@ -365,11 +403,14 @@ def main():
                         help="Full path to the Mongo Source secrets file (ex: /path/to/mongo/source/secret)",
                         required=True)
     parser.add_argument('--private_config_xml_file', help='Path to the file containing the ', required=True)
+    parser.add_argument("--cache_file", type=str, required=False,
+                        help="SQLite file where the parsing of each log is saved so the next runs only parse the "
+                             "logs that are new or have changed.")
 
     args = parser.parse_args()
     mongo_source = MongoDatabase(uri=args.mongo_source_uri, secrets_file=args.mongo_source_secrets_file,
                                  db_name="eva_accession_sharded")
-    gather_count_from_mongo(args.clustering_root_path, mongo_source, args.private_config_xml_file)
+    gather_count_from_mongo(args.clustering_root_path, mongo_source, args.private_config_xml_file, args.cache_file)
 
 
 if __name__ == '__main__':
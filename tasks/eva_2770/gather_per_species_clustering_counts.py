@@ -1,16 +1,17 @@
 import argparse
 import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.metadata_utils import get_metadata_connection_handle
-from ebi_eva_common_pyutils.command_utils import run_command_with_output
 from ebi_eva_common_pyutils.pg_utils import get_all_results_for_query, execute_query
 
+from tasks.eva_2770.release_rs_counter import count_rs_for_species, write_assembly_combination_counts
+
 logger = logging_config.get_logger(__name__)
 logging_config.add_stdout_handler()
 
-shell_script_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bash')
-
 species_table_name = 'dbsnp_ensembl_species.release_rs_statistics_per_species'
 assembly_table_name = 'dbsnp_ensembl_species.release_rs_statistics_per_assembly'
 tracker_table_name = 'eva_progress_tracker.clustering_release_tracker'
@@ -35,93 +36,121 @@ def write_counts_to_table(private_config_xml_file, counts):
         execute_query(db_conn, insert_query)
 
 
-def get_new_ss_clustered(private_config_xml_file, release_version, taxonomy_id):
-    query = f"select new_ss_clustered from {assembly_table_name} " \
+def load_new_ss_clustered(private_config_xml_file, release_version):
+    """Returns the number of new clustered ss for each taxonomy in this release."""
+    query = f"select taxonomy_id, new_ss_clustered from {assembly_table_name} " \
             f"where release_version={release_version} " \
-            f"and taxonomy_id={taxonomy_id} " \
             f"and new_ss_clustered > 0"
     with get_metadata_connection_handle('development', private_config_xml_file) as db_conn:
         results = get_all_results_for_query(db_conn, query)
+    new_ss_clustered_per_taxonomy = defaultdict(list)
+    for taxonomy_id, new_ss_clustered in results:
+        new_ss_clustered_per_taxonomy[taxonomy_id].append(new_ss_clustered)
+    return new_ss_clustered_per_taxonomy
+
+
+def get_new_ss_clustered(new_ss_clustered_per_taxonomy, taxonomy_id):
+    results = new_ss_clustered_per_taxonomy.get(taxonomy_id, [])
     if len(results) > 1:
         raise ValueError(f'Should have exactly one assembly for taxonomy {taxonomy_id} with new clustered ss, '
                          f'instead found {len(results)}')
     elif len(results) == 0:
         logger.warning(f'No assemblies found with new clustered ss for taxonomy {taxonomy_id}')
         return 0
-    return results[0][0]
+    return results[0]
 
 
-def get_last_release_metric(private_config_xml_file, release_version, taxonomy_id, column_name):
-    query = f"select {column_name} from {species_table_name} " \
-            f"where release_version={release_version-1} " \
-            f"and taxonomy_id={taxonomy_id}"
+def load_last_release_metrics(private_config_xml_file, release_version):
+    """Returns the metrics of the previous release for each taxonomy."""
+    column_names = list(id_to_column.values())
+    query = f"select taxonomy_id, {','.join(column_names)} from {species_table_name} " \
+            f"where release_version={release_version-1}"
     with get_metadata_connection_handle('development', private_config_xml_file) as db_conn:
         results = get_all_results_for_query(db_conn, query)
-    # If this is a new species for this release, won't find anything, so just return 0
-    if len(results) < 1:
-        return 0
-    return results[0][0]
+    return dict((result[0], dict(zip(column_names, result[1:]))) for result in results)
 
 
-def get_taxonomy_and_scientific_name(private_config_xml_file, release_version, species_folder):
-    query = f"select taxonomy, scientific_name from {tracker_table_name} " \
+def load_taxonomy_and_scientific_names(private_config_xml_file, release_version):
+    """Returns the taxonomy and scientific name of each species folder released in this release."""
+    query = f"select release_folder_name, taxonomy, scientific_name from {tracker_table_name} " \
             f"where release_version={release_version} " \
-            f"and release_folder_name='{species_folder}' " \
             f"and should_be_released"
     with get_metadata_connection_handle('development', private_config_xml_file) as db_conn:
         results = get_all_results_for_query(db_conn, query)
-    if len(results) < 1:
-        logger.warning(f'Failed to get scientific name and taxonomy for {species_folder}')
-        return None, None
-    return results[0][0], results[0][1]
-
-
-def run_count_script(script_name, species_dir, metric_id):
-    log_file = f'{os.path.basename(species_dir)}_count_{metric_id}_rsid.log'
-    if not os.path.exists(log_file):
-        run_command_with_output(
-            f'Run {script_name}',
-            f'{os.path.join(shell_script_dir, script_name)} {species_dir} {metric_id}'
-        )
-    return log_file
-
-
-def gather_counts(private_config_xml_file, release_version, release_dir):
-    results = []
+    taxonomy_and_scientific_names = {}
+    for species_folder, taxonomy, scientific_name in results:
+        # Keep the first row found for a folder
+        taxonomy_and_scientific_names.setdefault(species_folder, (taxonomy, scientific_name))
+    return taxonomy_and_scientific_names
+
+
+def count_rs(species_dir, max_workers, tmp_dir):
+    """
+    Count the RS of each metric for a species and write, for each metric, the number of RS present in each combination
+    of assemblies to a log file. Metrics that already have a log file are not counted again.
+    """
+    log_files = dict(
+        (metric_id, f'{os.path.basename(species_dir)}_count_{metric_id}_rsid.log') for metric_id in id_to_column
+    )
+    metrics_to_count = [metric_id for metric_id, log_file in log_files.items() if not os.path.exists(log_file)]
+    if metrics_to_count:
+        counts_per_metric = count_rs_for_species(species_dir, metrics_to_count, max_workers, tmp_dir)
+        for metric_id, counts in counts_per_metric.items():
+            write_assembly_combination_counts(counts, log_files[metric_id])
+    return log_files
+
+
+def get_rs_totals(species_dir, max_workers, tmp_dir):
+    """Returns the number of RS of each metric for a species, keyed by column name."""
+    output_logs = count_rs(species_dir, max_workers, tmp_dir)
+    totals = {}
+    for metric_id in id_to_column.keys():
+        with open(output_logs[metric_id]) as f:
+            totals[id_to_column[metric_id]] = sum(int(l.strip().split(' ')[0]) for l in f)
+    return totals
+
+
+def gather_counts(private_config_xml_file, release_version, release_dir, max_workers=4, tmp_dir=None,
+                  species_workers=1):
+    """
+    Gather the RS statistics of all the species of a release.
+    The tracker rows, new clustered ss and previous release metrics are loaded once for all the species, then the
+    release files of species_workers species are counted concurrently, each using max_workers processes.
+    """
+    # Get data from other tables
+    taxonomy_and_scientific_names = load_taxonomy_and_scientific_names(private_config_xml_file, release_version)
+    new_ss_clustered_per_taxonomy = load_new_ss_clustered(private_config_xml_file, release_version)
+    last_release_metrics = load_last_release_metrics(private_config_xml_file, release_version)
+
+    species_results = []
     for species_dir in os.listdir(release_dir):
-        full_species_dir = os.path.join(release_dir, species_dir)
-
-        # Get data from other tables
-        taxid, sci_name = get_taxonomy_and_scientific_name(private_config_xml_file, release_version, species_dir)
+        taxid, sci_name = taxonomy_and_scientific_names.get(species_dir, (None, None))
         if not taxid or not sci_name:
+            logger.warning(f'Failed to get scientific name and taxonomy for {species_dir}')
             continue
-        new_ss_clustered = get_new_ss_clustered(private_config_xml_file, release_version, taxid)
         per_species_results = {
             'taxonomy_id': taxid,
             'scientific_name': f"'{sci_name}'",
             'release_folder': f"'{species_dir}'",
             'release_version': release_version,
-            'new_ss_clustered': new_ss_clustered
+            'new_ss_clustered': get_new_ss_clustered(new_ss_clustered_per_taxonomy, taxid)
         }
-
-        # Get metrics from release files
-        for metric_id in id_to_column.keys():
-            if metric_id in {'current', 'merged', 'multimap'}:
-                output_log = run_count_script('count_rs_for_release.sh', full_species_dir, metric_id)
-            elif metric_id in {'deprecated', 'merged_deprecated'}:
-                output_log = run_count_script('count_rs_for_release_for_txt.sh', full_species_dir, metric_id)
-            else:
-                output_log = run_count_script('count_rs_for_release_unmapped.sh', full_species_dir, metric_id)
-
-            with open(output_log) as f:
-                total = sum(int(l.strip().split(' ')[0]) for l in f)
-            per_species_results[id_to_column[metric_id]] = total
-
-            # Include diff with previous release
-            last_release_total = get_last_release_metric(private_config_xml_file, release_version, taxid, id_to_column[metric_id])
-            per_species_results[f'new_{id_to_column[metric_id]}'] = max(0, total-last_release_total)
-
-        results.append(per_species_results)
+        species_results.append((os.path.join(release_dir, species_dir), per_species_results))
+
+    # Get metrics from release files
+    with ProcessPoolExecutor(max_workers=species_workers) as executor:
+        futures = [executor.submit(get_rs_totals, full_species_dir, max_workers, tmp_dir)
+                   for full_species_dir, _ in species_results]
+        results = []
+        for future, (full_species_dir, per_species_results) in zip(futures, species_results):
+            # If this is a new species for this release, there are no metrics for the previous release
+            last_release_totals = last_release_metrics.get(per_species_results['taxonomy_id'], {})
+            for column_name, total in future.result().items():
+                per_species_results[column_name] = total
+                # Include diff with previous release
+                per_species_results[f'new_{column_name}'] = max(0, total - (last_release_totals.get(column_name) or 0))
+            logger.info(f'Gathered RS statistics for {full_species_dir}')
+            results.append(per_species_results)
     return results
 
 
@@ -132,9 +161,16 @@ def main():
                         help="base directory where all the release was run.", required=True)
     parser.add_argument("--private-config-xml-file", help="ex: /path/to/eva-maven-settings.xml", required=True)
     parser.add_argument("--release-version", type=int, help="current release version", required=True)
+    parser.add_argument("--max-workers", type=int, default=4,
+                        help="number of release files read in parallel for each species")
+    parser.add_argument("--species-workers", type=int, default=1,
+                        help="number of species counted concurrently")
+    parser.add_argument("--tmp-dir", type=str, default=None,
+                        help="directory where the sorted ids are written while counting (default: system temp dir)")
 
     args = parser.parse_args()
-    counts = gather_counts(args.private_config_xml_file, args.release_version, args.release_root_path)
+    counts = gather_counts(args.private_config_xml_file, args.release_version, args.release_root_path,
+                           args.max_workers, args.tmp_dir, args.species_workers)
     write_counts_to_table(args.private_config_xml_file, counts)
 
 
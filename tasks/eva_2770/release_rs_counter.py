@@ -0,0 +1,190 @@
+import glob
+import gzip
+import heapq
+import os
+import tempfile
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from ebi_eva_common_pyutils.logger import logging_config
+
+logger = logging_config.get_logger(__name__)
+
+# Number of ids held in memory by each reader before a sorted run is written to disk. The ids are kept in an array
+# (8 bytes per id) but sorting them temporarily needs about 40 bytes per id.
+DEFAULT_MAX_IDS_IN_MEMORY = 10000000
+READ_BLOCK_SIZE = 65536
+
+# Release file and column holding the RS id for each metric
+release_files = {
+    'current': ('{assembly}_current_ids.vcf.gz', 2),
+    'multimap': ('{assembly}_multimap_ids.vcf.gz', 2),
+    'merged': ('{assembly}_merged_ids.vcf.gz', 2),
+    'deprecated': ('{assembly}_deprecated_ids.txt.gz', 0),
+    'merged_deprecated': ('{assembly}_merged_deprecated_ids.txt.gz', 0),
+}
+
+
+def parse_rs_id(rs_id):
+    return int(rs_id[2:]) if rs_id.startswith('rs') else int(rs_id)
+
+
+def write_sorted_run(ids, tmp_dir):
+    """Sort and deduplicate the ids then write them to a temporary binary file. Returns the file path."""
+    unique_ids = array('q', (rs_id for rs_id, _ in groupby(sorted(ids))))
+    file_descriptor, run_file = tempfile.mkstemp(suffix='.ids', dir=tmp_dir)
+    with os.fdopen(file_descriptor, 'wb') as open_file:
+        unique_ids.tofile(open_file)
+    return run_file
+
+
+def read_sorted_run(run_file):
+    with open(run_file, 'rb') as open_file:
+        while True:
+            block = array('q')
+            try:
+                block.fromfile(open_file, READ_BLOCK_SIZE)
+            except EOFError:
+                # fromfile still reads the items available before raising
+                yield from block
+                return
+            yield from block
+
+
+def merge_unique(sorted_iterables):
+    """Merge sorted iterables of ids and drop the ids present in several of them."""
+    for rs_id, _ in groupby(heapq.merge(*sorted_iterables)):
+        yield rs_id
+
+
+def extract_sorted_ids(release_file, id_column, tmp_dir=None, max_ids_in_memory=DEFAULT_MAX_IDS_IN_MEMORY):
+    """
+    Stream the ids of one gzipped release file and write them sorted and deduplicated to a temporary binary file.
+    When more than max_ids_in_memory ids have been read, a sorted run is written to disk and the runs are merged at
+    the end. Returns the path of the file, which the caller must remove.
+    """
+    runs = []
+    ids = array('q')
+    with gzip.open(release_file, 'rt') as open_file:
+        for line in open_file:
+            if line.startswith('#'):
+                continue
+            ids.append(parse_rs_id(line.split()[id_column]))
+            if len(ids) >= max_ids_in_memory:
+                runs.append(write_sorted_run(ids, tmp_dir))
+                ids = array('q')
+    if not runs:
+        return write_sorted_run(ids, tmp_dir)
+    runs.append(write_sorted_run(ids, tmp_dir))
+    file_descriptor, merged_file = tempfile.mkstemp(suffix='.ids', dir=tmp_dir)
+    with os.fdopen(file_descriptor, 'wb') as open_file:
+        block = array('q')
+        for rs_id in merge_unique([read_sorted_run(run) for run in runs]):
+            block.append(rs_id)
+            if len(block) == READ_BLOCK_SIZE:
+                block.tofile(open_file)
+                block = array('q')
+        block.tofile(open_file)
+    for run in runs:
+        os.remove(run)
+    return merged_file
+
+
+def _ids_with_mask(sorted_id_file, mask):
+    for rs_id in read_sorted_run(sorted_id_file):
+        yield rs_id, mask
+
+
+def count_assembly_combinations(sorted_id_files_per_assembly):
+    """
+    Count the number of ids present in each combination of assemblies.
+    Each assembly is given a bit so the combination an id belongs to is an integer mask built while merging the
+    sorted ids of all the assemblies. Returns a Counter keyed by tuples of assemblies.
+    """
+    assemblies = sorted(sorted_id_files_per_assembly)
+    streams = []
+    for index, assembly in enumerate(assemblies):
+        for sorted_id_file in sorted_id_files_per_assembly[assembly]:
+            streams.append(_ids_with_mask(sorted_id_file, 1 << index))
+    mask_counts = Counter()
+    for rs_id, ids_with_mask in groupby(heapq.merge(*streams), key=lambda id_mask: id_mask[0]):
+        mask = 0
+        for _, assembly_mask in ids_with_mask:
+            mask |= assembly_mask
+        mask_counts[mask] += 1
+    return Counter(dict(
+        (tuple(assembly for index, assembly in enumerate(assemblies) if mask & (1 << index)), count)
+        for mask, count in mask_counts.items()
+    ))
+
+
+def get_species_release_files(species_dir, metric_ids):
+    """Returns the release files to count for each metric, grouped by assembly."""
+    files_per_metric = {}
+    for metric_id in metric_ids:
+        if metric_id == 'unmapped':
+            # Unmapped ids are not associated with an assembly
+            files_per_metric[metric_id] = {'unmapped': sorted(glob.glob(os.path.join(species_dir, '*_unmapped_ids.txt.gz')))}
+            continue
+        file_pattern, _ = release_files[metric_id]
+        files_per_metric[metric_id] = {}
+        for assembly_dir in sorted(filter(os.path.isdir, glob.glob(os.path.join(species_dir, 'GC*')))):
+            assembly = os.path.basename(assembly_dir)
+            release_file = os.path.join(assembly_dir, file_pattern.format(assembly=assembly))
+            if os.path.exists(release_file):
+                files_per_metric[metric_id][assembly] = [release_file]
+    return files_per_metric
+
+
+def _remove_sorted_id_files(futures):
+    for future in futures:
+        if future.done() and not future.cancelled() and future.exception() is None \
+                and os.path.exists(future.result()):
+            os.remove(future.result())
+
+
+def count_rs_for_species(species_dir, metric_ids, max_workers=4, tmp_dir=None,
+                         max_ids_in_memory=DEFAULT_MAX_IDS_IN_MEMORY):
+    """
+    Count the RS of each metric in the release files of a species, reading each file once.
+    The files of all the metrics and assemblies are read in parallel. Returns, for each metric, a Counter of the
+    number of RS present in each combination of assemblies.
+    """
+    files_per_metric = get_species_release_files(species_dir, metric_ids)
+    counts_per_metric = {}
+    futures_per_metric = {}
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for metric_id, files_per_assembly in files_per_metric.items():
+                id_column = 0 if metric_id == 'unmapped' else release_files[metric_id][1]
+                futures_per_metric[metric_id] = dict(
+                    (assembly, [executor.submit(extract_sorted_ids, release_file, id_column, tmp_dir,
+                                                max_ids_in_memory)
+                                for release_file in assembly_files])
+                    for assembly, assembly_files in files_per_assembly.items()
+                )
+            for metric_id, futures_per_assembly in futures_per_metric.items():
+                try:
+                    sorted_id_files_per_assembly = dict(
+                        (assembly, [future.result() for future in futures])
+                        for assembly, futures in futures_per_assembly.items()
+                    )
+                    counts_per_metric[metric_id] = count_assembly_combinations(sorted_id_files_per_assembly)
+                finally:
+                    _remove_sorted_id_files(future for futures in futures_per_assembly.values() for future in futures)
+                logger.info(f'Counted {sum(counts_per_metric[metric_id].values())} {metric_id} RS in {species_dir}')
+    finally:
+        # When a file could not be read, the sorted ids of the files of the other metrics are removed once they are
+        # written (leaving the executor waits for the files being read)
+        _remove_sorted_id_files(future for futures_per_assembly in futures_per_metric.values()
+                                for futures in futures_per_assembly.values() for future in futures)
+    return counts_per_metric
+
+
+def write_assembly_combination_counts(counts, output_file):
+    """Write the counts in the format of `uniq -c`, most frequent combinations first."""
+    with open(output_file, 'w') as open_file:
+        for assemblies, count in counts.most_common():
+            open_file.write(f"{count:>7} {' '.join(assemblies)}\n")
@@ -0,0 +1,72 @@
+import gzip
+import os
+import tempfile
+from collections import Counter
+from unittest import TestCase
+
+from tasks.eva_2770.release_rs_counter import extract_sorted_ids, read_sorted_run, count_rs_for_species, \
+    write_assembly_combination_counts
+
+
+class TestReleaseRsCounter(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.species_dir = os.path.join(self.tmp_dir.name, 'species')
+        self.work_dir = os.path.join(self.tmp_dir.name, 'work')
+        os.makedirs(self.work_dir)
+        self.write_vcf('GCA_000001.1', 'current', [5, 1, 3, 3, 9, 7])
+        self.write_vcf('GCA_000002.1', 'current', [3, 7, 11, 1])
+        self.write_vcf('GCA_000003.1', 'current', [1, 13])
+        self.write_ids(os.path.join(self.species_dir, 'species_unmapped_ids.txt.gz'), [20, 21, 20])
+        self.write_ids(os.path.join(self.species_dir, 'species_2_unmapped_ids.txt.gz'), [21, 22])
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def write_ids(path, rs_ids):
+        with gzip.open(path, 'wt') as open_file:
+            open_file.writelines(f'rs{rs_id}\tGCA_000001.1\n' for rs_id in rs_ids)
+
+    def write_vcf(self, assembly, metric, rs_ids):
+        os.makedirs(os.path.join(self.species_dir, assembly), exist_ok=True)
+        with gzip.open(os.path.join(self.species_dir, assembly, f'{assembly}_{metric}_ids.vcf.gz'), 'wt') as open_file:
+            open_file.write('##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+            open_file.writelines(f'1\t{rs_id * 10}\trs{rs_id}\tA\tT\t.\t.\t.\n' for rs_id in rs_ids)
+
+    def test_extract_sorted_ids(self):
+        vcf_file = os.path.join(self.species_dir, 'GCA_000001.1', 'GCA_000001.1_current_ids.vcf.gz')
+        # All the ids are sorted in memory, or sorted runs of 2 ids are spilled to disk and merged
+        for max_ids_in_memory in [100, 2]:
+            sorted_id_file = extract_sorted_ids(vcf_file, 2, self.work_dir, max_ids_in_memory)
+            self.assertEqual(list(read_sorted_run(sorted_id_file)), [1, 3, 5, 7, 9])
+            os.remove(sorted_id_file)
+            # The sorted runs are removed once merged
+            self.assertEqual(os.listdir(self.work_dir), [])
+
+    def test_count_rs_for_species(self):
+        for max_ids_in_memory in [100, 2]:
+            counts_per_metric = count_rs_for_species(self.species_dir, ['current', 'unmapped'], max_workers=2,
+                                                     tmp_dir=self.work_dir, max_ids_in_memory=max_ids_in_memory)
+            self.assertEqual(counts_per_metric['current'], Counter({
+                ('GCA_000001.1',): 2, ('GCA_000001.1', 'GCA_000002.1'): 2, ('GCA_000002.1',): 1,
+                ('GCA_000001.1', 'GCA_000002.1', 'GCA_000003.1'): 1, ('GCA_000003.1',): 1
+            }))
+            # The unmapped RS are counted once even when they are in several lines or files
+            self.assertEqual(counts_per_metric['unmapped'], Counter({('unmapped',): 3}))
+            self.assertEqual(os.listdir(self.work_dir), [])
+
+    def test_temporary_files_removed_on_error(self):
+        with open(os.path.join(self.species_dir, 'GCA_000003.1', 'GCA_000003.1_current_ids.vcf.gz'), 'w') as open_file:
+            open_file.write('not gzipped')
+        with self.assertRaises(OSError):
+            count_rs_for_species(self.species_dir, ['current', 'unmapped'], max_workers=2, tmp_dir=self.work_dir)
+        self.assertEqual(os.listdir(self.work_dir), [])
+
+    def test_write_assembly_combination_counts(self):
+        output_file = os.path.join(self.tmp_dir.name, 'counts.log')
+        write_assembly_combination_counts(Counter({('GCA_000001.1',): 12, ('GCA_000001.1', 'GCA_000002.1'): 1234567}),
+                                          output_file)
+        with open(output_file) as open_file:
+            self.assertEqual(open_file.read(), '1234567 GCA_000001.1 GCA_000002.1\n     12 GCA_000001.1\n')
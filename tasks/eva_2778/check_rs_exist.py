@@ -4,6 +4,8 @@ import sys
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
 from pymongo.read_concern import ReadConcern
 
+from tasks.common.range_scanner import RangeScanner
+
 
 def find_rs_entity_not_exist_in_collection(mongo_db, collection_name, rsid_list, assembly_accession):
     cve_collection = mongo_db.mongo_handle[mongo_db.db_name][collection_name]
@@ -23,19 +25,14 @@ def find_rs_entity_not_exist(mongo_db, collections, rsid_list, assembly_accessio
     return remaining_rsids
 
 
-def find_rs_references_in_ss_collection(mongo_db, collection_name, assembly_accession, batch_size=1000):
+def find_rs_references_in_ss_collection(mongo_db, collection_name, assembly_accession, batch_size=1000,
+                                        max_workers=4):
     sve_collection = mongo_db.mongo_handle[mongo_db.db_name][collection_name]
     filter_criteria = {'seq': assembly_accession, 'rs': {'$exists': True}}
     projection = {'rs': 1}
-    cursor = sve_collection.with_options(read_concern=ReadConcern("majority"))\
-                           .find(filter_criteria, projection, no_cursor_timeout=True)
-    rs_list = []
-    for record in cursor:
-        rs_list.append(record['rs'])
-        if len(rs_list) == batch_size:
-            yield rs_list
-            rs_list = []
-    yield rs_list
+    scanner = RangeScanner(sve_collection, filter_criteria, projection, max_workers=max_workers, batch_size=batch_size)
+    for records in scanner.scan_batches():
+        yield [record['rs'] for record in records]
 
 
 def check_rs_for_assembly(mongo_db, assembly_accession, batch_size):
@@ -73,7 +70,7 @@ if __name__ == '__main__':
     parser.add_argument("--mongo-db-secrets-file",
                         help="Full path to the Mongo Database secrets file (ex: /path/to/mongo/db/secret)",
                         required=True)
-    parser.add_argument("--batch_size", help="Number of SS queried in one batch", default=2000, required=False)
+    parser.add_argument("--batch_size", help="Number of SS queried in one batch", default=2000, type=int, required=False)
 
     args = parser.parse_args()
     mongo_db = MongoDatabase(uri=args.mongo_db_uri, secrets_file=args.mongo_db_secrets_file,
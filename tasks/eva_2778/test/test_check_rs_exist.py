@@ -75,11 +75,10 @@ class TestCheckRsExist(TestCase):
     def test_find_rs_references_in_ss_collection(self):
         rs_lists = find_rs_references_in_ss_collection(self.mongo_db, self.submitted_variants_collection,
                                                        'GCA_000181335.4', batch_size=5)
-        assert list(rs_lists) == [
-            [1000, 1001, 1002, 1003, 1004],
-            [1005, 1006, 1007, 1008, 1009],
-            [1010]
-        ]
+        rs_lists = list(rs_lists)
+        # The ranges of the collection are scanned concurrently so the rs are not returned in a specific order
+        assert [len(rs_list) for rs_list in rs_lists] == [5, 5, 1]
+        assert sorted(rs for rs_list in rs_lists for rs in rs_list) == list(range(1000, 1011))
 
     def test_check_rs_for_assembly(self):
         with patch('builtins.print') as mock_print:
@@ -1,34 +1,18 @@
 import argparse
-import hashlib
 import logging
+import os
 import traceback
 
 import pymongo
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
 from pymongo import WriteConcern
-from pymongo.errors import BulkWriteError
 from pymongo.read_concern import ReadConcern
 
-logger = logging_config.get_logger(__name__)
-
-
-def get_SHA1(text):
-    h = hashlib.sha1()
-    h.update(text.encode())
-    return h.hexdigest().upper()
-
+from tasks.common.id_rewrite import rewrite_document_ids
+from tasks.common.variant_hashing import get_submitted_SHA1, get_clustered_SHA1
 
-def get_submitted_SHA1(variant_rec):
-    """Calculate the SHA1 digest from the seq, study, contig, start, ref, and alt attributes of the variant"""
-    keys = ['seq', 'study', 'contig', 'start', 'ref', 'alt']
-    return get_SHA1('_'.join([str(variant_rec[key]) for key in keys]))
-
-
-def get_clustered_SHA1(variant_rec):
-    """Calculate the SHA1 digest from the asm, contig, start and type attributes of the variant"""
-    keys = ['asm', 'contig', 'start', 'type']
-    return get_SHA1('_'.join([str(variant_rec[key]) for key in keys]))
+logger = logging_config.get_logger(__name__)
 
 
 def find_documents_in_batch(mongo_source, collection_name, filter_criteria, batch_size=1000):
@@ -51,55 +35,18 @@ def find_documents_in_batch(mongo_source, collection_name, filter_criteria, batc
 
 
 def replace_document_with_correct_information(mongo_source, collection_name, id_creation_func, filter_criteria,
-                                              correction_map, batch_size):
-    collection = mongo_source.mongo_handle[mongo_source.db_name][collection_name]
+                                              correction_map, batch_size, checkpoint_file=None):
+    def apply_correction_map(variant):
+        for key in correction_map:
+            variant[key] = correction_map[key]
 
-    total_inserted, total_dropped = 0, 0
     try:
-        for batch_of_variant in find_documents_in_batch(mongo_source, collection_name, filter_criteria, batch_size):
-            insert_statements = []
-            drop_statements = []
-            for variant in batch_of_variant:
-                original_id = id_creation_func(variant)
-                assert variant['_id'] == original_id, "Original id is different from the one calculated %s != %s" % (
-                    variant['_id'], original_id)
-                for key in correction_map:
-                    variant[key] = correction_map[key]
-                variant['_id'] = id_creation_func(variant)
-                insert_statements.append(pymongo.InsertOne(variant))
-                drop_statements.append(pymongo.DeleteOne({'_id': original_id}))
-            if insert_statements and drop_statements:
-                try:
-                    result_insert = collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000))\
-                                              .bulk_write(requests=insert_statements, ordered=False)
-                    total_inserted += result_insert.inserted_count
-                    logger.debug(f'{result_insert.inserted_count} new documents inserted in {collection_name}')
-                except BulkWriteError as bulk_error:
-                    error_code_names = set([error.get('codeName') for error in bulk_error.details.get('writeErrors')])
-                    if len(error_code_names) == 1 and error_code_names.pop() == 'DuplicateKey':
-                        # This error occurs because we were able to create the entry in a previous run but not able to
-                        # remove the original variant yet
-                        total_inserted += bulk_error.details.get('nInserted')
-                        logger.debug(f"Duplicate key error found while inserting but still inserted "
-                                     f"{bulk_error.details.get('nInserted')} new documents inserted "
-                                     f"in {collection_name}")
-                    else:
-                        raise bulk_error
-
-                result_drop = collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000)) \
-                                        .bulk_write(requests=drop_statements, ordered=False)
-                total_dropped += result_drop.deleted_count
-                logger.debug(f'{result_drop.deleted_count} old documents dropped in {collection_name}')
-            else:
-                logger.warning(f'{len(insert_statements)} insert statements and {len(drop_statements)} drop statements '
-                               f'created. Skipping.')
-
-        logger.info(f'{total_inserted} new documents inserted in {collection_name}')
-        logger.info(f'{total_dropped} old documents dropped in {collection_name}')
+        counts = rewrite_document_ids(mongo_source, collection_name, filter_criteria, apply_correction_map,
+                                      id_creation_func, batch_size, checkpoint_file)
     except Exception as e:
         print(traceback.format_exc())
         raise e
-    return total_inserted
+    return counts['inserted']
 
 
 def update_operation_entities(mongo_source, collection_name, id_creation_func, filter_criteria, correction_map, batch_size):
@@ -138,7 +85,10 @@ def update_operation_entities(mongo_source, collection_name, id_creation_func, f
     return total_updated
 
 
-def replace_variant_entities(mongo_source, batch_size):
+def replace_variant_entities(mongo_source, batch_size, checkpoint_dir=None):
+    def checkpoint_file(collection, step):
+        return os.path.join(checkpoint_dir, f'{collection}_{step}.checkpoint') if checkpoint_dir else None
+
     source_asm = 'GCA_015227675.1'
     target_asm = 'GCA_015227675.2'
     source_mt = 'CM026996.1'
@@ -154,7 +104,8 @@ def replace_variant_entities(mongo_source, batch_size):
     for collection in submitted_variant_collections:
         replace_document_with_correct_information(
             mongo_source, collection, get_submitted_SHA1,
-            filter_sve_with_MT, change_sve_with_MT, batch_size
+            filter_sve_with_MT, change_sve_with_MT, batch_size,
+            checkpoint_file(collection, 'with_MT')
         )
 
     # submitted variants Not on MT chromosome
@@ -162,7 +113,8 @@ def replace_variant_entities(mongo_source, batch_size):
     for collection in submitted_variant_collections:
         replace_document_with_correct_information(
             mongo_source, collection, get_submitted_SHA1,
-            filter_sve_without_MT, change_sve_without_MT, batch_size
+            filter_sve_without_MT, change_sve_without_MT, batch_size,
+            checkpoint_file(collection, 'without_MT')
         )
 
     filter_cve_with_MT = {'asm': source_asm, 'contig': source_mt}
@@ -175,7 +127,8 @@ def replace_variant_entities(mongo_source, batch_size):
     for collection in clustered_variant_collections:
         replace_document_with_correct_information(
             mongo_source, collection, get_clustered_SHA1,
-            filter_cve_with_MT, change_cve_with_MT, batch_size
+            filter_cve_with_MT, change_cve_with_MT, batch_size,
+            checkpoint_file(collection, 'with_MT')
         )
 
     # Clustered variants Not on MT chromosome
@@ -183,7 +136,8 @@ def replace_variant_entities(mongo_source, batch_size):
     for collection in clustered_variant_collections:
         replace_document_with_correct_information(
             mongo_source, collection, get_clustered_SHA1,
-            filter_cve_without_MT, change_cve_without_MT, batch_size
+            filter_cve_without_MT, change_cve_without_MT, batch_size,
+            checkpoint_file(collection, 'without_MT')
         )
 
     filter_cvoe_with_merge_MT = {'inactiveObjects.asm': source_asm, 'inactiveObjects.contig': source_mt, 'eventType': 'MERGED'}
@@ -260,6 +214,8 @@ def main():
                         help="Full path to the Mongo Source secrets file (ex: /path/to/mongo/source/secret)",
                         required=True)
     parser.add_argument("--batch-size", help="number of document processed at once", required=False, type=int, default=1000)
+    parser.add_argument("--checkpoint-dir", help="Directory where the progress of each replacement is saved so an "
+                                                 "interrupted run can be resumed", required=False)
     parser.add_argument("--debug", help="Set the script to output debug message", default=False, action='store_true')
     args = parser.parse_args()
 
@@ -270,7 +226,7 @@ def main():
 
     mongo_source = MongoDatabase(uri=args.mongo_source_uri, secrets_file=args.mongo_source_secrets_file,
                                  db_name="eva_accession_sharded")
-    replace_variant_entities(mongo_source, batch_size=int(args.batch_size))
+    replace_variant_entities(mongo_source, batch_size=int(args.batch_size), checkpoint_dir=args.checkpoint_dir)
     del mongo_source
 
 
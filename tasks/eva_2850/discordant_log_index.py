@@ -0,0 +1,203 @@
+import os
+import sqlite3
+from collections import defaultdict
+
+from ebi_eva_common_pyutils.logger import AppLogger
+
+RS_LIST_MARKER = "RS_list ->"
+MERGE_EVENT_MARKER = "creating merge event for"
+SVE_UPDATE_MARKER = "updating submittedVariantEntity with old_rs:"
+INSERT_RS_MARKERS = ["Insert rs with new start and id", "insert rs with new start and hash :"]
+ASSEMBLY_MARKER = 'Started processing assembly :'
+CORRECT_RS_MARKER = "Correct Discordant variants for RS"
+MERGED_INTO_MARKER = "has been merged into RS"
+
+SCHEMA = """
+CREATE TABLE log_file (file_id INTEGER PRIMARY KEY, path TEXT, size INTEGER, mtime REAL);
+CREATE TABLE rs_line (rs INTEGER, file_id INTEGER, offset INTEGER);
+CREATE TABLE batch_rs (batch_id INTEGER, rs INTEGER);
+CREATE TABLE merge_event (event_id INTEGER PRIMARY KEY, merged_rs INTEGER, merged_into INTEGER, batch_id INTEGER,
+                          file_id INTEGER, offset INTEGER);
+CREATE TABLE sve_update (update_id INTEGER PRIMARY KEY, old_rs INTEGER, new_rs INTEGER);
+CREATE TABLE inserted_rs (insert_id INTEGER PRIMARY KEY, rs_hash TEXT);
+CREATE TABLE assembly_marker (marker_id INTEGER PRIMARY KEY, assembly TEXT);
+CREATE TABLE corrected_rs (marker_id INTEGER, assembly TEXT, rs INTEGER);
+CREATE TABLE merged_into_rs (merged_id INTEGER PRIMARY KEY, assembly TEXT, merged_rs INTEGER, new_rs INTEGER);
+"""
+
+
+class DiscordantLogIndex(AppLogger):
+    """
+    On-disk (SQLite) index of the logs written by fix_discordant_variants.py.
+    The log files are read once to record the batches, merge events, SVE updates, inserted RS, assembly markers and
+    the byte offset of every line mentioning an RS so that all the checks can be run as queries on the index.
+    The index is rebuilt only when the set of log files (or their size/modification time) changes.
+    """
+
+    def __init__(self, all_log_files, index_file, buffer_size=100000):
+        # Same processing order as the original checks: smallest log file first
+        self.log_files = sorted(all_log_files, key=lambda x: os.stat(x).st_size)
+        self.index_file = index_file
+        self.buffer_size = buffer_size
+        self.conn = sqlite3.connect(index_file)
+        if not self._index_is_current():
+            self.build()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _file_signatures(self):
+        return [(file_id, os.path.abspath(path), os.stat(path).st_size, os.stat(path).st_mtime)
+                for file_id, path in enumerate(self.log_files)]
+
+    def _index_is_current(self):
+        try:
+            indexed_files = self.conn.execute('SELECT file_id, path, size, mtime FROM log_file ORDER BY file_id')\
+                .fetchall()
+        except sqlite3.OperationalError:
+            return False
+        return indexed_files == self._file_signatures()
+
+    def build(self):
+        self.info(f'Building log index {self.index_file} for {len(self.log_files)} log files')
+        with self.conn:
+            for table in ['log_file', 'rs_line', 'batch_rs', 'merge_event', 'sve_update', 'inserted_rs',
+                          'assembly_marker', 'corrected_rs', 'merged_into_rs']:
+                self.conn.execute(f'DROP TABLE IF EXISTS {table}')
+            self.conn.executescript(SCHEMA)
+
+        batch_id = 0
+        marker_id = 0
+        curr_asm = ""
+        for file_id, log_file_path in enumerate(self.log_files):
+            self.info(f'Indexing {log_file_path}')
+            rs_lines = []
+            curr_batch_id = None
+            curr_batch = set()
+            offset = 0
+            with open(log_file_path, 'rb') as log_file:
+                for raw_line in log_file:
+                    line = raw_line.decode(errors='replace')
+                    line_offset = offset
+                    offset += len(raw_line)
+
+                    if RS_LIST_MARKER in line:
+                        rs_id_list = [s.replace("[", "").replace("]", "").strip()
+                                      for s in line[line.find('['):].split(",")]
+                        # only one rs in batch: the current batch stays the previous one
+                        if len(rs_id_list) == 1:
+                            continue
+                        batch_id += 1
+                        curr_batch_id = batch_id
+                        curr_batch = set(int(rs) for rs in rs_id_list)
+                        self.conn.executemany('INSERT INTO batch_rs VALUES (?, ?)',
+                                              [(batch_id, rs) for rs in curr_batch])
+                        continue
+
+                    rs_lines.extend((int(token), file_id, line_offset) for token in self._rs_tokens(line))
+                    if len(rs_lines) >= self.buffer_size:
+                        self.conn.executemany('INSERT INTO rs_line VALUES (?, ?, ?)', rs_lines)
+                        rs_lines = []
+
+                    if MERGE_EVENT_MARKER in line:
+                        merge_line = line[line.index(MERGE_EVENT_MARKER):].split(":")
+                        merged_rs = int(merge_line[1].split(" ")[1].strip())
+                        merged_into = int(merge_line[2].strip())
+                        in_same_batch = merged_rs in curr_batch and merged_into in curr_batch
+                        self.conn.execute('INSERT INTO merge_event VALUES (NULL, ?, ?, ?, ?, ?)',
+                                          (merged_rs, merged_into, curr_batch_id if in_same_batch else None,
+                                           file_id, line_offset))
+                    elif SVE_UPDATE_MARKER in line:
+                        update_line = line[line.index(SVE_UPDATE_MARKER):].split(":")
+                        old_rs = int(update_line[1].strip().split(" ")[0].strip())
+                        new_rs = int(update_line[2].strip())
+                        self.conn.execute('INSERT INTO sve_update VALUES (NULL, ?, ?)', (old_rs, new_rs))
+                    elif any(marker in line for marker in INSERT_RS_MARKERS):
+                        id_field = line[line.index("{"):].split(",")[0]
+                        rs_hash = id_field.split(":")[1].replace("'", "").strip()
+                        self.conn.execute('INSERT INTO inserted_rs VALUES (NULL, ?)', (rs_hash,))
+                    elif ASSEMBLY_MARKER in line:
+                        curr_asm = line.split(':')[1].strip()
+                        marker_id += 1
+                        self.conn.execute('INSERT INTO assembly_marker VALUES (?, ?)', (marker_id, curr_asm))
+                    elif CORRECT_RS_MARKER in line:
+                        rs = int(line[line.index(CORRECT_RS_MARKER):].split(" ")[-1].strip())
+                        self.conn.execute('INSERT INTO corrected_rs VALUES (?, ?, ?)', (marker_id, curr_asm, rs))
+                    elif MERGED_INTO_MARKER in line:
+                        rs_line = line[line.index("RS"):].split(" ")
+                        merged_rs = int(rs_line[1].strip())
+                        new_rs = int(rs_line[7].replace(".", "").strip())
+                        self.conn.execute('INSERT INTO merged_into_rs VALUES (NULL, ?, ?, ?)',
+                                          (curr_asm, merged_rs, new_rs))
+
+            self.conn.executemany('INSERT INTO rs_line VALUES (?, ?, ?)', rs_lines)
+            self.conn.commit()
+
+        with self.conn:
+            self.conn.execute('CREATE INDEX rs_line_rs ON rs_line (rs)')
+            self.conn.executemany('INSERT INTO log_file VALUES (?, ?, ?, ?)', self._file_signatures())
+        self.info(f'Finished building log index {self.index_file}')
+
+    @staticmethod
+    def _rs_tokens(line):
+        # Same tokenisation as the original grep-like search: space separated words stripped of commas
+        return set(token for token in (s.strip().replace(",", "") for s in line.split(" ")) if token.isdigit())
+
+    def get_merge_events(self):
+        """Returns (merged_rs, merged_into, in_same_batch) for every merge event in the order they were logged"""
+        return [(merged_rs, merged_into, batch_id is not None) for merged_rs, merged_into, batch_id in
+                self.conn.execute('SELECT merged_rs, merged_into, batch_id FROM merge_event ORDER BY event_id')]
+
+    def get_lines_for_rs(self, rs_list):
+        """Returns the log lines (other than the batch lists) mentioning any of the provided RS in log order"""
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS query_rs (rs INTEGER PRIMARY KEY)')
+        self.conn.execute('DELETE FROM query_rs')
+        self.conn.executemany('INSERT OR IGNORE INTO query_rs VALUES (?)', [(int(rs),) for rs in rs_list])
+        cursor = self.conn.execute('SELECT DISTINCT rs_line.file_id, rs_line.offset FROM rs_line '
+                                   'JOIN query_rs ON rs_line.rs = query_rs.rs '
+                                   'ORDER BY rs_line.file_id, rs_line.offset')
+        open_file_id, open_file = None, None
+        try:
+            for file_id, offset in cursor:
+                if file_id != open_file_id:
+                    if open_file:
+                        open_file.close()
+                    open_file_id, open_file = file_id, open(self.log_files[file_id], 'rb')
+                open_file.seek(offset)
+                yield open_file.readline().decode(errors='replace')
+        finally:
+            if open_file:
+                open_file.close()
+
+    def get_sve_updates(self):
+        """Returns (old_rs, new_rs) for every submitted variant update in log order"""
+        return self.conn.execute('SELECT old_rs, new_rs FROM sve_update ORDER BY update_id').fetchall()
+
+    def get_inserted_rs_hashes(self):
+        return [rs_hash for rs_hash, in self.conn.execute('SELECT rs_hash FROM inserted_rs ORDER BY insert_id')]
+
+    def get_corrected_rs_per_assembly(self):
+        """Returns the RS corrected for each assembly, only considering the last time each assembly was processed"""
+        asm_rs_list = {}
+        for assembly, in self.conn.execute('SELECT assembly FROM assembly_marker ORDER BY marker_id'):
+            asm_rs_list[assembly] = []
+        query = ('SELECT corrected_rs.assembly, corrected_rs.rs FROM corrected_rs '
+                 'WHERE corrected_rs.marker_id = (SELECT MAX(marker_id) FROM assembly_marker '
+                 'WHERE assembly_marker.assembly = corrected_rs.assembly) ORDER BY rowid')
+        for assembly, rs in self.conn.execute(query):
+            asm_rs_list[assembly].append(rs)
+        return asm_rs_list
+
+    def get_merged_rs_per_assembly(self):
+        """Returns {assembly: {merged_rs: new_rs}} for the RS found to be already merged while fixing each assembly"""
+        asm_rs_list = defaultdict(dict)
+        for assembly, merged_rs, new_rs in self.conn.execute(
+                'SELECT assembly, merged_rs, new_rs FROM merged_into_rs ORDER BY merged_id'):
+            asm_rs_list[assembly][merged_rs] = new_rs
+        return asm_rs_list
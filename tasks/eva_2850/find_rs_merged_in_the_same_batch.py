@@ -1,80 +1,61 @@
 import argparse
 import os
-import signal
 from collections import defaultdict
 
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.metadata_utils import get_metadata_connection_handle
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
-from ebi_eva_common_pyutils.network_utils import forward_remote_port_to_local_port, get_available_local_port
 from ebi_eva_common_pyutils.pg_utils import get_all_results_for_query
+import pymongo
 
+from tasks.common.variant_hashing import get_SHA1
+from tasks.eva_2850.discordant_log_index import DiscordantLogIndex
 from tasks.eva_2850.fix_discordant_variants import get_variants, DBSNP_SUBMITTED_VARIANT_ENTITY, \
-    EVA_SUBMITTED_VARIANT_ENTITY, merge_all_records, DBSNP_CLUSTERED_VARIANT_ENTITY, get_SHA1, \
+    EVA_SUBMITTED_VARIANT_ENTITY, merge_all_records, DBSNP_CLUSTERED_VARIANT_ENTITY, \
     DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, find_documents
+from tasks.eva_2850.merge_chain_resolver import MergeChainResolver
+from tasks.eva_2850.tempmongo_access import TempmongoPool
 
 logger = logging_config.get_logger(__name__)
 
+# All the queries of these checks are read-only so they do not need to load the primaries
+READ_PREFERENCE = pymongo.ReadPreference.SECONDARY_PREFERRED
+# Only the fields used by the checks (and needed to compute the RS hash from the SS) are retrieved
+SS_PROJECTION = {'seq': 1, 'tax': 1, 'contig': 1, 'start': 1, 'ref': 1, 'alt': 1, 'rs': 1, 'accession': 1}
+RS_PROJECTION = {'asm': 1, 'contig': 1, 'start': 1, 'type': 1, 'accession': 1, 'mapWeight': 1}
+EVENT_PROJECTION = {'accession': 1, 'mergeInto': 1, 'inactiveObjects.asm': 1}
 
-def merged_rs_ids_present_in_same_batch(all_log_files):
+
+def merged_rs_ids_present_in_same_batch(log_index):
     merged_rs_ids = {}
     merged_rs_with_further_hash_collision = []
 
-    for log_file_path in sorted(all_log_files, key=lambda x: os.stat(x).st_size):
-        with open(log_file_path, 'r') as log_file:
-            curr_rs_id_batch = []
-            for line in log_file:
-                if "RS_list ->" in line:
-                    rs_id_list = line[line.find('['):].split(",")
-                    rs_id_list = [s.replace("[", "") for s in rs_id_list]
-                    rs_id_list = [s.replace("]", "") for s in rs_id_list]
-                    rs_id_list = [s.strip() for s in rs_id_list]
-                    # only one rs in batch
-                    if len(rs_id_list) == 1:
-                        continue
-                    curr_rs_id_batch = rs_id_list
-                if "creating merge event for" in line:
-                    merged_rs = line[line.index("creating merge event for"):].split(":")[1].split(" ")[1].strip()
-                    merged_into = line[line.index("creating merge event for"):].split(":")[2].strip()
-                    # check if the variants are involved in another hash collision
-                    if merged_rs in merged_rs_ids:
-                        merged_rs_with_further_hash_collision.append(merged_rs)
-                    if merged_into in merged_rs_ids:
-                        merged_rs_with_further_hash_collision.append(merged_into)
-
-                    if merged_rs in curr_rs_id_batch and merged_into in curr_rs_id_batch:
-                        merged_rs_ids[merged_rs] = merged_into
-
-    # sundar_merged_rs_accession_set = set()
-    # sundar_merged_rs_hashes_set = set()
-    # for rs in merged_rs_ids:
-    #     sundar_merged_rs_accession_set.add(int(rs))
-    #     sundar_merged_rs_accession_set.add(int(merged_rs_ids[rs]))
-    #
-    # all_variants = get_rs_variants(mongo_source, list(sundar_merged_rs_accession_set))
-    # for accession, rs_variants  in all_variants.items():
-    #     for rs_variant in rs_variants:
-    #         sundar_merged_rs_hashes_set.add(rs_variant['_id'])
-    #
-    # print(f"Sundar merged rs accession: {sundar_merged_rs_accession_set}")
-    # print(f"Sundar merged rs hashes: {sundar_merged_rs_hashes_set}")
+    for merged_rs, merged_into, in_same_batch in log_index.get_merge_events():
+        # check if the variants are involved in another hash collision
+        if merged_rs in merged_rs_ids:
+            merged_rs_with_further_hash_collision.append(merged_rs)
+        if merged_into in merged_rs_ids:
+            merged_rs_with_further_hash_collision.append(merged_into)
+
+        if in_same_batch:
+            merged_rs_ids[merged_rs] = merged_into
 
     logger.info(f"All rs ids merged in same batch. Total=> {len(merged_rs_ids.keys())} RS=> {merged_rs_ids}")
     rs_not_involved_in_further_merge = list(set(merged_rs_ids.keys()) - set(merged_rs_with_further_hash_collision))
     logger.info(f"RS ids not involved in further merge events: {rs_not_involved_in_further_merge}")
     logger.info(f"RS ids involved in further merge events: {set(merged_rs_with_further_hash_collision)}")
 
-    # get logs for each rs involved
+    # get logs for each rs involved: the index only returns the lines mentioning one of them
+    merged_rs_for_token = defaultdict(list)
+    for rs, merged_into in merged_rs_ids.items():
+        merged_rs_for_token[str(rs)].append(rs)
+        merged_rs_for_token[str(merged_into)].append(rs)
     rs_logs = defaultdict(list)
-    for log_file_path in sorted(all_log_files, key=lambda x: os.stat(x).st_size):
-        with open(log_file_path, 'r') as log_file:
-            for line in log_file:
-                split_line = [s.strip().replace(",", "") for s in line.split(" ")]
-                if "RS_list ->" in line:
-                    continue
-                for rs in merged_rs_ids:
-                    if rs in split_line or merged_rs_ids[rs] in split_line:
-                        rs_logs[rs].append(line)
+    for line in log_index.get_lines_for_rs(merged_rs_for_token.keys()):
+        split_line = set(s.strip().replace(",", "") for s in line.split(" "))
+        matching_rs = set(rs for token in split_line & merged_rs_for_token.keys() for rs in merged_rs_for_token[token])
+        for rs in matching_rs:
+            rs_logs[rs].append(line)
 
     # print logs for each rs
     for rs, logs in rs_logs.items():
@@ -84,20 +65,9 @@ def merged_rs_ids_present_in_same_batch(all_log_files):
             print(log_line.replace("\n", ""))
 
 
-def correct_sve_with_wrong_rs(all_log_files, mongo_source, private_config_xml_file):
-    rs_list = []
-
-    # go through each of the log files and find all rs for which sve has been updated
-    for log_file_path in sorted(all_log_files, key=lambda x: os.stat(x).st_size):
-        with open(log_file_path, 'r') as log_file:
-            for line in log_file:
-                # get the new_rs from the line where sve with old_rs updated to new_rs
-                if "updating submittedVariantEntity with old_rs:" in line:
-                    # old_rs = line[line.index("updating submittedVariantEntity with old_rs:"):].split(":")[1].strip() \
-                    #     .split(" ")[0].strip()
-                    new_rs = int(
-                        line[line.index("updating submittedVariantEntity with old_rs:"):].split(":")[2].strip())
-                    rs_list.append(new_rs)
+def correct_sve_with_wrong_rs(log_index, mongo_source, private_config_xml_file, merge_cache_file=None):
+    # get all the new_rs for which sve has been updated from old_rs to new_rs
+    rs_list = [new_rs for old_rs, new_rs in log_index.get_sve_updates()]
 
     all_rs_variants = get_rs_variants(mongo_source, list(set(rs_list)))
     rs_not_found_in_db = []
@@ -141,8 +111,8 @@ def correct_sve_with_wrong_rs(all_log_files, mongo_source, private_config_xml_fi
         logger.info("Getting SVE from tempmongo")
         all_sve_from_tempmongo = get_sve_from_tempmongo(sve_for_which_cve_not_found, private_config_xml_file)
         logger.info(f"Total SVE found in tempmongo: {len(all_sve_from_tempmongo)}")
-        sve_not_found_in_tempmongo = check_sve_with_sve_for_correction(sve_for_which_cve_not_found,
-                                                                       all_sve_from_tempmongo)
+        sve_not_found_in_tempmongo = check_sve_with_sve_for_correction(mongo_source, sve_for_which_cve_not_found,
+                                                                       all_sve_from_tempmongo, merge_cache_file)
 
         if sve_not_found_in_tempmongo:
             logger.info(f"There are some sve which could not be found in tempmongo")
@@ -153,52 +123,21 @@ def correct_sve_with_wrong_rs(all_log_files, mongo_source, private_config_xml_fi
     logger.info("Finished")
 
 
-def get_sve_from_tempmongo(sve_list_for_tempmongo, private_config_xml_file):
-    tax_sve_list = defaultdict(list)
+def get_sve_from_tempmongo(sve_list_for_tempmongo, private_config_xml_file, max_workers=4):
+    tax_sve_ids = defaultdict(set)
     for sve in sve_list_for_tempmongo:
-        tax_sve_list[sve['tax']].append(sve)
+        tax_sve_ids[sve['tax']].add(sve['_id'])
 
     tax_tempmongo = get_tax_tempmongo(private_config_xml_file)
 
     sve_from_tempmongo = {}
-    for tax, sve_list_for_tax in tax_sve_list.items():
-        for tempmongo in tax_tempmongo[tax]:
-            logger.info(
-                f"Connecting to tempmongo {tempmongo} for taxonomy {tax} with sve list of len {len(sve_list_for_tax)}")
-            all_sve_ids_for_tempmongo = list(set([sve['_id'] for sve in sve_list_for_tax]))
-            sve_from_tempmongo.update(get_sve_for_taxonomy_from_tempmongo(all_sve_ids_for_tempmongo, tax, tempmongo))
+    with TempmongoPool(max_workers=max_workers) as tempmongo_pool:
+        for sve_found in tempmongo_pool.find_sve_with_ids(tax_sve_ids, tax_tempmongo):
+            sve_from_tempmongo.update(sve_found)
 
     return sve_from_tempmongo
 
 
-def get_sve_for_taxonomy_from_tempmongo(all_sve_ids_for_tempmongo, taxonomy, tempmongo_instance):
-    MONGO_PORT = 27017
-    local_forwarded_port = get_available_local_port(MONGO_PORT)
-    try:
-        logger.info("Forwarding remote MongoDB port 27017 to local port {0}...".format(local_forwarded_port))
-        port_forwarding_process_id = forward_remote_port_to_local_port(tempmongo_instance, MONGO_PORT,
-                                                                       local_forwarded_port)
-        mongo_source = MongoDatabase(uri=f"mongodb://localhost:{local_forwarded_port}/?authSource=admin",
-                                     secrets_file=None, db_name=f"acc_{taxonomy}")
-        dbsnp_sve_from_tempmongo = get_sve_variants_with_hashes(mongo_source, all_sve_ids_for_tempmongo,
-                                                                DBSNP_SUBMITTED_VARIANT_ENTITY)
-        eva_sve_from_tempmongo = get_sve_variants_with_hashes(mongo_source, all_sve_ids_for_tempmongo,
-                                                              EVA_SUBMITTED_VARIANT_ENTITY)
-        all_sve_from_tempmongo = merge_all_records(dbsnp_sve_from_tempmongo, eva_sve_from_tempmongo)
-        logger.info(
-            f"For {taxonomy} in {tempmongo_instance} retrieved a total of  {len(all_sve_from_tempmongo)} SVE")
-        return all_sve_from_tempmongo
-    finally:
-        close_mongo_port_to_tempmongo(port_forwarding_process_id)
-
-
-def close_mongo_port_to_tempmongo(port_forwarding_process_id):
-    os.kill(port_forwarding_process_id, signal.SIGTERM)
-    os.system('echo -e "Killed port forwarding from remote port with signal 1 - SIGTERM. '
-              '\\033[31;1;4mIGNORE OS MESSAGE '  # escape sequences for bold red and underlined text
-              '\'Killed by Signal 1\' in the preceding/following text\\033[0m".')
-
-
 def get_tax_tempmongo(private_config_xml_file):
     tax_tempmongo = defaultdict(list)
     with get_metadata_connection_handle('production_processing', private_config_xml_file) as pg_conn:
@@ -239,7 +178,7 @@ def check_sve_with_cve_for_correction(ss_list, all_cve_for_sve):
     return sve_for_which_cve_not_found
 
 
-def check_sve_with_sve_for_correction(ss_list, all_sve_from_tempmongo):
+def check_sve_with_sve_for_correction(mongo_source, ss_list, all_sve_from_tempmongo, merge_cache_file=None):
     sve_not_found = []
     sve_with_wrong_rs = []
     tempmongo_rs_not_found_in_db_nor_merged = []
@@ -248,51 +187,65 @@ def check_sve_with_sve_for_correction(ss_list, all_sve_from_tempmongo):
     for sve in ss_list:
         if sve['_id'] not in all_sve_from_tempmongo:
             sve_not_found.append(sve)
+        elif sve['rs'] != all_sve_from_tempmongo[sve['_id']][0]['rs']:
+            sve_with_wrong_rs.append(sve)
+
+    # Check all the RS from tempmongo and their final merged RS at once for each assembly
+    asm_tempmongo_rs = defaultdict(set)
+    for sve in sve_with_wrong_rs:
+        asm_tempmongo_rs[sve['seq']].add(all_sve_from_tempmongo[sve['_id']][0]['rs'])
+    asm_rs_in_db = {}
+    asm_final_merged_rs = {}
+    with MergeChainResolver(mongo_source, cache_file=merge_cache_file,
+                            read_preference=READ_PREFERENCE) as merge_chain_resolver:
+        for asm, rs_set in asm_tempmongo_rs.items():
+            rs_in_db = set(get_rs_variants_with_asm(mongo_source, asm, list(rs_set)).keys())
+            final_merged_rs = merge_chain_resolver.resolve(asm, rs_set - rs_in_db)
+            merged_rs_to_check = set(rs for rs in final_merged_rs.values() if rs is not None) - rs_in_db
+            rs_in_db.update(get_rs_variants_with_asm(mongo_source, asm, list(merged_rs_to_check)).keys())
+            asm_rs_in_db[asm] = rs_in_db
+            asm_final_merged_rs[asm] = final_merged_rs
+
+    for sve in sve_with_wrong_rs:
+        sve_from_tempmongo = all_sve_from_tempmongo[sve['_id']]
+        rs_from_tempmongo = sve_from_tempmongo[0]['rs']
+        print("-----------------------------------------------------------------------------------------------")
+        logger.info(f"SVE: {sve} \nSVE from Tempmongo: {sve_from_tempmongo[0]}")
+        logger.info(
+            f"SVE RS {sve['rs']} does not match with SVE RS from tempmongo {rs_from_tempmongo}")
+        print("\n")
+
+        if rs_from_tempmongo in asm_rs_in_db[sve['seq']]:
+            print("db.submittedVariantEntity.updateOne({'_id': '" + sve['_id'] + "' },{'$set': {'rs': " + str(
+                rs_from_tempmongo) + "}})")
+            print("db.dbsnpSubmittedVariantEntity.updateOne({'_id': '" + sve[
+                '_id'] + "' },{'$set': {'rs': " + str(
+                rs_from_tempmongo) + "}})")
+            print("-------------------------------------------------------------------------------------------")
         else:
-            sve_from_tempmongo = all_sve_from_tempmongo[sve['_id']]
-            rs_from_tempmongo = sve_from_tempmongo[0]['rs']
-            if sve['rs'] != rs_from_tempmongo:
-                sve_with_wrong_rs.append(sve)
-                print("-----------------------------------------------------------------------------------------------")
-                logger.info(f"SVE: {sve} \nSVE from Tempmongo: {sve_from_tempmongo[0]}")
-                logger.info(
-                    f"SVE RS {sve['rs']} does not match with SVE RS from tempmongo {rs_from_tempmongo}")
-                print("\n")
-
-                rs_from_db = get_rs_variants_with_asm(mongo_source, sve['seq'], [rs_from_tempmongo])
-
-                if rs_from_tempmongo in rs_from_db:
-                    print("db.submittedVariantEntity.updateOne({'_id': '" + sve['_id'] + "' },{'$set': {'rs': " + str(
-                        rs_from_tempmongo) + "}})")
-                    print("db.dbsnpSubmittedVariantEntity.updateOne({'_id': '" + sve[
-                        '_id'] + "' },{'$set': {'rs': " + str(
-                        rs_from_tempmongo) + "}})")
-                    print("-------------------------------------------------------------------------------------------")
+            logger.info(f"RS {rs_from_tempmongo} not present in Mongo Prod")
+            merged_rs = asm_final_merged_rs[sve['seq']][rs_from_tempmongo]
+            if merged_rs is not None:
+                logger.info(f"RS {rs_from_tempmongo} merged into RS {merged_rs}")
+                if merged_rs in asm_rs_in_db[sve['seq']]:
+                    print(
+                        "db.submittedVariantEntity.updateOne({'_id': '" + sve['_id'] + "' },{'$set': {'rs': " +
+                        str(merged_rs) + "}})")
+                    print(
+                        "db.dbsnpSubmittedVariantEntity.updateOne({'_id': '" + sve[
+                            '_id'] + "' },{'$set': {'rs': "
+                        + str(merged_rs) + "}})")
+                    print("-----------------------------------------------------------------------------------")
                 else:
-                    logger.info(f"RS {rs_from_tempmongo} not present in Mongo Prod")
-                    merged_rs = check_and_get_final_merged_rs(rs_from_tempmongo, sve['seq'])
-                    if merged_rs is not None:
-                        merged_rs_from_db = get_rs_variants_with_asm(mongo_source, sve['seq'], [merged_rs])
-                        if merged_rs in merged_rs_from_db:
-                            print(
-                                "db.submittedVariantEntity.updateOne({'_id': '" + sve['_id'] + "' },{'$set': {'rs': " +
-                                str(merged_rs) + "}})")
-                            print(
-                                "db.dbsnpSubmittedVariantEntity.updateOne({'_id': '" + sve[
-                                    '_id'] + "' },{'$set': {'rs': "
-                                + str(merged_rs) + "}})")
-                            print("-----------------------------------------------------------------------------------")
-                        else:
-                            logger.info(
-                                f"Tempmongo merged RS {merged_rs} found in merged operations but is not present in prod db")
-                            tempmongo_merged_rs_not_found_in_db.append(sve)
-                    else:
-                        logger.info(f"Tempmongo RS {rs_from_tempmongo} was not found in merged operations")
-                        tempmongo_rs_not_found_in_db_nor_merged.append(sve)
+                    logger.info(
+                        f"Tempmongo merged RS {merged_rs} found in merged operations but is not present in prod db")
+                    tempmongo_merged_rs_not_found_in_db.append(sve)
+            else:
+                logger.info(f"Tempmongo RS {rs_from_tempmongo} was not found in merged operations")
+                tempmongo_rs_not_found_in_db_nor_merged.append(sve)
 
     logger.info(f"SVE for which SVE is not found  in tempmongo: {len(sve_not_found)}")
     logger.info(f"SVE needs to be corrected: {len(sve_with_wrong_rs)}")
-    # print(f"Sundar sve hashes: {[sve['_id'] for sve in sve_with_wrong_rs]}")
     logger.info(
         f"SVE for which tempmongo RS was merged but final merged RS is no longer in db: {len(tempmongo_merged_rs_not_found_in_db)}\n"
         f"{tempmongo_merged_rs_not_found_in_db}")
@@ -303,36 +256,8 @@ def check_sve_with_sve_for_correction(ss_list, all_sve_from_tempmongo):
     return sve_not_found
 
 
-def check_and_get_final_merged_rs(org_rs, asm):
-    logger.info(f"Checking if RS {org_rs} is merged into another RS")
-    final_rs = None
-    while org_rs is not None:
-        merge_event = get_rs_merge_events_with_asm(mongo_source, [org_rs], asm)
-        if org_rs in merge_event:
-            mergedInto_rs = merge_event[org_rs][0]['mergeInto']
-            logger.info(f"RS {org_rs} merged into RS {mergedInto_rs}")
-            final_rs = mergedInto_rs
-            org_rs = mergedInto_rs
-        else:
-            break
-
-    return final_rs
-
-
-def check_if_any_newly_added_rs_has_collision_in_eva_cve(all_log_files, mongo_source):
-    inserted_rs_id_list = []
-    for log_file_path in sorted(all_log_files, key=lambda x: os.stat(x).st_size):
-        with open(log_file_path, 'r') as log_file:
-            for line in log_file:
-                if "Insert rs with new start and id" in line:
-                    id_field = line[line.index("{"):].split(",")[0]
-                    id = id_field.split(":")[1].replace("'", "").strip()
-                    inserted_rs_id_list.append(id)
-                    continue
-                if "insert rs with new start and hash :" in line:
-                    id_field = line[line.index("{"):].split(",")[0]
-                    id = id_field.split(":")[1].replace("'", "").strip()
-                    inserted_rs_id_list.append(id)
+def check_if_any_newly_added_rs_has_collision_in_eva_cve(log_index, mongo_source):
+    inserted_rs_id_list = log_index.get_inserted_rs_hashes()
 
     eva_rs_variants = get_rs_variants_with_hashes(mongo_source, inserted_rs_id_list, "clusteredVariantEntity")
     logger.info(f"No of rs ids found in eva : {len(eva_rs_variants)}")
@@ -340,18 +265,8 @@ def check_if_any_newly_added_rs_has_collision_in_eva_cve(all_log_files, mongo_so
         logger.info(f"{cve}")
 
 
-def check_if_all_processed_rs_was_supposed_to_be_processed(all_log_files, mongo_source):
-    asm_rs_list = {}
-    curr_asm = ""
-    for log_file_path in sorted(all_log_files, key=lambda x: os.stat(x).st_size):
-        with open(log_file_path, 'r') as log_file:
-            for line in log_file:
-                if 'Started processing assembly :' in line:
-                    curr_asm = line.split(':')[1].strip()
-                    asm_rs_list[curr_asm] = []
-                if "Correct Discordant variants for RS" in line:
-                    rs = line[line.index("Correct Discordant variants for RS"):].split(" ")[-1].strip()
-                    asm_rs_list[curr_asm].append(int(rs))
+def check_if_all_processed_rs_was_supposed_to_be_processed(log_index, mongo_source):
+    asm_rs_list = log_index.get_corrected_rs_per_assembly()
 
     for asm, rs_list in asm_rs_list.items():
         rs_variants = get_rs_variants_with_asm(mongo_source, asm, list(set(rs_list)))
@@ -364,20 +279,8 @@ def check_if_all_processed_rs_was_supposed_to_be_processed(all_log_files, mongo_
     logger.info("finished")
 
 
-def check_if_correct_merge_rs_was_picked(all_log_files, mongo_source):
-    asm_rs_list = defaultdict(lambda: defaultdict())
-    curr_asm = ""
-    for log_file_path in sorted(all_log_files, key=lambda x: os.stat(x).st_size):
-        with open(log_file_path, 'r') as log_file:
-            for line in log_file:
-                if 'Started processing assembly :' in line:
-                    curr_asm = line.split(':')[1].strip()
-                    continue
-                if "has been merged into RS" in line:
-                    merged_rs = line[line.index("RS"):].split(" ")[1].strip()
-                    new_rs = line[line.index("RS"):].split(" ")[7].replace(".", "").strip()
-                    # print(f"Merged RS {merged_rs}, New RS {new_rs}")
-                    asm_rs_list[curr_asm][int(merged_rs)] = int(new_rs)
+def check_if_correct_merge_rs_was_picked(log_index, mongo_source):
+    asm_rs_list = log_index.get_merged_rs_per_assembly()
 
     for asm in asm_rs_list:
         print(f"Assembly: {asm}")
@@ -445,21 +348,25 @@ def get_variant_type(sve):
 
 def get_ss_variants(mongo_source, rs_list):
     ss_filter_criteria = {'rs': {'$in': rs_list}}
-    dbsnp_ss_variants = get_variants(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, ss_filter_criteria, 'rs')
-    eva_ss_variants = get_variants(mongo_source, EVA_SUBMITTED_VARIANT_ENTITY, ss_filter_criteria, 'rs')
+    dbsnp_ss_variants = get_variants(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, ss_filter_criteria, 'rs',
+                                     SS_PROJECTION, READ_PREFERENCE)
+    eva_ss_variants = get_variants(mongo_source, EVA_SUBMITTED_VARIANT_ENTITY, ss_filter_criteria, 'rs',
+                                   SS_PROJECTION, READ_PREFERENCE)
     all_ss_variants = merge_all_records(dbsnp_ss_variants, eva_ss_variants)
     return dbsnp_ss_variants, eva_ss_variants, all_ss_variants
 
 
 def get_rs_variants_with_asm(mongo_source, assembly, rs_list):
     rs_filter_criteria = {'asm': assembly, 'accession': {'$in': rs_list}}
-    rs_variants = get_variants(mongo_source, DBSNP_CLUSTERED_VARIANT_ENTITY, rs_filter_criteria, 'accession')
+    rs_variants = get_variants(mongo_source, DBSNP_CLUSTERED_VARIANT_ENTITY, rs_filter_criteria, 'accession',
+                               RS_PROJECTION, READ_PREFERENCE)
     return rs_variants
 
 
 def get_rs_variants(mongo_source, rs_list):
     rs_filter_criteria = {'accession': {'$in': rs_list}}
-    rs_variants = get_variants(mongo_source, DBSNP_CLUSTERED_VARIANT_ENTITY, rs_filter_criteria, 'accession')
+    rs_variants = get_variants(mongo_source, DBSNP_CLUSTERED_VARIANT_ENTITY, rs_filter_criteria, 'accession',
+                               {'accession': 1}, READ_PREFERENCE)
     return rs_variants
 
 
@@ -469,15 +376,9 @@ def get_rs_merge_events(mongo_source, rs_list):
     return rs_events
 
 
-def get_rs_merge_events_with_asm(mongo_source, rs_list, asm):
-    event_filter_criteria = {'accession': {'$in': rs_list}, 'eventType': 'MERGED', "inactiveObjects.asm": asm}
-    rs_events = get_events(mongo_source, DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, event_filter_criteria)
-    return rs_events
-
-
 def get_events(mongo_source, collection_name, filter_criteria):
     records = {}
-    for event in find_documents(mongo_source, collection_name, filter_criteria):
+    for event in find_documents(mongo_source, collection_name, filter_criteria, EVENT_PROJECTION, READ_PREFERENCE):
         if event['accession'] in records:
             records[event['accession']].append(event)
         else:
@@ -488,16 +389,10 @@ def get_events(mongo_source, collection_name, filter_criteria):
 
 def get_rs_variants_with_hashes(mongo_source, rs_hash_list, collection):
     rs_filter_criteria = {'_id': {'$in': rs_hash_list}}
-    rs_variants = get_variants(mongo_source, collection, rs_filter_criteria, '_id')
+    rs_variants = get_variants(mongo_source, collection, rs_filter_criteria, '_id', RS_PROJECTION, READ_PREFERENCE)
     return rs_variants
 
 
-def get_sve_variants_with_hashes(mongo_source, sve_id_list, collection):
-    sve_filter_criteria = {'_id': {'$in': sve_id_list}}
-    sve_variants = get_variants(mongo_source, collection, sve_filter_criteria, '_id')
-    return sve_variants
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description='Find variants which are part of the same batch and involved in merge', add_help=False)
@@ -508,6 +403,10 @@ if __name__ == "__main__":
                         help="Full path to the Mongo Source secrets file (ex: /path/to/mongo/source/secret)",
                         required=True)
     parser.add_argument("--log-file-dir", help="File containing discordant rs ids", required=True)
+    parser.add_argument("--log-index-file", help="SQLite file where the index of the log files is stored and reused "
+                                                 "across runs", default='eva2850_log_index.db')
+    parser.add_argument("--merge-cache-file", help="SQLite file where the merge events already resolved are cached "
+                                                   "across runs", required=False)
     args = parser.parse_args()
 
     # there are 2 different log files
@@ -516,8 +415,10 @@ if __name__ == "__main__":
     mongo_source = MongoDatabase(uri=args.mongo_source_uri, secrets_file=args.mongo_source_secrets_file,
                                  db_name="eva_accession_sharded")
 
-    # merged_rs_ids_present_in_same_batch(all_log_files)
-    # correct_sve_with_wrong_rs(all_log_files, mongo_source, args.private_config_xml_file)
-    # check_if_any_newly_added_rs_has_collision_in_eva_cve(all_log_files, mongo_source)
-    # check_if_all_processed_rs_was_supposed_to_be_processed(all_log_files, mongo_source)
-    check_if_correct_merge_rs_was_picked(all_log_files, mongo_source)
+    # The logs are read once to build the index (or not at all if the index is up to date), then all checks query it
+    with DiscordantLogIndex(all_log_files, args.log_index_file) as log_index:
+        # merged_rs_ids_present_in_same_batch(log_index)
+        # correct_sve_with_wrong_rs(log_index, mongo_source, args.private_config_xml_file, args.merge_cache_file)
+        # check_if_any_newly_added_rs_has_collision_in_eva_cve(log_index, mongo_source)
+        # check_if_all_processed_rs_was_supposed_to_be_processed(log_index, mongo_source)
+        check_if_correct_merge_rs_was_picked(log_index, mongo_source)
@@ -1,17 +1,18 @@
 import argparse
 import copy
-import hashlib
 import os
 import traceback
 from datetime import datetime
 from itertools import islice
 
-import pymongo.read_preferences
+import pymongo
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
 from pymongo.read_concern import ReadConcern
 from pymongo.write_concern import WriteConcern
 
+from tasks.common.variant_hashing import get_clustered_SHA1, get_clustered_SHA1_for_records
+
 logging_config.add_stdout_handler()
 logger = logging_config.get_logger(__name__)
 
@@ -22,23 +23,11 @@ EVA_SUBMITTED_VARIANT_ENTITY = 'submittedVariantEntity'
 DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY = 'dbsnpClusteredVariantOperationEntity'
 EVA_CLUSTERED_VARIANT_OPERATION_ENTITY = 'clusteredVariantOperationEntity'
 
-
-def get_SHA1(text):
-    h = hashlib.sha1()
-    h.update(text.encode())
-    return h.hexdigest().upper()
-
-
-def get_submitted_SHA1(variant_rec):
-    """Calculate the SHA1 digest from the seq, study, contig, start, ref, and alt attributes of the variant"""
-    keys = ['seq', 'study', 'contig', 'start', 'ref', 'alt']
-    return get_SHA1('_'.join([str(variant_rec[key]) for key in keys]))
-
-
-def get_clustered_SHA1(variant_rec):
-    """Calculate the SHA1 digest from the asm, contig, start and type attributes of the variant"""
-    keys = ['asm', 'contig', 'start', 'type']
-    return get_SHA1('_'.join([str(variant_rec[key]) for key in keys]))
+# Maximum number of values sent in a single $in query
+IN_CHUNK_SIZE = 10000
+# Fields of the submitted variants and of the operations used to correct the discordant RS
+SS_PROJECTION = {'rs': 1, 'contig': 1, 'start': 1, 'mapWeight': 1}
+EVENT_PROJECTION = {'accession': 1, 'eventType': 1, 'mergeInto': 1, 'splitInto': 1}
 
 
 def fix_discordant_variants(mongo_source, assembly, rs_file, batch_size=1000):
@@ -59,126 +48,196 @@ def fix_discordant_variants(mongo_source, assembly, rs_file, batch_size=1000):
                 all_rs_variants = get_rs_variants(mongo_source, assembly, rs_list)
                 dbsnp_ss_variants, eva_ss_variants, all_ss_variants = get_ss_variants(mongo_source, assembly, rs_list)
                 all_events = {}
+                discordant_batch = DiscordantBatch(mongo_source, get_new_rs_hashes(all_rs_variants, all_ss_variants))
+
+                try:
+                    for rs in rs_list:
+                        logger.info(f"Started Processing RS {rs}")
+
+                        if rs not in all_rs_variants or not all_rs_variants[rs]:
+                            logger.error(f"No RS variant could be found for RS {rs}")
+
+                            if not all_events:
+                                all_events = get_rs_events(mongo_source, rs_list, assembly)
+
+                            # If no RS found in DB, check if the original RS has been merged to some other RS,
+                            # if yes, add the new RS to the list for processing
+                            if rs not in all_events:
+                                logger.error(f"No RS merge events could be found for RS {rs}")
+                                continue
+
+                            rs_events = all_events[rs]
+                            for event in rs_events:
+                                if event['accession'] == rs and event['eventType'] == 'MERGED':
+                                    merge_into_RS = event['mergeInto']
+                                    logger.error(
+                                        f"RS {rs} has been merged into RS {merge_into_RS}. Adding {merge_into_RS} to the list")
+                                    rs_list_to_process.append(merge_into_RS)
+                                    break
+                            continue
 
-                for rs in rs_list:
-                    logger.info(f"Started Processing RS {rs}")
-
-                    if rs not in all_rs_variants or not all_rs_variants[rs]:
-                        logger.error(f"No RS variant could be found for RS {rs}")
+                        rs_records = all_rs_variants[rs]
 
-                        if not all_events:
-                            all_events = get_rs_events(mongo_source, rs_list, assembly)
+                        rs_without_map_weight = get_rs_without_map_weight(rs_records)
+                        if not rs_without_map_weight:
+                            logger.error(f"All variants for {rs} are map-weighted : \n{rs_records}")
+                            continue
+                        elif len(rs_without_map_weight) > 1:
+                            logger.error(f"More than one variant without map-weight found for RS {rs} :"
+                                         f"\n {rs_without_map_weight}")
+                            continue
 
-                        # If no RS found in DB, check if the original RS has been merged to some other RS,
-                        # if yes, add the new RS to the list for processing
-                        if rs not in all_events:
-                            logger.error(f"No RS merge events could be found for RS {rs}")
+                        if rs not in all_ss_variants or not all_ss_variants[rs]:
+                            logger.error(f"No original SS record found for RS {rs}")
                             continue
 
-                        rs_events = all_events[rs]
-                        for event in rs_events:
-                            if event['accession'] == rs and event['eventType'] == 'MERGED':
-                                merge_into_RS = event['mergeInto']
-                                logger.error(
-                                    f"RS {rs} has been merged into RS {merge_into_RS}. Adding {merge_into_RS} to the list")
-                                rs_list_to_process.append(merge_into_RS)
-                                break
-                        continue
-
-                    rs_records = all_rs_variants[rs]
-
-                    rs_without_map_weight = get_rs_without_map_weight(rs_records)
-                    if not rs_without_map_weight:
-                        logger.error(f"All variants for {rs} are map-weighted : \n{rs_records}")
-                        continue
-                    elif len(rs_without_map_weight) > 1:
-                        logger.error(f"More than one variant without map-weight found for RS {rs} :"
-                                     f"\n {rs_without_map_weight}")
-                        continue
-
-                    if rs not in all_ss_variants or not all_ss_variants[rs]:
-                        logger.error(f"No original SS record found for RS {rs}")
-                        continue
-
-                    rs_variant = rs_without_map_weight[0]
-                    ss_records = all_ss_variants[rs]
-
-                    if ss_has_map_weight(ss_records):
-                        logger.error(f"RS {rs} has SS with map weight.{ss_records}")
-                        continue
-
-                    if check_all_ss_has_same_info(ss_records):
-                        if rs_variant['start'] == ss_records[0]['start']:
-                            logger.error(f"RS {rs} and original SS's Start matches. Nothing to do")
+                        rs_variant = rs_without_map_weight[0]
+                        ss_records = all_ss_variants[rs]
+
+                        if ss_has_map_weight(ss_records):
+                            logger.error(f"RS {rs} has SS with map weight.{ss_records}")
                             continue
 
-                        logger.info(f"Correct Discordant variants for RS {rs}")
-                        merged_rs, merged_into = correct_discordant_rs_and_insert_into_db(rs_variant, ss_records,
-                                                                                          assembly)
-
-                        # check if any merge has happened and
-                        # if the merged_rs and the merged_into rs are both in the same batch
-                        # if not we don't need to do anything
-                        # if yes
-                        if merged_rs is not None and merged_rs in rs_list and merged_into in rs_list:
-                            # check if the merged_rs is present later in the list (after current rs),
-                            # if yes remove it and put the RS it merged into in next batch for processing
-                            if rs_list.index(merged_rs) > rs_list.index(rs):
-                                logger.info(f"Removing rs {merged_rs} from current batch as it is merged "
-                                            f"and putting rs {merged_into} for processing in the next batch")
-                                rs_list.remove(merged_rs)
-                                rs_list_to_process.append(merged_into)
-                            # if the current RS is the one being merged and the RS it got merged into is in the same
-                            # batch later, we need to update the info associated with that merged_into RS in memory
-                            # as some of it might have changed because of the merge
-                            # The easiest to do this is just put it into the next batch
-                            else:
-                                logger.info(f"Removing rs {merged_into} from current batch "
-                                            f"as it is involved in merge event and putting it in the next batch")
-                                rs_list.remove(merged_into)
-                                rs_list_to_process.append(merged_into)
-
-                    else:
-                        logger.error(
-                            f"For RS {rs}, Not all original SS has same info. Case for Split: \nSS Records {ss_records}")
+                        if check_all_ss_has_same_info(ss_records):
+                            if rs_variant['start'] == ss_records[0]['start']:
+                                logger.error(f"RS {rs} and original SS's Start matches. Nothing to do")
+                                continue
+
+                            logger.info(f"Correct Discordant variants for RS {rs}")
+                            merged_rs, merged_into = correct_discordant_rs_and_insert_into_db(rs_variant, ss_records,
+                                                                                              assembly, discordant_batch)
+
+                            # check if any merge has happened and
+                            # if the merged_rs and the merged_into rs are both in the same batch
+                            # if not we don't need to do anything
+                            # if yes
+                            if merged_rs is not None and merged_rs in rs_list and merged_into in rs_list:
+                                # check if the merged_rs is present later in the list (after current rs),
+                                # if yes remove it and put the RS it merged into in next batch for processing
+                                if rs_list.index(merged_rs) > rs_list.index(rs):
+                                    logger.info(f"Removing rs {merged_rs} from current batch as it is merged "
+                                                f"and putting rs {merged_into} for processing in the next batch")
+                                    rs_list.remove(merged_rs)
+                                    rs_list_to_process.append(merged_into)
+                                # if the current RS is the one being merged and the RS it got merged into is in the same
+                                # batch later, we need to update the info associated with that merged_into RS in memory
+                                # as some of it might have changed because of the merge
+                                # The easiest to do this is just put it into the next batch
+                                else:
+                                    logger.info(f"Removing rs {merged_into} from current batch "
+                                                f"as it is involved in merge event and putting it in the next batch")
+                                    rs_list.remove(merged_into)
+                                    rs_list_to_process.append(merged_into)
+
+                        else:
+                            logger.error(
+                                f"For RS {rs}, Not all original SS has same info. Case for Split: \nSS Records {ss_records}")
+                finally:
+                    # All the changes of the batch need to be in the database before the next batch is read. They
+                    # are also written when an RS fails, since the changes of the previous RS are already logged.
+                    discordant_batch.flush()
 
                 rs_list = rs_list_to_process.copy()
                 rs_list_to_process.clear()
 
 
-def correct_discordant_rs_and_insert_into_db(rs_variant, ss_records, assembly):
+def get_new_rs_hashes(all_rs_variants, all_ss_variants):
+    """Hashes of the RS variants once their start is replaced with the start of their original SS"""
+    rs_with_new_start_list = []
+    for rs, rs_records in all_rs_variants.items():
+        if rs not in all_ss_variants or not all_ss_variants[rs]:
+            continue
+        for rs_variant in get_rs_without_map_weight(rs_records):
+            rs_with_new_start = copy.copy(rs_variant)
+            rs_with_new_start['start'] = all_ss_variants[rs][0]['start']
+            rs_with_new_start_list.append(rs_with_new_start)
+    return get_clustered_SHA1_for_records(rs_with_new_start_list)
+
+
+class DiscordantBatch:
+    """
+    In-memory view of the clustered variants that can collide with the corrected RS of a batch, and the writes
+    required to correct them.
+    The potential collisions are loaded with one $in query per collection, then each correction updates the view so
+    the following RS of the batch see the same state as if the writes had been made one by one.
+    The writes are kept in order and sent with one ordered bulk_write per collection when the batch is flushed.
+    """
+
+    def __init__(self, mongo_source, new_rs_hashes):
+        self.mongo_source = mongo_source
+        self.cve_per_collection = {}
+        for collection_name in [DBSNP_CLUSTERED_VARIANT_ENTITY, EVA_CLUSTERED_VARIANT_ENTITY]:
+            self.cve_per_collection[collection_name] = dict(
+                (variant['_id'], variant) for variant in
+                find_documents(mongo_source, collection_name, {'_id': {'$in': list(set(new_rs_hashes))}})
+            )
+        self.operations = dict((collection_name, []) for collection_name in [
+            DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, EVA_CLUSTERED_VARIANT_OPERATION_ENTITY,
+            DBSNP_CLUSTERED_VARIANT_ENTITY, EVA_CLUSTERED_VARIANT_ENTITY,
+            DBSNP_SUBMITTED_VARIANT_ENTITY, EVA_SUBMITTED_VARIANT_ENTITY
+        ])
+
+    def check_for_hash_collision(self, id):
+        variant_in_dbsnp = self.cve_per_collection[DBSNP_CLUSTERED_VARIANT_ENTITY].get(id)
+        variant_in_eva = self.cve_per_collection[EVA_CLUSTERED_VARIANT_ENTITY].get(id)
+        if variant_in_dbsnp and variant_in_eva:
+            raise Exception(f"CVE variant with {id}  is present in both dbsnp cve and eva cve")
+        return variant_in_dbsnp, variant_in_eva
+
+    def insert(self, collection_name, document):
+        if collection_name in self.cve_per_collection:
+            self.cve_per_collection[collection_name][document['_id']] = document
+        self.operations[collection_name].append(pymongo.InsertOne(document))
+
+    def delete(self, collection_name, ids):
+        if collection_name in self.cve_per_collection:
+            for id in ids:
+                self.cve_per_collection[collection_name].pop(id, None)
+        self.operations[collection_name].append(pymongo.DeleteMany({'_id': {'$in': ids}}))
+
+    def update_rs(self, collection_name, old_rs, new_rs, assembly):
+        self.operations[collection_name].append(
+            pymongo.UpdateMany({'rs': old_rs, 'seq': assembly}, {'$set': {'rs': new_rs}})
+        )
+
+    def flush(self):
+        for collection_name, operations in self.operations.items():
+            if not operations:
+                continue
+            collection = self.mongo_source.mongo_handle[self.mongo_source.db_name][collection_name]
+            result = collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=1200000)) \
+                .bulk_write(requests=operations, ordered=True)
+            logger.info(f"{collection_name}: {result.inserted_count} inserted, {result.deleted_count} deleted, "
+                        f"{result.modified_count} updated")
+            operations.clear()
+
+
+def correct_discordant_rs_and_insert_into_db(rs_variant, ss_records, assembly, discordant_batch):
     rs_with_new_start = copy.copy(rs_variant)
     rs_with_new_start['start'] = ss_records[0]['start']
     rs_with_new_start['_id'] = get_clustered_SHA1(rs_with_new_start)
 
-    variant_in_dbsnp, variant_in_eva = check_for_hash_collision(rs_with_new_start['_id'])
+    variant_in_dbsnp, variant_in_eva = discordant_batch.check_for_hash_collision(rs_with_new_start['_id'])
 
     if variant_in_dbsnp or variant_in_eva:
         logger.warn(f"Hash collision will occur for RS {rs_variant['accession']} "
                     f"with RS {variant_in_dbsnp['accession'] if variant_in_dbsnp else variant_in_eva['accession']}")
         return resolve_collision_and_insert_rs(rs_variant, rs_with_new_start, variant_in_dbsnp, variant_in_eva,
-                                               assembly)
+                                               assembly, discordant_batch)
     else:
         logger.info(f"No hash collision for RS {rs_variant['accession']}")
-        dbsnp_cve_collection = mongo_source.mongo_handle[mongo_source.db_name][DBSNP_CLUSTERED_VARIANT_ENTITY]
         # delete original rs
         logger.info(f"delete rs with wrong start : {rs_variant}")
-        dbsnp_cve_collection.with_options(write_concern=WriteConcern("majority")) \
-            .delete_one({'_id': rs_variant['_id']})
+        discordant_batch.delete(DBSNP_CLUSTERED_VARIANT_ENTITY, [rs_variant['_id']])
         # insert rs with new
         logger.info(f"Insert rs with new start and id(hash): {rs_with_new_start}")
-        dbsnp_cve_collection.with_options(write_concern=WriteConcern("majority")) \
-            .insert_one(rs_with_new_start)
+        discordant_batch.insert(DBSNP_CLUSTERED_VARIANT_ENTITY, rs_with_new_start)
 
         return None, None
 
 
-def resolve_collision_and_insert_rs(rs_variant, rs_with_new_start, variant_in_dbsnp, variant_in_eva, assembly):
-    dbsnp_cve_collection = mongo_source.mongo_handle[mongo_source.db_name][DBSNP_CLUSTERED_VARIANT_ENTITY]
-    dbsnp_cvoe_collection = mongo_source.mongo_handle[mongo_source.db_name][DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY]
-    eva_cve_collection = mongo_source.mongo_handle[mongo_source.db_name][EVA_CLUSTERED_VARIANT_ENTITY]
-    eva_cvoe_collection = mongo_source.mongo_handle[mongo_source.db_name][EVA_CLUSTERED_VARIANT_OPERATION_ENTITY]
-
+def resolve_collision_and_insert_rs(rs_variant, rs_with_new_start, variant_in_dbsnp, variant_in_eva, assembly,
+                                    discordant_batch):
     variant_in_db = variant_in_dbsnp if variant_in_dbsnp else variant_in_eva
 
     # For priority refer to:
@@ -186,36 +245,33 @@ def resolve_collision_and_insert_rs(rs_variant, rs_with_new_start, variant_in_db
     if rs_with_new_start['accession'] < variant_in_db['accession']:
         if variant_in_dbsnp:
             merge_event = create_merge_event(variant_in_db, rs_with_new_start)
-            dbsnp_cvoe_collection.with_options(write_concern=WriteConcern("majority")).insert_one(merge_event)
+            discordant_batch.insert(DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, merge_event)
             logger.info(
                 f"delete rs with wrong start and the one being merged: \nWrong start: {rs_variant} \nMerged: {variant_in_db}")
-            dbsnp_cve_collection.with_options(write_concern=WriteConcern("majority")) \
-                .delete_many({'_id': {'$in': [rs_variant['_id'], variant_in_db['_id']]}})
+            discordant_batch.delete(DBSNP_CLUSTERED_VARIANT_ENTITY, [rs_variant['_id'], variant_in_db['_id']])
         else:
             merge_event = create_merge_event(variant_in_db, rs_with_new_start)
-            eva_cvoe_collection.with_options(write_concern=WriteConcern("majority")).insert_one(merge_event)
+            discordant_batch.insert(EVA_CLUSTERED_VARIANT_OPERATION_ENTITY, merge_event)
             logger.info(
                 f"delete rs with wrong start and the one being merged: \nWrong start: {rs_variant} \nMerged: {variant_in_db}")
-            dbsnp_cve_collection.with_options(write_concern=WriteConcern("majority")) \
-                .delete_many({'_id': {'$in': [rs_variant['_id']]}})
-            eva_cve_collection.with_options(write_concern=WriteConcern("majority")) \
-                .delete_many({'_id': {'$in': [variant_in_db['_id']]}})
+            discordant_batch.delete(DBSNP_CLUSTERED_VARIANT_ENTITY, [rs_variant['_id']])
+            discordant_batch.delete(EVA_CLUSTERED_VARIANT_ENTITY, [variant_in_db['_id']])
 
         logger.info(f"insert rs with new start and hash : {rs_with_new_start}")
-        dbsnp_cve_collection.with_options(write_concern=WriteConcern("majority")).insert_one(rs_with_new_start)
+        discordant_batch.insert(DBSNP_CLUSTERED_VARIANT_ENTITY, rs_with_new_start)
 
-        update_ss_with_new_rs(variant_in_db['accession'], rs_with_new_start['accession'], assembly)
+        update_ss_with_new_rs(variant_in_db['accession'], rs_with_new_start['accession'], assembly, discordant_batch)
 
         return variant_in_db['accession'], rs_with_new_start['accession']
 
     else:
         merge_event = create_merge_event(rs_with_new_start, variant_in_db)
-        dbsnp_cvoe_collection.with_options(write_concern=WriteConcern("majority")).insert_one(merge_event)
+        discordant_batch.insert(DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, merge_event)
 
         logger.info(f"delete rs with wrong start: {rs_variant}")
-        dbsnp_cve_collection.with_options(write_concern=WriteConcern("majority")).delete_one({'_id': rs_variant['_id']})
+        discordant_batch.delete(DBSNP_CLUSTERED_VARIANT_ENTITY, [rs_variant['_id']])
 
-        update_ss_with_new_rs(rs_with_new_start['accession'], variant_in_db['accession'], assembly)
+        update_ss_with_new_rs(rs_with_new_start['accession'], variant_in_db['accession'], assembly, discordant_batch)
 
         return rs_with_new_start['accession'], variant_in_db['accession']
 
@@ -238,23 +294,10 @@ def create_merge_event(variant_merged, variant_retained):
     return merge_event
 
 
-def update_ss_with_new_rs(old_rs, new_rs, assembly):
-    dbsnp_sve_collection = mongo_source.mongo_handle[mongo_source.db_name][DBSNP_SUBMITTED_VARIANT_ENTITY]
-    eva_sve_collection = mongo_source.mongo_handle[mongo_source.db_name][EVA_SUBMITTED_VARIANT_ENTITY]
-
+def update_ss_with_new_rs(old_rs, new_rs, assembly, discordant_batch):
     logger.info(f"updating submittedVariantEntity with old_rs: {old_rs} to new_rs: {new_rs}")
-
-    filter_query = {'rs': old_rs, 'seq': assembly}
-    update_value = {'$set': {'rs': new_rs}}
-
-    dbsnp_sve_collection.with_options(read_concern=ReadConcern("majority"),
-                                      read_preference=pymongo.ReadPreference.PRIMARY,
-                                      write_concern=WriteConcern("majority")) \
-        .update_many(filter_query, update_value)
-    eva_sve_collection.with_options(read_concern=ReadConcern("majority"),
-                                    read_preference=pymongo.ReadPreference.PRIMARY,
-                                    write_concern=WriteConcern("majority")) \
-        .update_many(filter_query, update_value)
+    discordant_batch.update_rs(DBSNP_SUBMITTED_VARIANT_ENTITY, old_rs, new_rs, assembly)
+    discordant_batch.update_rs(EVA_SUBMITTED_VARIANT_ENTITY, old_rs, new_rs, assembly)
 
 
 def get_rs_variants(mongo_source, assembly, rs_list):
@@ -266,22 +309,25 @@ def get_rs_variants(mongo_source, assembly, rs_list):
 def get_ss_variants(mongo_source, assembly, rs_list):
     ss_filter_criteria = {'seq': assembly, 'rs': {'$in': rs_list}, '$or': [{"allelesMatch": {"$exists": False}},
                                                                            {"allelesMatch": True}]}
-    dbsnp_ss_variants = get_variants(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, ss_filter_criteria, 'rs')
-    eva_ss_variants = get_variants(mongo_source, EVA_SUBMITTED_VARIANT_ENTITY, ss_filter_criteria, 'rs')
+    dbsnp_ss_variants = get_variants(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, ss_filter_criteria, 'rs',
+                                     SS_PROJECTION)
+    eva_ss_variants = get_variants(mongo_source, EVA_SUBMITTED_VARIANT_ENTITY, ss_filter_criteria, 'rs',
+                                   SS_PROJECTION)
     all_ss_variants = merge_all_records(dbsnp_ss_variants, eva_ss_variants)
     return dbsnp_ss_variants, eva_ss_variants, all_ss_variants
 
 
 def get_rs_events(mongo_source, rs_list, asm):
     event_filter_criteria = {"inactiveObjects.asm": asm, 'accession': {'$in': rs_list}, 'eventType': 'MERGED'}
-    rs_events = get_events(mongo_source, DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, event_filter_criteria)
+    rs_events = get_events(mongo_source, DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, event_filter_criteria,
+                           EVENT_PROJECTION)
     return rs_events
 
 
-def get_events(mongo_source, collection_name, filter_criteria):
+def get_events(mongo_source, collection_name, filter_criteria, projection=None):
     records = {}
     try:
-        for event in find_documents(mongo_source, collection_name, filter_criteria):
+        for event in find_documents(mongo_source, collection_name, filter_criteria, projection):
             if event['accession'] in records:
                 records[event['accession']].append(event)
             else:
@@ -301,10 +347,11 @@ def get_events(mongo_source, collection_name, filter_criteria):
     return records
 
 
-def get_variants(mongo_source, collection_name, filter_criteria, key):
+def get_variants(mongo_source, collection_name, filter_criteria, key, projection=None,
+                 read_preference=pymongo.ReadPreference.PRIMARY):
     records = {}
     try:
-        for variant in find_documents(mongo_source, collection_name, filter_criteria):
+        for variant in find_documents(mongo_source, collection_name, filter_criteria, projection, read_preference):
             if variant[key] in records:
                 records[variant[key]].append(variant)
             else:
@@ -316,22 +363,36 @@ def get_variants(mongo_source, collection_name, filter_criteria, key):
     return records
 
 
-def find_documents(mongo_source, collection_name, filter_criteria):
+def split_in_filter(filter_criteria, chunk_size=IN_CHUNK_SIZE):
+    """Split the filter in several ones if the list of values of one of its $in is larger than chunk_size."""
+    for key, value in filter_criteria.items():
+        if isinstance(value, dict) and isinstance(value.get('$in'), list) and len(value['$in']) > chunk_size:
+            # Duplicated values would return the same documents in several chunks
+            values = list(dict.fromkeys(value['$in']))
+            for i in range(0, len(values), chunk_size):
+                yield {**filter_criteria, key: {**value, '$in': values[i:i + chunk_size]}}
+            return
+    yield filter_criteria
+
+
+def find_documents(mongo_source, collection_name, filter_criteria, projection=None,
+                   read_preference=pymongo.ReadPreference.PRIMARY):
+    """
+    Yields the documents matching the filter, with only the fields of the projection if provided.
+    Read-only diagnostics can use a secondary read preference to keep the load away from the primaries.
+    """
     collection = mongo_source.mongo_handle[mongo_source.db_name][collection_name]
-    cursor = collection.with_options(read_concern=ReadConcern("majority"),
-                                     read_preference=pymongo.ReadPreference.PRIMARY) \
-        .find(filter_criteria, no_cursor_timeout=True)
-    records = []
-    try:
-        for result in cursor:
-            records.append(result)
-    except Exception as e:
-        logger.exception(traceback.format_exc())
-        raise e
-    finally:
-        cursor.close()
-
-    return records
+    collection = collection.with_options(read_concern=ReadConcern("majority"), read_preference=read_preference)
+    for chunk_filter_criteria in split_in_filter(filter_criteria):
+        cursor = collection.find(chunk_filter_criteria, projection, no_cursor_timeout=True)
+        try:
+            for result in cursor:
+                yield result
+        except Exception as e:
+            logger.exception(traceback.format_exc())
+            raise e
+        finally:
+            cursor.close()
 
 
 def merge_all_records(dbsnp_records, eva_records):
@@ -376,22 +437,6 @@ def check_all_ss_has_same_info(ss_list):
         return True
 
 
-def check_for_hash_collision(id):
-    hash_collision_filter_criteria = {'_id': id}
-    dbsnp_collision_records = find_documents(mongo_source, DBSNP_CLUSTERED_VARIANT_ENTITY,
-                                             hash_collision_filter_criteria)
-    eva_collision_records = find_documents(mongo_source, EVA_CLUSTERED_VARIANT_ENTITY, hash_collision_filter_criteria)
-
-    if dbsnp_collision_records and not eva_collision_records:
-        return dbsnp_collision_records[0], None
-    elif not dbsnp_collision_records and eva_collision_records:
-        return None, eva_collision_records[0]
-    elif not dbsnp_collision_records and not eva_collision_records:
-        return None, None
-    else:
-        raise Exception(f"CVE variant with {id}  is present in both dbsnp cve and eva cve")
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Find discordant variants', add_help=False)
     parser.add_argument("--mongo-source-uri",
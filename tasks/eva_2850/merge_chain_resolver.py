@@ -0,0 +1,110 @@
+import sqlite3
+
+import pymongo
+from ebi_eva_common_pyutils.logger import AppLogger
+
+from tasks.eva_2850.fix_discordant_variants import DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, \
+    EVA_CLUSTERED_VARIANT_OPERATION_ENTITY, find_documents
+
+
+class MergeChainResolver(AppLogger):
+    """
+    Follow the chains of MERGED clustered variant operations to find the RS that each RS was ultimately merged into.
+    All the RS at the same depth of the chains (the frontier) are queried together with $in batches so the number of
+    round trips depends on the length of the longest chain rather than on the number of RS.
+    Each hop found can be stored in a SQLite cache so later runs do not query it again. The absence of merge is not
+    cached since the RS can be merged after the run.
+    """
+
+    def __init__(self, mongo_source, cache_file=None, batch_size=1000,
+                 collections=(DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, EVA_CLUSTERED_VARIANT_OPERATION_ENTITY),
+                 read_preference=pymongo.ReadPreference.PRIMARY):
+        self.mongo_source = mongo_source
+        self.batch_size = batch_size
+        self.read_preference = read_preference
+        # Earlier collections take precedence when an RS has merge events in several collections
+        self.collections = collections
+        self.cache = None
+        if cache_file:
+            self.cache = sqlite3.connect(cache_file)
+            self.cache.execute('CREATE TABLE IF NOT EXISTS merge_hop (assembly TEXT, rs INTEGER, merge_into INTEGER, '
+                               'PRIMARY KEY (assembly, rs))')
+
+    def close(self):
+        if self.cache:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def resolve(self, assembly, rs_list):
+        """
+        Returns a dict with the final RS each of the provided RS was merged into in the assembly.
+        RS that were never merged or that are part of a merge cycle are associated with None.
+        """
+        next_hop = {}
+        frontier = set(rs_list)
+        while frontier:
+            next_hop.update(self._get_cached_hops(assembly, frontier))
+            to_query = frontier - next_hop.keys()
+            if to_query:
+                found_hops = self._fetch_merge_hops(assembly, to_query)
+                self._cache_hops(assembly, found_hops)
+                next_hop.update((rs, found_hops.get(rs)) for rs in to_query)
+            frontier = set(next_hop[rs] for rs in frontier if next_hop[rs] is not None) - next_hop.keys()
+
+        final_rs = {}
+        for rs in rs_list:
+            final_rs[rs] = self._follow_chain(rs, next_hop)
+        return final_rs
+
+    def _follow_chain(self, rs, next_hop):
+        visited = [rs]
+        curr_rs = rs
+        while next_hop.get(curr_rs) is not None:
+            curr_rs = next_hop[curr_rs]
+            if curr_rs in visited:
+                self.error(f'Merge cycle detected for RS {rs}: {" -> ".join(str(r) for r in visited + [curr_rs])}')
+                return None
+            visited.append(curr_rs)
+        if len(visited) > 1:
+            self.debug(f'RS {rs} merged into RS {curr_rs} through {len(visited) - 1} merge events')
+            return curr_rs
+        return None
+
+    def _fetch_merge_hops(self, assembly, rs_set):
+        self.debug(f'Query merge events for {len(rs_set)} RS in {assembly}')
+        merge_hops = {}
+        rs_list = list(rs_set)
+        for collection_name in self.collections:
+            for i in range(0, len(rs_list), self.batch_size):
+                filter_criteria = {'accession': {'$in': rs_list[i:i + self.batch_size]}, 'eventType': 'MERGED',
+                                   'inactiveObjects.asm': assembly}
+                for event in find_documents(self.mongo_source, collection_name, filter_criteria,
+                                            {'accession': 1, 'mergeInto': 1}, self.read_preference):
+                    if event['accession'] not in merge_hops:
+                        merge_hops[event['accession']] = event['mergeInto']
+            rs_list = [rs for rs in rs_list if rs not in merge_hops]
+        return merge_hops
+
+    def _get_cached_hops(self, assembly, rs_set):
+        if not self.cache:
+            return {}
+        cached_hops = {}
+        rs_list = list(rs_set)
+        # Stay below the maximum number of parameters in a SQLite query
+        for i in range(0, len(rs_list), 500):
+            rs_batch = rs_list[i:i + 500]
+            query = f'SELECT rs, merge_into FROM merge_hop WHERE assembly = ? AND rs IN ({",".join("?" * len(rs_batch))})'
+            cached_hops.update(self.cache.execute(query, [assembly] + rs_batch).fetchall())
+        return cached_hops
+
+    def _cache_hops(self, assembly, hops):
+        if not self.cache:
+            return
+        with self.cache:
+            self.cache.executemany('INSERT OR REPLACE INTO merge_hop VALUES (?, ?, ?)',
+                                   [(assembly, rs, merge_into) for rs, merge_into in hops.items()])
@@ -0,0 +1,124 @@
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ebi_eva_common_pyutils.logger import AppLogger
+from ebi_eva_common_pyutils.mongodb import MongoDatabase
+from ebi_eva_common_pyutils.network_utils import forward_remote_port_to_local_port, get_available_local_port
+
+from tasks.eva_2850.fix_discordant_variants import DBSNP_SUBMITTED_VARIANT_ENTITY, EVA_SUBMITTED_VARIANT_ENTITY, \
+    merge_all_records
+
+MONGO_PORT = 27017
+
+
+def close_mongo_port_to_tempmongo(port_forwarding_process_id):
+    os.kill(port_forwarding_process_id, signal.SIGTERM)
+    os.system('echo -e "Killed port forwarding from remote port with signal 1 - SIGTERM. '
+              '\\033[31;1;4mIGNORE OS MESSAGE '  # escape sequences for bold red and underlined text
+              '\'Killed by Signal 1\' in the preceding/following text\\033[0m".')
+
+
+class TempmongoInstance(AppLogger):
+    """
+    Single port forward and Mongo client to one tempmongo host, opened on first use and shared by all the queries
+    made to this host whatever the taxonomy.
+    """
+
+    def __init__(self, host, local_port):
+        self.host = host
+        self.local_port = local_port
+        self.port_forwarding_process_id = None
+        self.mongo_db = None
+
+    def open(self):
+        if self.mongo_db is None:
+            self.info(f"Forwarding remote MongoDB port {MONGO_PORT} of {self.host} to local port {self.local_port}...")
+            self.port_forwarding_process_id = forward_remote_port_to_local_port(self.host, MONGO_PORT, self.local_port)
+            self.mongo_db = MongoDatabase(uri=f"mongodb://localhost:{self.local_port}/?authSource=admin",
+                                          secrets_file=None)
+        return self.mongo_db
+
+    def close(self):
+        if self.mongo_db is not None:
+            self.mongo_db.mongo_handle.close()
+            self.mongo_db = None
+        if self.port_forwarding_process_id is not None:
+            close_mongo_port_to_tempmongo(self.port_forwarding_process_id)
+            self.port_forwarding_process_id = None
+
+    def find_sve_with_ids(self, taxonomy, sve_ids):
+        mongo_handle = self.open().mongo_handle
+        all_sve = []
+        for collection_name in [DBSNP_SUBMITTED_VARIANT_ENTITY, EVA_SUBMITTED_VARIANT_ENTITY]:
+            records = {}
+            # Only the rs of the SVE in tempmongo is compared with the one in production
+            for sve in mongo_handle[f"acc_{taxonomy}"][collection_name].find({'_id': {'$in': sve_ids}},
+                                                                             {'seq': 1, 'accession': 1, 'rs': 1}):
+                records.setdefault(sve['_id'], []).append(sve)
+            all_sve.append(records)
+        return merge_all_records(*all_sve)
+
+
+class TempmongoPool(AppLogger):
+    """
+    Query several tempmongo instances concurrently through a bounded pool of workers.
+    Each instance is reached through one port forward and client kept open until the pool is closed and the lists of
+    ids are split in chunks so no query carries an unbounded $in.
+    """
+
+    def __init__(self, max_workers=4, chunk_size=1000):
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.instances = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for instance in self.instances.values():
+            instance.close()
+        self.instances = {}
+
+    def _get_instance(self, host):
+        # Local ports are only used once the ssh process binds them so they are reserved while creating the instances
+        with self.lock:
+            if host not in self.instances:
+                reserved_ports = set(instance.local_port for instance in self.instances.values())
+                local_port = MONGO_PORT
+                while True:
+                    local_port = get_available_local_port(local_port)
+                    if local_port not in reserved_ports:
+                        break
+                    local_port += 1
+                self.instances[host] = TempmongoInstance(host, local_port)
+            instance = self.instances[host]
+            instance.open()
+            return instance
+
+    def _query_chunk(self, host, taxonomy, sve_ids):
+        sve_from_tempmongo = self._get_instance(host).find_sve_with_ids(taxonomy, sve_ids)
+        self.debug(f"For {taxonomy} in {host} retrieved {len(sve_from_tempmongo)} SVE out of {len(sve_ids)} ids")
+        return sve_from_tempmongo
+
+    def find_sve_with_ids(self, tax_sve_ids, tax_tempmongo):
+        """
+        Search the SVE ids of each taxonomy in all the tempmongo instances of that taxonomy.
+        Yields dictionaries of SVE records keyed by id as soon as each chunk of ids has been queried.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            for taxonomy, sve_ids in tax_sve_ids.items():
+                sve_ids = list(sve_ids)
+                for host in tax_tempmongo[taxonomy]:
+                    self.info(f"Querying tempmongo {host} for taxonomy {taxonomy} with sve list of len {len(sve_ids)}")
+                    for i in range(0, len(sve_ids), self.chunk_size):
+                        futures.append(executor.submit(self._query_chunk, host, taxonomy,
+                                                       sve_ids[i:i + self.chunk_size]))
+            for future in as_completed(futures):
+                yield future.result()
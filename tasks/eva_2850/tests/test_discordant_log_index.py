@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from tasks.eva_2850.discordant_log_index import DiscordantLogIndex
+
+LOG_CONTENT = """[2022-Jun-01 10:00:00][fix_discordant_variants][INFO] 
+
+Started processing assembly : GCA_000001.1
+[2022-Jun-01 10:00:01][fix_discordant_variants][INFO] Processing Batch. Num_of_RS in batch : 3 
+RS_list -> [100, 200, 300]
+[2022-Jun-01 10:00:02][fix_discordant_variants][INFO] Started Processing RS 100
+[2022-Jun-01 10:00:02][fix_discordant_variants][INFO] Correct Discordant variants for RS 100
+[2022-Jun-01 10:00:03][fix_discordant_variants][INFO] creating merge event for accession: 200 mergeInto: 100
+[2022-Jun-01 10:00:03][fix_discordant_variants][INFO] updating submittedVariantEntity with old_rs: 200 to new_rs: 100
+[2022-Jun-01 10:00:03][fix_discordant_variants][INFO] insert rs with new start and hash : {'_id': 'AAAA', 'accession': 100, 'start': 10}
+[2022-Jun-01 10:00:04][fix_discordant_variants][INFO] Correct Discordant variants for RS 300
+[2022-Jun-01 10:00:04][fix_discordant_variants][INFO] creating merge event for accession: 300 mergeInto: 400
+[2022-Jun-01 10:00:04][fix_discordant_variants][INFO] Insert rs with new start and id(hash): {'_id': 'BBBB', 'accession': 300, 'start': 12}
+[2022-Jun-01 10:00:05][fix_discordant_variants][ERROR] RS 500 has been merged into RS 600. Adding 600 to the list
+"""
+
+
+class TestDiscordantLogIndex(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.tmp_dir, 'fix_discordant_variants.log')
+        with open(self.log_file, 'w') as open_file:
+            open_file.write(LOG_CONTENT)
+        self.index_file = os.path.join(self.tmp_dir, 'index.db')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def test_queries(self):
+        with DiscordantLogIndex([self.log_file], self.index_file) as log_index:
+            assert log_index.get_merge_events() == [(200, 100, True), (300, 400, False)]
+            assert log_index.get_sve_updates() == [(200, 100)]
+            assert log_index.get_inserted_rs_hashes() == ['AAAA', 'BBBB']
+            assert log_index.get_corrected_rs_per_assembly() == {'GCA_000001.1': [100, 300]}
+            assert log_index.get_merged_rs_per_assembly() == {'GCA_000001.1': {500: 600}}
+            lines = list(log_index.get_lines_for_rs([200]))
+            assert len(lines) == 2
+            assert all('200' in line for line in lines)
+            assert 'RS_list' not in ''.join(lines)
+
+    def test_index_is_reused_until_logs_change(self):
+        with DiscordantLogIndex([self.log_file], self.index_file) as log_index:
+            log_index.conn.execute('DELETE FROM sve_update')
+            log_index.conn.commit()
+        # Log unchanged: the existing index is reused as is
+        with DiscordantLogIndex([self.log_file], self.index_file) as log_index:
+            assert log_index.get_sve_updates() == []
+        with open(self.log_file, 'a') as open_file:
+            open_file.write('[2022-Jun-01 10:00:06][fix_discordant_variants][INFO] '
+                            'updating submittedVariantEntity with old_rs: 300 to new_rs: 400\n')
+        # Log changed: the index is rebuilt
+        with DiscordantLogIndex([self.log_file], self.index_file) as log_index:
+            assert log_index.get_sve_updates() == [(200, 100), (300, 400)]
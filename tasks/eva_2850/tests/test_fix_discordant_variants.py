@@ -0,0 +1,88 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from tasks.eva_2850.fix_discordant_variants import DiscordantBatch, get_clustered_SHA1, fix_discordant_variants, \
+    correct_discordant_rs_and_insert_into_db, DBSNP_CLUSTERED_VARIANT_ENTITY, EVA_CLUSTERED_VARIANT_ENTITY, \
+    DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, DBSNP_SUBMITTED_VARIANT_ENTITY, get_new_rs_hashes, split_in_filter
+
+
+def clustered_variant(accession, start):
+    variant = {'asm': 'GCA_000001.1', 'contig': 'CM0001.1', 'start': start, 'type': 'SNV', 'accession': accession}
+    variant['_id'] = get_clustered_SHA1(variant)
+    return variant
+
+
+class TestDiscordantBatch(TestCase):
+
+    def test_corrections_see_previous_changes_of_the_batch(self):
+        rs1 = clustered_variant(1, 100)
+        rs2 = clustered_variant(2, 200)
+        rs3 = clustered_variant(3, 300)
+        # rs1 moves to 200 where rs2 was, rs2 moves to 300 where rs3 is (in the database)
+        all_rs_variants = {1: [rs1], 2: [rs2]}
+        all_ss_variants = {1: [{'start': 200}], 2: [{'start': 300}]}
+        new_rs_hashes = get_new_rs_hashes(all_rs_variants, all_ss_variants)
+        assert new_rs_hashes == [rs2['_id'], rs3['_id']]
+
+        queried_collections = []
+
+        def find_documents(mongo_source, collection_name, filter_criteria, *args):
+            queried_collections.append(collection_name)
+            db_content = {DBSNP_CLUSTERED_VARIANT_ENTITY: [rs2, rs3], EVA_CLUSTERED_VARIANT_ENTITY: []}
+            return [v for v in db_content[collection_name] if v['_id'] in filter_criteria['_id']['$in']]
+
+        with patch('tasks.eva_2850.fix_discordant_variants.find_documents', side_effect=find_documents):
+            discordant_batch = DiscordantBatch(None, new_rs_hashes)
+        # One query per clustered variant collection for the whole batch
+        assert queried_collections == [DBSNP_CLUSTERED_VARIANT_ENTITY, EVA_CLUSTERED_VARIANT_ENTITY]
+
+        # rs2 is processed first and moves onto rs3, which is merged into rs2 (the lowest accession is kept)
+        assert correct_discordant_rs_and_insert_into_db(rs2, all_ss_variants[2], 'GCA_000001.1',
+                                                        discordant_batch) == (3, 2)
+        # rs2 was deleted from the batch view so rs1 can take its place without collision
+        assert correct_discordant_rs_and_insert_into_db(rs1, all_ss_variants[1], 'GCA_000001.1',
+                                                        discordant_batch) == (None, None)
+
+        cve_operations = discordant_batch.operations[DBSNP_CLUSTERED_VARIANT_ENTITY]
+        assert [type(op).__name__ for op in cve_operations] == ['DeleteMany', 'InsertOne', 'DeleteMany', 'InsertOne']
+        assert len(discordant_batch.operations[DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY]) == 1
+        assert len(discordant_batch.operations[DBSNP_SUBMITTED_VARIANT_ENTITY]) == 1
+        assert discordant_batch.check_for_hash_collision(rs2['_id'])[0]['accession'] == 1
+        assert discordant_batch.check_for_hash_collision(rs3['_id'])[0]['accession'] == 2
+
+
+class TestFixDiscordantVariants(TestCase):
+
+    def test_batch_flushed_when_an_rs_fails(self):
+        rs1 = clustered_variant(1, 100)
+        rs2 = clustered_variant(2, 200)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rs_file = os.path.join(tmp_dir, 'rs_list.txt')
+            with open(rs_file, 'w') as open_file:
+                open_file.write('1\n2\n')
+            with patch('tasks.eva_2850.fix_discordant_variants.get_rs_variants', return_value={1: [rs1], 2: [rs2]}), \
+                    patch('tasks.eva_2850.fix_discordant_variants.get_ss_variants',
+                          return_value=({}, {}, {1: [{'contig': 'CM0001.1', 'start': 150}],
+                                                   2: [{'contig': 'CM0001.1', 'start': 250}]})), \
+                    patch('tasks.eva_2850.fix_discordant_variants.DiscordantBatch') as discordant_batch_class, \
+                    patch('tasks.eva_2850.fix_discordant_variants.correct_discordant_rs_and_insert_into_db',
+                          side_effect=[(None, None), Exception('Cannot correct rs2')]) as correct:
+                with self.assertRaises(Exception):
+                    fix_discordant_variants(None, 'GCA_000001.1', rs_file)
+        assert correct.call_count == 2
+        # The changes queued for rs1 are written even though rs2 failed
+        discordant_batch_class.return_value.flush.assert_called_once_with()
+
+
+class TestSplitInFilter(TestCase):
+
+    def test_split_in_filter(self):
+        filter_criteria = {'asm': 'GCA_000001.1', 'accession': {'$in': [1, 2, 3, 2, 4, 5]}}
+        assert list(split_in_filter(filter_criteria, chunk_size=2)) == [
+            {'asm': 'GCA_000001.1', 'accession': {'$in': [1, 2]}},
+            {'asm': 'GCA_000001.1', 'accession': {'$in': [3, 4]}},
+            {'asm': 'GCA_000001.1', 'accession': {'$in': [5]}}
+        ]
+        assert list(split_in_filter(filter_criteria, chunk_size=10)) == [filter_criteria]
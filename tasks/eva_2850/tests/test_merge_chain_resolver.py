@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from tasks.eva_2850.fix_discordant_variants import DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, \
+    EVA_CLUSTERED_VARIANT_OPERATION_ENTITY
+from tasks.eva_2850.merge_chain_resolver import MergeChainResolver
+
+
+def merge_event(accession, merge_into, asm='GCA_000001.1'):
+    return {'accession': accession, 'mergeInto': merge_into, 'eventType': 'MERGED', 'inactiveObjects': [{'asm': asm}]}
+
+
+MERGE_EVENTS = {
+    DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY: [
+        merge_event(1, 2), merge_event(2, 3), merge_event(4, 3), merge_event(10, 11), merge_event(11, 10),
+        merge_event(20, 21, asm='GCA_000002.1')
+    ],
+    EVA_CLUSTERED_VARIANT_OPERATION_ENTITY: [merge_event(3, 5), merge_event(1, 100)]
+}
+
+
+class TestMergeChainResolver(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp()
+        self.queries = []
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+    def find_documents(self, mongo_source, collection_name, filter_criteria, *args):
+        self.queries.append((collection_name, sorted(filter_criteria['accession']['$in'])))
+        return [event for event in MERGE_EVENTS[collection_name]
+                if event['accession'] in filter_criteria['accession']['$in']
+                and event['inactiveObjects'][0]['asm'] == filter_criteria['inactiveObjects.asm']]
+
+    def test_resolve(self):
+        with patch('tasks.eva_2850.merge_chain_resolver.find_documents', side_effect=self.find_documents):
+            with MergeChainResolver(None) as resolver:
+                final_rs = resolver.resolve('GCA_000001.1', [1, 4, 6, 10, 20])
+        # dbsnp events take precedence over eva ones, chains are followed across collections
+        assert final_rs == {1: 5, 4: 5, 6: None, 10: None, 20: None}
+        # One query per collection for each depth of the chains
+        assert self.queries[:2] == [(DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, [1, 4, 6, 10, 20]),
+                                    (EVA_CLUSTERED_VARIANT_OPERATION_ENTITY, [6, 20])]
+        assert len(self.queries) == 6
+
+    def test_resolve_with_cache(self):
+        cache_file = os.path.join(self.tmp_dir, 'merge_cache.db')
+        with patch('tasks.eva_2850.merge_chain_resolver.find_documents', side_effect=self.find_documents):
+            with MergeChainResolver(None, cache_file=cache_file) as resolver:
+                assert resolver.resolve('GCA_000001.1', [1, 6]) == {1: 5, 6: None}
+            self.queries.clear()
+            with MergeChainResolver(None, cache_file=cache_file) as resolver:
+                assert resolver.resolve('GCA_000001.1', [1, 4, 6]) == {1: 5, 4: 5, 6: None}
+        # The merges of RS 1 are cached, RS 4 was not resolved in the previous run and the RS without merge (6 and the
+        # end of the chain 5) are queried again
+        assert self.queries == [(DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, [4, 6]),
+                                (EVA_CLUSTERED_VARIANT_OPERATION_ENTITY, [6]),
+                                (DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY, [5]),
+                                (EVA_CLUSTERED_VARIANT_OPERATION_ENTITY, [5])]
+
+    def test_merge_after_cached_run(self):
+        cache_file = os.path.join(self.tmp_dir, 'merge_cache.db')
+        with patch('tasks.eva_2850.merge_chain_resolver.find_documents', side_effect=self.find_documents):
+            with MergeChainResolver(None, cache_file=cache_file) as resolver:
+                assert resolver.resolve('GCA_000001.1', [6]) == {6: None}
+            # RS 6 is merged after the first run
+            dbsnp_events = MERGE_EVENTS[DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY] + [merge_event(6, 7)]
+            with patch.dict(MERGE_EVENTS, {DBSNP_CLUSTERED_VARIANT_OPERATION_ENTITY: dbsnp_events}):
+                with MergeChainResolver(None, cache_file=cache_file) as resolver:
+                    assert resolver.resolve('GCA_000001.1', [6]) == {6: 7}
@@ -0,0 +1,39 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from tasks.eva_2850.tempmongo_access import TempmongoPool, TempmongoInstance
+
+
+class TestTempmongoPool(TestCase):
+
+    def test_find_sve_with_ids(self):
+        queried_chunks = []
+        opened_instances = []
+
+        def find_sve_with_ids(instance, taxonomy, sve_ids):
+            queried_chunks.append((instance.host, taxonomy, sve_ids))
+            # each host only knows about the ids ending with its name
+            return dict((sve_id, [{'_id': sve_id, 'host': instance.host}]) for sve_id in sve_ids
+                        if sve_id.endswith(instance.host))
+
+        def open_instance(instance):
+            opened_instances.append(instance)
+
+        tax_sve_ids = {1: ['ss1_a', 'ss2_b', 'ss3_a'], 2: ['ss4_b', 'ss5_c']}
+        tax_tempmongo = {1: ['a', 'b'], 2: ['b']}
+        with patch.object(TempmongoInstance, 'find_sve_with_ids', new=find_sve_with_ids), \
+                patch.object(TempmongoInstance, 'open', new=open_instance), \
+                patch('tasks.eva_2850.tempmongo_access.get_available_local_port', side_effect=lambda port: port):
+            with patch.object(TempmongoInstance, 'close'):
+                with TempmongoPool(max_workers=3, chunk_size=2) as pool:
+                    results = {}
+                    for sve_found in pool.find_sve_with_ids(tax_sve_ids, tax_tempmongo):
+                        results.update(sve_found)
+                    # One instance per host with a distinct local port
+                    assert sorted(pool.instances) == ['a', 'b']
+                    assert len(set(instance.local_port for instance in pool.instances.values())) == 2
+
+        assert sorted(results) == ['ss1_a', 'ss2_b', 'ss3_a', 'ss4_b']
+        # ids are queried in chunks of at most 2
+        assert len(queried_chunks) == 5
+        assert all(len(sve_ids) <= 2 for _, _, sve_ids in queried_chunks)
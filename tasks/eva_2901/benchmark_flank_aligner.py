@@ -0,0 +1,92 @@
+import argparse
+import random
+import timeit
+from itertools import combinations
+
+from Bio import pairwise2
+from ebi_eva_common_pyutils.logger import logging_config
+
+from tasks.eva_2901.flank_aligner import FlankAligner, revcomp
+
+logger = logging_config.get_logger(__name__)
+logging_config.add_stdout_handler()
+
+
+def pairwise2_compare_variant_flanks(sequence1, sequence2):
+    # Alignment previously used in check_submitted_variant_flanks
+    alignment1 = pairwise2.align.globalms(sequence1, sequence2, 1, -3, -10, -10, one_alignment_only=True)[0]
+    alignment2 = pairwise2.align.globalms(sequence1, revcomp(sequence2), 1, -3, -10, -10, one_alignment_only=True)[0]
+    if alignment2.score > alignment1.score:
+        return alignment2, '-'
+    return alignment1, '+'
+
+
+def mutate(sequence, num_snps, num_indels):
+    sequence = list(sequence)
+    for _ in range(num_snps):
+        position = random.randrange(len(sequence))
+        sequence[position] = random.choice('ACGT'.replace(sequence[position], ''))
+    for _ in range(num_indels):
+        position = random.randrange(len(sequence))
+        if random.random() < 0.5:
+            del sequence[position]
+        else:
+            sequence.insert(position, random.choice('ACGT'))
+    return ''.join(sequence)
+
+
+def generate_flanks_per_ssid(num_ssids, flank_size, num_variants):
+    """
+    Flanks of the variants of each ss on different assemblies: most are identical or differ by a few substitutions
+    and indels, some are on the opposite strand and a few come from unrelated regions.
+    """
+    random.seed(42)
+    flanks_per_ssid = {}
+    for ssid in range(num_ssids):
+        sequence = ''.join(random.choice('ACGT') for _ in range(2 * flank_size + 1))
+        flanks = [sequence]
+        for _ in range(num_variants - 1):
+            draw = random.random()
+            if draw < 0.4:
+                flank = sequence
+            elif draw < 0.9:
+                flank = mutate(sequence, random.randint(1, 4), random.choice([0, 0, 0, 1, 2]))
+            else:
+                flank = ''.join(random.choice('ACGT') for _ in range(2 * flank_size + 1))
+            flanks.append(revcomp(flank) if random.random() < 0.2 else flank)
+        flanks_per_ssid[ssid] = flanks
+    return flanks_per_ssid
+
+
+def benchmark(num_ssids, flank_size, num_variants, num_processes_list, repeat):
+    flanks_per_ssid = generate_flanks_per_ssid(num_ssids, flank_size, num_variants)
+    pairs = [pair for flanks in flanks_per_ssid.values() for pair in combinations(flanks, 2)]
+
+    expected_alignments = [pairwise2_compare_variant_flanks(*pair) for pair in pairs]
+    pairwise2_time = min(timeit.repeat(lambda: [pairwise2_compare_variant_flanks(*pair) for pair in pairs],
+                                       number=1, repeat=repeat))
+    logger.info(f'pairwise2: {len(pairs)} pairs in {pairwise2_time:.2f}s')
+    for num_processes in num_processes_list:
+        with FlankAligner(num_processes) as flank_aligner:
+            alignments_per_ssid = flank_aligner.align_sequences_per_ssid(flanks_per_ssid)
+            alignments = [alignment for ssid_alignments in alignments_per_ssid.values() for alignment in ssid_alignments]
+            assert [(alignment.score, strand) for alignment, strand in alignments] == \
+                   [(alignment.score, strand) for alignment, strand in expected_alignments], \
+                f'Alignments with {num_processes} processes differ from pairwise2'
+            aligner_time = min(timeit.repeat(lambda: flank_aligner.align_sequences_per_ssid(flanks_per_ssid),
+                                             number=1, repeat=repeat))
+        logger.info(f'FlankAligner with {num_processes} processes: {len(pairs)} pairs in {aligner_time:.2f}s '
+                    f'({pairwise2_time / aligner_time:.1f}x)')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the pairwise2 and FlankAligner alignments of variant flanks')
+    parser.add_argument("--num-ssids", help="Number of random ss to align", type=int, default=2000)
+    parser.add_argument("--flank-size", help="Size of the flanks on each side of the variant", type=int, default=50)
+    parser.add_argument("--num-variants", help="Number of variants per ss", type=int, default=3)
+    parser.add_argument("--num-processes", help="Number of processes to use with FlankAligner",
+                        type=int, nargs='+', default=[1, 4])
+    parser.add_argument("--repeat", help="Number of time each method is run (the best run is reported)",
+                        type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.num_ssids, args.flank_size, args.num_variants, args.num_processes, args.repeat)
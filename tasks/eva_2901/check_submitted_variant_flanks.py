@@ -3,27 +3,27 @@ import os
 import sys
 
 import itertools
+from collections import defaultdict
 
-from Bio import pairwise2
-from Bio.Seq import Seq
-from ebi_eva_common_pyutils.command_utils import run_command_with_output
 from ebi_eva_common_pyutils.config import cfg
 from ebi_eva_common_pyutils.config_utils import get_primary_mongo_creds_for_profile
-from ebi_eva_common_pyutils.taxonomy.taxonomy import get_scientific_name_from_ensembl
 from pymongo import MongoClient
 
-cache = {'scientific_name_from_taxonomy': {}}
+from tasks.common.metadata_client import MetadataClient
+from tasks.common.reference_sequence import ReferenceSequenceCache
+from tasks.eva_2901.flank_aligner import FlankAligner, revcomp
 
+SVE_PROJECTION = {'accession': 1, 'seq': 1, 'tax': 1, 'contig': 1, 'start': 1, 'ref': 1, 'alt': 1}
 
-def revcomp(seq):
-    return str(Seq(seq).reverse_complement())
+# Replaced in main with a client using the cache file provided
+metadata_client = MetadataClient()
 
 
 def get_scientific_name_from_taxonomy(taxonomy):
-    if taxonomy not in cache['scientific_name_from_taxonomy']:
-        species_scientific_name = get_scientific_name_from_ensembl(taxonomy)
-        cache['scientific_name_from_taxonomy'][taxonomy] =species_scientific_name
-    return cache['scientific_name_from_taxonomy'][taxonomy]
+    species_scientific_name = metadata_client.get_ensembl_scientific_names([taxonomy]).get(str(taxonomy))
+    if not species_scientific_name:
+        raise Exception("Scientific name could not be found for taxonomy {0} using the Ensembl API".format(taxonomy))
+    return species_scientific_name
 
 
 def get_genome(taxonomy, assembly_accession):
@@ -34,21 +34,6 @@ def get_genome(taxonomy, assembly_accession):
     )
 
 
-def compare_variant_flanks(sequence1, sequence2):
-    alignments1 = pairwise2.align.globalms(sequence1, sequence2, 1, -3, -10, -10, one_alignment_only=True)
-    alignments2 = pairwise2.align.globalms(sequence1, revcomp(sequence2), 1, -3, -10, -10, one_alignment_only=True)
-
-    if alignments1 and alignments2:
-        if alignments2[0].score > alignments1[0].score:
-            return alignments2[0], '-'
-        else:
-            return alignments1[0], '+'
-    elif alignments1:
-        return alignments1, '+'
-    elif alignments2:
-        return alignments2, '-'
-
-
 def format_output(ssid, variant1, variant2, alignment, strand, flank_up1, flank_down1, flank_up2, flank_down2):
     ref1 = ' '.join((flank_up1, variant1['ref'], flank_down1))
     ref_bases = variant2['ref'] if strand == '+' else revcomp(variant2['ref'])
@@ -65,34 +50,76 @@ def format_output(ssid, variant1, variant2, alignment, strand, flank_up1, flank_
     return '\t'.join([str(s) for s in out])
 
 
-def check_submitted_variant_flanks(mongo_client, ssid):
-    samtools = cfg.query('executable', 'samtools', ret_default='samtools')
-    sve_collection = mongo_client['eva_accession_sharded']['dbsnpSubmittedVariantEntity']
-    cursor = sve_collection.find({'accession': int(ssid), 'remappedFrom': {'$exists': False}})
-    flank_size = 50
-    variant_records = list(cursor)
-    id_2_info = {}
-    for variant_rec in variant_records:
-        flank_up_coord = f"{variant_rec['contig']}:{variant_rec['start'] - flank_size}-{variant_rec['start'] - 1}"
-        flank_down_coord = f"{variant_rec['contig']}:{variant_rec['start'] + 1}-{variant_rec['start'] + flank_size}"
+def get_variant_flanks(reference_cache, variant_records, flank_size=50):
+    """Returns the upstream and downstream flanks of each variant, fetching all the flanks of a genome at once."""
+    regions_per_genome = defaultdict(list)
+    for i, variant_rec in enumerate(variant_records):
         genome_assembly_fasta = get_genome(assembly_accession=variant_rec['seq'], taxonomy=variant_rec['tax'])
-        command = f"{samtools} faidx {genome_assembly_fasta} {flank_up_coord} | grep -v '^>' | sed 's/\\n//' "
-        flank_up = run_command_with_output(f'Extract upstream sequence using {flank_up_coord}',  command, return_process_output=True).strip().upper()
-        command = f"{samtools} faidx {genome_assembly_fasta} {flank_down_coord} | grep -v '^>' | sed 's/\\n//' "
-        flank_down = run_command_with_output(f'Extract downstream sequence using {flank_down_coord}',  command, return_process_output=True).strip().upper()
-        id_2_info[variant_rec['_id']] = {'variant_rec': variant_rec, 'flank_up': flank_up, 'flank_down': flank_down}
-
-    for variant_id1, variant_id2 in list(itertools.combinations(id_2_info, 2)):
-        alignment, strand = compare_variant_flanks(
-            id_2_info[variant_id1]['flank_up'] + id_2_info[variant_id1]['variant_rec']['ref'] + id_2_info[variant_id1]['flank_down'],
-            id_2_info[variant_id2]['flank_up'] + id_2_info[variant_id2]['variant_rec']['ref'] + id_2_info[variant_id2]['flank_down']
-        )
-        output = format_output(
-            ssid, id_2_info[variant_id1]['variant_rec'], id_2_info[variant_id2]['variant_rec'], alignment, strand,
-            id_2_info[variant_id1]['flank_up'], id_2_info[variant_id1]['flank_down'],
-            id_2_info[variant_id2]['flank_up'], id_2_info[variant_id2]['flank_down']
-        )
-        print(output)
+        contig, start = variant_rec['contig'], variant_rec['start']
+        regions_per_genome[genome_assembly_fasta].append((i, (contig, start - flank_size, start - 1)))
+        regions_per_genome[genome_assembly_fasta].append((i, (contig, start + 1, start + flank_size)))
+    flanks = [[] for _ in variant_records]
+    for genome_assembly_fasta, indexed_regions in regions_per_genome.items():
+        sequences = reference_cache.fetch_regions(genome_assembly_fasta, [region for _, region in indexed_regions])
+        for (i, _), sequence in zip(indexed_regions, sequences):
+            flanks[i].append(sequence.upper())
+    return flanks
+
+
+def find_submitted_variants(mongo_client, ssids):
+    """Returns the submitted variants of each ss, keeping the order of ssids."""
+    sve_collection = mongo_client['eva_accession_sharded']['dbsnpSubmittedVariantEntity']
+    cursor = sve_collection.find(
+        {'accession': {'$in': [int(ssid) for ssid in ssids]}, 'remappedFrom': {'$exists': False}}, SVE_PROJECTION
+    )
+    variant_records_per_ssid = dict((int(ssid), []) for ssid in ssids)
+    for variant_rec in cursor:
+        variant_records_per_ssid[variant_rec['accession']].append(variant_rec)
+    return variant_records_per_ssid
+
+
+def check_submitted_variant_flanks(mongo_client, ssids, reference_cache, flank_aligner):
+    """
+    Compare the flanks of the submitted variants of each ss to each other and return the formatted comparisons.
+    The variants of all the ssids are retrieved at once and all their pairs are aligned in a single batch.
+    """
+    variant_records_per_ssid = find_submitted_variants(mongo_client, ssids)
+    all_variant_records = [variant_rec for variant_records in variant_records_per_ssid.values()
+                           for variant_rec in variant_records]
+    flanks_per_variant = dict(
+        (variant_rec['_id'], flanks)
+        for variant_rec, flanks in zip(all_variant_records, get_variant_flanks(reference_cache, all_variant_records))
+    )
+
+    comparisons = []
+    for ssid, variant_records in variant_records_per_ssid.items():
+        for variant_rec1, variant_rec2 in itertools.combinations(variant_records, 2):
+            flank_up1, flank_down1 = flanks_per_variant[variant_rec1['_id']]
+            flank_up2, flank_down2 = flanks_per_variant[variant_rec2['_id']]
+            comparisons.append((ssid, variant_rec1, variant_rec2, flank_up1, flank_down1, flank_up2, flank_down2))
+    variant_pairs = [(flank_up1 + variant_rec1['ref'] + flank_down1, flank_up2 + variant_rec2['ref'] + flank_down2)
+                     for _, variant_rec1, variant_rec2, flank_up1, flank_down1, flank_up2, flank_down2 in comparisons]
+    alignments = flank_aligner.align_pairs(variant_pairs)
+
+    outputs = []
+    for (ssid, variant_rec1, variant_rec2, flank_up1, flank_down1, flank_up2, flank_down2), (alignment, strand) \
+            in zip(comparisons, alignments):
+        outputs.append(format_output(ssid, variant_rec1, variant_rec2, alignment, strand,
+                                     flank_up1, flank_down1, flank_up2, flank_down2))
+    return outputs
+
+
+def read_ssids_in_batches(ssid_file, batch_size):
+    with open(ssid_file) as open_file:
+        batch = []
+        for line in open_file:
+            if line.strip():
+                batch.append(line.strip())
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
 
 def load_config(*args):
@@ -106,7 +133,15 @@ if __name__ == '__main__':
     parser.add_argument("--profile_name",
                         help="Maven profile to use when connecting to mongodb")
     parser.add_argument("--ssid_file", help="file containing a single ssid per line", type=str, required=True)
+    parser.add_argument("--cache_file", help="file where the scientific names retrieved from Ensembl are cached",
+                        type=str, required=False)
+    parser.add_argument("--batch_size", help="number of ssids retrieved from mongodb at once", type=int, default=1000)
+    parser.add_argument("--num_processes", help="number of processes aligning the flanks", type=int, default=4)
+    parser.add_argument("--max_open_genomes", help="number of genomes kept open at once", type=int, default=4)
+    parser.add_argument("--index_dir", help="directory where the missing genome indexes are created, a temporary "
+                                            "directory is used when not provided", type=str, required=False)
     args = parser.parse_args()
+    metadata_client = MetadataClient(cache_file=args.cache_file)
     # Get the config file loaded
     load_config()
     # Connect to mongodb database
@@ -115,10 +150,11 @@ if __name__ == '__main__':
     mongo_uri = f'mongodb://{mongo_user}:@{mongo_host}:27017/eva_accession_sharded?authSource=admin'
     mongo_client = MongoClient(mongo_uri, password=mongo_pass)
     nb_ssids = 0
-    with open(args.ssid_file) as open_file:
-        for line in open_file:
-            nb_ssids += 1
-            if nb_ssids % 1000 == 0 :
-                print(f'Processed {nb_ssids} ssids', file=sys.stderr)
-            check_submitted_variant_flanks(mongo_client, line.strip())
+    with ReferenceSequenceCache(args.max_open_genomes, args.index_dir) as reference_cache, \
+            FlankAligner(args.num_processes) as flank_aligner:
+        for ssids in read_ssids_in_batches(args.ssid_file, args.batch_size):
+            for output in check_submitted_variant_flanks(mongo_client, ssids, reference_cache, flank_aligner):
+                print(output)
+            nb_ssids += len(ssids)
+            print(f'Processed {nb_ssids} ssids', file=sys.stderr)
     mongo_client.close()
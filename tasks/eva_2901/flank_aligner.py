@@ -0,0 +1,150 @@
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+from Bio import Align
+from Bio.Seq import Seq
+
+# Scores used with pairwise2.align.globalms: a gap costs the same to open and to extend so gaps are linear
+MATCH = 1
+MISMATCH = -3
+GAP = -10
+KMER_SIZE = 5
+
+# Same fields as the alignments returned by pairwise2
+FlankAlignment = namedtuple('FlankAlignment', ['seqA', 'seqB', 'score', 'start', 'end'])
+
+_aligner = None
+
+
+def revcomp(seq):
+    return str(Seq(seq).reverse_complement())
+
+
+def get_aligner():
+    global _aligner
+    if _aligner is None:
+        _aligner = Align.PairwiseAligner(mode='global', match_score=MATCH, mismatch_score=MISMATCH,
+                                         open_gap_score=GAP, extend_gap_score=GAP)
+    return _aligner
+
+
+def make_alignment(seq_a, seq_b, score):
+    return FlankAlignment(seq_a, seq_b, float(score), 0, len(seq_a))
+
+
+def full_global_alignment(seq1, seq2):
+    # PairwiseAligner rejects empty sequences (flanks of variants at the start of a contig), aligned with gaps only
+    if not seq1 or not seq2:
+        return make_alignment(seq1 or '-' * len(seq2), seq2 or '-' * len(seq1), max(len(seq1), len(seq2)) * GAP)
+    alignment = get_aligner().align(seq1, seq2)[0]
+    return make_alignment(alignment[0], alignment[1], alignment.score)
+
+
+def diagonal_alignment(seq1, seq2):
+    """
+    Gapless alignment of two sequences of the same length, which is the banded global alignment of band width 0.
+    Returns None when an alignment with gaps could score better.
+    """
+    if len(seq1) != len(seq2):
+        return None
+    mismatches = sum(base1 != base2 for base1, base2 in zip(seq1, seq2))
+    score = (len(seq1) - mismatches) * MATCH + mismatches * MISMATCH
+    # Sequences of the same length need at least two gaps to leave the diagonal
+    if len(seq1) * MATCH + 2 * GAP > score:
+        return None
+    return make_alignment(seq1, seq2, score)
+
+
+def kmer_score_upper_bound(seq1, seq2, kmer_size=KMER_SIZE):
+    """
+    Upper bound of the global alignment score based on the number of k-mers shared by the sequences.
+    Each edit (mismatch or gap) removes at most kmer_size shared k-mers and costs at least MATCH - MISMATCH.
+    """
+    shared_kmers = sum((Counter(seq1[i:i + kmer_size] for i in range(len(seq1) - kmer_size + 1)) &
+                        Counter(seq2[i:i + kmer_size] for i in range(len(seq2) - kmer_size + 1))).values())
+    min_edits = max(0, -(-(max(len(seq1), len(seq2)) - kmer_size + 1 - shared_kmers) // kmer_size))
+    return min(len(seq1), len(seq2)) * MATCH - min_edits * (MATCH - MISMATCH)
+
+
+def global_alignment(seq1, seq2):
+    """Optimal global alignment, without dynamic programming when the sequences only differ by a few substitutions."""
+    if seq1 == seq2:
+        return make_alignment(seq1, seq2, len(seq1) * MATCH)
+    return diagonal_alignment(seq1, seq2) or full_global_alignment(seq1, seq2)
+
+
+def align_flanks(sequence1, sequence2):
+    """
+    Returns the best global alignment of sequence1 with sequence2 or its reverse complement and the strand, like the
+    pairwise2 comparison previously used in check_submitted_variant_flanks. The strand with the highest k-mer identity is aligned first and the other one is only
+    aligned when its k-mer upper bound shows it could score better.
+    """
+    reverse_sequence2 = revcomp(sequence2)
+    if sequence1 == sequence2:
+        return make_alignment(sequence1, sequence2, len(sequence1) * MATCH), '+'
+    if sequence1 == reverse_sequence2:
+        return make_alignment(sequence1, reverse_sequence2, len(sequence1) * MATCH), '-'
+    forward_bound = kmer_score_upper_bound(sequence1, sequence2)
+    reverse_bound = kmer_score_upper_bound(sequence1, reverse_sequence2)
+    # The reverse strand is only reported when it scores strictly better than the forward strand
+    if forward_bound >= reverse_bound:
+        forward_alignment = global_alignment(sequence1, sequence2)
+        if reverse_bound <= forward_alignment.score:
+            return forward_alignment, '+'
+        reverse_alignment = global_alignment(sequence1, reverse_sequence2)
+    else:
+        reverse_alignment = global_alignment(sequence1, reverse_sequence2)
+        if forward_bound < reverse_alignment.score:
+            return reverse_alignment, '-'
+        forward_alignment = global_alignment(sequence1, sequence2)
+    if reverse_alignment.score > forward_alignment.score:
+        return reverse_alignment, '-'
+    return forward_alignment, '+'
+
+
+def _align_pairs(sequence_pairs):
+    return [align_flanks(sequence1, sequence2) for sequence1, sequence2 in sequence_pairs]
+
+
+class FlankAligner:
+    """
+    Align the flanks of all the pairs of variants of each ss, in a pool of num_processes processes when more than one
+    is requested. Pairs of identical sequences are only aligned once.
+    """
+
+    def __init__(self, num_processes=1, chunk_size=200):
+        self.num_processes = num_processes
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(max_workers=num_processes) if num_processes > 1 else None
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def align_pairs(self, sequence_pairs):
+        unique_pairs = list(dict.fromkeys(sequence_pairs))
+        if self.executor and len(unique_pairs) > self.chunk_size:
+            chunks = [unique_pairs[i:i + self.chunk_size] for i in range(0, len(unique_pairs), self.chunk_size)]
+            alignments = [alignment for chunk_alignments in self.executor.map(_align_pairs, chunks)
+                          for alignment in chunk_alignments]
+        else:
+            alignments = _align_pairs(unique_pairs)
+        alignment_per_pair = dict(zip(unique_pairs, alignments))
+        return [alignment_per_pair[pair] for pair in sequence_pairs]
+
+    def align_sequences_per_ssid(self, sequences_per_ssid):
+        """
+        Returns, for each ssid, the alignment and strand of each pair of its sequences in the order of
+        itertools.combinations. The pairs of all the ssids are aligned in a single batch.
+        """
+        pairs_per_ssid = dict((ssid, list(combinations(sequences, 2)))
+                              for ssid, sequences in sequences_per_ssid.items())
+        alignments = iter(self.align_pairs([pair for pairs in pairs_per_ssid.values() for pair in pairs]))
+        return dict((ssid, [next(alignments) for _ in pairs]) for ssid, pairs in pairs_per_ssid.items())
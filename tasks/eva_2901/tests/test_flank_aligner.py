@@ -0,0 +1,53 @@
+import random
+from unittest import TestCase
+
+from Bio import pairwise2
+
+from tasks.eva_2901.flank_aligner import FlankAligner, align_flanks, revcomp
+
+
+def pairwise2_score(sequence1, sequence2):
+    return pairwise2.align.globalms(sequence1, sequence2, 1, -3, -10, -10, one_alignment_only=True)[0].score
+
+
+class TestFlankAligner(TestCase):
+
+    def setUp(self) -> None:
+        random.seed(1)
+        self.flank = ''.join(random.choice('ACGT') for _ in range(101))
+
+    def test_identical_and_reverse_complemented_flanks(self):
+        alignment, strand = align_flanks(self.flank, self.flank)
+        self.assertEqual((alignment.score, strand), (101, '+'))
+        alignment, strand = align_flanks(self.flank, revcomp(self.flank))
+        self.assertEqual((alignment.score, strand), (101, '-'))
+        self.assertEqual(alignment.seqB, self.flank)
+
+    def test_same_score_and_strand_as_pairwise2(self):
+        snp = self.flank[:50] + ('A' if self.flank[50] != 'A' else 'C') + self.flank[51:]
+        deletion = self.flank[:30] + self.flank[32:]
+        unrelated = ''.join(random.choice('ACGT') for _ in range(101))
+        for sequence2 in [snp, revcomp(snp), deletion, revcomp(deletion), unrelated]:
+            alignment, strand = align_flanks(self.flank, sequence2)
+            forward_score = pairwise2_score(self.flank, sequence2)
+            reverse_score = pairwise2_score(self.flank, revcomp(sequence2))
+            self.assertEqual(alignment.score, max(forward_score, reverse_score))
+            self.assertEqual(strand, '-' if reverse_score > forward_score else '+')
+
+    def test_empty_flank(self):
+        # The flank of a variant at the start of a contig can be empty, it is aligned with gaps only
+        alignment, strand = align_flanks('', 'ACG')
+        self.assertEqual((alignment.seqA, alignment.seqB, alignment.score, strand), ('---', 'ACG', -30, '+'))
+        alignment, strand = align_flanks('ACG', '')
+        self.assertEqual((alignment.seqA, alignment.seqB, alignment.score, strand), ('ACG', '---', -30, '+'))
+
+    def test_align_sequences_per_ssid(self):
+        deletion = self.flank[:30] + self.flank[32:]
+        with FlankAligner() as flank_aligner:
+            alignments_per_ssid = flank_aligner.align_sequences_per_ssid({
+                1: [self.flank, deletion, revcomp(self.flank)],
+                2: [self.flank]
+            })
+        self.assertEqual([strand for _, strand in alignments_per_ssid[1]], ['+', '-', '-'])
+        self.assertEqual(alignments_per_ssid[1][0][0].score, alignments_per_ssid[1][2][0].score)
+        self.assertEqual(alignments_per_ssid[2], [])
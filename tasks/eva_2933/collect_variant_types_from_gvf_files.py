@@ -12,27 +12,84 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os
 import argparse
+import gzip
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+
+def find_gvf_files(gvf_root_path):
+    """Returns the plain and gzipped gvf files found in gvf_root_path and its sub-directories."""
+    gvf_files = []
+    for directory, _, file_names in os.walk(gvf_root_path):
+        gvf_files.extend(os.path.join(directory, file_name) for file_name in file_names
+                         if file_name.endswith('.gvf') or file_name.endswith('.gvf.gz'))
+    return sorted(gvf_files)
+
+
+def open_gvf(gvf_file):
+    if gvf_file.endswith('.gz'):
+        return gzip.open(gvf_file, 'rt')
+    return open(gvf_file)
+
+
+def count_variant_types(gvf_file):
+    """
+    Returns the study of the gvf file and the number of variants of each type it contains. The study comes from the
+    Study_accession header or, when absent, from the start of the file name.
+    """
+    study = os.path.basename(gvf_file).split('_')[0]
+    variant_type_counts = Counter()
+    with open_gvf(gvf_file) as open_file:
+        for file_line in open_file:
+            if file_line.startswith("#"):
+                if file_line.startswith('#Study_accession:'):
+                    study = file_line.split(':', 1)[1].strip()
+                continue
+            variant_type_counts[file_line.split("\t", 3)[2]] += 1
+    return study, variant_type_counts
+
+
+def collect_variant_type_counts(gvf_root_path, num_processes=1):
+    """Returns the study and variant type counts of each gvf file, reading the files in num_processes processes."""
+    gvf_files = find_gvf_files(gvf_root_path)
+    if num_processes > 1:
+        with ProcessPoolExecutor(max_workers=num_processes) as executor:
+            counts = list(executor.map(count_variant_types, gvf_files, chunksize=10))
+    else:
+        counts = [count_variant_types(gvf_file) for gvf_file in gvf_files]
+    return dict(zip(gvf_files, counts))
+
 
+def collect_structural_variant_types(gvf_root_path, num_processes=1):
+    all_variant_types = set()
+    for _, variant_type_counts in collect_variant_type_counts(gvf_root_path, num_processes).values():
+        all_variant_types.update(variant_type_counts)
+    return all_variant_types
 
-def collect_structural_variant_types(gvf_root_path):
-    all_variant_list = set()
-    file_folder_list = os.listdir(gvf_root_path)
-    file_list = [gvf_file for gvf_file in file_folder_list if os.path.isfile(os.path.join(gvf_root_path, gvf_file))]
-    for file in file_list:
-        if file.endswith(".gvf"):
-            variant_list = []
-            with open(os.path.join(gvf_root_path, file)) as open_file:
-                for file_line in open_file:
-                    if file_line.startswith("#"):
-                        continue
-                    attributes_column = file_line.split("\t")[2]
-                    variant_list.append(attributes_column)
 
-            variant_list_unique = set(variant_list)
-            all_variant_list.update(variant_list_unique)
-    return all_variant_list
+def write_variant_type_counts(counts_per_file, output_path):
+    """Write the number of variants of each type overall, per file and per study to tab separated files."""
+    total_counts = Counter()
+    counts_per_study = defaultdict(Counter)
+    with open(os.path.join(output_path, 'variant_type_counts_per_file.tsv'), 'w') as open_output:
+        print('file', 'study', 'variant_type', 'count', sep='\t', file=open_output)
+        for gvf_file, (study, variant_type_counts) in counts_per_file.items():
+            total_counts.update(variant_type_counts)
+            counts_per_study[study].update(variant_type_counts)
+            for variant_type, count in sorted(variant_type_counts.items()):
+                print(gvf_file, study, variant_type, count, sep='\t', file=open_output)
+    with open(os.path.join(output_path, 'variant_type_counts_per_study.tsv'), 'w') as open_output:
+        print('study', 'variant_type', 'count', sep='\t', file=open_output)
+        for study, variant_type_counts in sorted(counts_per_study.items()):
+            for variant_type, count in sorted(variant_type_counts.items()):
+                print(study, variant_type, count, sep='\t', file=open_output)
+    with open(os.path.join(output_path, 'variant_type_counts.tsv'), 'w') as open_output:
+        print('variant_type', 'count', sep='\t', file=open_output)
+        for variant_type, count in total_counts.most_common():
+            print(variant_type, count, sep='\t', file=open_output)
+    return total_counts
 
 
 def main():
@@ -40,13 +97,17 @@ def main():
         description='Collecting different variant types present in the gvf files')
 
     parser.add_argument("--gvf_root_path", type=str,
-                        help="Path where the gvf files are present", required=True)
+                        help="Path where the gvf files are present, they can be in sub-directories and gzipped",
+                        required=True)
 
     parser.add_argument("--output_path", type=str,
                         help="Path to the output .", required=True)
+    parser.add_argument("--num_processes", type=int, default=1,
+                        help="Number of processes reading the gvf files")
     args = parser.parse_args()
 
-    variant_types = collect_structural_variant_types(args.gvf_root_path)
+    counts_per_file = collect_variant_type_counts(args.gvf_root_path, args.num_processes)
+    variant_types = write_variant_type_counts(counts_per_file, args.output_path)
     with open(os.path.join(args.output_path, "output_file.txt"), 'w') as output_file:
         print("\nThe different variant types are as follows:", file=output_file)
         print(*variant_types, sep="\n", file=output_file)
@@ -1,13 +1,46 @@
+import gzip
 import os
+import shutil
+import tempfile
 from unittest import TestCase
 
-from tasks.eva_2933.collect_variant_types_from_gvf_files import collect_structural_variant_types
+from tasks.eva_2933.collect_variant_types_from_gvf_files import collect_structural_variant_types, \
+    collect_variant_type_counts, write_variant_type_counts
 
 
 class TestCollectVariantTypesFromGVFFiles(TestCase):
 
+    def setUp(self) -> None:
+        self.gvf_root_path = os.path.join(os.path.dirname(__file__), "data")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
     def test_collect_structural_variant_types(self):
-        gvf_root_path = os.path.join(os.path.dirname(__file__), "data")
-        variant_types = collect_structural_variant_types(gvf_root_path)
+        variant_types = collect_structural_variant_types(self.gvf_root_path)
         self.assertSetEqual({'deletion', 'copy_number_variation', 'complex_structural_alteration', 'copy_number_loss',
                              'duplication', 'copy_number_gain'}, variant_types)
+
+    def test_collect_variant_type_counts_in_sub_directories_and_gzipped_files(self):
+        gvf_file = 'estd208_Helbig_et_al_2013.2014-04-25.NCBI36.Submitted.gvf'
+        os.makedirs(os.path.join(self.tmp_dir.name, 'sub_directory'))
+        shutil.copy(os.path.join(self.gvf_root_path, gvf_file), self.tmp_dir.name)
+        with open(os.path.join(self.gvf_root_path, gvf_file), 'rb') as open_file, \
+                gzip.open(os.path.join(self.tmp_dir.name, 'sub_directory', gvf_file + '.gz'), 'wb') as open_gzip:
+            shutil.copyfileobj(open_file, open_gzip)
+
+        counts_per_file = collect_variant_type_counts(self.tmp_dir.name, num_processes=2)
+        self.assertEqual(len(counts_per_file), 2)
+        expected_counts = {'duplication': 47, 'copy_number_variation': 77, 'deletion': 37}
+        for study, variant_type_counts in counts_per_file.values():
+            self.assertEqual(study, 'estd208')
+            self.assertEqual(variant_type_counts, expected_counts)
+
+    def test_write_variant_type_counts(self):
+        total_counts = write_variant_type_counts(collect_variant_type_counts(self.gvf_root_path), self.tmp_dir.name)
+        self.assertEqual(total_counts['copy_number_variation'], 731 + 132 + 77)
+        with open(os.path.join(self.tmp_dir.name, 'variant_type_counts_per_study.tsv')) as open_file:
+            lines = open_file.readlines()
+        self.assertEqual(lines[0], 'study\tvariant_type\tcount\n')
+        self.assertIn('estd203\tcopy_number_loss\t2389\n', lines)
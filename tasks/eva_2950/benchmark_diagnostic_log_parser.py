@@ -0,0 +1,101 @@
+import argparse
+import ast
+import datetime
+import os
+import random
+import tempfile
+import timeit
+
+from ebi_eva_common_pyutils.logger import logging_config
+
+from tasks.eva_2950.diagnostic_log_parser import parse_rs_payloads
+
+logger = logging_config.get_logger(__name__)
+logging_config.add_stdout_handler()
+
+
+def ast_parse_with_datetime(astr):
+    """
+    Parse a string representing a python data structure into a python data structure
+    Based on https://stackoverflow.com/questions/4235606/way-to-use-ast-literal-eval-to-convert-string-into-a-datetime
+    """
+    try:
+        tree = ast.parse(astr)
+    except SyntaxError:
+        raise ValueError(astr)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.Expr, ast.Dict, ast.Str, ast.List, ast.Constant,
+                            ast.Attribute, ast.Num, ast.Name, ast.Load, ast.Tuple)):
+            continue
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'datetime':
+            continue
+        raise ValueError(astr)
+    return eval(astr)
+
+
+def ast_parse_eva2850_diagnostic_log(log_file):
+    # Parsing previously used in split_rs_with_inconsistent_ss
+    rsid = None
+    with open(log_file) as open_file:
+        for line in open_file:
+            line = line.strip()
+            if rsid:
+                yield rsid, ast_parse_with_datetime(line[11:])
+                rsid = None
+            if 'Not all original SS has same info' in line:
+                rsid = int(line.split()[4].strip(','))
+
+
+def random_submitted_variant(rsid):
+    created_date = datetime.datetime(2000 + random.randrange(20), random.randint(1, 12), random.randint(1, 28),
+                                     random.randrange(24), random.randrange(60), random.randrange(60),
+                                     random.choice([0, random.randrange(1000000)]))
+    return {
+        '_id': ''.join(random.choice('0123456789ABCDEF') for _ in range(40)),
+        'seq': 'GCA_000001405.1', 'tax': 9606, 'study': f'HANDLE_{random.randrange(1000)}',
+        'contig': f'CM000{random.randrange(663, 686)}.1', 'start': random.randrange(1, 200000000),
+        'ref': random.choice(['A', 'C', 'G', 'T', '', 'CA']), 'alt': random.choice(['A', 'C', 'G', 'T', '', 'TTG']),
+        'rs': rsid, 'evidence': random.choice([True, False]), 'validated': False, 'remappedFrom': None,
+        'accession': random.randrange(1, 2000000000), 'version': 1, 'createdDate': created_date,
+    }
+
+
+def write_diagnostic_log(log_file, num_rs, num_ss_per_rs):
+    """Write a log in the format of the eva2850 diagnostic logs with random submitted variants."""
+    random.seed(42)
+    with open(log_file, 'w') as open_file:
+        for rsid in range(1, num_rs + 1):
+            open_file.write(f'[2022-Jul-11 10:04:32][__main__][ERROR] For RS {rsid}, Not all original SS has same '
+                            f'info. Case for Split: \n')
+            ss_entities = [random_submitted_variant(rsid) for _ in range(num_ss_per_rs)]
+            open_file.write(f'SS Records {ss_entities}\n')
+
+
+def benchmark(num_rs, num_ss_per_rs, num_processes_list, repeat):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_file = os.path.join(tmp_dir, 'diagnostic.log')
+        write_diagnostic_log(log_file, num_rs, num_ss_per_rs)
+        expected_payloads = list(ast_parse_eva2850_diagnostic_log(log_file))
+        ast_time = min(timeit.repeat(lambda: list(ast_parse_eva2850_diagnostic_log(log_file)),
+                                     number=1, repeat=repeat))
+        logger.info(f'ast and eval: {num_rs} RS in {ast_time:.2f}s')
+        for num_processes in num_processes_list:
+            assert list(parse_rs_payloads(log_file, num_processes)) == expected_payloads, \
+                f'Payloads parsed with {num_processes} processes differ from ast and eval'
+            parser_time = min(timeit.repeat(lambda: list(parse_rs_payloads(log_file, num_processes)),
+                                            number=1, repeat=repeat))
+            logger.info(f'parse_rs_payloads with {num_processes} processes: {num_rs} RS in {parser_time:.2f}s '
+                        f'({ast_time / parser_time:.1f}x)')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the ast and the token based parsing of eva2850 diagnostic '
+                                                 'logs')
+    parser.add_argument("--num-rs", help="Number of RS in the generated log", type=int, default=20000)
+    parser.add_argument("--num-ss-per-rs", help="Number of submitted variants per RS", type=int, default=4)
+    parser.add_argument("--num-processes", help="Number of processes to use with parse_rs_payloads",
+                        type=int, nargs='+', default=[1, 4])
+    parser.add_argument("--repeat", help="Number of time each method is run (the best run is reported)",
+                        type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.num_rs, args.num_ss_per_rs, args.num_processes, args.repeat)
@@ -0,0 +1,152 @@
+import ast
+import datetime
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+# One token of the repr of a list of submitted variant entities: a string, a number, a constant, the start of a
+# datetime.datetime call or a punctuation character
+_token_regex = re.compile(r"""\s*(?:
+    (?P<string>'[^'\\]*(?:\\.[^'\\]*)*'|"[^"\\]*(?:\\.[^"\\]*)*")
+    |(?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+    |(?P<datetime>datetime\.datetime\()
+    |(?P<constant>True|False|None)
+    |(?P<punctuation>[\[\]{}(),:])
+)""", re.VERBOSE)
+_constants = {'True': True, 'False': False, 'None': None}
+_no_value = object()
+LIST, DICT, TUPLE, DATETIME = range(4)
+_container_types = {'[': LIST, '{': DICT, '(': TUPLE}
+_closed_types = {']': (LIST,), '}': (DICT,), ')': (TUPLE, DATETIME)}
+
+
+def _parse_number(token):
+    if '.' in token or 'e' in token or 'E' in token:
+        return float(token)
+    return int(token)
+
+
+def _parse_string(token):
+    # Escaped characters are rare in the payloads, only those strings go through literal_eval
+    if '\\' in token:
+        return ast.literal_eval(token)
+    return token[1:-1]
+
+
+def parse_payload(payload):
+    """
+    Parse the repr of a python data structure made of lists, dicts, tuples, strings, numbers, booleans, None and
+    datetime.datetime calls, as found in the eva2850 diagnostic logs. The data structure is built directly, without
+    evaluating the payload, and a ValueError is raised for anything else.
+    """
+    # Each open container is [type, content, key of the next dict value]
+    stack = []
+    value = _no_value
+    position = 0
+    match = _token_regex.match
+    while stack or value is _no_value:
+        token_match = match(payload, position)
+        if not token_match:
+            raise ValueError(f'Cannot parse payload at position {position}: {payload[position:position + 50]}')
+        position = token_match.end()
+        token_type = token_match.lastgroup
+        token = token_match.group(token_type)
+        if token_type != 'punctuation' or token in '[{(':
+            if value is not _no_value:
+                raise ValueError(f'Missing separator before position {position} of payload')
+            if token_type == 'string':
+                value = _parse_string(token)
+            elif token_type == 'number':
+                value = _parse_number(token)
+            elif token_type == 'constant':
+                value = _constants[token]
+            elif token_type == 'datetime':
+                stack.append([DATETIME, [], None])
+            else:
+                stack.append([_container_types[token], {} if token == '{' else [], _no_value])
+            continue
+        if not stack:
+            raise ValueError(f'Unexpected {token} at position {position} of payload')
+        container = stack[-1]
+        if token == ':':
+            if container[0] != DICT or value is _no_value or container[2] is not _no_value:
+                raise ValueError(f'Unexpected : at position {position} of payload')
+            container[2] = value
+            value = _no_value
+            continue
+        if value is not _no_value:
+            if container[0] == DICT:
+                if container[2] is _no_value:
+                    raise ValueError(f'Missing key before position {position} of payload')
+                container[1][container[2]] = value
+                container[2] = _no_value
+            else:
+                container[1].append(value)
+            value = _no_value
+        if token == ',':
+            continue
+        if container[0] not in _closed_types[token]:
+            raise ValueError(f'Unexpected {token} at position {position} of payload')
+        stack.pop()
+        if container[0] == TUPLE:
+            value = tuple(container[1])
+        elif container[0] == DATETIME:
+            value = datetime.datetime(*container[1])
+        else:
+            value = container[1]
+    if payload[position:].strip():
+        raise ValueError(f'Unexpected data after position {position} of payload')
+    return value
+
+
+def _parse_rs_payloads(rs_payloads):
+    return [(rsid, parse_payload(payload)) for rsid, payload in rs_payloads]
+
+
+def read_rs_payloads(log_file):
+    """Yields the RS id and the unparsed list of submitted variants of each RS with inconsistent SS in the log."""
+    rsid = None
+    line = ''
+    with open(log_file) as open_file:
+        for line in open_file:
+            line = line.strip()
+            if rsid:
+                # We are parsing the line just after finding the RS id
+                yield rsid, line[11:]
+                rsid = None
+            if 'Not all original SS has same info' in line:
+                sp_line = line.split()
+                rsid = int(sp_line[4].strip(','))
+
+        if rsid:
+            yield rsid, line[11:]
+
+
+def _chunks(iterable, chunk_size):
+    chunk = []
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_rs_payloads(log_file, num_processes=1, chunk_size=1000):
+    """
+    Yields the RS id and the list of submitted variants of each RS with inconsistent SS in the log, in the order of the
+    log. With more than one process, chunks of chunk_size payloads are parsed in a process pool.
+    """
+    if num_processes <= 1:
+        for rsid, payload in read_rs_payloads(log_file):
+            yield rsid, parse_payload(payload)
+        return
+    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+        # Only a few chunks are read ahead of the one being consumed
+        pending_chunks = []
+        for chunk in _chunks(read_rs_payloads(log_file), chunk_size):
+            pending_chunks.append(executor.submit(_parse_rs_payloads, chunk))
+            if len(pending_chunks) > 2 * num_processes:
+                yield from pending_chunks.pop(0).result()
+        for pending_chunk in pending_chunks:
+            yield from pending_chunk.result()
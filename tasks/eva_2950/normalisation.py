@@ -0,0 +1,319 @@
+import glob
+import os
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from pyfaidx import Fasta
+
+# Maximum number of bases a variant is shifted to the left by leftalign
+MAX_SHIFT = 1000
+# Variants whose sequence windows are closer than this are normalised against a single window
+DEFAULT_MAX_GAP = 10000
+# Size above which a window is not extended to the next variants
+MAX_WINDOW_SIZE = 1000000
+
+
+# Code from VCFtidy (https://github.com/quinlan-lab/vcftidy/blob/master/vcftidy.py)
+def leftalign(chrom, pos, ref, alt, fa, max_shift=1000):
+    # Add the context base if it is not there already
+    if ref == '':
+        ref = fa[chrom][pos - 2].upper()  # -1 because pos is 1-based and -1 because we want the base before
+        pos -= 1
+        alt = ref + alt
+    if alt == '':
+        alt = fa[chrom][pos - 2].upper()
+        pos -= 1
+        ref = alt + ref
+    seq = fa[chrom][max(0, pos - max_shift - 1):pos + len(ref) - 1].upper()
+    ref = ref.upper()
+    alt = alt.upper()
+    if not seq.endswith(ref):
+        raise ReferenceError('The reference bases in the variant are different from the reference sequence ' + str((chrom, pos, ref, alt, seq[-10:])))
+    return _leftalign(pos, ref, alt, seq)[:3]
+
+
+def _leftalign(pos, ref, alt, seq):
+    """
+    simple implementation from the vt paper:
+    # actual variant is 2-base CA insertion.
+    Last argument indicates whether we ran out of sequence and therefore did not
+    finish left-aligning before running out of sequence. (False is bad).
+    >>> _leftalign(123, 'CAC', 'C', 'GGGCACACAC')
+    (118, 'GCA', 'G', True)
+    # run out of sequence!
+    >>> _leftalign(123, 'CAC', 'C', 'CACACAC')
+    (119, 'CAC', 'C', False)
+    >>> _leftalign(123, 'CCA', 'CAA', 'ACCCCCCA')
+    (123, 'CC', 'CA', True)
+    # have to left-trim after left-align
+    >>> normalize(*_leftalign(123, 'CCA', 'CAA', 'ACCCCCCA')[:3], left_only=True)
+    (124, 'C', 'A')
+    >>> _leftalign(123, 'C', 'A', 'ACCCCCC')
+    (123, 'C', 'A', True)
+    """
+    assert seq.endswith(ref)
+    assert ref != alt
+    seq = seq[:-len(ref)]
+    ref, alt = list(ref), list(alt)
+    j = 0
+
+    quit = False
+    while j < len(seq) and not quit:
+        quit = True
+
+        if ref[-1] == alt[-1]:
+            ref, alt = ref[:-1], alt[:-1]
+            quit = False
+
+        if len(ref) == 0 or len(alt) == 0:
+            j += 1
+            ref = [seq[-j]] + ref
+            alt = [seq[-j]] + alt
+            quit = False
+
+    return pos - j, "".join(ref), "".join(alt), quit
+
+
+def normalize(pos, ref, alt, left_only=False):
+    """simplify a ref/alt a la vt normalize so that ref=CC, alt=CCT becomes
+    ref=C, alt=CT. this helps in annotating variants.
+    This code relies on the observation by Eric Minikel that many annotation
+    misses can be addressed by removing common suffix and prefixes.
+    (http://www.cureffi.org/2014/04/24/converting-genetic-variants-to-their-minimal-representation/)
+    >>> normalize(123, 'T', 'C')
+    (123, 'T', 'C')
+    >>> normalize(123, 'CC', 'CCT')
+    (124, 'C', 'CT')
+    >>> normalize(123, 'TCCCCT', 'CCCCT')
+    (123, 'TC', 'C')
+    >>> normalize(123, 'TCCCCTA', 'CCCCT')
+    (123, 'TCCCCTA', 'CCCCT')
+    >>> normalize(123, 'TCCCCTA', 'CCCCTA')
+    (123, 'TC', 'C')
+    >>> normalize(123, 'AAATCCCCTA', 'AAACCCCTA')
+    (125, 'AT', 'A')
+    >>> normalize(123, 'CAAATCCCCTAG', 'AAACCCCTA')
+    (123, 'CAAATCCCCTAG', 'AAACCCCTA')
+    """
+    if len(ref) == len(alt) == 1:
+        return pos, ref, alt
+
+    # logic for trimming from either end is the same so we just reverse the
+    # string to trim the suffix (i == 0) and correct position when doing prefix
+    # (i == 1). To support alleles that have already been right-trimmed from
+    # _leftalign, we allow the left_only argument to just do prefix-trimming.
+    if left_only:
+        sides = (1,)
+    else:
+        sides = (0, 1)
+    for i in sides:
+        if i == 0: # suffix so flip
+            ref, alt = ref[::-1], alt[::-1]
+
+        n, min_len = 0, min(len(ref), len(alt))
+        while n + 1 < min_len and alt[n] == ref[n]:
+            n += 1
+
+        alt, ref = alt[n:], ref[n:]
+        if i == 0: # flip back
+            ref, alt = ref[::-1], alt[::-1]
+        else: # add to position since we stripped the prefix
+            pos += n
+
+    return pos, ref, alt
+
+
+def leftnorm(chrom, pos, ref, alt, fa=None):
+    """
+    this is the normalization function that should be used.
+    if no fasta is present, then it just normalizes. Otherwise
+    it left-aligns and then normalizes.
+    """
+    if fa is None:
+        return normalize(pos, ref, alt)
+
+    return normalize(*leftalign(chrom, pos, ref, alt, fa), left_only=True)
+
+
+def add_contex_base(fa, chrom, pos, ref, alt):
+    # Add the context base if it is not there already
+    if ref == '':
+        ref = fa[chrom][pos - 2].upper()  # -1 because pos is 1-based and -1 because we want the base before
+        pos -= 1
+        alt = ref + alt
+    if alt == '':
+        alt = fa[chrom][pos - 2].upper()
+        pos -= 1
+        ref = alt + ref
+    return pos, ref, alt
+
+
+class ContigWindow:
+    """
+    Region of the sequence of a contig read once from the fasta file and indexed with the 0-based coordinates of the
+    contig, like the records of a Fasta opened with as_raw=True. The positions outside the region are read from the
+    fasta file.
+    """
+
+    def __init__(self, contig_sequence, start, end):
+        self.contig_sequence = contig_sequence
+        self.start = start
+        self.sequence = contig_sequence[start:end]
+        self.end = start + len(self.sequence)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            if item.step is None and item.start is not None and item.stop is not None \
+                    and self.start <= item.start and item.stop <= self.end:
+                return self.sequence[item.start - self.start:item.stop - self.start]
+        elif self.start <= item < self.end:
+            return self.sequence[item - self.start]
+        return self.contig_sequence[item]
+
+
+class GenomeCache:
+    """Fasta files of the genomes found in ref_genome_directory, at most max_genomes of them are kept open."""
+
+    def __init__(self, ref_genome_directory, max_genomes=2):
+        self.ref_genome_directory = ref_genome_directory
+        self.max_genomes = max_genomes
+        self.genomes = OrderedDict()
+
+    def get(self, genome_accession):
+        if genome_accession in self.genomes:
+            self.genomes.move_to_end(genome_accession)
+            return self.genomes[genome_accession]
+        path_to_search = os.path.join(self.ref_genome_directory, '*', genome_accession, genome_accession + '.fa')
+        genome_paths = glob.glob(path_to_search)
+        if len(genome_paths) == 0:
+            raise ValueError(f'Cannot locate genome for {genome_accession} in {self.ref_genome_directory}')
+        self.genomes[genome_accession] = Fasta(genome_paths[0], as_raw=True, read_ahead=40000)
+        if len(self.genomes) > self.max_genomes:
+            _, evicted_genome = self.genomes.popitem(last=False)
+            evicted_genome.close()
+        return self.genomes[genome_accession]
+
+    def close(self):
+        for genome in self.genomes.values():
+            genome.close()
+        self.genomes.clear()
+
+
+def _variant_window(pos, ref):
+    # add_contex_base and leftalign read at most MAX_SHIFT + 2 bases before the variant and up to the end of its ref
+    return max(0, pos - MAX_SHIFT - 3), pos + len(ref)
+
+
+def cluster_variants(variants, max_gap=DEFAULT_MAX_GAP):
+    """
+    Returns the windows (contig, start, end) covering the sequence needed to normalise the (contig, pos, ref, alt)
+    variants, with the indexes of the variants of each window. Variants closer than max_gap share the same window.
+    """
+    clusters = []
+    sorted_indexes = sorted(range(len(variants)), key=lambda index: variants[index][:2])
+    for contig, contig_indexes in groupby(sorted_indexes, key=lambda index: variants[index][0]):
+        start = end = None
+        indexes = []
+        for index in contig_indexes:
+            variant_start, variant_end = _variant_window(*variants[index][1:3])
+            if end is not None and variant_start <= end + max_gap and variant_end - start <= MAX_WINDOW_SIZE:
+                end = max(end, variant_end)
+            else:
+                if indexes:
+                    clusters.append((contig, start, end, indexes))
+                start, end, indexes = variant_start, variant_end, []
+            indexes.append(index)
+        clusters.append((contig, start, end, indexes))
+    return clusters
+
+
+def normalise_variants(fasta, variants, max_gap=DEFAULT_MAX_GAP):
+    """
+    Add the context base to each (contig, pos, ref, alt) variant then left-align and normalise it, reading a single
+    window of sequence for the variants close to each other.
+    Returns, in the order of the variants, the (pos, ref, alt) with the context base and the normalised (pos, ref, alt)
+    of each variant, or the ReferenceError raised when its reference bases differ from the genome.
+    """
+    results = [None] * len(variants)
+    for contig, start, end, indexes in cluster_variants(variants, max_gap):
+        window = {contig: ContigWindow(fasta[contig], start, end)}
+        for index in indexes:
+            _, pos, ref, alt = variants[index]
+            try:
+                context_variant = add_contex_base(window, contig, pos, ref, alt)
+                results[index] = (context_variant, leftnorm(contig, *context_variant, fa=window))
+            except ReferenceError as e:
+                results[index] = e
+    return results
+
+
+_worker_genome_cache = None
+
+
+def _init_worker(ref_genome_directory, max_genomes):
+    global _worker_genome_cache
+    _worker_genome_cache = GenomeCache(ref_genome_directory, max_genomes)
+
+
+def _normalise_genome_variants(genome_accession, variants, max_gap):
+    return normalise_variants(_worker_genome_cache.get(genome_accession), variants, max_gap)
+
+
+class BatchNormaliser:
+    """
+    Normalise batches of variants from several genomes, sorted by genome, contig and position so each genome is
+    opened once per batch and the sequence around neighbouring variants is read once. With more than one process,
+    chunks of chunk_size neighbouring variants are normalised in a pool of num_processes processes, each keeping at
+    most max_genomes genomes open.
+    """
+
+    def __init__(self, ref_genome_directory, num_processes=1, chunk_size=10000, max_genomes=2,
+                 max_gap=DEFAULT_MAX_GAP):
+        self.genome_cache = GenomeCache(ref_genome_directory, max_genomes)
+        self.num_processes = num_processes
+        self.chunk_size = chunk_size
+        self.max_gap = max_gap
+        self.executor = ProcessPoolExecutor(max_workers=num_processes, initializer=_init_worker,
+                                            initargs=(ref_genome_directory, max_genomes)) \
+            if num_processes > 1 else None
+
+    def close(self):
+        self.genome_cache.close()
+        if self.executor:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def normalise(self, variants):
+        """
+        Returns the variant with the context base and the normalised variant of each (genome_accession, contig, pos,
+        ref, alt), or the ReferenceError raised for it, in the order of the variants.
+        """
+        indexes_per_genome = defaultdict(list)
+        for index, variant in enumerate(variants):
+            indexes_per_genome[variant[0]].append(index)
+        results = [None] * len(variants)
+        futures = []
+        for genome_accession, indexes in indexes_per_genome.items():
+            indexes.sort(key=lambda index: variants[index][1:3])
+            for i in range(0, len(indexes), self.chunk_size):
+                chunk_indexes = indexes[i:i + self.chunk_size]
+                chunk_variants = [variants[index][1:] for index in chunk_indexes]
+                if self.executor:
+                    futures.append((chunk_indexes, self.executor.submit(
+                        _normalise_genome_variants, genome_accession, chunk_variants, self.max_gap
+                    )))
+                else:
+                    chunk_results = normalise_variants(self.genome_cache.get(genome_accession), chunk_variants,
+                                                       self.max_gap)
+                    for index, result in zip(chunk_indexes, chunk_results):
+                        results[index] = result
+        for chunk_indexes, future in futures:
+            for index, result in zip(chunk_indexes, future.result()):
+                results[index] = result
+        return results
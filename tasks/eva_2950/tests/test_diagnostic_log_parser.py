@@ -0,0 +1,36 @@
+import datetime
+import os
+from unittest import TestCase
+
+from tasks.eva_2950.diagnostic_log_parser import parse_payload, parse_rs_payloads
+
+
+class TestDiagnosticLogParser(TestCase):
+
+    test_dir = os.path.dirname(__file__)
+
+    def test_parse_payload(self):
+        payload = "[{'_id': 'A1', 'start': -12, 'af': 0.5, 'alt': 'it\\'s', 'evidence': True, 'rs': None, " \
+                  "'pos': (1, 2,), 'empty': [], 'createdDate': datetime.datetime(2021, 4, 6, 13, 55, 20, 110000)}]"
+        self.assertEqual(parse_payload(payload), [{
+            '_id': 'A1', 'start': -12, 'af': 0.5, 'alt': "it's", 'evidence': True, 'rs': None, 'pos': (1, 2),
+            'empty': [], 'createdDate': datetime.datetime(2021, 4, 6, 13, 55, 20, 110000)
+        }])
+
+    def test_parse_invalid_payload(self):
+        for payload in ["__import__('os').system('ls')", "[1 2]", "[1] [2]", "{'a' 1}", "[1,", "(1]",
+                        "datetime.datetime(2021, 4]"]:
+            with self.assertRaises(ValueError):
+                parse_payload(payload)
+
+    def test_parse_rs_payloads(self):
+        diagnostic_file = os.path.join(self.test_dir, 'diagnostic_output_log.out')
+        expected_accessions = [
+            [71656146, 1961656906, 73429405, 71656146, 73429405], [73630724, 73526101, 1965862538, 73630724, 73526101],
+            [1964358410, 73565740, 1964358413, 73565740]
+        ]
+        for num_processes in [1, 2]:
+            rs_payloads = list(parse_rs_payloads(diagnostic_file, num_processes=num_processes, chunk_size=1))
+            self.assertEqual([rsid for rsid, _ in rs_payloads], [54131737, 53378121, 54319631])
+            self.assertEqual([[ss_entity['accession'] for ss_entity in ss_entities] for _, ss_entities in rs_payloads],
+                             expected_accessions)
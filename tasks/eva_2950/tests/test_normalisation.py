@@ -0,0 +1,106 @@
+import os
+import random
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pyfaidx import Fasta
+
+from tasks.eva_2950.normalisation import leftnorm, add_contex_base, normalise_variants, cluster_variants, \
+    GenomeCache, BatchNormaliser
+
+
+class TestNormalisation(TestCase):
+
+    test_dir = os.path.dirname(__file__)
+
+    def setUp(self) -> None:
+        random.seed(1)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ref_genome_dir = os.path.join(self.tmp_dir, 'references')
+        # Random contigs with repeats so the variants are shifted by various lengths
+        self.contigs = {}
+        for contig in ['chr1', 'chr2']:
+            sequence = ''
+            while len(sequence) < 20000:
+                unit = ''.join(random.choice('ACGT') for _ in range(random.randint(1, 4)))
+                sequence += ''.join(random.choice('ACGT') for _ in range(random.randint(1, 50)))
+                sequence += unit * random.randint(1, 10)
+            self.contigs[contig] = sequence
+        for genome_accession in ['GCA_1.1', 'GCA_2.1', 'GCA_3.1']:
+            os.makedirs(os.path.join(self.ref_genome_dir, 'species', genome_accession))
+            with open(os.path.join(self.ref_genome_dir, 'species', genome_accession, genome_accession + '.fa'),
+                      'w') as open_file:
+                for contig, sequence in self.contigs.items():
+                    open_file.write(f'>{contig}\n')
+                    open_file.writelines(sequence[i:i + 60] + '\n' for i in range(0, len(sequence), 60))
+        self.fasta = Fasta(os.path.join(self.ref_genome_dir, 'species', 'GCA_1.1', 'GCA_1.1.fa'), as_raw=True)
+        self.variants = []
+        for _ in range(500):
+            contig = random.choice(list(self.contigs))
+            pos = random.randint(3, len(self.contigs[contig]) - 10)
+            ref = self.contigs[contig][pos - 1:pos - 1 + random.randint(0, 4)]
+            alt = random.choice(['', 'A', 'T', 'CG', ref[:1] + 'TT', ref[1:]])
+            if ref == alt:
+                alt += 'A'
+            # A few variants do not match the reference
+            if random.random() < 0.05:
+                ref = 'N' + ref
+            self.variants.append((contig, pos, ref, alt))
+
+    def tearDown(self) -> None:
+        self.fasta.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def normalise_one_at_a_time(self, variants):
+        results = []
+        for contig, pos, ref, alt in variants:
+            try:
+                context_variant = add_contex_base(self.fasta, contig, pos, ref, alt)
+                results.append((context_variant, leftnorm(contig, *context_variant, fa=self.fasta)))
+            except ReferenceError as e:
+                results.append(str(e))
+        return results
+
+    def assert_same_normalisation(self, results, expected_results):
+        self.assertEqual([str(result) if isinstance(result, ReferenceError) else result for result in results],
+                         expected_results)
+
+    def test_cluster_variants(self):
+        variants = [('chr1', 5000, 'A', 'T'), ('chr2', 1, 'A', 'T'), ('chr1', 1, 'AC', 'A'), ('chr1', 4000, 'A', 'T')]
+        self.assertEqual(cluster_variants(variants, max_gap=0), [
+            ('chr1', 0, 3, [2]), ('chr1', 2997, 5001, [3, 0]), ('chr2', 0, 2, [1])
+        ])
+
+    def test_normalise_variants(self):
+        expected_results = self.normalise_one_at_a_time(self.variants)
+        for max_gap in [0, 100, 100000]:
+            self.assert_same_normalisation(normalise_variants(self.fasta, self.variants, max_gap), expected_results)
+
+    def test_normalise_rs54131737(self):
+        fasta = Fasta(os.path.join(self.test_dir, 'fasta_file.fa'), as_raw=True, read_ahead=40000)
+        variants = [('AP014957.1', 91, '', 'TTTTT'), ('AP014957.1', 81, '', 'T')]
+        self.assertEqual(normalise_variants(fasta, variants), [
+            ((90, 'T', 'TTTTTT'), (80, 'C', 'CTTTTT')), ((80, 'C', 'CT'), (80, 'C', 'CT'))
+        ])
+
+    def test_genome_cache(self):
+        genome_cache = GenomeCache(self.ref_genome_dir, max_genomes=2)
+        genome1 = genome_cache.get('GCA_1.1')
+        genome_cache.get('GCA_2.1')
+        self.assertIs(genome_cache.get('GCA_1.1'), genome1)
+        genome_cache.get('GCA_3.1')
+        # The least recently used genome is closed
+        self.assertEqual(list(genome_cache.genomes), ['GCA_1.1', 'GCA_3.1'])
+        with self.assertRaises(ValueError):
+            genome_cache.get('GCA_4.1')
+        genome_cache.close()
+
+    def test_batch_normaliser(self):
+        expected_results = self.normalise_one_at_a_time(self.variants)
+        genome_variants = [(genome_accession, *variant) for genome_accession, variant in
+                           zip(['GCA_1.1', 'GCA_2.1', 'GCA_3.1'] * len(self.variants), self.variants)]
+        for num_processes in [1, 2]:
+            with BatchNormaliser(self.ref_genome_dir, num_processes=num_processes, chunk_size=50,
+                                 max_genomes=1) as batch_normaliser:
+                self.assert_same_normalisation(batch_normaliser.normalise(genome_variants), expected_results)
@@ -1,10 +1,13 @@
 import os.path
 from pprint import pprint
 from unittest import TestCase
+from unittest.mock import patch
 
 from pyfaidx import Fasta
 
-from tasks.eva_2950.split_rs_with_inconsistent_ss import leftnorm, parse_eva2850_diagnositc_log, process_diagnostic_log
+from tasks.eva_2950.normalisation import leftnorm
+from tasks.eva_2950 import split_rs_with_inconsistent_ss
+from tasks.eva_2950.split_rs_with_inconsistent_ss import parse_eva2850_diagnostic_log, process_diagnostic_log
 
 
 class TestNormalisation(TestCase):
@@ -38,11 +41,11 @@ class TestSplitRS(TestCase):
 
     test_dir = os.path.dirname(__file__)
 
-    def test_parse_eva2850_diagnositc_log(self):
+    def test_parse_eva2850_diagnostic_log(self):
         diagnostic_file = os.path.join(self.test_dir, 'diagnostic_output_log.out')
         rsids = []
         lists_of_ssids = []
-        for rsid, list_of_ssids in parse_eva2850_diagnositc_log(diagnostic_file):
+        for rsid, list_of_ssids in parse_eva2850_diagnostic_log(diagnostic_file):
             rsids.append(rsid)
             lists_of_ssids.append(list_of_ssids)
 
@@ -57,3 +60,34 @@ class TestSplitRS(TestCase):
         ref_genome_dir = os.path.join(self.test_dir, 'references')
 
         process_diagnostic_log(diagnostic_file, ref_genome_dir)
+
+    def test_process_diagnostic_log_with_reference_error(self):
+        diagnostic_file = os.path.join(self.test_dir, 'diagnostic_output_log.out')
+        rs_and_ss_entities = list(parse_eva2850_diagnostic_log(diagnostic_file))
+        # The second ss of the second rs cannot be normalised
+        failing_index = len(rs_and_ss_entities[0][1]) + 1
+
+        class FailingNormaliser:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, exc_type, exc_val, exc_tb):
+                pass
+
+            def normalise(self, variants):
+                return [
+                    ReferenceError('Reference mismatch') if i == failing_index else ((pos, ref, alt), (pos, ref, alt))
+                    for i, (_, _, pos, ref, alt) in enumerate(variants)
+                ]
+
+        with patch.object(split_rs_with_inconsistent_ss, 'BatchNormaliser', FailingNormaliser), \
+                patch.object(split_rs_with_inconsistent_ss, 'shelve_submitted_variant_entities') as shelve:
+            process_diagnostic_log(diagnostic_file, 'references', mongo_handle='mongo_handle')
+
+        # The ss of the failing rs following the one that cannot be normalised are not shelved
+        expected_ids = set(ss_entity['_id'] for ss_entity in rs_and_ss_entities[0][1] + rs_and_ss_entities[2][1])
+        expected_ids.update(ss_entity['_id'] for ss_entity in rs_and_ss_entities[1][1][:2])
+        shelve.assert_called_once_with('mongo_handle', expected_ids)
@@ -1,8 +1,12 @@
 import gzip
+import hashlib
 import shutil
 import tarfile
 import os.path
 from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
 
 from ebi_eva_common_pyutils.logger import logging_config
 from retry import retry
@@ -10,13 +14,39 @@ from retry import retry
 logging_config.add_stdout_handler()
 logger = logging_config.get_logger(__name__)
 
+MEG = 2 ** 20
+# Compressed files smaller than this are kept in memory until they are added to the tar, larger ones are spooled
+# to the scratch directory
+MAX_IN_MEMORY_SIZE = 64 * MEG
+MANIFEST_HEADER = ['name', 'type', 'source_size', 'sha256', 'tar_offset']
 
-def make_tarfile(source_dir, output_filename):
-    logger.info(f'Create Final Tar file {output_filename}.')
-    with tarfile.open(output_filename, "w") as tar:
-        tar.add(source_dir, arcname=os.path.basename(source_dir))
-    file_stats = os.stat(output_filename)
-    logger.info(f'{output_filename} completed. File Size in Bytes is {file_stats.st_size}')
+
+class HashingWriter:
+    """File object computing the sha256 of the data written through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+class HashingReader:
+    """File object computing the sha256 of the data read through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
 
 
 def is_compressed(file_path):
@@ -28,33 +58,30 @@ def is_compressed(file_path):
 
 
 @retry(tries=5, delay=3, backoff=2, logger=logger)
-def retriable_compress(src_file_path, dest_file_path):
-    MEG = 2 ** 20
-    with open(src_file_path, 'rb') as f_in:
-        with gzip.open(dest_file_path, 'wb') as f_out:
+def retriable_compress(src_file_path, scratch_dir, compression_level):
+    """
+    Returns a temporary file with the gzipped content of src_file_path and its sha256. The temporary file stays in
+    memory unless it grows beyond MAX_IN_MEMORY_SIZE.
+    """
+    compressed_file = SpooledTemporaryFile(max_size=MAX_IN_MEMORY_SIZE, dir=scratch_dir)
+    hashing_writer = HashingWriter(compressed_file)
+    try:
+        with open(src_file_path, 'rb') as f_in, \
+                gzip.GzipFile(fileobj=hashing_writer, mode='wb', compresslevel=compression_level) as f_out:
             shutil.copyfileobj(f_in, f_out, length=16 * MEG)
+    except Exception:
+        compressed_file.close()
+        raise
+    compressed_file.seek(0)
+    return compressed_file, hashing_writer.sha256.hexdigest()
 
 
 def matches(name, patterns):
     return any((pattern for pattern in patterns if pattern in name))
 
 
-@retry(tries=5, delay=3, backoff=2, logger=logger)
-def retriable_remove(path):
-    shutil.rmtree(path)
-
-
-@retry(tries=5, delay=3, backoff=2, logger=logger)
-def retryable_copy(src_file_path, dest_file_path, **kwargs):
-    if os.path.exists(dest_file_path):
-        os.remove(dest_file_path)
-    shutil.copyfile(src_file_path, dest_file_path, **kwargs)
-
-
-def archive_directory(root_dir, scratch_dir, destination_dir, filter_patterns=None):
-
-    root_dir_name = os.path.basename(root_dir)
-    logger.info(f'Archive {root_dir_name} from {root_dir}')
+def list_entries(root_dir, filter_patterns):
+    """Yields the type, path and name in the archive of the directories and files of root_dir to archive."""
     parent_root_dir = os.path.dirname(root_dir)
     for base, dirs, files in os.walk(root_dir, topdown=True, followlinks=False):
         # Filter the downstream directory to
@@ -66,37 +93,128 @@ def archive_directory(root_dir, scratch_dir, destination_dir, filter_patterns=No
                 filtered_dir.append(d)
         # modify dirs in place
         dirs[:] = filtered_dir
-        src_basename = os.path.relpath(base, parent_root_dir)
-        scratch_dest_dir = os.path.join(scratch_dir, src_basename)
-        os.makedirs(scratch_dest_dir, exist_ok=True)
-        for fname in files:
+        yield 'directory', base, os.path.relpath(base, parent_root_dir)
+        for fname in sorted(files):
             src_file_path = os.path.join(base, fname)
-            dest_file_path = os.path.join(scratch_dest_dir, fname)
+            arcname = os.path.relpath(src_file_path, parent_root_dir)
             if matches(fname, filter_patterns):
                 logger.info(f'Ignore file {src_file_path} because of filters: {filter_patterns}')
-                continue
-            if os.path.islink(src_file_path) or is_compressed(src_file_path):
-                logger.info(f'Copy {src_file_path}')
-                retryable_copy(src_file_path, dest_file_path, follow_symlinks=False)
+            elif os.path.islink(src_file_path) or is_compressed(src_file_path):
+                yield 'copy', src_file_path, arcname
             else:
-                logger.info(f'Compress {src_file_path}')
-                retriable_compress(src_file_path, dest_file_path + '.gz')
+                yield 'compress', src_file_path, arcname + '.gz'
+
+
+def read_manifest(manifest_file):
+    """Returns the names already archived and the offset of the end of the last archived entry in the tar."""
+    archived_names = set()
+    tar_offset = 0
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as open_manifest:
+            for line in open_manifest:
+                sp_line = line.rstrip('\n').split('\t')
+                if sp_line == MANIFEST_HEADER or len(sp_line) != len(MANIFEST_HEADER):
+                    continue
+                archived_names.add(sp_line[0])
+                tar_offset = max(tar_offset, int(sp_line[4]))
+    return archived_names, tar_offset
+
+
+def add_to_tar(tar, entry_type, src_file_path, arcname, compressed=None):
+    """Add one entry to the tar and returns the sha256 of the content added."""
+    tarinfo = tar.gettarinfo(src_file_path, arcname=arcname)
+    if entry_type == 'compress':
+        compressed_file, sha256 = compressed
+        with compressed_file:
+            compressed_file.seek(0, os.SEEK_END)
+            tarinfo.size = compressed_file.tell()
+            compressed_file.seek(0)
+            tar.addfile(tarinfo, compressed_file)
+        return sha256
+    if tarinfo.isreg():
+        with open(src_file_path, 'rb') as open_file:
+            hashing_reader = HashingReader(open_file)
+            tar.addfile(tarinfo, hashing_reader)
+        return hashing_reader.sha256.hexdigest()
+    # Directories and symbolic links have no content
+    tar.addfile(tarinfo)
+    return ''
+
+
+def archive_directory(root_dir, scratch_dir, destination_dir, filter_patterns=None, num_threads=4,
+                      compression_level=9):
+    """
+    Archive root_dir in a tar file in destination_dir, compressing the files that are not already compressed.
+    Files are compressed by num_threads threads and streamed into the tar in the order of the directory walk.
+    A manifest listing each entry with the sha256 of its content in the tar is written next to the tar. When the
+    manifest already exists, the archiving resumes after the last entry it lists.
+    """
+    filter_patterns = filter_patterns or []
+    root_dir = os.path.abspath(root_dir)
+    root_dir_name = os.path.basename(root_dir)
+    logger.info(f'Archive {root_dir_name} from {root_dir}')
+    os.makedirs(scratch_dir, exist_ok=True)
+    os.makedirs(destination_dir, exist_ok=True)
     final_tar_file = os.path.join(destination_dir, root_dir_name + '.tar')
-    scratch_dir_archived = os.path.join(scratch_dir, root_dir_name)
-    make_tarfile(scratch_dir_archived, final_tar_file)
-    logger.info(f'Delete scratch folder {scratch_dir_archived}.')
-    retriable_remove(scratch_dir_archived)
-    logger.info(f'Scratch folder {scratch_dir_archived} deleted.')
+    manifest_file = final_tar_file + '.manifest.tsv'
+    archived_names, tar_offset = read_manifest(manifest_file)
+    if archived_names:
+        logger.info(f'Resume archive of {root_dir_name}: {len(archived_names)} entries already in {final_tar_file}')
+
+    with open(final_tar_file, 'r+b' if tar_offset else 'wb') as open_tar, \
+            open(manifest_file, 'a') as open_manifest, \
+            ThreadPoolExecutor(max_workers=num_threads) as executor:
+        # Remove what was written after the last entry of the manifest
+        open_tar.truncate(tar_offset)
+        open_tar.seek(tar_offset)
+        if not open_manifest.tell():
+            print(*MANIFEST_HEADER, sep='\t', file=open_manifest)
+        with tarfile.TarFile(fileobj=open_tar, mode='w') as tar:
+            pending_entries = deque()
+
+            def write_next_entry():
+                entry_type, src_file_path, arcname, compressed_future = pending_entries.popleft()
+                logger.info(f'Add {src_file_path} to {final_tar_file} as {arcname}')
+                compressed = compressed_future.result() if compressed_future else None
+                sha256 = add_to_tar(tar, entry_type, src_file_path, arcname, compressed)
+                # The tar is flushed before the manifest so every entry of the manifest is complete in the tar
+                open_tar.flush()
+                print(arcname, entry_type, os.lstat(src_file_path).st_size, sha256, tar.offset, sep='\t',
+                      file=open_manifest)
+                open_manifest.flush()
+
+            for entry_type, src_file_path, arcname in list_entries(root_dir, filter_patterns):
+                if arcname in archived_names:
+                    continue
+                compressed_future = None
+                if entry_type == 'compress':
+                    compressed_future = executor.submit(retriable_compress, src_file_path, scratch_dir,
+                                                        compression_level)
+                pending_entries.append((entry_type, src_file_path, arcname, compressed_future))
+                # Limit the number of compressed files waiting to be added to the tar
+                if len(pending_entries) > 2 * num_threads:
+                    write_next_entry()
+            while pending_entries:
+                write_next_entry()
+    file_stats = os.stat(final_tar_file)
+    logger.info(f'{final_tar_file} completed. File Size in Bytes is {file_stats.st_size}')
 
 
 def main():
     parser = ArgumentParser()
     parser.add_argument('--root_dir', required=True, type=str)
     parser.add_argument('--destination_dir', required=True, type=str)
-    parser.add_argument('--scratch_dir', required=True, type=str)
+    parser.add_argument('--scratch_dir', required=True, type=str,
+                        help='Directory where the compressed files too large to be kept in memory are written '
+                             'until they are added to the tar')
     parser.add_argument('--filter_patterns', type=str, nargs='*', default=[] )
+    parser.add_argument('--num_threads', type=int, default=4, help='Number of files compressed at once')
+    parser.add_argument('--compression_level', type=int, default=9, choices=range(1, 10),
+                        help='gzip compression level of the files that are not already compressed, lower levels are '
+                             'faster but produce larger archives')
     args = parser.parse_args()
-    archive_directory(args.root_dir, args.scratch_dir,  args.destination_dir, args.filter_patterns)
+    archive_directory(args.root_dir, args.scratch_dir,  args.destination_dir, args.filter_patterns,
+                      args.num_threads, args.compression_level)
 
 
 if __name__ == '__main__':
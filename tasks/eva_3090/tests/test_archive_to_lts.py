@@ -1,12 +1,55 @@
+import gzip
 import os
+import tarfile
+import tempfile
 
-from tasks.eva_3090.archive_to_lts import archive_directory
+from tasks.eva_3090.archive_to_lts import archive_directory, read_manifest
+
+expected_names = ['src', 'src/test1.txt.gz', 'src/test2.txt.gz', 'src/dir1', 'src/dir1/test3.txt.gz',
+                  'src/dir1/test4.txt.gz', 'src/dir1/dir2', 'src/dir1/dir2/test5.txt.gz']
 
 
 def test_archive_directory():
     resources = os.path.join(os.path.dirname(__file__), 'resources')
     src_dir = os.path.join(resources, 'src')
-    dest_dir = os.path.join(resources, 'dest')
-    scratch_dir = os.path.join(resources, 'scratch')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dest_dir = os.path.join(tmp_dir, 'dest')
+        scratch_dir = os.path.join(tmp_dir, 'scratch')
+
+        archive_directory(src_dir, scratch_dir, dest_dir, filter_patterns=['do_not_want'])
+        with tarfile.open(os.path.join(dest_dir, 'src.tar')) as tar:
+            assert tar.getnames() == expected_names
+        archived_names, _ = read_manifest(os.path.join(dest_dir, 'src.tar.manifest.tsv'))
+        assert archived_names == set(expected_names)
+
+
+def test_resume_archive_directory():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = os.path.join(tmp_dir, 'src')
+        os.makedirs(os.path.join(src_dir, 'dir1'))
+        for i, file_name in enumerate(['test1.txt', 'test2.txt', 'dir1/test3.txt']):
+            with open(os.path.join(src_dir, file_name), 'w') as open_file:
+                open_file.write(f'content of file {i}\n' * 1000)
+        dest_dir = os.path.join(tmp_dir, 'dest')
+        archive_directory(src_dir, os.path.join(tmp_dir, 'scratch'), dest_dir, num_threads=2)
+        tar_file = os.path.join(dest_dir, 'src.tar')
+        manifest_file = tar_file + '.manifest.tsv'
+
+        # Simulate a run interrupted while the third entry was being written
+        with open(manifest_file) as open_manifest:
+            manifest_lines = open_manifest.readlines()
+        with open(manifest_file, 'w') as open_manifest:
+            open_manifest.writelines(manifest_lines[:3])
+        with open(tar_file, 'r+b') as open_tar:
+            open_tar.truncate(int(manifest_lines[3].split('\t')[4]) - 100)
 
-    archive_directory(src_dir, scratch_dir, dest_dir, filter_patterns=['do_not_want'])
+        archive_directory(src_dir, os.path.join(tmp_dir, 'scratch'), dest_dir, num_threads=2, compression_level=1)
+        with open(manifest_file) as open_manifest:
+            resumed_manifest_lines = open_manifest.readlines()
+        assert resumed_manifest_lines[:3] == manifest_lines[:3]
+        resumed_names = [line.split('\t')[0] for line in resumed_manifest_lines[3:]]
+        assert resumed_names == ['src/test2.txt.gz', 'src/dir1', 'src/dir1/test3.txt.gz']
+        with tarfile.open(tar_file) as tar:
+            assert tar.getnames() == ['src', 'src/test1.txt.gz', 'src/test2.txt.gz', 'src/dir1',
+                                      'src/dir1/test3.txt.gz']
+            assert gzip.decompress(tar.extractfile('src/dir1/test3.txt.gz').read()) == b'content of file 2\n' * 1000
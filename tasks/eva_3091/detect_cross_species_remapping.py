@@ -1,39 +1,21 @@
 import argparse
-import datetime
-import json
-import os.path
-import atexit
 from collections import defaultdict
 
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.metadata_utils import get_metadata_connection_handle
-from ebi_eva_common_pyutils.ncbi_utils import get_ncbi_assembly_dicts_from_term, get_ncbi_taxonomy_dicts_from_ids
 from ebi_eva_common_pyutils.pg_utils import get_all_results_for_query
 
-cached_dict = {}
-cached_file = 'cached_data.json'
-if os.path.exists(cached_file):
-    with open(cached_file) as open_file:
-        cached_dict = json.load(open_file)
-if 'assembly_dicts' not in cached_dict: cached_dict['assembly_dicts'] = {}
-if 'taxonomy_dicts' not in cached_dict: cached_dict['taxonomy_dicts'] = {}
-
-def exit_handler():
-    with open(cached_file, 'w') as open_file:
-        json.dump(cached_dict, open_file)
-
-
-atexit.register(exit_handler)
-
-
+from tasks.common.metadata_client import MetadataClient
 
 logging_config.add_stdout_handler()
 logger = logging_config.get_logger(__name__)
 
+# Replaced in main with a client using the cache file and options provided
+metadata_client = MetadataClient()
+
+
 def cached_get_key_from(assembly, key):
-    if assembly not in cached_dict['assembly_dicts']:
-        cached_dict['assembly_dicts'][assembly] = get_ncbi_assembly_dicts_from_term(assembly)
-    assembly_dicts = cached_dict['assembly_dicts'][assembly]
+    assembly_dicts = metadata_client.get_ncbi_assembly_summaries([assembly]).get(assembly) or []
     values = set([d.get(key) for d in assembly_dicts])
     if len(values) > 1:
         # Only keep the one that have the assembly accession as a synonymous and check again
@@ -54,9 +36,8 @@ def cached_get_assembly_name_from(assembly):
 
 
 def cached_get_scientific_name(taxid):
-    if taxid not in cached_dict['taxonomy_dicts']:
-        cached_dict['taxonomy_dicts'][taxid] = get_ncbi_taxonomy_dicts_from_ids([str(taxid)])
-    taxonomy_dicts = cached_dict['taxonomy_dicts'][taxid]
+    taxonomy_summary = metadata_client.get_ncbi_taxonomy_summaries([taxid]).get(str(taxid))
+    taxonomy_dicts = [taxonomy_summary] if taxonomy_summary else []
     scientific_names = set([d.get('scientificname') for d in taxonomy_dicts])
     if len(scientific_names) != 1:
         raise ValueError(f"Cannot resolve taxonomy's name for taxonomy_id {taxid} in NCBI. "
@@ -87,6 +68,11 @@ def detect_species_with_cross_species_target(maven_config, maven_profile):
         for taxonomy, assembly, remapping_start, study_accessions in get_all_results_for_query(pg_conn, query):
             assemblies_to_species_clustering_dates[(taxonomy, assembly)].append(remapping_start)
 
+    # Retrieve all the assemblies and taxonomies from NCBI at once
+    all_assemblies = [assembly for assemblies in taxonomy_to_assemblies.values() for assembly in assemblies]
+    metadata_client.get_ncbi_assembly_summaries(all_assemblies)
+    metadata_client.get_ncbi_taxonomy_summaries(list(taxonomy_to_assemblies))
+
     for taxonomy in taxonomy_to_current_assembly:
         for assembly in taxonomy_to_assemblies[taxonomy]:
             taxonomy_from_assembly = cached_get_taxonomy_from(assembly)
@@ -133,6 +119,11 @@ if __name__ == '__main__':
     parser.add_argument("--maven_config", help="ex: /path/to/eva-maven-settings.xml", required=True)
     parser.add_argument("--maven_profile", choices=('localhost', 'development', 'production_processing'),
                         help="Profile to decide which environment should be used for making entries", required=True)
+    parser.add_argument("--cache_file", default='cached_data.sqlite',
+                        help="Path to the file where the information retrieved from NCBI is cached")
+    parser.add_argument("--offline", action='store_true', default=False,
+                        help="Only use the information already in the cache file")
 
     args = parser.parse_args()
+    metadata_client = MetadataClient(cache_file=args.cache_file, offline=args.offline)
     detect_species_with_cross_species_target(args.maven_config, args.maven_profile)
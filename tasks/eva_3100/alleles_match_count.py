@@ -1,14 +1,18 @@
 import argparse
 import os.path
+import threading
 import traceback
 from collections import defaultdict
-from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice, chain
 
 import pymongo
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.mongodb import MongoDatabase
 from pymongo.read_concern import ReadConcern
 
+from tasks.common.range_scanner import RangeScanner, get_ranges, get_id_range_filter
+
 logging_config.add_stdout_handler()
 logger = logging_config.get_logger(__name__)
 
@@ -16,6 +20,11 @@ SUBMITTED_VARIANT_ENTITY = "submittedVariantEntity"
 DBSNP_SUBMITTED_VARIANT_ENTITY = "dbsnpSubmittedVariantEntity"
 DBSNP_SUBMITTED_VARIANT_OPERATION_ENTITY = "dbsnpSubmittedVariantOperationEntity"
 
+# Only the fields used by the checks are retrieved
+SVE_PROJECTION = {'accession': 1, 'rs': 1, 'allelesMatch': 1}
+SVOE_PROJECTION = {'accession': 1, 'mergeInto': 1, 'splitInto': 1, 'inactiveObjects.hashedMessage': 1,
+                   'inactiveObjects.rs': 1}
+
 
 def retrieve_dbsnp_sve_with_allelesMatch_false(mongo_source, doc_file):
     retrieve_records_with_allelesMatch_false(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, doc_file)
@@ -25,15 +34,15 @@ def retrieve_sve_with_allelesMatch_false(mongo_source, doc_file):
     retrieve_records_with_allelesMatch_false(mongo_source, SUBMITTED_VARIANT_ENTITY, doc_file)
 
 
-def retrieve_records_with_allelesMatch_false(mongo_source, collection_name, doc_file):
+def retrieve_records_with_allelesMatch_false(mongo_source, collection_name, doc_file, max_workers=4):
+    filter_criteria = {"allelesMatch": False}
+    collection = mongo_source.mongo_handle[mongo_source.db_name][collection_name] \
+        .with_options(read_preference=pymongo.ReadPreference.PRIMARY)
+    scanner = RangeScanner(collection, filter_criteria, projection=SVE_PROJECTION,
+                           max_workers=max_workers)
     with open(doc_file, 'w') as file:
-        filter_criteria = {"allelesMatch": False}
-        collection = mongo_source.mongo_handle[mongo_source.db_name][collection_name]
-        cursor = collection.with_options(read_concern=ReadConcern("majority"),
-                                         read_preference=pymongo.ReadPreference.PRIMARY) \
-            .find(filter_criteria, no_cursor_timeout=True)
         try:
-            for record in cursor:
+            for record in scanner.scan_documents():
                 ss_id = record['_id']
                 ss_accession = record['accession']
                 rs = record['rs'] if 'rs' in record else ''
@@ -41,11 +50,9 @@ def retrieve_records_with_allelesMatch_false(mongo_source, collection_name, doc_
         except Exception as e:
             logger.exception(traceback.format_exc())
             raise e
-        finally:
-            cursor.close()
 
 
-def ss_with_same_accession_but_without_alleles_match_false(sve_doc_file, output_doc_file):
+def ss_with_same_accession_but_without_alleles_match_false(mongo_source, sve_doc_file, output_doc_file):
     with open(sve_doc_file, 'r') as sve_file:
         with open(output_doc_file, 'w') as output_file:
             batch_id = 1
@@ -55,13 +62,11 @@ def ss_with_same_accession_but_without_alleles_match_false(sve_doc_file, output_
                 ss_acc_list = [int(line.split(",")[1].strip()) for line in list(islice(sve_file, 100000))]
                 if not ss_acc_list:
                     break
-                filter_criteria = {'accession': {'$in': ss_acc_list}}
-                records = find_documents(mongo_source, SUBMITTED_VARIANT_ENTITY, filter_criteria)
-                dbsnp_records = find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, filter_criteria)
-                records.extend(dbsnp_records)
-
-                records = [record for record in records if 'allelesMatch' not in record]
-
+                filter_criteria = {'accession': {'$in': ss_acc_list}, 'allelesMatch': {'$exists': False}}
+                records = chain(
+                    find_documents(mongo_source, SUBMITTED_VARIANT_ENTITY, filter_criteria, SVE_PROJECTION),
+                    find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, filter_criteria, SVE_PROJECTION)
+                )
                 for record in records:
                     ss_id = record['_id']
                     ss_accession = record['accession']
@@ -93,18 +98,13 @@ def ss_merged_into_ss_with_alleles_match_false(mongo_source, sve_doc_file, merge
                 if not ss_acc_list:
                     break
                 filter_criteria = {'eventType': 'MERGED', 'mergeInto': {'$in': ss_acc_list}}
-                records = find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_OPERATION_ENTITY, filter_criteria)
+                records = find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_OPERATION_ENTITY, filter_criteria,
+                                         SVOE_PROJECTION)
                 for record in records:
-                    event_id = record['_id']
-                    merged_into_ss_accession = record['mergeInto']
-                    merged_ss_accession = record['accession']
-                    merged_ss_id = record['inactiveObjects'][0]['hashedMessage']
-                    merged_ss_rs = record['inactiveObjects'][0]['rs'] if 'rs' in record['inactiveObjects'][0] else ''
-                    merged_file.write(
-                        f'{event_id},{merged_into_ss_accession},{merged_ss_accession},{merged_ss_id},{merged_ss_rs}\n')
+                    merged_file.write(format_merge_event(record))
 
 
-def check_all_mergedInto_entities_has_alleles_match_false(merged_doc_file, output_file):
+def check_all_mergedInto_entities_has_alleles_match_false(mongo_source, merged_doc_file, output_file):
     with open(merged_doc_file, 'r') as input_file:
         with open(output_file, 'w') as output_file:
             batch_id = 1
@@ -117,9 +117,10 @@ def check_all_mergedInto_entities_has_alleles_match_false(merged_doc_file, outpu
 
                 mergeInto_acc_list = [int(line.split(",")[1].strip()) for line in lines_list]
                 filter_criteria = {'accession': {'$in': mergeInto_acc_list}}
-                records = find_documents(mongo_source, SUBMITTED_VARIANT_ENTITY, filter_criteria)
-                dbsnp_records = find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, filter_criteria)
-                records.extend(dbsnp_records)
+                records = chain(
+                    find_documents(mongo_source, SUBMITTED_VARIANT_ENTITY, filter_criteria, SVE_PROJECTION),
+                    find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, filter_criteria, SVE_PROJECTION)
+                )
                 merged_acc_records = defaultdict(list)
                 for record in records:
                     record_acc = record['accession']
@@ -153,15 +154,13 @@ def ss_split_from_ss_with_alleles_match_false(mongo_source, sve_doc_file, split_
                 if not ss_acc_list:
                     break
                 filter_criteria = {'eventType': 'SS_SPLIT', 'accession': {'$in': ss_acc_list}}
-                records = find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_OPERATION_ENTITY, filter_criteria)
+                records = find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_OPERATION_ENTITY, filter_criteria,
+                                         SVOE_PROJECTION)
                 for record in records:
-                    event_id = record['_id']
-                    split_from_ss_accession = record['accession']
-                    split_into_ss_accession = record["splitInto"]
-                    split_file.write(f'{event_id},{split_from_ss_accession},{split_into_ss_accession}\n')
+                    split_file.write(format_split_event(record))
 
 
-def check_if_splitInto_ss_has_alleles_match_false(split_doc_file, split_output_file):
+def check_if_splitInto_ss_has_alleles_match_false(mongo_source, split_doc_file, split_output_file):
     with open(split_doc_file, 'r') as sve_input_file:
         with open(split_output_file, 'w') as sve_output_file:
             batch_id = 1
@@ -171,35 +170,172 @@ def check_if_splitInto_ss_has_alleles_match_false(split_doc_file, split_output_f
                 batch_id = batch_id + 1
                 if not ss_acc_list:
                     break
-                filter_criteria = {'accession': {'$in': ss_acc_list}}
-                records = find_documents(mongo_source, SUBMITTED_VARIANT_ENTITY, filter_criteria)
-                dbsnp_records = find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, filter_criteria)
-                records.extend(dbsnp_records)
-
-                records = [record for record in records if 'allelesMatch' in record]
-
+                filter_criteria = {'accession': {'$in': ss_acc_list}, 'allelesMatch': {'$exists': True}}
+                records = chain(
+                    find_documents(mongo_source, SUBMITTED_VARIANT_ENTITY, filter_criteria, SVE_PROJECTION),
+                    find_documents(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, filter_criteria, SVE_PROJECTION)
+                )
                 for record in records:
                     ss_id = record['_id']
                     ss_accession = record['accession']
                     sve_output_file.write(f"{ss_id},{ss_accession},{record['allelesMatch']}\n")
 
 
-def find_documents(mongo_source, collection_name, filter_criteria):
+def find_documents(mongo_source, collection_name, filter_criteria, projection=None):
     collection = mongo_source.mongo_handle[mongo_source.db_name][collection_name]
     cursor = collection.with_options(read_concern=ReadConcern("majority"),
                                      read_preference=pymongo.ReadPreference.PRIMARY) \
-        .find(filter_criteria, no_cursor_timeout=True)
-    records = []
+        .find(filter_criteria, projection, no_cursor_timeout=True)
     try:
         for result in cursor:
-            records.append(result)
+            yield result
     except Exception as e:
         logger.exception(traceback.format_exc())
         raise e
     finally:
         cursor.close()
 
-    return records
+
+def format_merge_event(record):
+    merged_ss_id = record['inactiveObjects'][0]['hashedMessage']
+    merged_ss_rs = record['inactiveObjects'][0]['rs'] if 'rs' in record['inactiveObjects'][0] else ''
+    return f"{record['_id']},{record['mergeInto']},{record['accession']},{merged_ss_id},{merged_ss_rs}\n"
+
+
+def format_split_event(record):
+    return f"{record['_id']},{record['accession']},{record['splitInto']}\n"
+
+
+def aggregate_from_alleles_match_false(mongo_source, lookups, output_file, format_func, max_workers=4):
+    """
+    Run an aggregation starting from the dbSNP SVE with allelesMatch=false that joins them with $lookup to the
+    documents of other collections and write each document joined with format_func.
+    Like the $in queries of the find mode, each document is written once even when several SVE share its accession.
+    The aggregation is run concurrently on the _id ranges of the dbSNP SVE collection. It requires MongoDB 5.0+ for
+    $lookup combining localField and pipeline and 5.1+ when the collections joined are sharded.
+    """
+    collection = mongo_source.mongo_handle[mongo_source.db_name][DBSNP_SUBMITTED_VARIANT_ENTITY] \
+        .with_options(read_concern=ReadConcern("majority"), read_preference=pymongo.ReadPreference.PRIMARY)
+    lookup_stages = []
+    for i, (foreign_collection, foreign_field, filter_criteria, projection) in enumerate(lookups):
+        lookup_stages.append({'$lookup': {
+            'from': foreign_collection, 'localField': '_id', 'foreignField': foreign_field,
+            # The index of the lookup tells apart documents with the same _id in different collections
+            'pipeline': [{'$match': filter_criteria}, {'$project': {**projection, 'lookup_index': {'$literal': i}}}],
+            'as': f'joined_{i}'
+        }})
+    joined_fields = [f'$joined_{i}' for i in range(len(lookups))]
+    write_lock = threading.Lock()
+    # SVE sharing an accession can be in different ranges so their documents are also deduplicated across ranges
+    written_documents = set()
+
+    def aggregate_range(lower, upper):
+        pipeline = [
+            {'$match': {'$and': [{'allelesMatch': False}, get_id_range_filter(lower, upper)]}},
+            # Each accession is joined once in the range
+            {'$group': {'_id': '$accession'}},
+            *lookup_stages,
+            {'$project': {'_id': 0, 'joined': {'$concatArrays': joined_fields}}},
+            {'$unwind': '$joined'},
+            {'$replaceRoot': {'newRoot': '$joined'}}
+        ]
+        records = []
+        for record in collection.aggregate(pipeline, allowDiskUse=True):
+            records.append(record)
+            if len(records) >= 10000:
+                write_records(records)
+                records = []
+        write_records(records)
+
+    def write_records(records):
+        with write_lock:
+            for record in records:
+                document_key = (record.pop('lookup_index'), record['_id'])
+                if document_key not in written_documents:
+                    written_documents.add(document_key)
+                    output.write(format_func(record))
+
+    with open(output_file, 'w') as output:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(aggregate_range, lower, upper)
+                       for lower, upper in get_ranges(collection, default_num_ranges=max_workers * 4)]
+            for future in as_completed(futures):
+                future.result()
+
+
+def aggregate_ss_with_same_accession_but_without_alleles_match_false(mongo_source, output_doc_file, max_workers=4):
+    filter_criteria = {'allelesMatch': {'$exists': False}}
+    aggregate_from_alleles_match_false(
+        mongo_source,
+        [(SUBMITTED_VARIANT_ENTITY, 'accession', filter_criteria, SVE_PROJECTION),
+         (DBSNP_SUBMITTED_VARIANT_ENTITY, 'accession', filter_criteria, SVE_PROJECTION)],
+        output_doc_file, lambda record: f"{record['_id']},{record['accession']}\n", max_workers
+    )
+
+
+def aggregate_ss_merged_into_ss_with_alleles_match_false(mongo_source, merged_doc_file, max_workers=4):
+    aggregate_from_alleles_match_false(
+        mongo_source,
+        [(DBSNP_SUBMITTED_VARIANT_OPERATION_ENTITY, 'mergeInto', {'eventType': 'MERGED'}, SVOE_PROJECTION)],
+        merged_doc_file, format_merge_event, max_workers
+    )
+
+
+def aggregate_ss_split_from_ss_with_alleles_match_false(mongo_source, split_doc_file, max_workers=4):
+    aggregate_from_alleles_match_false(
+        mongo_source,
+        [(DBSNP_SUBMITTED_VARIANT_OPERATION_ENTITY, 'accession', {'eventType': 'SS_SPLIT'}, SVOE_PROJECTION)],
+        split_doc_file, format_split_event, max_workers
+    )
+
+
+def run_checks(mongo_source, res_dir, mode='find', max_workers=4):
+    """
+    Run the three chains of checks that only share the file of dbSNP SVE with allelesMatch=false concurrently.
+    In 'aggregation' mode, the first step of each chain is done with a server side $lookup instead of reading the
+    file back and querying the accessions with $in.
+    """
+    dbsnp_sve_doc_file = os.path.join(res_dir, "dbsnp_sve_records_alleles_match_false")
+    if mode == 'find' and not os.path.isfile(dbsnp_sve_doc_file):
+        retrieve_records_with_allelesMatch_false(mongo_source, DBSNP_SUBMITTED_VARIANT_ENTITY, dbsnp_sve_doc_file,
+                                                 max_workers)
+
+    sve_should_have = os.path.join(res_dir, "ss_that_should_have_allele_match_false")
+    merged_doc_file = os.path.join(res_dir, "ss_merged_into_ss_with_alleles_match_false")
+    output_file = os.path.join(res_dir, "not_mergedInto_having_alleles_match_false")
+    split_doc_file = os.path.join(res_dir, "ss_split_from_ss_with_alleles_match_false")
+    splitInto_ss_with_alleles_match_false = os.path.join(res_dir, "splitInto_ss_with_alleles_match_False")
+
+    def should_have_chain():
+        if mode == 'aggregation':
+            aggregate_ss_with_same_accession_but_without_alleles_match_false(mongo_source, sve_should_have,
+                                                                             max_workers)
+        else:
+            ss_with_same_accession_but_without_alleles_match_false(mongo_source, dbsnp_sve_doc_file,
+                                                                   sve_should_have)
+
+    def merged_chain():
+        if mode == 'aggregation':
+            aggregate_ss_merged_into_ss_with_alleles_match_false(mongo_source, merged_doc_file, max_workers)
+        else:
+            ss_merged_into_ss_with_alleles_match_false(mongo_source, dbsnp_sve_doc_file, merged_doc_file)
+        check_all_mergedInto_entities_has_alleles_match_false(mongo_source, merged_doc_file, output_file)
+
+    def split_chain():
+        if mode == 'aggregation':
+            aggregate_ss_split_from_ss_with_alleles_match_false(mongo_source, split_doc_file, max_workers)
+        else:
+            ss_split_from_ss_with_alleles_match_false(mongo_source, dbsnp_sve_doc_file, split_doc_file)
+        check_if_splitInto_ss_has_alleles_match_false(mongo_source, split_doc_file,
+                                                      splitInto_ss_with_alleles_match_false)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(chain_func) for chain_func in (should_have_chain, merged_chain, split_chain)]
+        for future in as_completed(futures):
+            future.result()
+
+    if mode == 'find' and not get_rs_of_ss_with_alleles_match_false(dbsnp_sve_doc_file):
+        logger.info("None of the dbsnp sve retrieved has rs associated with it")
 
 
 if __name__ == "__main__":
@@ -211,6 +347,11 @@ if __name__ == "__main__":
                         help="Full path to the Mongo Source secrets file (ex: /path/to/mongo/source/secret)",
                         required=True)
     parser.add_argument("--res-dir", help="File containing discordant rs ids", required=True)
+    parser.add_argument("--mode", choices=['find', 'aggregation'], default='find',
+                        help="Query the accessions found in the dbsnp sve file with $in (find) or join the "
+                             "collections on the server with $lookup (aggregation)")
+    parser.add_argument("--max-workers", help="Number of ranges of the collections queried concurrently", type=int,
+                        default=4)
     args = parser.parse_args()
 
     mongo_source = MongoDatabase(uri=args.mongo_source_uri, secrets_file=args.mongo_source_secrets_file,
@@ -221,27 +362,6 @@ if __name__ == "__main__":
     # if not os.path.isfile(sve_doc_file):
     #     retrieve_sve_with_allelesMatch_false(mongo_source, sve_doc_file)
 
-    dbsnp_sve_doc_file = os.path.join(args.res_dir, "dbsnp_sve_records_alleles_match_false")
-    if not os.path.isfile(dbsnp_sve_doc_file):
-        retrieve_dbsnp_sve_with_allelesMatch_false(mongo_source, dbsnp_sve_doc_file)
-
-    sve_should_have = os.path.join(args.res_dir, "ss_that_should_have_allele_match_false")
-    ss_with_same_accession_but_without_alleles_match_false(dbsnp_sve_doc_file, sve_should_have)
-
-    rs_list = get_rs_of_ss_with_alleles_match_false(dbsnp_sve_doc_file)
-    if not rs_list:
-        logger.info("None of the dbsnp sve retrieved has rs associated with it")
-
-    merged_doc_file = os.path.join(args.res_dir, "ss_merged_into_ss_with_alleles_match_false")
-    ss_merged_into_ss_with_alleles_match_false(mongo_source, dbsnp_sve_doc_file, merged_doc_file)
-
-    output_file = os.path.join(args.res_dir, "not_mergedInto_having_alleles_match_false")
-    check_all_mergedInto_entities_has_alleles_match_false(merged_doc_file, output_file)
-
-    split_doc_file = os.path.join(args.res_dir, "ss_split_from_ss_with_alleles_match_false")
-    ss_split_from_ss_with_alleles_match_false(mongo_source, dbsnp_sve_doc_file, split_doc_file)
-
-    splitInto_ss_with_alleles_match_false = os.path.join(args.res_dir, "splitInto_ss_with_alleles_match_False")
-    check_if_splitInto_ss_has_alleles_match_false(split_doc_file, splitInto_ss_with_alleles_match_false)
+    run_checks(mongo_source, args.res_dir, args.mode, args.max_workers)
 
     logger.info(f"Process Finished")
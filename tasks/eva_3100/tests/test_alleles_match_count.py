@@ -0,0 +1,81 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from ebi_eva_common_pyutils.mongodb import MongoDatabase
+
+from tasks.eva_3100.alleles_match_count import aggregate_from_alleles_match_false, run_checks, \
+    DBSNP_SUBMITTED_VARIANT_ENTITY, SUBMITTED_VARIANT_ENTITY, DBSNP_SUBMITTED_VARIANT_OPERATION_ENTITY
+
+
+def read_lines(file_path):
+    with open(file_path) as open_file:
+        return sorted(open_file.readlines())
+
+
+class TestAggregateFromAllelesMatchFalse(TestCase):
+
+    def test_documents_joined_in_several_ranges_are_written_once(self):
+        mongo_source = MagicMock()
+        collection = mongo_source.mongo_handle.__getitem__.return_value.__getitem__.return_value.with_options()
+        # Both ranges contain an SVE with accession 1, joined to the same documents
+        collection.aggregate.side_effect = lambda pipeline, **kwargs: [
+            {'_id': 'SS1', 'accession': 1, 'lookup_index': 0},
+            {'_id': 'SS1', 'accession': 1, 'lookup_index': 1}
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                patch('tasks.eva_3100.alleles_match_count.get_ranges', return_value=[(None, 'B'), ('B', None)]):
+            output_file = os.path.join(tmp_dir, 'output')
+            aggregate_from_alleles_match_false(mongo_source, [], output_file,
+                                               lambda record: f"{record['_id']},{record['accession']}\n")
+            # The documents with the same _id in the two collections joined are both kept
+            assert read_lines(output_file) == ['SS1,1\n', 'SS1,1\n']
+        assert collection.aggregate.call_count == 2
+        # The SVE are grouped by accession before the $lookup
+        assert collection.aggregate.call_args[0][0][1] == {'$group': {'_id': '$accession'}}
+
+
+class TestRunChecks(TestCase):
+
+    def setUp(self) -> None:
+        self.db = 'eva_accession_sharded'
+        self.mongo_source = MongoDatabase(uri='mongodb://localhost:27017/', db_name=self.db)
+        database = self.mongo_source.mongo_handle[self.db]
+        # Two dbSNP SVE with allelesMatch=false share the accession 1
+        database[DBSNP_SUBMITTED_VARIANT_ENTITY].insert_many([
+            {'_id': 'DBSNP1A', 'accession': 1, 'rs': 10, 'allelesMatch': False},
+            {'_id': 'DBSNP1B', 'accession': 1, 'rs': 10, 'allelesMatch': False},
+            {'_id': 'DBSNP1C', 'accession': 1, 'rs': 10},
+            {'_id': 'DBSNP2', 'accession': 2, 'allelesMatch': False},
+        ])
+        database[SUBMITTED_VARIANT_ENTITY].insert_many([
+            {'_id': 'EVA1', 'accession': 1, 'rs': 10},
+        ])
+        database[DBSNP_SUBMITTED_VARIANT_OPERATION_ENTITY].insert_many([
+            {'_id': 'MERGE3', 'eventType': 'MERGED', 'accession': 3, 'mergeInto': 1,
+             'inactiveObjects': [{'hashedMessage': 'DBSNP3', 'rs': 30}]},
+            {'_id': 'SPLIT1', 'eventType': 'SS_SPLIT', 'accession': 1, 'splitInto': 4},
+        ])
+        self.res_dirs = {mode: tempfile.TemporaryDirectory() for mode in ('find', 'aggregation')}
+
+    def tearDown(self) -> None:
+        self.mongo_source.mongo_handle.drop_database(self.db)
+        self.mongo_source.mongo_handle.close()
+        for res_dir in self.res_dirs.values():
+            res_dir.cleanup()
+
+    def test_find_and_aggregation_modes_agree(self):
+        for mode, res_dir in self.res_dirs.items():
+            run_checks(self.mongo_source, res_dir.name, mode, max_workers=2)
+        find_dir = self.res_dirs['find'].name
+        aggregation_dir = self.res_dirs['aggregation'].name
+        assert read_lines(os.path.join(find_dir, 'ss_that_should_have_allele_match_false')) == \
+            ['DBSNP1C,1\n', 'EVA1,1\n']
+        assert read_lines(os.path.join(find_dir, 'ss_merged_into_ss_with_alleles_match_false')) == \
+            ['MERGE3,1,3,DBSNP3,30\n']
+        assert read_lines(os.path.join(find_dir, 'ss_split_from_ss_with_alleles_match_false')) == ['SPLIT1,1,4\n']
+        for file_name in ['ss_that_should_have_allele_match_false', 'ss_merged_into_ss_with_alleles_match_false',
+                          'ss_split_from_ss_with_alleles_match_false']:
+            assert read_lines(os.path.join(aggregation_dir, file_name)) == \
+                read_lines(os.path.join(find_dir, file_name)), file_name
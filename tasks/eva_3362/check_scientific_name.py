@@ -1,45 +1,36 @@
 import logging
-import re
 from argparse import ArgumentParser
 
-import requests
-from ebi_eva_common_pyutils.ena_utils import download_xml_from_ena
 from ebi_eva_common_pyutils.metadata_utils import get_metadata_connection_handle
-from ebi_eva_common_pyutils.network_utils import json_request
 from ebi_eva_common_pyutils.pg_utils import get_all_results_for_query
 
+from tasks.common.metadata_client import MetadataClient
+
 logging.basicConfig(level=logging.INFO)
 
 
-def get_scientific_name_from_ensembl(taxonomy_id):
-    ENSEMBL_REST_API_URL = "https://rest.ensembl.org/taxonomy/id/{0}?content-type=application/json".format(taxonomy_id)
-    response = json_request(ENSEMBL_REST_API_URL)
-    if 'scientific_name' not in response:
-        logging.warning(f'Scientific name not available in Ensembl for taxonomy: {taxonomy_id}')
-        return 'Not Available'
-    else:
-        return response['scientific_name']
+def fill_not_available(names, source):
+    """Replace the scientific names missing from a source with 'Not Available'."""
+    for taxonomy_id, name in names.items():
+        if not name:
+            logging.warning(f'Scientific name not available in {source} for taxonomy: {taxonomy_id}')
+            names[taxonomy_id] = 'Not Available'
+    return names
+
 
+def get_scientific_names_from_ensembl(metadata_client, taxonomy_list):
+    names = metadata_client.get_ensembl_scientific_names(taxonomy_list)
+    return fill_not_available(dict((taxonomy, names.get(str(taxonomy))) for taxonomy in taxonomy_list), 'Ensembl')
 
-def get_scientific_name_from_ena(taxonomy_id):
-    xml_root = download_xml_from_ena(f'https://www.ebi.ac.uk/ena/browser/api/xml/{taxonomy_id}')
-    xml_taxon = xml_root.xpath('/TAXON_SET/taxon')
-    if len(xml_taxon) == 0:
-        logging.warning(f'Scientific name not available in ENA for taxonomy: {taxonomy_id}')
-        return 'Not Available'
-    else:
-        return xml_taxon[0].get('scientificName')
 
+def get_scientific_names_from_ena(metadata_client, taxonomy_list):
+    names = metadata_client.get_ena_scientific_names(taxonomy_list)
+    return fill_not_available(dict((taxonomy, names.get(str(taxonomy))) for taxonomy in taxonomy_list), 'ENA')
 
-def get_scientific_name_from_ncbi(taxonomy_id):
-    payload = {'db': 'Taxonomy', 'id': taxonomy_id}
-    r = requests.get('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi', params=payload)
-    match = re.search('<ScientificName>(.+?)</ScientificName>', r.text, re.MULTILINE)
-    if match:
-        return match.group(1)
-    else:
-        logging.warning(f'Scientific name not available in ENA for taxonomy: {taxonomy_id}')
-        return 'Not Available'
+
+def get_scientific_names_from_ncbi(metadata_client, taxonomy_list):
+    names = metadata_client.get_ncbi_scientific_names(taxonomy_list)
+    return fill_not_available(dict((taxonomy, names.get(str(taxonomy))) for taxonomy in taxonomy_list), 'NCBI')
 
 
 def get_list_of_taxonomy_from_evapro(private_config_xml_file):
@@ -52,12 +43,10 @@ def get_list_of_taxonomy_from_evapro(private_config_xml_file):
     return taxonomy_list
 
 
-def get_scientific_name_from_evapro(private_config_xml_file, taxonomy_id):
-    query = f"select scientific_name from evapro.taxonomy " \
-            f"where taxonomy_id = {taxonomy_id}"
+def get_scientific_names_from_evapro(private_config_xml_file):
+    query = "select taxonomy_id, scientific_name from evapro.taxonomy"
     with get_metadata_connection_handle('production_processing', private_config_xml_file) as db_conn:
-        results = get_all_results_for_query(db_conn, query)
-        return results[0][0]
+        return dict(get_all_results_for_query(db_conn, query))
 
 
 def check_if_name_is_different(taxonomy_list, evapro_names, ensembl_names, ena_names, ncbi_names):
@@ -78,24 +67,23 @@ def main():
                                            'ENA and NCBI and check if there is any difference between them')
     argparser.add_argument("--private-config-xml-file", help="ex: /path/to/eva-maven-settings.xml",
                            required=True)
+    argparser.add_argument("--cache-file", help="Path to the file where the scientific names retrieved are cached",
+                           required=False)
+    argparser.add_argument("--offline", help="Only use the scientific names already in the cache file",
+                           action='store_true', default=False)
+    argparser.add_argument("--max-workers", help="Number of concurrent requests to each service", type=int,
+                           default=4)
     args = argparser.parse_args()
 
     taxonomy_list = get_list_of_taxonomy_from_evapro(args.private_config_xml_file)
-
-    evapro_names = {}
-    ensembl_names = {}
-    ena_names = {}
-    ncbi_names = {}
-    count = 1
-    for taxonomy in taxonomy_list:
-        logging.info(f'{count}. {taxonomy}')
-
-        evapro_names[taxonomy] = get_scientific_name_from_evapro(args.private_config_xml_file, taxonomy)
-        ensembl_names[taxonomy] = get_scientific_name_from_ensembl(taxonomy)
-        ena_names[taxonomy] = get_scientific_name_from_ena(taxonomy)
-        ncbi_names[taxonomy] = get_scientific_name_from_ncbi(taxonomy)
-
-        count = count + 1
+    logging.info(f'Retrieve scientific names for {len(taxonomy_list)} taxonomies')
+
+    metadata_client = MetadataClient(cache_file=args.cache_file, offline=args.offline,
+                                      max_workers=args.max_workers)
+    evapro_names = get_scientific_names_from_evapro(args.private_config_xml_file)
+    ensembl_names = get_scientific_names_from_ensembl(metadata_client, taxonomy_list)
+    ena_names = get_scientific_names_from_ena(metadata_client, taxonomy_list)
+    ncbi_names = get_scientific_names_from_ncbi(metadata_client, taxonomy_list)
 
     check_if_name_is_different(taxonomy_list, evapro_names, ensembl_names, ena_names, ncbi_names)
 
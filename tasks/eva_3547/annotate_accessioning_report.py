@@ -1,32 +1,161 @@
 import gzip
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from Bio import bgzf
+from ebi_eva_common_pyutils.logger import logging_config
+from ebi_eva_common_pyutils.mongodb import MongoDatabase
+from pymongo import ReadPreference
+from requests.adapters import HTTPAdapter
 
+logger = logging_config.get_logger(__name__)
 
-def get_rs_from_ss(ssid):
-    response = requests.get(f'https://www.ebi.ac.uk/eva/webservices/identifiers/v1/submitted-variants/{ssid}')
+identifiers_url = 'https://www.ebi.ac.uk/eva/webservices/identifiers/v1/submitted-variants/'
+submitted_variant_collections = ['submittedVariantEntity', 'dbsnpSubmittedVariantEntity']
+SS_PROJECTION = {'accession': 1, 'seq': 1, 'rs': 1, 'backPropRS': 1}
+
+
+def get_rs_from_ss(ssid, session=requests):
+    response = session.get(f'{identifiers_url}{ssid}')
     response.raise_for_status()
     json_data = response.json()
     assert len(json_data) == 1
     return json_data[0]['data'].get('clusteredVariantAccession') or json_data[0]['data'].get('backPropagatedVariantAccession')
 
 
-parser = ArgumentParser()
-parser.add_argument('--accessioning_report')
-parser.add_argument('--annotated_vcf')
-args = parser.parse_args()
+def get_rs_from_ss_with_http(ssids, session, max_workers):
+    """Returns the rs of each ss retrieved from the identifiers web service with max_workers concurrent requests."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(ssids, executor.map(lambda ssid: get_rs_from_ss(ssid, session), ssids)))
+
+
+def get_rs_from_ss_with_mongo(ssids, mongo_source, assembly_accession=None):
+    """
+    Returns the rs of each ss found in the submitted variant collections, or the back-propagated rs when the ss is not
+    clustered. When assembly_accession is provided, only the ss on that assembly are considered.
+    """
+    filter_criteria = {'accession': {'$in': ssids}}
+    if assembly_accession:
+        filter_criteria['seq'] = assembly_accession
+    rs_per_ss = {}
+    for collection_name in submitted_variant_collections:
+        collection = mongo_source.mongo_handle[mongo_source.db_name][collection_name]
+        for variant in collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED) \
+                .find(filter_criteria, SS_PROJECTION):
+            rsid = variant.get('rs') or variant.get('backPropRS')
+            if not rsid:
+                continue
+            if variant['accession'] in rs_per_ss:
+                if rsid != rs_per_ss[variant['accession']]:
+                    logger.warning(f'ss{variant["accession"]} is associated with rs{rs_per_ss[variant["accession"]]} '
+                                   f'and rs{rsid} (assembly {variant["seq"]}), keep the first one')
+                continue
+            rs_per_ss[variant['accession']] = rsid
+    return rs_per_ss
 
-input_vcf = args.accessioning_report
-output_vcf = args.annotated_vcf
-with open(output_vcf, 'w') as open_output:
+
+def open_output(output_vcf):
+    # Compressed outputs are written in BGZF blocks so they can be indexed
+    if output_vcf.endswith('.gz'):
+        return bgzf.BgzfWriter(output_vcf, 'wb')
+    return open(output_vcf, 'w', buffering=1024 * 1024)
+
+
+def read_vcf_in_batches(input_vcf, batch_size):
+    """Yields the header lines then lists of data lines split on tab, batch_size lines at a time."""
     with gzip.open(input_vcf, 'rt') as open_file:
+        batch = []
         for line in open_file:
             if line.startswith('#'):
-                open_output.write(line)
+                yield line
             else:
-                sp_line = line.split('\t')
-                ssid = int(sp_line[2][2:])
-                rsid = get_rs_from_ss(ssid)
+                batch.append(line.split('\t'))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+
+def annotate_accessioning_report(input_vcf, output_vcf, get_rs_for_ssids, batch_size=10000):
+    """
+    Replace the ss ids of the accessioning report with their rs ids. The rs of each batch of ss are retrieved with
+    get_rs_for_ssids while the previous batch is being written. SS without rs are left unchanged.
+    """
+    def write_batch(open_output_file, batch, rs_lookup):
+        rs_per_ss = rs_lookup.result()
+        lines = []
+        nb_without_rs = 0
+        for sp_line in batch:
+            rsid = rs_per_ss.get(int(sp_line[2][2:]))
+            if rsid:
                 sp_line[2] = f'rs{rsid}'
-                open_output.write('\t'.join(sp_line))
+            else:
+                logger.debug(f'No rs found for {sp_line[2]}')
+                nb_without_rs += 1
+            lines.append('\t'.join(sp_line))
+        open_output_file.write(''.join(lines))
+        return len(lines), nb_without_rs
+
+    nb_variants = 0
+    nb_variants_without_rs = 0
+    with open_output(output_vcf) as open_output_file, ThreadPoolExecutor(max_workers=1) as executor:
+        pending_batch = None
+        for batch in read_vcf_in_batches(input_vcf, batch_size):
+            if isinstance(batch, str):
+                open_output_file.write(batch)
+                continue
+            rs_lookup = executor.submit(get_rs_for_ssids, [int(sp_line[2][2:]) for sp_line in batch])
+            if pending_batch:
+                nb_batch_variants, nb_batch_without_rs = write_batch(open_output_file, *pending_batch)
+                nb_variants += nb_batch_variants
+                nb_variants_without_rs += nb_batch_without_rs
+            pending_batch = (batch, rs_lookup)
+        if pending_batch:
+            nb_batch_variants, nb_batch_without_rs = write_batch(open_output_file, *pending_batch)
+            nb_variants += nb_batch_variants
+            nb_variants_without_rs += nb_batch_without_rs
+    if nb_variants_without_rs:
+        logger.warning(f'No rs found for {nb_variants_without_rs} ss, their ss id was kept in {output_vcf}')
+    logger.info(f'{nb_variants} variants annotated in {output_vcf}')
+    return nb_variants
+
+
+def main():
+    parser = ArgumentParser(description='Replace the ss ids of an accessioning report with their rs ids')
+    parser.add_argument('--accessioning_report', required=True)
+    parser.add_argument('--annotated_vcf', required=True,
+                        help='Output VCF, compressed with bgzip if the file name ends with .gz')
+    parser.add_argument('--mode', choices=('mongo', 'http'), default='http',
+                        help='Retrieve the rs from the accessioning database or from the identifiers web service')
+    parser.add_argument('--mongo_source_uri',
+                        help='Mongo Source URI (ex: mongodb://user:@mongos-source-host:27017/admin)')
+    parser.add_argument('--mongo_source_secrets_file', help='Full path to the Mongo Source secrets file')
+    parser.add_argument('--assembly_accession', help='Only use the ss on this assembly in mongo mode')
+    parser.add_argument('--batch_size', type=int, default=10000, help='Number of ss looked up at once')
+    parser.add_argument('--max_workers', type=int, default=8, help='Number of concurrent requests in http mode')
+    args = parser.parse_args()
+    logging_config.add_stdout_handler()
+
+    if args.mode == 'mongo':
+        if not args.mongo_source_uri or not args.mongo_source_secrets_file:
+            parser.error('--mongo_source_uri and --mongo_source_secrets_file are required in mongo mode')
+        mongo_source = MongoDatabase(uri=args.mongo_source_uri, secrets_file=args.mongo_source_secrets_file,
+                                     db_name='eva_accession_sharded')
+        annotate_accessioning_report(
+            args.accessioning_report, args.annotated_vcf,
+            lambda ssids: get_rs_from_ss_with_mongo(ssids, mongo_source, args.assembly_accession), args.batch_size
+        )
+    else:
+        # One connection per worker is kept open and reused for all the requests
+        with requests.Session() as session:
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=args.max_workers))
+            annotate_accessioning_report(
+                args.accessioning_report, args.annotated_vcf,
+                lambda ssids: get_rs_from_ss_with_http(ssids, session, args.max_workers), args.batch_size
+            )
+
+
+if __name__ == '__main__':
+    main()
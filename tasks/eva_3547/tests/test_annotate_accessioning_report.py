@@ -0,0 +1,133 @@
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from ebi_eva_common_pyutils.mongodb import MongoDatabase
+
+from tasks.eva_3547 import annotate_accessioning_report as annotate_module
+from tasks.eva_3547.annotate_accessioning_report import annotate_accessioning_report, get_rs_from_ss_with_http, \
+    get_rs_from_ss_with_mongo, read_vcf_in_batches
+
+
+class TestAnnotateAccessioningReport(TestCase):
+
+    header = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+
+    def setUp(self) -> None:
+        self.work_dir = tempfile.mkdtemp()
+        self.input_vcf = os.path.join(self.work_dir, 'accessioning_report.vcf.gz')
+        with gzip.open(self.input_vcf, 'wt') as open_file:
+            open_file.write(self.header)
+            for position, ssid in enumerate([1, 2, 3, 4, 5], start=1):
+                open_file.write(f'chr1\t{position}\tss{ssid}\tA\tT\t.\t.\t.\n')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.work_dir)
+
+    def read_output(self, output_vcf):
+        with gzip.open(output_vcf, 'rt') as open_file:
+            return open_file.readlines()
+
+    def test_annotate_accessioning_report(self):
+        looked_up_ssids = []
+
+        def get_rs_for_ssids(ssids):
+            looked_up_ssids.append(ssids)
+            return {ssid: ssid + 100 for ssid in ssids if ssid != 4}
+
+        output_vcf = os.path.join(self.work_dir, 'annotated_report.vcf.gz')
+        with self.assertLogs(annotate_module.logger, level='WARNING') as logs:
+            nb_variants = annotate_accessioning_report(self.input_vcf, output_vcf, get_rs_for_ssids, batch_size=2)
+
+        assert nb_variants == 5
+        assert looked_up_ssids == [[1, 2], [3, 4], [5]]
+        output_lines = self.read_output(output_vcf)
+        assert ''.join(output_lines[:2]) == self.header
+        assert [line.split('\t')[2] for line in output_lines[2:]] == ['rs101', 'rs102', 'rs103', 'ss4', 'rs105']
+        # The ss without rs are reported once for the whole file
+        assert len(logs.records) == 1
+        assert 'No rs found for 1 ss' in logs.output[0]
+
+    def test_next_batch_read_before_previous_batch_written(self):
+        events = []
+
+        def recording_read_vcf_in_batches(input_vcf, batch_size):
+            for batch in read_vcf_in_batches(input_vcf, batch_size):
+                if not isinstance(batch, str):
+                    events.append(('read', [sp_line[2] for sp_line in batch]))
+                yield batch
+
+        def record_write(text):
+            if not text.startswith('#'):
+                events.append(('write', [line.split('\t')[2] for line in text.splitlines()]))
+
+        output = MagicMock()
+        output.__enter__.return_value.write.side_effect = record_write
+        with patch.object(annotate_module, 'read_vcf_in_batches', recording_read_vcf_in_batches), \
+                patch.object(annotate_module, 'open_output', return_value=output):
+            annotate_accessioning_report(self.input_vcf, 'output.vcf', lambda ssids: {}, batch_size=2)
+
+        # The lookup of a batch is started before the previous batch is written
+        assert events == [
+            ('read', ['ss1', 'ss2']),
+            ('read', ['ss3', 'ss4']),
+            ('write', ['ss1', 'ss2']),
+            ('read', ['ss5']),
+            ('write', ['ss3', 'ss4']),
+            ('write', ['ss5'])
+        ]
+
+    def test_get_rs_from_ss_with_http(self):
+        def get(url):
+            ssid = int(url.rsplit('/', 1)[1])
+            response = MagicMock()
+            if ssid == 1:
+                response.json.return_value = [{'data': {'clusteredVariantAccession': 101}}]
+            elif ssid == 2:
+                response.json.return_value = [{'data': {'backPropagatedVariantAccession': 102}}]
+            else:
+                response.json.return_value = [{'data': {}}]
+            return response
+
+        session = MagicMock()
+        session.get.side_effect = get
+        assert get_rs_from_ss_with_http([1, 2, 3], session, max_workers=2) == {1: 101, 2: 102, 3: None}
+        assert session.get.call_count == 3
+
+
+class TestGetRsFromSsWithMongo(TestCase):
+
+    def setUp(self) -> None:
+        self.db = 'eva_accession_sharded'
+        self.mongo_source = MongoDatabase(uri='mongodb://localhost:27017/', db_name=self.db)
+        self.mongo_source.mongo_handle[self.db]['submittedVariantEntity'].insert_many([
+            {'_id': 'A', 'accession': 1, 'seq': 'GCA_000001.1', 'rs': 101},
+            {'_id': 'B', 'accession': 2, 'seq': 'GCA_000001.1', 'backPropRS': 102},
+            {'_id': 'C', 'accession': 3, 'seq': 'GCA_000002.1', 'rs': 103},
+            {'_id': 'D', 'accession': 4, 'seq': 'GCA_000001.1'},
+        ])
+        self.mongo_source.mongo_handle[self.db]['dbsnpSubmittedVariantEntity'].insert_many([
+            {'_id': 'E', 'accession': 5, 'seq': 'GCA_000001.1', 'rs': 105},
+            {'_id': 'F', 'accession': 1, 'seq': 'GCA_000002.1', 'rs': 201},
+            {'_id': 'G', 'accession': 3, 'seq': 'GCA_000003.1'},
+        ])
+
+    def tearDown(self) -> None:
+        self.mongo_source.mongo_handle.drop_database(self.db)
+        self.mongo_source.mongo_handle.close()
+
+    def test_get_rs_from_ss_with_mongo(self):
+        with self.assertLogs(annotate_module.logger, level='WARNING') as logs:
+            rs_per_ss = get_rs_from_ss_with_mongo([1, 2, 3, 4, 5, 6], self.mongo_source)
+        assert rs_per_ss == {1: 101, 2: 102, 3: 103, 5: 105}
+        # ss1 is associated with two rs, the first one found is kept. ss3 has no rs on GCA_000003.1, which is not a
+        # mismatch
+        assert len(logs.records) == 1
+        assert 'ss1 is associated with rs101 and rs201' in logs.output[0]
+
+    def test_get_rs_from_ss_with_mongo_on_assembly(self):
+        assert get_rs_from_ss_with_mongo([1, 2, 3, 4, 5], self.mongo_source, assembly_accession='GCA_000002.1') == \
+            {1: 201, 3: 103}